@@ -0,0 +1,40 @@
+"""v3.11: Add column performance to table pidea_audit
+
+Revision ID: 3e9b6c2d7f15
+Revises: 8c2e4d1f6a90
+Create Date: 2025-02-03 14:22:51.604318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+# revision identifiers, used by Alembic.
+revision = '3e9b6c2d7f15'
+down_revision = '8c2e4d1f6a90'
+
+
+def upgrade():
+    try:
+        op.add_column('pidea_audit', sa.Column('performance', sa.Unicode(120), nullable=True))
+    except (OperationalError, ProgrammingError) as exx:
+        if "already exists" in str(exx.orig).lower() or "duplicate column name" in str(exx.orig).lower():
+            print("Column 'performance' already exists.")
+        else:
+            print("Could not add column 'performance' to table 'pidea_audit'.")
+            print(exx)
+    except Exception as exx:
+        print("Could not add column 'performance' to table 'pidea_audit'.")
+        print(exx)
+
+
+def downgrade():
+    try:
+        op.drop_column('pidea_audit', 'performance')
+    except (OperationalError, ProgrammingError) as exx:
+        msg = str(exx.orig).lower()
+        if "no such column" in msg or "does not exist" in msg:
+            print("Column 'performance' already removed.")
+        else:
+            print("Could not remove column 'performance' from table 'pidea_audit'.")
+            print(exx)
@@ -0,0 +1,36 @@
+"""v3.11: Add unique constraint on used_login and resolver to table usercache
+
+Revision ID: 5f1c7a9e2b34
+Revises: 7301d5130c3a
+Create Date: 2025-01-20 10:12:40.318204
+
+"""
+from alembic import op
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+# revision identifiers, used by Alembic.
+revision = '5f1c7a9e2b34'
+down_revision = '7301d5130c3a'
+
+
+def upgrade():
+    try:
+        # The table may contain several entries for a login name. As it is
+        # only a cache, all entries are removed instead of merging them.
+        op.execute("DELETE FROM usercache")
+        with op.batch_alter_table('usercache') as batch_op:
+            batch_op.create_unique_constraint('ucix_1', ['used_login', 'resolver'])
+    except (OperationalError, ProgrammingError) as exx:
+        if "already exists" in str(exx.orig).lower():
+            print("Ok, constraint 'ucix_1' already exists.")
+            print(exx)
+        else:
+            raise
+    except Exception as exx:
+        print(f"Could not add constraint 'ucix_1' to table 'usercache': {exx}")
+        raise
+
+
+def downgrade():
+    with op.batch_alter_table('usercache') as batch_op:
+        batch_op.drop_constraint('ucix_1', type_='unique')
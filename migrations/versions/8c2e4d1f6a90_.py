@@ -0,0 +1,60 @@
+"""v3.11: Add table otpindex
+
+Revision ID: 8c2e4d1f6a90
+Revises: 5f1c7a9e2b34
+Create Date: 2025-01-27 09:31:12.512870
+
+"""
+from alembic import op, context
+import sqlalchemy as sa
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.schema import Sequence, CreateSequence, DropSequence
+
+# revision identifiers, used by Alembic.
+revision = '8c2e4d1f6a90'
+down_revision = '5f1c7a9e2b34'
+
+
+# Check if the SQL dialect uses sequences
+def dialect_supports_sequences():
+    migration_context = context.get_context()
+    return migration_context.dialect.supports_sequences
+
+
+def upgrade():
+    try:
+        seq = Sequence('otpindex_seq')
+        if dialect_supports_sequences():
+            try:
+                op.execute(CreateSequence(seq))
+            except Exception as _e:
+                pass
+        op.create_table('otpindex',
+                        sa.Column('id', sa.Integer(), seq, nullable=False),
+                        sa.Column('token_id', sa.Integer(), nullable=True),
+                        sa.Column('counter', sa.Integer(), nullable=False),
+                        sa.Column('otp_hash', sa.Unicode(length=64), nullable=False),
+                        sa.Column('fingerprint', sa.Unicode(length=64), nullable=False),
+                        sa.ForeignKeyConstraint(['token_id'], ['token.id'], ),
+                        sa.PrimaryKeyConstraint('id'),
+                        sa.UniqueConstraint('token_id', 'counter', name='otpiix_1'),
+                        mysql_row_format='DYNAMIC'
+                        )
+        op.create_index(op.f('ix_otpindex_token_id'), 'otpindex', ['token_id'], unique=False)
+        op.create_index(op.f('ix_otpindex_otp_hash'), 'otpindex', ['otp_hash'], unique=False)
+    except (OperationalError, ProgrammingError) as exx:
+        if "already exists" in str(exx.orig).lower():
+            print("Ok, Table 'otpindex' already exists.")
+        else:
+            print(exx)
+    except Exception as exx:
+        print("Could not add table 'otpindex' to database")
+        print(exx)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_otpindex_otp_hash'), table_name='otpindex')
+    op.drop_index(op.f('ix_otpindex_token_id'), table_name='otpindex')
+    op.drop_table('otpindex')
+    if dialect_supports_sequences():
+        op.execute(DropSequence(Sequence('otpindex_seq')))
@@ -66,6 +66,7 @@ from .smsgateway import smsgateway_blueprint
 from .clienttype import client_blueprint
 from .subscriptions import subscriptions_blueprint
 from .monitoring import monitoring_blueprint
+from .timing import timing_blueprint
 from .tokengroup import tokengroup_blueprint
 from .serviceid import serviceid_blueprint
 from privacyidea.api.lib.postpolicy import postrequest, sign_response
@@ -73,6 +74,11 @@ from ..lib.error import (privacyIDEAError,
                          AuthError, UserError,
                          PolicyError, ResourceNotFoundError)
 from privacyidea.lib.utils import get_client_ip, get_plugin_info_from_useragent
+from privacyidea.lib.monitoringstats import (write_timing_stats, write_request_stats,
+                                             write_config_reload_stats)
+from privacyidea.lib.requeststats import start_request_stats, end_request_stats
+from privacyidea.lib.sqlutils import end_unit_of_work
+from privacyidea.models import db
 from privacyidea.lib.user import User
 import datetime
 import threading
@@ -87,18 +93,34 @@ log = logging.getLogger(__name__)
 def log_begin_request():
     log.debug("Begin handling of request {!r}".format(request.full_path))
     g.startdate = datetime.datetime.now()
+    start_request_stats()
 
 
 @token_blueprint.teardown_app_request
 def teardown_request(exc):
+    # The unit of work of a request must be ended, before the audit entry is
+    # written, otherwise the transaction may lock the database.
+    try:
+        end_unit_of_work(db.session, commit=exc is None)
+    except Exception as exx:  # pragma: no cover
+        log.error("Could not commit the changes of the request: {0!r}".format(exx))
+    request_stats = end_request_stats()
     try:
         if g.audit_object.has_data:
+            if request_stats:
+                g.audit_object.log({"performance": request_stats})
             g.audit_object.finalize_log()
     except AttributeError:
         # In certain error cases the before_request was not handled
         # completely so that we do not have an audit_object
         # Also during calling webui, there is no audit_object, yet.
         pass
+    try:
+        write_timing_stats()
+        write_request_stats()
+        write_config_reload_stats()
+    except Exception as exx:  # pragma: no cover
+        log.warning("Could not write the timing statistics: {0!r}".format(exx))
     call_finalizers()
     log.debug("End handling of request {!r}".format(request.full_path))
 
@@ -141,6 +163,7 @@ def before_userendpoint_request():
 @client_blueprint.before_request
 @subscriptions_blueprint.before_request
 @monitoring_blueprint.before_request
+@timing_blueprint.before_request
 @tokengroup_blueprint.before_request
 @serviceid_blueprint.before_request
 @admin_required
@@ -294,6 +317,7 @@ def before_request():
 @client_blueprint.after_request
 @subscriptions_blueprint.after_request
 @monitoring_blueprint.after_request
+@timing_blueprint.after_request
 @ttype_blueprint.after_request
 @validate_blueprint.after_request
 @register_blueprint.after_request
@@ -326,6 +350,7 @@ def after_request(response):
 @eventhandling_blueprint.app_errorhandler(AuthError)
 @subscriptions_blueprint.app_errorhandler(AuthError)
 @monitoring_blueprint.app_errorhandler(AuthError)
+@timing_blueprint.app_errorhandler(AuthError)
 @tokengroup_blueprint.app_errorhandler(AuthError)
 @serviceid_blueprint.app_errorhandler(AuthError)
 @container_blueprint.app_errorhandler(AuthError)
@@ -362,6 +387,7 @@ def auth_error(error):
 @recover_blueprint.app_errorhandler(PolicyError)
 @subscriptions_blueprint.app_errorhandler(PolicyError)
 @monitoring_blueprint.app_errorhandler(PolicyError)
+@timing_blueprint.app_errorhandler(PolicyError)
 @ttype_blueprint.app_errorhandler(PolicyError)
 @tokengroup_blueprint.app_errorhandler(PolicyError)
 @serviceid_blueprint.app_errorhandler(PolicyError)
@@ -415,6 +441,7 @@ def resource_not_found_error(error):
 @recover_blueprint.app_errorhandler(privacyIDEAError)
 @subscriptions_blueprint.app_errorhandler(privacyIDEAError)
 @monitoring_blueprint.app_errorhandler(privacyIDEAError)
+@timing_blueprint.app_errorhandler(privacyIDEAError)
 @ttype_blueprint.app_errorhandler(privacyIDEAError)
 @tokengroup_blueprint.app_errorhandler(privacyIDEAError)
 @serviceid_blueprint.app_errorhandler(privacyIDEAError)
@@ -445,6 +472,7 @@ def privacyidea_error(error):
 @recover_blueprint.app_errorhandler(500)
 @subscriptions_blueprint.app_errorhandler(500)
 @monitoring_blueprint.app_errorhandler(500)
+@timing_blueprint.app_errorhandler(500)
 @ttype_blueprint.app_errorhandler(500)
 @tokengroup_blueprint.app_errorhandler(500)
 @serviceid_blueprint.app_errorhandler(500)
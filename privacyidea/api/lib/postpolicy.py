@@ -54,7 +54,7 @@ from privacyidea.lib import lazy_gettext
 from privacyidea.lib.auth import ROLE
 from privacyidea.lib.config import get_multichallenge_enrollable_tokentypes, get_token_class
 from privacyidea.lib.config import get_privacyidea_node
-from privacyidea.lib.crypto import Sign
+from privacyidea.lib.crypto import get_sign_object
 from privacyidea.lib.error import PolicyError, ValidateError
 from privacyidea.lib.machine import get_auth_items
 from privacyidea.lib.policy import DEFAULT_ANDROID_APP_URL, DEFAULT_IOS_APP_URL
@@ -182,9 +182,7 @@ def sign_response(request, response):
     # Disable the costly checking of private RSA keys when loading them.
     check_private_key = not current_app.config.get("PI_RESPONSE_NO_PRIVATE_KEY_CHECK", False)
     try:
-        with open(private_key_file, 'rb') as file:
-            private_key = file.read()
-        sign_object = Sign(private_key, public_key=None, check_private_key=check_private_key)
+        sign_object = get_sign_object(private_key_file, check_private_key=check_private_key)
     except (IOError, ValueError, TypeError) as e:
         log.info('Could not load private key from '
                  'file {0!s}: {1!r}!'.format(private_key_file, e))
@@ -0,0 +1,106 @@
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+"""
+This endpoint is used to fetch the timing of the functions of the privacyIDEA
+server. The timing is recorded by the functions, which are decorated with
+``log_with``, if ``PI_TIMING_STATS`` is enabled in ``pi.cfg``.
+
+The timing is recorded by each process of the server. The endpoint returns
+the timing of the process, which handles the request.
+
+The code of this module is tested in tests/test_api_timing.py
+"""
+import logging
+import os
+
+from flask import (Blueprint, request, g)
+from privacyidea.api.lib.utils import getParam, send_result
+from privacyidea.api.lib.prepolicy import prepolicy, check_base_action
+from privacyidea.lib.error import ParameterError
+from privacyidea.lib.log import (log_with, is_timing_enabled, get_timing_stats,
+                                 reset_timing_stats)
+from privacyidea.lib.policy import ACTION
+
+log = logging.getLogger(__name__)
+
+SORT_KEYS = ["count", "total", "mean", "max", "p50", "p90", "p99"]
+
+timing_blueprint = Blueprint('timing_blueprint', __name__)
+
+
+@timing_blueprint.route('/', methods=['GET'])
+@log_with(log)
+@prepolicy(check_base_action, request, ACTION.STATISTICSREAD)
+def get_timing():
+    """
+    Return the timing of the functions of this server process. The durations
+    are given in milliseconds. The percentiles are the upper bounds of the
+    histogram buckets, which are powers of two of microseconds.
+
+    :query sortby: sort the functions by "count", "total" (default), "mean",
+        "max", "p50", "p90" or "p99" in descending order
+    :query limit: the number of returned functions (default: 50)
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+        {
+          "id": 1,
+          "jsonrpc": "2.0",
+          "result": {
+            "status": true,
+            "value": {
+              "enabled": true,
+              "pid": 1234,
+              "functions": [
+                {"name": "privacyidea.lib.token.check_token_list",
+                 "count": 10, "total": 52.1, "mean": 5.21, "max": 9.3,
+                 "p50": 8.192, "p90": 16.384, "p99": 16.384}
+              ]
+            }
+          },
+          "version": "privacyIDEA unknown"
+        }
+    """
+    sortby = getParam(request.all_data, "sortby", default="total")
+    if sortby not in SORT_KEYS:
+        raise ParameterError("sortby must be one of {0!s}".format(", ".join(SORT_KEYS)))
+    try:
+        limit = int(getParam(request.all_data, "limit", default=50))
+    except ValueError:
+        raise ParameterError("limit must be an integer")
+    functions = [dict(name=name, **entry) for name, entry in get_timing_stats().items()]
+    functions.sort(key=lambda entry: entry[sortby], reverse=True)
+    g.audit_object.log({"success": True})
+    return send_result({"enabled": is_timing_enabled(),
+                        "pid": os.getpid(),
+                        "functions": functions[:limit]})
+
+
+@timing_blueprint.route('/', methods=['DELETE'])
+@log_with(log)
+@prepolicy(check_base_action, request, ACTION.STATISTICSDELETE)
+def delete_timing():
+    """
+    Delete the timing of the functions of this server process.
+    """
+    reset_timing_stats()
+    g.audit_object.log({"success": True})
+    return send_result(True)
@@ -105,6 +105,7 @@ from privacyidea.lib.event import event
 from privacyidea.lib.machine import list_machine_tokens
 from privacyidea.lib.policy import ACTION
 from privacyidea.lib.policy import PolicyClass, SCOPE
+from privacyidea.lib.sqlutils import begin_unit_of_work, end_unit_of_work
 from privacyidea.lib.subscriptions import CheckSubscription
 from privacyidea.lib.token import (check_user_pass, check_serial_pass,
                                    check_otp, create_challenges_from_tokens, get_one_token)
@@ -115,6 +116,7 @@ from privacyidea.lib.tokenclass import CHALLENGE_SESSION
 from privacyidea.lib.user import get_user_from_param, log_used_user, User
 from privacyidea.lib.utils import get_client_ip, get_plugin_info_from_useragent
 from privacyidea.lib.utils import is_true, get_computer_name_from_user_agent
+from privacyidea.models import db
 from .lib.utils import required
 from .lib.utils import send_result, getParam, get_required, get_optional
 from ..lib.decorators import (check_user_serial_or_cred_id_in_request)
@@ -162,6 +164,24 @@ def before_request():
                         "info": ""})
 
 
+@validate_blueprint.before_request
+def begin_request_unit_of_work():
+    """
+    The changes of the tokens during the authentication request are committed
+    in one transaction at the end of the request. Changes, which must not get
+    lost like the OTP counter and the fail counter, are committed immediately.
+    If the request fails, the unit of work is ended in the teardown handler,
+    before the audit entry is written.
+    """
+    begin_unit_of_work(db.session)
+
+
+@validate_blueprint.after_request
+def end_request_unit_of_work(response):
+    end_unit_of_work(db.session)
+    return response
+
+
 @validate_blueprint.route('/offlinerefill', methods=['POST'])
 @check_user_serial_or_cred_id_in_request(request)
 @event("validate_offlinerefill", request, g)
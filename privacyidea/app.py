@@ -65,10 +65,12 @@ from privacyidea.api.smsgateway import smsgateway_blueprint
 from privacyidea.api.clienttype import client_blueprint
 from privacyidea.api.subscriptions import subscriptions_blueprint
 from privacyidea.api.monitoring import monitoring_blueprint
+from privacyidea.api.timing import timing_blueprint
 from privacyidea.api.tokengroup import tokengroup_blueprint
 from privacyidea.api.serviceid import serviceid_blueprint
 from privacyidea.lib import queue
-from privacyidea.lib.log import DEFAULT_LOGGING_CONFIG
+from privacyidea.lib.log import DEFAULT_LOGGING_CONFIG, enable_timing
+from privacyidea.lib.requeststats import enable_request_stats, REQUEST_STATS
 from privacyidea.config import config
 from privacyidea.models import db, NodeName
 from privacyidea.lib.crypto import init_hsm
@@ -166,6 +168,7 @@ def create_app(config_name="development",
     app.register_blueprint(client_blueprint, url_prefix='/client')
     app.register_blueprint(subscriptions_blueprint, url_prefix='/subscriptions')
     app.register_blueprint(monitoring_blueprint, url_prefix='/monitoring')
+    app.register_blueprint(timing_blueprint, url_prefix='/timing')
     app.register_blueprint(tokengroup_blueprint, url_prefix='/tokengroup')
     app.register_blueprint(serviceid_blueprint, url_prefix='/serviceid')
     app.register_blueprint(container_blueprint, url_prefix='/container')
@@ -218,6 +221,11 @@ def create_app(config_name="development",
 
     queue.register_app(app)
 
+    # Record the timing of the functions decorated with log_with
+    enable_timing(app.config.get("PI_TIMING_STATS", False))
+    # Record the time of the requests spent in the database, resolvers etc.
+    enable_request_stats(app.config.get(REQUEST_STATS, False))
+
     if initialize_hsm:
         with app.app_context():
             init_hsm()
@@ -20,11 +20,13 @@
 import datetime
 import re
 import sys
+import time
 import click
 import yaml
 from flask import current_app
 from flask.cli import AppGroup
-from sqlalchemy import create_engine, desc, MetaData
+from sqlalchemy import (create_engine, desc, MetaData, String, and_, or_, not_,
+                        false, func)
 from sqlalchemy.orm import sessionmaker
 
 from privacyidea.lib.audit import getAudit
@@ -94,48 +96,11 @@ def rotate_audit(highwatermark, lowwatermark, age, config,
     # create a Session
     metadata.create_all(engine)
     if config:
-        yml_config = yaml.safe_load(config)
-        auditlogs = session.query(LogEntry).all()
-        delete_list = []
-        for log in auditlogs:
-            click.echo("investigating log entry {0!s}".format(log.id))
-            for rule in yml_config:
-                age = int(rule.get("rotate"))
-                rotate_date = datetime.datetime.now() - datetime.timedelta(days=age)
-
-                match = False
-                for key in rule.keys():
-                    if key not in ["rotate"]:
-                        search_value = str(rule.get(key))
-                        click.echo(" + searching for {0!r} in {1!s}".format(search_value,
-                                                                            getattr(LogEntry, key)))
-                        audit_value = str(getattr(log, key, ""))
-                        m = re.search(search_value, audit_value)
-                        if m:
-                            # it matches!
-                            click.echo(" + -- found {0!r}".format(audit_value))
-                            match = True
-                        else:
-                            # It does not match, we continue to next rule
-                            click.echo(" + NO MATCH - SKIPPING rest of conditions!")
-                            match = False
-                            break
-
-                if match:
-                    if log.date < rotate_date:
-                        # Delete it!
-                        click.echo(" + Deleting {0!s} due to rule {1!s}".format(log.id, rule))
-                        # Delete it
-                        delete_list.append(log.id)
-                    # skip all other rules and go to the next log entry
-                    break
-        if dryrun:
-            click.echo("If you only would let me I would clean up "
-                       "{0!s} entries!".format(len(delete_list)))
+        rules = _parse_rotate_rules(yaml.safe_load(config), engine.dialect.name)
+        if all(rule["criterion"] is not None for rule in rules):
+            _rotate_with_sql_rules(session, rules, dryrun, chunksize)
         else:
-            click.echo("Cleaning up {0!s} entries.".format(len(delete_list)))
-            delete_matching_rows(session, LogEntry.__table__,
-                                 LogEntry.id.in_(delete_list), chunksize)
+            _rotate_with_scan(session, rules, dryrun, chunksize or SCAN_BATCH_SIZE)
     elif age:
         now = datetime.datetime.now() - datetime.timedelta(days=age)
         click.echo("Deleting entries older than {0!s}".format(now))
@@ -168,6 +133,244 @@ def rotate_audit(highwatermark, lowwatermark, age, config,
                 click.echo("{0!s} entries deleted.".format(r))
 
 
+# The number of audit entries read at once, if the rules need to be
+# evaluated in Python
+SCAN_BATCH_SIZE = 1000
+_REGEX_SPECIAL_CHARS = ".^$*+?{}[]|()"
+# The databases, which compare strings case-sensitively and with trailing
+# spaces by default. MySQL and MariaDB ignore the case (and the accents) with
+# the usual collations and the trailing spaces, so the rules are evaluated
+# with regular expressions.
+_CASE_SENSITIVE_DIALECTS = ["sqlite", "postgresql"]
+
+
+def _regex_to_like(pattern):
+    """
+    Translate a regular expression, which is used with ``re.search``, to a
+    LIKE comparison, if it only consists of a literal text with optional
+    anchors. A leading or trailing ``.*`` does not change the result of the
+    search and is ignored.
+
+    :param pattern: the regular expression
+    :return: tuple of the comparison ("equals", "startswith", "endswith" or
+        "contains") and the literal text or None, if the expression can not
+        be translated
+    """
+    anchored_start = pattern.startswith("^")
+    if anchored_start:
+        pattern = pattern[1:]
+    if pattern.startswith(".*"):
+        anchored_start = False
+        pattern = re.sub(r"^(\.\*)+", "", pattern)
+    anchored_end = False
+    literal = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            escaped = pattern[i + 1:i + 2]
+            if not escaped or escaped.isalnum() or escaped == "_":
+                # character classes like \d or an incomplete escape
+                return None
+            literal.append(escaped)
+            i += 2
+            continue
+        if char in _REGEX_SPECIAL_CHARS:
+            rest = pattern[i:]
+            if rest == "$":
+                anchored_end = True
+            elif not re.fullmatch(r"(\.\*)+", rest):
+                return None
+            break
+        literal.append(char)
+        i += 1
+    literal = "".join(literal)
+    if anchored_start and anchored_end:
+        return "equals", literal
+    if anchored_start:
+        return "startswith", literal
+    if anchored_end:
+        return "endswith", literal
+    return "contains", literal
+
+
+def _glob_escape(literal):
+    """
+    Escape the wildcards of a literal text for the GLOB operator of SQLite
+    """
+    return re.sub(r"([*?\[])", r"[\1]", literal)
+
+
+def _column_criterion(column, search_value, dialect):
+    """
+    Return an SQL criterion, which matches the same audit entries as
+    ``re.search(search_value, str(value))`` or None, if the search value can
+    not be translated.
+    """
+    if dialect not in _CASE_SENSITIVE_DIALECTS:
+        return None
+    if not isinstance(column.type, String):
+        # The string representation of other types depends on the database
+        return None
+    like = _regex_to_like(search_value)
+    if like is None:
+        return None
+    comparison, literal = like
+    if comparison == "equals":
+        criterion = column == literal
+    elif dialect == "sqlite":
+        # LIKE ignores the case of ASCII letters in SQLite, GLOB does not
+        pattern = _glob_escape(literal)
+        if comparison in ["endswith", "contains"]:
+            pattern = "*" + pattern
+        if comparison in ["startswith", "contains"]:
+            pattern = pattern + "*"
+        criterion = column.op("GLOB")(pattern)
+    else:
+        criterion = getattr(column, comparison)(literal, autoescape=True)
+    # Empty columns are compared as the string "None". The criterion must
+    # never be NULL, since it is negated for the following rules.
+    if re.search(search_value, "None"):
+        return or_(column.is_(None), criterion)
+    return and_(column.isnot(None), criterion)
+
+
+def _parse_rotate_rules(yml_config, dialect):
+    """
+    Parse the rules of the rotate config file. Each rule contains the date,
+    before which the matching entries are deleted, the compiled regular
+    expressions and the SQL criterion of the rule, if all search values
+    could be translated for the given database dialect.
+    """
+    now = datetime.datetime.now()
+    rules = []
+    for rule in yml_config:
+        rotate_date = now - datetime.timedelta(days=int(rule.get("rotate")))
+        searches = []
+        criteria = []
+        for key, value in rule.items():
+            if key == "rotate":
+                continue
+            column = getattr(LogEntry, key, None)
+            if column is None or not hasattr(column, "type"):
+                raise click.BadParameter(f"Unknown audit column {key!r} in rule {rule!r}.",
+                                         param_hint="--config")
+            search_value = str(value)
+            searches.append((key, re.compile(search_value)))
+            criteria.append(_column_criterion(column, search_value, dialect))
+        if not searches:
+            # A rule without any search value never matches an entry
+            criterion = false()
+        elif any(c is None for c in criteria):
+            criterion = None
+        else:
+            criterion = and_(*criteria)
+        click.echo("Rule {0!s}: {1!s}".format(rule, "evaluated by the database" if criterion is not None
+                                              else "evaluated with regular expressions"))
+        rules.append({"rule": rule, "rotate_date": rotate_date,
+                      "searches": searches, "criterion": criterion})
+    return rules
+
+
+def _rule_criteria(rules):
+    """
+    Return the SQL criteria for the entries, which are deleted by each rule.
+    The first matching rule for an entry wins.
+    """
+    criteria = []
+    for i, rule in enumerate(rules):
+        earlier_rules = [not_(r["criterion"]) for r in rules[:i]]
+        criteria.append(and_(rule["criterion"], LogEntry.date < rule["rotate_date"], *earlier_rules))
+    return criteria
+
+
+class _Progress(object):
+    """
+    Report the number of processed entries and the throughput
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+
+    def __call__(self, deleted, scanned=None):
+        duration = max(time.monotonic() - self.start, 1e-6)
+        if scanned is None:
+            click.echo(" + {0!s} entries deleted ({1:.0f} entries/s)".format(
+                deleted, deleted / duration))
+        else:
+            click.echo(" + {0!s} entries scanned, {1!s} matching ({2:.0f} entries/s)".format(
+                scanned, deleted, scanned / duration))
+
+
+def _rotate_with_sql_rules(session, rules, dryrun, chunksize):
+    """
+    Delete the entries matching the rules with chunked DELETE statements.
+    """
+    criteria = _rule_criteria(rules)
+    if dryrun:
+        count = 0
+        for rule, criterion in zip(rules, criteria):
+            rule_count = session.query(func.count(LogEntry.id)).filter(criterion).scalar()
+            click.echo(" + {0!s} entries match rule {1!s}".format(rule_count, rule["rule"]))
+            count += rule_count
+        click.echo("If you only would let me I would clean up "
+                   "{0!s} entries!".format(count))
+    else:
+        click.echo("Cleaning up entries.")
+        deleted = delete_matching_rows(session, LogEntry.__table__, or_(false(), *criteria),
+                                       chunksize, progress=_Progress())
+        click.echo("{0!s} entries deleted.".format(deleted))
+
+
+def _matching_rule(entry, rules):
+    """
+    Return the first rule, which matches the audit entry or None
+    """
+    for rule in rules:
+        if rule["searches"] and all(regex.search(str(getattr(entry, key))) for key, regex in rule["searches"]):
+            return rule
+    return None
+
+
+def _rotate_with_scan(session, rules, dryrun, batch_size):
+    """
+    Read the audit entries in batches ordered by their id and evaluate the
+    rules in Python. Only the columns used in the rules are read and the
+    matching entries of each batch are deleted, so that the memory usage
+    does not depend on the size of the audit table.
+    """
+    keys = sorted({key for rule in rules for key, _regex in rule["searches"]})
+    columns = [getattr(LogEntry, key) for key in keys if key not in ("id", "date")]
+    # Newer entries can not be deleted by any rule
+    latest_date = max(rule["rotate_date"] for rule in rules)
+    progress = _Progress()
+    scanned = matching = 0
+    last_id = 0
+    while True:
+        entries = session.query(LogEntry.id, LogEntry.date, *columns) \
+            .filter(LogEntry.id > last_id, LogEntry.date < latest_date) \
+            .order_by(LogEntry.id).limit(batch_size).all()
+        if not entries:
+            break
+        last_id = entries[-1].id
+        delete_ids = []
+        for entry in entries:
+            rule = _matching_rule(entry, rules)
+            if rule and entry.date < rule["rotate_date"]:
+                delete_ids.append(entry.id)
+        scanned += len(entries)
+        matching += len(delete_ids)
+        if delete_ids and not dryrun:
+            delete_matching_rows(session, LogEntry.__table__, LogEntry.id.in_(delete_ids))
+        session.commit()
+        progress(matching, scanned)
+    if dryrun:
+        click.echo("If you only would let me I would clean up "
+                   "{0!s} entries!".format(matching))
+    else:
+        click.echo("{0!s} entries deleted.".format(matching))
+
+
 def _validate_timelimit(_ctx, _param, value):
     if value:
         try:
@@ -23,7 +23,7 @@ import pathlib
 import sys
 import click
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import rsa, ed25519, ec
 from cryptography.hazmat.primitives import serialization
 from flask.cli import AppGroup
 from flask import current_app
@@ -145,13 +145,17 @@ def create_pgp_keys(ctx, keysize, force):
 
 @setup_cli.command("create_audit_keys")
 @click.option("-k", "--keysize", type=int, default=2048, show_default=True,
-              help="Create keys with the given size in bits")
+              help="Create RSA keys with the given size in bits")
+@click.option("-t", "--keytype", type=click.Choice(["rsa", "ed25519", "ecdsa"]),
+              default="rsa", show_default=True,
+              help="The type of the keys. Ed25519 and ECDSA (P-256) signatures "
+                   "are much faster to create than RSA signatures.")
 @click.pass_context
-def create_audit_keys(ctx, keysize):
+def create_audit_keys(ctx, keysize, keytype):
     """
-    Create the RSA signing keys for the audit log.
+    Create the signing keys for the audit log and the responses.
 
-    You may specify a different key size.
+    You may specify a different key size for RSA keys.
     The default key size is 2048 bit.
     """
     priv_key = pathlib.Path(current_app.config.get("PI_AUDIT_KEY_PRIVATE"))
@@ -159,12 +163,19 @@ def create_audit_keys(ctx, keysize):
         click.secho(f"The file \n\t{priv_key}\nalready exist. We do not overwrite it!",
                     fg="yellow")
         ctx.exit(1)
-    new_key = rsa.generate_private_key(public_exponent=65537,
-                                       key_size=keysize,
-                                       backend=default_backend())
+    if keytype == "ed25519":
+        new_key = ed25519.Ed25519PrivateKey.generate()
+    elif keytype == "ecdsa":
+        new_key = ec.generate_private_key(ec.SECP256R1(), backend=default_backend())
+    else:
+        new_key = rsa.generate_private_key(public_exponent=65537,
+                                           key_size=keysize,
+                                           backend=default_backend())
+    # Only RSA keys can be written in the traditional OpenSSL format
     priv_pem = new_key.private_bytes(
         encoding=serialization.Encoding.PEM,
-        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        format=(serialization.PrivateFormat.TraditionalOpenSSL if keytype == "rsa"
+                else serialization.PrivateFormat.PKCS8),
         encryption_algorithm=serialization.NoEncryption())
     with open(priv_key, "wb") as f:
         f.write(priv_pem)
@@ -17,10 +17,13 @@
 # You should have received a copy of the GNU Affero General Public
 # License along with this program. If not, see <http://www.gnu.org/licenses/>.
 """CLI commands for managing tokens"""
+import time
+
 import click
 from flask.cli import AppGroup
-from privacyidea.lib.token import import_token
-from privacyidea.lib.importotp import parseOATHcsv
+from privacyidea.lib.error import ParameterError
+from privacyidea.lib.token import import_tokens, update_otp_index_of_tokens
+from privacyidea.lib.importotp import iter_oath_csv
 
 
 token_cli = AppGroup("token", short_help="Manage tokens in privacyIDEA",
@@ -32,15 +35,44 @@ token_cli = AppGroup("token", short_help="Manage tokens in privacyIDEA",
 @click.option("-t", "--tokenrealm", multiple=True, default=[],
               help="The realms in which the tokens should be imported (can be "
                    "used multiple times)")
-def import_tokens(file, tokenrealm):
+@click.option("-b", "--batch-size", type=click.IntRange(min=1), default=1000, show_default=True,
+              help="The number of tokens, which are written to the database together")
+def import_token_file(file, tokenrealm, batch_size):
     """
     Import Tokens from CSV data in FILE
     """
-    contents = file.read()
-    tokens = parseOATHcsv(contents)
-    i = 0
-    for serial in tokens:
-        i += 1
-        print(u"{0!s}/{1!s} Importing token {2!s}".format(i, len(tokens), serial))
-
-        import_token(serial, tokens[serial], tokenrealms=tokenrealm)
+    start = time.time()
+
+    def report(imported, failed):
+        duration = max(time.time() - start, 0.001)
+        click.echo("{0!s} tokens imported, {1!s} failed ({2:.0f} tokens/s)".format(
+            imported, len(failed), imported / duration))
+
+    # The file is read line by line
+    _imported, failed = import_tokens(iter_oath_csv(file), tokenrealms=list(tokenrealm),
+                                      batch_size=batch_size, progress=report)
+    if failed:
+        click.echo("Failed to import the tokens: {0!s}".format(", ".join(failed)))
+
+
+@token_cli.command("update-otp-index", short_help="Build or refresh the OTP index of HOTP tokens")
+@click.option("-w", "--window", type=click.IntRange(min=1), default=10, show_default=True,
+              help="The look ahead window, which the index has to cover")
+@click.option("--chunksize", type=click.IntRange(min=1), default=1000, show_default=True,
+              help="The number of tokens, which are read and committed together")
+def update_otp_index(window, chunksize):
+    """
+    Calculate the OTP index entries of all HOTP tokens, which are not covered
+    by the index (PI_OTP_INDEX_SIZE) for the given window. Run it after
+    enabling the index and regularly, e.g. in a cronjob, to refresh the entries
+    of the tokens, whose counter has advanced.
+    """
+    def report(checked, updated):
+        click.echo("{0!s} tokens checked, {1!s} updated".format(checked, updated))
+
+    try:
+        updated = update_otp_index_of_tokens(window=window, chunksize=chunksize,
+                                             progress=report)
+    except ParameterError as exx:
+        raise click.ClickException(exx.message)
+    click.echo("Updated the OTP index of {0!s} tokens".format(updated))
@@ -42,17 +42,20 @@
 # CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
 # ARISING IN ANY WAY OUT OF THE
 
+import time
+
 from flask.cli import AppGroup
 import click
 
-from privacyidea.lib.token import import_token
+from privacyidea.lib.error import TokenImportException
+from privacyidea.lib.token import import_tokens
 
 
 loadtokens_cli = AppGroup("load")
 
 
 @loadtokens_cli.command("load")
-@click.argument('pskc', type=click.File())
+@click.argument('pskc', type=click.File('rb'))
 @click.option('--preshared_key_hex',
               help='The AES encryption key.')
 @click.option('--validate_mac', default='check_fail_hard',
@@ -60,32 +63,52 @@ loadtokens_cli = AppGroup("load")
                    "'no_check' : Every token is parsed, ignoring HMAC\n"
                    "'check_fail_soft' : Skip tokens with invalid HMAC\n"
                    "'check_fail_hard' : Only import tokens if all HMAC are valid.")
-def loadtokens(pskc, preshared_key_hex, validate_mac):
+@click.option('--batch_size', default=1000, type=click.IntRange(min=1), show_default=True,
+              help="The number of tokens, which are written to the database together.")
+def loadtokens(pskc, preshared_key_hex, validate_mac, batch_size):
     """
     Loads token data from the PSKC file.
     """
-    from privacyidea.lib.importotp import parsePSKCdata
-
-    file_contents = pskc.read()
+    from privacyidea.lib.importotp import iter_pskc_data
 
-    tokens, not_parsed_tokens = parsePSKCdata(file_contents,
-                                              preshared_key_hex=preshared_key_hex,
-                                              validate_mac=validate_mac)
-    success = 0
-    failed = 0
-    failed_tokens = []
-    for serial in tokens:
+    if validate_mac == 'check_fail_hard':
+        # The complete file is checked first, so that no token is imported,
+        # if the MAC of a token is invalid.
         try:
-            print("Importing token {0!s}".format(serial))
-            import_token(serial, tokens[serial])
-            success = success + 1
-        except Exception as e:
-            failed = failed + 1
-            failed_tokens.append(serial)
-            print("--- Failed to import token. {0!s}".format(e))
+            for _token in iter_pskc_data(pskc, preshared_key_hex=preshared_key_hex,
+                                         validate_mac=validate_mac):
+                pass
+        except TokenImportException as e:
+            print("No tokens were imported: {0!s}".format(e))
+            return
+        pskc.seek(0)
+
+    not_parsed_tokens = []
+
+    def parsed_tokens():
+        # The key packages are read one after the other
+        for serial, token in iter_pskc_data(pskc, preshared_key_hex=preshared_key_hex,
+                                            validate_mac=validate_mac):
+            if token is None:
+                not_parsed_tokens.append(serial)
+            else:
+                yield serial, token
+
+    start = time.time()
+
+    def report(imported, failed):
+        duration = max(time.time() - start, 0.001)
+        print("Imported {0!s} tokens ({1:.0f} tokens/s)".format(imported, imported / duration))
+
+    try:
+        success, failed_tokens = import_tokens(parsed_tokens(), batch_size=batch_size,
+                                               progress=report)
+    except TokenImportException as e:
+        print("Failed to read the PSKC file: {0!s}".format(e))
+        return
 
     if not_parsed_tokens:
         print("The following tokens were not read from the PSKC file"
               " because they could not be validated: {0!s}".format(not_parsed_tokens))
     print("Successfully imported {0!s} tokens.".format(success))
-    print("Failed to import {0!s} tokens: {1!s}".format(failed, failed_tokens))
+    print("Failed to import {0!s} tokens: {1!s}".format(len(failed_tokens), failed_tokens))
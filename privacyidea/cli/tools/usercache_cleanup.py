@@ -37,13 +37,14 @@ This script deletes expired entries from the user cache.
 __version__ = "0.1"
 
 from flask.cli import with_appcontext, ScriptInfo
-from privacyidea.lib.usercache import create_filter, get_cache_time
+from privacyidea.lib.usercache import create_filter, get_cache_time, delete_user_cache
 from privacyidea.lib.utils import get_version_number
-from privacyidea.models import UserCache, db
+from privacyidea.models import UserCache
 from privacyidea.cli import create_silent_app
 import click
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+DEFAULT_CHUNKSIZE = 1000
 
 
 def _get_expired_entries():
@@ -59,8 +60,10 @@ LIST_FORMAT = '{:<5} {:<10} {:<10} {:<30} {:<10}'
 
 @click.command(context_settings=CONTEXT_SETTINGS)
 @click.option('-n', "--noaction", is_flag=True, default=False)
+@click.option('--chunksize', type=click.IntRange(min=1), default=DEFAULT_CHUNKSIZE, show_default=True,
+              help='The number of entries, which are deleted with one statement.')
 @with_appcontext
-def delete(noaction=False):
+def delete(noaction=False, chunksize=DEFAULT_CHUNKSIZE):
     """
     Delete all cache entries that are considered expired according to the
     UserCacheExpiration configuration setting.
@@ -83,11 +86,8 @@ def delete(noaction=False):
                                           entry.user_id))
         click.echo('{} entries'.format(len(entries)))
         if not noaction:
-            for entry in entries:
-                click.echo('Deleting entry with id={} ...'.format(entry.id))
-                entry.delete()
-            click.echo('Deleted {} expired entries.'.format(len(entries)))
-            db.session.commit()
+            deleted = delete_user_cache(expired=True, chunksize=chunksize)
+            click.echo('Deleted {} expired entries.'.format(deleted))
         else:
             click.echo("'--noaction' was passed, not doing anything.")
 
@@ -0,0 +1,486 @@
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+__doc__ = """The Asynchronous Audit Module writes the audit entries to the same SQL
+database as the SQL Audit Module, but not during the request. The finalized audit
+entries are passed to a queue. A background thread in each privacyIDEA process
+writes the entries in batches with its own database engine.
+
+The Asynchronous Audit Module is configured like this:
+
+    PI_AUDIT_MODULE = "privacyidea.lib.auditmodules.asyncaudit"
+
+    Optional:
+    PI_AUDIT_ASYNC_BATCH_SIZE = 100
+    PI_AUDIT_ASYNC_FLUSH_INTERVAL = 1
+    PI_AUDIT_ASYNC_QUEUE_SIZE = 10000
+    PI_AUDIT_ASYNC_BACKPRESSURE = "block" | "drop" | "spill"
+    PI_AUDIT_ASYNC_SPILL_FILE = "/var/lib/privacyidea/audit-spill.jsonl"
+    PI_AUDIT_ASYNC_STATS_INTERVAL = 60
+    PI_AUDIT_ASYNC_RETRIES = 3
+    PI_AUDIT_ASYNC_RETRY_DELAY = 0.5
+
+All other parameters of the SQL Audit Module (like the signing keys or
+PI_AUDIT_SQL_URI) are used as well. Reading the audit log is done like in the
+SQL Audit Module.
+
+This module is tested in tests/test_lib_audit.py
+"""
+
+import atexit
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+
+from flask import current_app
+from sqlalchemy.orm import sessionmaker
+
+from privacyidea.lib.auditmodules.sqlaudit import Audit as SQLAudit
+from privacyidea.lib.framework import get_app_local_store
+from privacyidea.lib.lifecycle import call_finalizers
+from privacyidea.lib.monitoringstats import write_stats
+from privacyidea.models import Audit as LogEntry
+
+log = logging.getLogger(__name__)
+
+BACKPRESSURE_BLOCK = "block"
+BACKPRESSURE_DROP = "drop"
+BACKPRESSURE_SPILL = "spill"
+
+# The columns, which are written to the spill file
+SPILL_COLUMNS = [column.name for column in LogEntry.__table__.columns
+                 if column.name not in ["id", "signature"]]
+DATETIME_COLUMNS = ["date", "startdate"]
+# The seconds a request waits for space in the queue, before it checks, that
+# the writer thread is still running
+PUT_TIMEOUT = 1
+
+
+def entry_to_dict(le):
+    """
+    Convert an audit entry to a JSON serializable dictionary
+    """
+    values = {}
+    for column in SPILL_COLUMNS:
+        value = getattr(le, column)
+        if value is not None and column in DATETIME_COLUMNS:
+            value = value.isoformat()
+        elif value is not None and column == "duration":
+            value = value.total_seconds()
+        values[column] = value
+    return values
+
+
+def entry_from_dict(values):
+    """
+    Create an audit entry from a dictionary created by :func:`entry_to_dict`
+    """
+    le = LogEntry()
+    for column in SPILL_COLUMNS:
+        value = values.get(column)
+        if value is not None and column in DATETIME_COLUMNS:
+            value = datetime.datetime.fromisoformat(value)
+        elif value is not None and column == "duration":
+            value = datetime.timedelta(seconds=value)
+        setattr(le, column, value)
+    return le
+
+
+class AuditWriter(object):
+    """
+    The background writer of a privacyIDEA process. It takes the audit entries
+    from the queue and writes up to ``batch_size`` entries in one transaction.
+    A batch is written at the latest ``flush_interval`` seconds after its first
+    entry was queued.
+
+    If the queue is full, the ``backpressure`` policy decides, what happens:
+
+    * ``block``: The request waits, until there is space in the queue. If the
+      writer thread is not running anymore, the entry is spilled (if the
+      ``spill_file`` is set) or dropped.
+    * ``drop``: The entry is dropped and counted in ``dropped``.
+    * ``spill``: The entry is appended to the ``spill_file`` of this process
+      (``PI_AUDIT_ASYNC_SPILL_FILE`` with the process id as suffix). The writer
+      reads the spilled entries, when the queue is empty again. Lines of the
+      spill file, which can not be read, are moved to the file with the suffix
+      ``.corrupt``.
+
+    If a batch can not be written, it is retried ``retries`` times with an
+    increasing delay, e.g. during a short outage of the database. Then the
+    entries are written one by one, so that only the failing entries are
+    appended to the spill file (if it is set) or counted in ``failed``.
+    """
+
+    def __init__(self, audit, app=None):
+        """
+        :param audit: The audit object, which is used to create the engine and
+            to sign the entries
+        :type audit: privacyidea.lib.auditmodules.asyncaudit.Audit
+        :param app: The Flask app, which is used to write the monitoring statistics
+        """
+        config = audit.config
+        self.audit = audit
+        self.app = app
+        self.batch_size = int(config.get("PI_AUDIT_ASYNC_BATCH_SIZE", 100))
+        self.flush_interval = float(config.get("PI_AUDIT_ASYNC_FLUSH_INTERVAL", 1))
+        self.backpressure = config.get("PI_AUDIT_ASYNC_BACKPRESSURE", BACKPRESSURE_BLOCK)
+        if self.backpressure not in [BACKPRESSURE_BLOCK, BACKPRESSURE_DROP, BACKPRESSURE_SPILL]:
+            log.warning("Unknown backpressure policy {0!r}. "
+                        "Using {1!r}.".format(self.backpressure, BACKPRESSURE_BLOCK))
+            self.backpressure = BACKPRESSURE_BLOCK
+        self.pid = os.getpid()
+        self.spill_file = None
+        if config.get("PI_AUDIT_ASYNC_SPILL_FILE"):
+            # Each process uses its own spill file
+            self.spill_file = "{0!s}.{1!s}".format(config.get("PI_AUDIT_ASYNC_SPILL_FILE"), self.pid)
+        if self.backpressure == BACKPRESSURE_SPILL and not self.spill_file:
+            log.warning("PI_AUDIT_ASYNC_SPILL_FILE is not set. Dropping audit entries, "
+                        "if the queue is full.")
+            self.backpressure = BACKPRESSURE_DROP
+        self.stats_interval = float(config.get("PI_AUDIT_ASYNC_STATS_INTERVAL", 60))
+        self.retries = int(config.get("PI_AUDIT_ASYNC_RETRIES", 3))
+        self.retry_delay = float(config.get("PI_AUDIT_ASYNC_RETRY_DELAY", 0.5))
+        self.queue = queue.Queue(maxsize=int(config.get("PI_AUDIT_ASYNC_QUEUE_SIZE", 10000)))
+        self.spill_lock = threading.Lock()
+        self.spill_pending = False
+        # The writer uses its own engine and session
+        self.engine = audit._create_engine()
+        self.session = sessionmaker(bind=self.engine)()
+        # Statistics, which are increased by the requests and the writer thread
+        self.stats_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.failed = 0
+        self.last_write_latency = 0.0
+        self.max_write_latency = 0.0
+        self._last_stats = time.monotonic()
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="privacyidea-audit-writer",
+                                       daemon=True)
+        self.thread.start()
+
+    def put(self, le):
+        """
+        Queue an audit entry according to the backpressure policy.
+
+        :param le: The audit entry
+        :type le: LogEntry
+        """
+        try:
+            if self.backpressure == BACKPRESSURE_BLOCK:
+                while True:
+                    try:
+                        self.queue.put(le, timeout=PUT_TIMEOUT)
+                        break
+                    except queue.Full:
+                        # Nobody empties the queue of a stopped writer
+                        if not self.thread.is_alive():
+                            raise
+            else:
+                self.queue.put_nowait(le)
+        except queue.Full:
+            if self.backpressure != BACKPRESSURE_DROP and self.spill_file and self._spill(le):
+                return
+            self._count("dropped")
+            log.warning("The audit queue is full. The audit entry {0!r} "
+                        "is dropped.".format(le.action))
+
+    def _count(self, name, number=1):
+        with self.stats_lock:
+            setattr(self, name, getattr(self, name) + number)
+
+    def _spill(self, le, pending=True):
+        """
+        Append an audit entry to the spill file.
+
+        :param le: The audit entry
+        :param pending: Whether the writer should read the spilled entries,
+            when the queue is empty again
+        :return: True, if the entry is written to the spill file
+        """
+        try:
+            with self.spill_lock:
+                with open(self.spill_file, "a") as f:
+                    f.write(json.dumps(entry_to_dict(le)) + "\n")
+                self.spill_pending = self.spill_pending or pending
+        except OSError as exx:
+            log.error("Could not write the audit entry to {0!s}: {1!r}".format(self.spill_file, exx))
+            return False
+        self._count("spilled")
+        return True
+
+    def _read_spilled(self):
+        """
+        Read and remove the spilled audit entries. The lines, which can not
+        be read, are appended to the spill file with the suffix ``.corrupt``
+        and counted as failed.
+
+        :return: list of audit entries
+        """
+        entries = []
+        corrupt = []
+        with self.spill_lock:
+            self.spill_pending = False
+            if not self.spill_file or not os.path.exists(self.spill_file):
+                return entries
+            with open(self.spill_file) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entries.append(entry_from_dict(json.loads(line)))
+                    except (ValueError, TypeError, AttributeError) as exx:
+                        log.error("Could not read the spilled audit entry {0!r}: {1!r}".format(line, exx))
+                        corrupt.append(line.rstrip("\n") + "\n")
+            if corrupt:
+                with open(self.spill_file + ".corrupt", "a") as f:
+                    f.writelines(corrupt)
+            os.remove(self.spill_file)
+        self._count("failed", len(corrupt))
+        return entries
+
+    def _get_batch(self):
+        """
+        Wait for the next batch of audit entries.
+
+        :return: list of audit entries and whether the writer should stop
+        """
+        batch = []
+        stop = False
+        try:
+            item = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return batch, self._stop.is_set()
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+        return batch, stop
+
+    def _write_entries(self, entries):
+        """
+        Write the audit entries in one transaction.
+
+        :return: True, if the entries are written
+        """
+        try:
+            self.audit._write_entries(entries, session=self.session)
+            return True
+        except Exception as exx:
+            log.warning("Could not write {0!s} audit entries: {1!r}".format(len(entries), exx))
+            log.debug("{0!s}".format(traceback.format_exc()))
+            self.session.rollback()
+            # The entries get new ids and signatures with the next try
+            for le in entries:
+                le.id = None
+                le.signature = None
+            return False
+        finally:
+            self.session.close()
+
+    def write(self, entries):
+        """
+        Write the audit entries in one transaction and measure the latency.
+        If the transaction fails, it is retried with an increasing delay.
+        Then the entries are written one by one and the failing entries are
+        spilled or counted as failed.
+        """
+        start = time.monotonic()
+        written = self._write_entries(entries)
+        for attempt in range(self.retries):
+            if written:
+                break
+            # The delay is skipped, if the writer is stopped
+            self._stop.wait(self.retry_delay * 2 ** attempt)
+            written = self._write_entries(entries)
+        if written:
+            self._count("written", len(entries))
+        else:
+            failed = entries
+            if len(entries) > 1:
+                # Isolate the failing entries
+                failed = [le for le in entries if not self._write_entries([le])]
+                self._count("written", len(entries) - len(failed))
+            for le in failed:
+                # The spilled entries are read again with the next spilled
+                # entries or when the writer is stopped
+                if not (self.spill_file and self._spill(le, pending=False)):
+                    self._count("failed")
+                    log.error("Could not write the audit entry {0!s}.".format(entry_to_dict(le)))
+        self.last_write_latency = time.monotonic() - start
+        self.max_write_latency = max(self.max_write_latency, self.last_write_latency)
+
+    def flush(self):
+        """
+        Write all queued and spilled entries. This is called by the writer
+        thread, if the writer is stopped.
+        """
+        entries = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                entries.append(item)
+        entries.extend(self._read_spilled())
+        for i in range(0, len(entries), self.batch_size):
+            self.write(entries[i:i + self.batch_size])
+        if self.spill_file and os.path.exists(self.spill_file):
+            log.error("The audit entries in {0!s} could not be written.".format(self.spill_file))
+
+    def get_stats(self):
+        """
+        Return the statistics of the writer
+
+        :rtype: dict
+        """
+        with self.stats_lock:
+            return {"queue_depth": self.queue.qsize(),
+                    "written": self.written,
+                    "dropped": self.dropped,
+                    "spilled": self.spilled,
+                    "failed": self.failed,
+                    "last_write_latency": self.last_write_latency,
+                    "max_write_latency": self.max_write_latency}
+
+    def _write_stats(self):
+        """
+        Write the queue depth and the write latency to the monitoring statistics
+        """
+        if not self.app or self.stats_interval <= 0 \
+                or time.monotonic() - self._last_stats < self.stats_interval:
+            return
+        self._last_stats = time.monotonic()
+        try:
+            with self.app.app_context():
+                try:
+                    write_stats("audit_queue_depth", self.queue.qsize())
+                    write_stats("audit_write_latency_ms", int(self.max_write_latency * 1000))
+                    self.max_write_latency = 0.0
+                finally:
+                    call_finalizers()
+        except Exception as exx:  # pragma: no cover
+            log.warning("Could not write the audit writer statistics: {0!r}".format(exx))
+
+    def _run_once(self):
+        """
+        Write the next batch and the spilled entries.
+
+        :return: True, if the writer is stopped
+        """
+        batch, stop = self._get_batch()
+        if batch:
+            self.write(batch)
+        if stop:
+            self.flush()
+            return True
+        if self.spill_pending and self.queue.empty():
+            spilled = self._read_spilled()
+            for i in range(0, len(spilled), self.batch_size):
+                self.write(spilled[i:i + self.batch_size])
+        self._write_stats()
+        return False
+
+    def run(self):
+        while True:
+            try:
+                stop = self._run_once()
+            except Exception as exx:
+                # The thread must keep running, otherwise the queue is not
+                # emptied anymore
+                log.error("The audit writer failed: {0!r}".format(exx))
+                log.debug("{0!s}".format(traceback.format_exc()))
+                stop = self._stop.is_set()
+            if stop:
+                break
+        self.engine.dispose()
+
+    def stop(self, timeout=None):
+        """
+        Stop the writer thread after all queued entries are written.
+        """
+        if self.thread.is_alive():
+            self._stop.set()
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+
+class Audit(SQLAudit):
+    """
+    This is the asynchronous audit module. The audit entries are created and
+    read like in the SQL audit module, but they are written by a background
+    :class:`AuditWriter`.
+
+    Please note, that the audit entries are not available in the audit log
+    immediately after the request. If the process crashes, the queued audit
+    entries are lost.
+    """
+
+    def __init__(self, config=None, startdate=None):
+        super(Audit, self).__init__(config, startdate)
+        self.name = "asyncaudit"
+        # The buffer of the SQL audit module is not used
+        self.buffer = None
+
+    def get_writer(self):
+        """
+        Return the audit writer of this process. It is started with the first
+        audit entry and stopped at exit.
+
+        :rtype: AuditWriter
+        """
+        store = get_app_local_store()
+        writer = store.get("asyncaudit_writer")
+        if writer is None or writer.pid != os.getpid() or not writer.thread.is_alive():
+            # The writer thread does not survive forking the process
+            if writer is not None:
+                atexit.unregister(writer.stop)
+            writer = AuditWriter(self, current_app._get_current_object())
+            store["asyncaudit_writer"] = writer
+            atexit.register(writer.stop, 10)
+        return writer
+
+    def finalize_log(self):
+        """
+        Create the audit entry and pass it to the background writer.
+        """
+        try:
+            le = self._create_entry()
+            self.get_writer().put(le)
+        except Exception as exx:  # pragma: no cover
+            log.error("exception {0!r}".format(exx))
+            log.error("DATA: {0!s}".format(self.audit_data))
+            log.debug("{0!s}".format(traceback.format_exc()))
+        finally:
+            # clear the audit data
+            self.audit_data = {}
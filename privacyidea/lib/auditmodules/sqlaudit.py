@@ -32,15 +32,22 @@ The SQL Audit Module is configured like this:
     PI_AUDIT_SQL_URI = "sqlite://"
     PI_AUDIT_SQL_TRUNCATE = True | False
     PI_AUDIT_SQL_COLUMN_LENGTH = {"user": 60, "info": 10 ...}
+    PI_AUDIT_SQL_BUFFER_SIZE = 0
+    PI_AUDIT_SQL_BUFFER_INTERVAL = 5
+    PI_AUDIT_SQL_BUFFER_MAX = 1000
 
 If the PI_AUDIT_SQL_URI is omitted the Audit data is written to the
 token database.
 """
 
+import atexit
 import logging
+import threading
+import time
 from collections import OrderedDict
 from privacyidea.lib.auditmodules.base import (Audit as AuditBase, Paginate)
-from privacyidea.lib.crypto import Sign
+from privacyidea.lib.crypto import get_sign_object
+from privacyidea.lib.framework import get_app_local_store
 from privacyidea.lib.pooling import get_engine
 from privacyidea.lib.utils import censor_connect_string
 from privacyidea.lib.lifecycle import register_finalizer
@@ -88,6 +95,73 @@ def fn_to_isodate(element, compiler, **kw):
         element.clauses, **kw)
 
 
+class AuditBuffer(object):
+    """
+    Process wide buffer for audit entries. The entries of many requests are
+    written to the database in one transaction.
+
+    The buffer is flushed, if it contains ``size`` entries or if the oldest
+    entry is older than ``interval`` seconds. Both conditions are checked when
+    an entry is added. At the latest, the buffer is flushed when the process
+    exits. If the process crashes, the buffered entries are lost.
+
+    If writing the entries fails, they are kept for the next flush. The
+    buffer never contains more than ``max_size`` entries. If it is full, the
+    oldest entries are dropped.
+    """
+
+    def __init__(self, size, interval, max_size):
+        self.size = size
+        self.interval = interval
+        self.max_size = max(max_size, size)
+        self.entries = []
+        self.first_added = None
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def _drop_oldest(self):
+        num = len(self.entries) - self.max_size
+        if num > 0:
+            del self.entries[:num]
+            self.dropped += num
+            log.warning("The audit buffer is full. {0!s} audit entries were "
+                        "dropped.".format(num))
+
+    def add(self, entry):
+        """
+        Add an entry to the buffer.
+
+        :return: True, if the buffer should be flushed
+        """
+        with self.lock:
+            if not self.entries:
+                self.first_added = time.monotonic()
+            self.entries.append(entry)
+            self._drop_oldest()
+            return (len(self.entries) >= self.size
+                    or time.monotonic() - self.first_added >= self.interval)
+
+    def take(self):
+        """
+        Remove all entries from the buffer and return them.
+        """
+        with self.lock:
+            entries = self.entries
+            self.entries = []
+            self.first_added = None
+            return entries
+
+    def put_back(self, entries):
+        """
+        Return entries, which could not be written, to the buffer.
+        """
+        with self.lock:
+            if not self.entries:
+                self.first_added = time.monotonic()
+            self.entries = entries + self.entries
+            self._drop_oldest()
+
+
 class Audit(AuditBase):
     """
     This is the SQLAudit module, which writes the audit entries
@@ -113,11 +187,21 @@ class Audit(AuditBase):
     * ``PI_AUDIT_POOL_SIZE``
     * ``PI_AUDIT_POOL_RECYCLE``
     * ``PI_AUDIT_SQL_TRUNCATE``
+    * ``PI_AUDIT_SQL_BUFFER_SIZE``
+    * ``PI_AUDIT_SQL_BUFFER_INTERVAL``
+    * ``PI_AUDIT_SQL_BUFFER_MAX``
     * ``PI_AUDIT_NO_SIGN``
     * ``PI_CHECK_OLD_SIGNATURES``
 
     You can use ``PI_AUDIT_NO_SIGN = True`` to avoid signing of the audit log.
 
+    With ``PI_AUDIT_SQL_BUFFER_SIZE`` greater than 1 the audit entries are
+    collected in an :class:`AuditBuffer` and written in batches.
+
+    If ``PI_AUDIT_KEY_HMAC`` contains the name of a file with a hexlified
+    secret key, the audit entries are signed with HMAC-SHA256 instead of the
+    private key. Entries signed with the private key can still be verified.
+
     If ``PI_CHECK_OLD_SIGNATURES = True`` old style signatures (text-book RSA) will
     be checked as well, otherwise they will be marked as ``FAIL``.
     """
@@ -133,10 +217,15 @@ class Audit(AuditBase):
         # Disable the costly checking of private RSA keys when loading them.
         self.check_private_key = not self.config.get("PI_AUDIT_NO_PRIVATE_KEY_CHECK", False)
         if self.sign_data:
-            self.read_keys(self.config.get("PI_AUDIT_KEY_PUBLIC"),
-                           self.config.get("PI_AUDIT_KEY_PRIVATE"))
-            self.sign_object = Sign(self.private, self.public,
-                                    check_private_key=self.check_private_key)
+            try:
+                self.sign_object = get_sign_object(self.config.get("PI_AUDIT_KEY_PRIVATE"),
+                                                   self.config.get("PI_AUDIT_KEY_PUBLIC"),
+                                                   check_private_key=self.check_private_key,
+                                                   hmac_key_file=self.config.get("PI_AUDIT_KEY_HMAC"))
+            except Exception as e:
+                log.error("Error reading key file: {0!r})".format(e))
+                log.debug(traceback.format_exc())
+                raise e
         # Read column_length from the config file
         config_column_length = self.config.get("PI_AUDIT_SQL_COLUMN_LENGTH", {})
         # fill the missing parts with the default from the models
@@ -155,6 +244,24 @@ class Audit(AuditBase):
         # been handled. This may close an already-closed session, but this is not a problem.
         register_finalizer(self._finalize_session)
         self.session._model_changes = {}
+        self.buffer = None
+        if int(self.config.get("PI_AUDIT_SQL_BUFFER_SIZE", 0)) > 1:
+            self.buffer = self._get_buffer()
+
+    def _get_buffer(self):
+        """
+        Return the audit buffer of this process. It is created with the
+        first audit object, which also takes care of flushing the
+        buffer at exit.
+        """
+        store = get_app_local_store()
+        if "sqlaudit_buffer" not in store:
+            store["sqlaudit_buffer"] = AuditBuffer(
+                int(self.config.get("PI_AUDIT_SQL_BUFFER_SIZE")),
+                float(self.config.get("PI_AUDIT_SQL_BUFFER_INTERVAL", 5)),
+                int(self.config.get("PI_AUDIT_SQL_BUFFER_MAX", 1000)))
+            atexit.register(self._flush_buffer, store["sqlaudit_buffer"])
+        return store["sqlaudit_buffer"]
 
     def _create_engine(self):
         """
@@ -272,62 +379,119 @@ class Audit(AuditBase):
             self.session.close()
         return count
 
+    def _create_entry(self):
+        """
+        Create a new audit entry from the audit data.
+
+        :rtype: LogEntry
+        """
+        for entry, value in self.audit_data.items():
+            if isinstance(value, list):
+                self.audit_data[entry] = ",".join(value)
+        if self.config.get("PI_AUDIT_SQL_TRUNCATE"):
+            self._truncate_data()
+        if "tokentype" in self.audit_data:
+            log.warning("We have a wrong 'tokentype' key. This should not happen. Fix it!. "
+                        "Error occurs in action: {0!r}.".format(self.audit_data.get("action")))
+            if not "token_type" in self.audit_data:
+                self.audit_data["token_type"] = self.audit_data.get("tokentype")
+        if self.audit_data.get("startdate"):
+            duration = datetime.datetime.now() - self.audit_data.get("startdate")
+        else:
+            duration = None
+        le = LogEntry(action=self.audit_data.get("action"),
+                      success=int(self.audit_data.get("success", 0)),
+                      authentication=self.audit_data.get("authentication"),
+                      serial=self.audit_data.get("serial"),
+                      token_type=self.audit_data.get("token_type"),
+                      container_serial=self.audit_data.get("container_serial"),
+                      container_type=self.audit_data.get("container_type"),
+                      user=self.audit_data.get("user"),
+                      realm=self.audit_data.get("realm"),
+                      resolver=self.audit_data.get("resolver"),
+                      administrator=self.audit_data.get("administrator"),
+                      action_detail=self.audit_data.get("action_detail"),
+                      info=self.audit_data.get("info"),
+                      privacyidea_server=self.audit_data.get("privacyidea_server"),
+                      client=self.audit_data.get("client", ""),
+                      user_agent=self.audit_data.get("user_agent"),
+                      user_agent_version=self.audit_data.get("user_agent_version"),
+                      loglevel=self.audit_data.get("log_level"),
+                      clearance_level=self.audit_data.get("clearance_level"),
+                      policies=self.audit_data.get("policies"),
+                      startdate=self.audit_data.get("startdate"),
+                      duration=duration,
+                      thread_id=self.audit_data.get("thread_id"),
+                      performance=self.audit_data.get("performance")
+                      )
+        if self.engine.dialect.name == "oracle":
+            # Oracle does not store fractions of seconds in a DATE column. The signature
+            # is created before reading the entry from the database, so the values need
+            # to be the same.
+            le.date = le.date.replace(microsecond=0)
+            if le.startdate:
+                le.startdate = le.startdate.replace(microsecond=0)
+        return le
+
+    def _write_entries(self, entries, session=None):
+        """
+        Write the audit entries and their signatures in one transaction.
+
+        The signature contains the id of the entry. So the entries are
+        inserted first to get the ids, but they are only committed together
+        with the signatures.
+
+        :param entries: list of LogEntry objects
+        :param session: The session to use, defaults to the session of the
+            audit object
+        """
+        session = session or self.session
+        session.add_all(entries)
+        session.flush()
+        if self.sign_data and self.sign_object:
+            for le in entries:
+                try:
+                    le.signature = self.sign_object.sign(self._log_to_string(le))
+                except Exception as exx:  # pragma: no cover
+                    # in case of an error in _log_to_string() we won't have
+                    # a signature, but the log entry is available
+                    log.error("Could not sign the audit entry {0!s}: {1!r}".format(le.id, exx))
+        session.commit()
+
+    def _flush_buffer(self, audit_buffer=None):
+        """
+        Write all entries of the audit buffer to the database.
+        """
+        audit_buffer = audit_buffer or self.buffer
+        entries = audit_buffer.take()
+        if not entries:
+            return
+        try:
+            self._write_entries(entries)
+        except Exception as exx:  # pragma: no cover
+            log.error("Could not write {0!s} buffered audit entries: {1!r}".format(len(entries), exx))
+            log.debug("{0!s}".format(traceback.format_exc()))
+            self.session.rollback()
+            # The entries get new ids with the next try
+            for le in entries:
+                le.id = None
+            audit_buffer.put_back(entries)
+        finally:
+            self.session.close()
+
     def finalize_log(self):
         """
         This method is used to log the data.
         It should hash the data and do a hash chain and sign the data
         """
         try:
-            for entry, value in self.audit_data.items():
-                if isinstance(value, list):
-                    self.audit_data[entry] = ",".join(value)
-            if self.config.get("PI_AUDIT_SQL_TRUNCATE"):
-                self._truncate_data()
-            if "tokentype" in self.audit_data:
-                log.warning("We have a wrong 'tokentype' key. This should not happen. Fix it!. "
-                            "Error occurs in action: {0!r}.".format(self.audit_data.get("action")))
-                if not "token_type" in self.audit_data:
-                    self.audit_data["token_type"] = self.audit_data.get("tokentype")
-            if self.audit_data.get("startdate"):
-                duration = datetime.datetime.now() - self.audit_data.get("startdate")
+            le = self._create_entry()
+            if self.buffer:
+                if self.buffer.add(le):
+                    self._flush_buffer()
             else:
-                duration = None
-            le = LogEntry(action=self.audit_data.get("action"),
-                          success=int(self.audit_data.get("success", 0)),
-                          authentication=self.audit_data.get("authentication"),
-                          serial=self.audit_data.get("serial"),
-                          token_type=self.audit_data.get("token_type"),
-                          container_serial=self.audit_data.get("container_serial"),
-                          container_type=self.audit_data.get("container_type"),
-                          user=self.audit_data.get("user"),
-                          realm=self.audit_data.get("realm"),
-                          resolver=self.audit_data.get("resolver"),
-                          administrator=self.audit_data.get("administrator"),
-                          action_detail=self.audit_data.get("action_detail"),
-                          info=self.audit_data.get("info"),
-                          privacyidea_server=self.audit_data.get("privacyidea_server"),
-                          client=self.audit_data.get("client", ""),
-                          user_agent=self.audit_data.get("user_agent"),
-                          user_agent_version=self.audit_data.get("user_agent_version"),
-                          loglevel=self.audit_data.get("log_level"),
-                          clearance_level=self.audit_data.get("clearance_level"),
-                          policies=self.audit_data.get("policies"),
-                          startdate=self.audit_data.get("startdate"),
-                          duration=duration,
-                          thread_id=self.audit_data.get("thread_id")
-                          )
-            self.session.add(le)
-            self.session.commit()
-            # Add the signature
-            if self.sign_data and self.sign_object:
-                s = self._log_to_string(le)
-                sign = self.sign_object.sign(s)
-                le.signature = sign
-                self.session.merge(le)
-                self.session.commit()
+                self._write_entries([le])
         except Exception as exx:  # pragma: no cover
-            # in case of a Unicode Error in _log_to_string() we won't have
-            # a signature, but the log entry is available
             log.error("exception {0!r}".format(exx))
             log.error("DATA: {0!s}".format(self.audit_data))
             log.debug("{0!s}".format(traceback.format_exc()))
@@ -410,6 +574,8 @@ class Audit(AuditBase):
             s += f",c_serial={le.container_serial}"
         if le.container_type:
             s += f",ct={le.container_type}"
+        if le.performance:
+            s += f",perf={le.performance}"
         return s
 
     @staticmethod
@@ -437,7 +603,8 @@ class Audit(AuditBase):
                     'clearance_level': LogEntry.clearance_level,
                     'thread_id': LogEntry.thread_id,
                     'container_serial': LogEntry.container_serial,
-                    'container_type': LogEntry.container_type}
+                    'container_type': LogEntry.container_type,
+                    'performance': LogEntry.performance}
         return sortname.get(key)
 
     def csv_generator(self, param=None, user=None, timelimit=None):
@@ -610,4 +777,5 @@ class Audit(AuditBase):
         audit_dict['startdate'] = audit_entry.startdate.isoformat() if audit_entry.startdate else None
         audit_dict['duration'] = audit_entry.duration.total_seconds() if audit_entry.duration else None
         audit_dict['thread_id'] = audit_entry.thread_id
+        audit_dict['performance'] = audit_entry.performance
         return audit_dict
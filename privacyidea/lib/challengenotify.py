@@ -0,0 +1,319 @@
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+__doc__ = """This module notifies requests, which wait for a challenge to be
+answered (like the push token with ``push_wait``), that the challenge was
+answered.
+
+Within a process, the waiting requests are woken up directly. Other processes
+and other privacyIDEA nodes are informed via a notification channel, which is
+configured in ``pi.cfg``:
+
+    PI_CHALLENGE_NOTIFY_CHANNEL = "local" | "socket" | "postgresql"
+
+``local``
+    Only requests in the same process are notified. This is the default.
+``socket``
+    All processes on the same host are notified via unix datagram sockets in
+    the directory ``PI_CHALLENGE_NOTIFY_SOCKET_DIR``.
+``postgresql``
+    All processes of all nodes using the same PostgreSQL database are notified
+    via ``LISTEN``/``NOTIFY``. The database URI ``PI_CHALLENGE_NOTIFY_URI``
+    defaults to ``SQLALCHEMY_DATABASE_URI``.
+
+As notifications may get lost, the waiting requests still check the challenge
+in the database every ``PI_CHALLENGE_NOTIFY_POLL_INTERVAL`` seconds.
+
+This module is tested in tests/test_lib_challengenotify.py
+"""
+import logging
+import os
+import select
+import socket
+import threading
+import traceback
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, text
+
+from privacyidea.lib.framework import get_app_local_store, get_app_config_value
+
+log = logging.getLogger(__name__)
+
+CHANNEL_LOCAL = "local"
+CHANNEL_SOCKET = "socket"
+CHANNEL_POSTGRESQL = "postgresql"
+# The name of the PostgreSQL notification channel
+PG_CHANNEL = "privacyidea_challenge"
+# The default seconds between two checks in the database
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_POLL_INTERVAL_CHANNEL = 5.0
+
+
+class NotificationChannel(object):
+    """
+    Base class of the channels to notify other processes. A channel passes
+    the transaction ids, which it receives from other processes, to the
+    ``callback``.
+    """
+
+    def start(self, callback):
+        """
+        Start receiving notifications
+        """
+        pass
+
+    def publish(self, transaction_id):
+        """
+        Notify the other processes about the answered challenge
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class SocketChannel(NotificationChannel):
+    """
+    Each process binds a unix datagram socket in the given directory. A
+    notification is sent to all sockets in this directory.
+    """
+
+    def __init__(self, directory, name=None):
+        """
+        :param directory: The directory containing the sockets of all processes
+        :param name: The name of the socket, defaults to the process id
+        """
+        self.directory = directory
+        self.path = os.path.join(directory, "pi-{0!s}.sock".format(name or os.getpid()))
+        self.sock = None
+        self.thread = None
+
+    def start(self, callback):
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+
+        def receive():
+            while True:
+                try:
+                    data = self.sock.recv(1024)
+                except OSError:
+                    # The socket was closed
+                    break
+                callback(data.decode("utf8"))
+
+        self.thread = threading.Thread(target=receive, name="privacyidea-challenge-notify",
+                                       daemon=True)
+        self.thread.start()
+
+    def publish(self, transaction_id):
+        data = transaction_id.encode("utf8")
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if path == self.path or not name.endswith(".sock"):
+                    continue
+                try:
+                    sender.sendto(data, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # The process does not exist anymore
+                    log.debug("Removing stale socket {0!s}.".format(path))
+                    try:
+                        os.unlink(path)
+                    except OSError:  # pragma: no cover
+                        pass
+                except OSError as exx:  # pragma: no cover
+                    log.warning("Could not notify {0!s}: {1!r}".format(path, exx))
+        finally:
+            sender.close()
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.path)
+            except OSError:  # pragma: no cover
+                pass
+
+
+class PostgresChannel(NotificationChannel):  # pragma: no cover
+    """
+    Uses ``LISTEN``/``NOTIFY`` of PostgreSQL. A separate connection of each
+    process listens to the notifications.
+    """
+
+    def __init__(self, uri):
+        self.engine = create_engine(uri)
+        self.connection = None
+        self.thread = None
+        self._closed = False
+
+    def start(self, callback):
+        self.connection = self.engine.raw_connection()
+        dbapi_connection = self.connection.connection
+        dbapi_connection.set_isolation_level(0)
+        cursor = dbapi_connection.cursor()
+        cursor.execute("LISTEN {0!s}".format(PG_CHANNEL))
+
+        def receive():
+            while not self._closed:
+                try:
+                    if select.select([dbapi_connection], [], [], 5) == ([], [], []):
+                        continue
+                    dbapi_connection.poll()
+                except Exception as exx:
+                    log.warning("Stop listening for challenge notifications: {0!r}".format(exx))
+                    log.debug(traceback.format_exc())
+                    break
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    callback(notify.payload)
+
+        self.thread = threading.Thread(target=receive, name="privacyidea-challenge-notify",
+                                       daemon=True)
+        self.thread.start()
+
+    def publish(self, transaction_id):
+        with self.engine.begin() as connection:
+            connection.execute(text("SELECT pg_notify(:channel, :payload)"),
+                               {"channel": PG_CHANNEL, "payload": transaction_id})
+
+    def close(self):
+        self._closed = True
+        if self.connection:
+            self.connection.close()
+        self.engine.dispose()
+
+
+class ChallengeNotifier(object):
+    """
+    Wakes up the requests of this process, which wait for a challenge to be
+    answered. The notifications of other processes are received via the
+    notification channel.
+    """
+
+    def __init__(self, channel=None, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.channel = channel or NotificationChannel()
+        self.poll_interval = poll_interval
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        # transaction_id -> list of events of the waiting requests
+        self._waiters = {}
+        self.channel.start(self._wake)
+
+    @contextmanager
+    def waiting(self, transaction_id):
+        """
+        Register a waiting request for the given transaction_id.
+        To not miss a notification, the request needs to be registered,
+        before it checks the challenge in the database::
+
+            with notifier.waiting(transaction_id) as answered:
+                while not challenge_answered():
+                    answered.wait(notifier.poll_interval)
+                    answered.clear()
+
+        :return: an event, which is set, when the challenge was answered
+        :rtype: threading.Event
+        """
+        event = threading.Event()
+        with self._lock:
+            self._waiters.setdefault(transaction_id, []).append(event)
+        try:
+            yield event
+        finally:
+            with self._lock:
+                events = self._waiters.get(transaction_id, [])
+                if event in events:
+                    events.remove(event)
+                if not events:
+                    self._waiters.pop(transaction_id, None)
+
+    def _wake(self, transaction_id):
+        with self._lock:
+            events = list(self._waiters.get(transaction_id, []))
+        for event in events:
+            event.set()
+        return len(events)
+
+    def notify(self, transaction_id):
+        """
+        Notify the waiting requests of this and all other processes, that the
+        challenge with the transaction_id was answered.
+
+        :return: the number of woken up requests of this process
+        """
+        woken = self._wake(transaction_id)
+        try:
+            self.channel.publish(transaction_id)
+        except Exception as exx:  # pragma: no cover
+            # The waiting requests will find the answer in the database
+            log.warning("Could not publish the challenge notification: {0!r}".format(exx))
+            log.debug(traceback.format_exc())
+        return woken
+
+    def close(self):
+        self.channel.close()
+
+
+def _create_channel():
+    channel_type = get_app_config_value("PI_CHALLENGE_NOTIFY_CHANNEL", CHANNEL_LOCAL)
+    if channel_type == CHANNEL_SOCKET:
+        return SocketChannel(get_app_config_value("PI_CHALLENGE_NOTIFY_SOCKET_DIR",
+                                                  "/run/privacyidea/challenge"))
+    if channel_type == CHANNEL_POSTGRESQL:  # pragma: no cover
+        return PostgresChannel(get_app_config_value("PI_CHALLENGE_NOTIFY_URI",
+                                                    get_app_config_value("SQLALCHEMY_DATABASE_URI")))
+    if channel_type != CHANNEL_LOCAL:
+        log.warning("Unknown challenge notification channel {0!r}.".format(channel_type))
+    return None
+
+
+def get_challenge_notifier():
+    """
+    Return the challenge notifier of this process.
+
+    :rtype: ChallengeNotifier
+    """
+    store = get_app_local_store()
+    notifier = store.get("challenge_notifier")
+    if notifier is None or notifier.pid != os.getpid():
+        # The threads of the channel do not survive forking the process
+        channel = None
+        try:
+            channel = _create_channel()
+        except Exception as exx:  # pragma: no cover
+            log.warning("Could not create the challenge notification channel: {0!r}".format(exx))
+            log.debug(traceback.format_exc())
+        default_interval = DEFAULT_POLL_INTERVAL_CHANNEL if channel else DEFAULT_POLL_INTERVAL
+        poll_interval = float(get_app_config_value("PI_CHALLENGE_NOTIFY_POLL_INTERVAL", default_interval))
+        notifier = ChallengeNotifier(channel, poll_interval)
+        store["challenge_notifier"] = notifier
+    return notifier
+
+
+def notify_challenge_answered(transaction_id):
+    """
+    Wake up all requests waiting for the challenge with the given transaction_id.
+    This needs to be called after the answer has been committed to the database.
+
+    :param transaction_id: the transaction_id of the answered challenge
+    """
+    get_challenge_notifier().notify(transaction_id)
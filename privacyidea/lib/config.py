@@ -36,10 +36,12 @@ import sys
 import logging
 import inspect
 import threading
+import time
 import traceback
 
 from .log import log_with
 from ..models import (Config, db, Resolver, Realm, PRIVACYIDEA_TIMESTAMP,
+                      CONFIG_CATEGORIES, CONFIG_TIMESTAMP_KEYS, get_config_timestamp_key,
                       save_config_timestamp, Policy, EventHandler, CAConnector,
                       NodeName)
 from privacyidea.lib.framework import get_request_local_store, get_app_config_value, get_app_local_store
@@ -50,6 +52,7 @@ from .crypto import decryptPassword
 from .resolvers.UserIdResolver import UserIdResolver
 from .machines.base import BaseMachineResolver
 from .caconnectors.baseca import BaseCAConnector
+from .policyindex import PolicyIndex
 # We need these imports to return the list of CA connector types. Bummer: New import for each new Class anyway.
 from .caconnectors import localca, msca
 from .utils import reload_db, is_true
@@ -74,8 +77,9 @@ class SharedConfigClass(object):
 
     The method ``_reload_from_db()`` compares this timestamp against the
     timestamp in the database (while taking the PI_CHECK_RELOAD_CONFIG
-    setting into account). If the database timestamp is newer, the current
-    configuration is updated.
+    setting into account). If the database timestamp is newer, the changed
+    categories of the configuration (see ``CONFIG_CATEGORIES``) are updated.
+    Resolver and CA connector definitions, which did not change, are reused.
 
     However, app code must not access the config stored in the shared object!
     Instead, it must use ``reload_and_clone()`` to retrieve
@@ -89,14 +93,137 @@ class SharedConfigClass(object):
         self.realm = {}
         self.default_realm = None
         self.policies = []
+        self.policy_index = PolicyIndex(self.policies)
         self.events = []
         self.timestamp = None
+        # The category timestamps, which were read from the database during the last reload
+        self._category_timestamps = {}
         self.caconnectors = []
+        # The database definitions of the resolvers and CA connectors, which
+        # are used to decide if the loaded objects can be reused.
+        self._resolver_definitions = {}
+        self._caconnector_definitions = {}
+        self.reload_count = 0
+        self.reload_duration = 0.0
+        self.last_reload_duration = 0.0
+        self.category_reload_count = {category: 0 for category in CONFIG_CATEGORIES}
+
+    def _get_changed_categories(self, db_ts):
+        """
+        Determine the configuration categories, which changed since the last
+        reload. A category changed, if its timestamp in the database differs
+        from the timestamp, which was read during the last reload.
+
+        :param db_ts: The global timestamp entry from the database
+        :return: tuple of the set of changed categories and the dictionary of
+            the current category timestamps
+        """
+        keys = [get_config_timestamp_key(category) for category in CONFIG_CATEGORIES]
+        entries = {c.Key: c.Value for c in Config.query.filter(Config.Key.in_(keys))}
+        timestamps = {category: entries.get(get_config_timestamp_key(category)) for category in CONFIG_CATEGORIES}
+        if not self.timestamp:
+            return set(CONFIG_CATEGORIES), timestamps
+        if db_ts and len(entries) == len(keys) and db_ts.Value > max(entries.values()):
+            # The global timestamp was written without the category timestamps,
+            # e.g. by an older privacyIDEA node, so we need to reload everything.
+            return set(CONFIG_CATEGORIES), timestamps
+        changed = {category for category in CONFIG_CATEGORIES
+                   if timestamps[category] is None or timestamps[category] != self._category_timestamps.get(category)}
+        if "resolver" in changed:
+            # the realm definitions contain the resolver types
+            changed.add("realm")
+        return changed, timestamps
+
+    @staticmethod
+    def _load_config():
+        config = {}
+        for sysconf in Config.query.all():
+            if sysconf.Key in CONFIG_TIMESTAMP_KEYS and sysconf.Key != PRIVACYIDEA_TIMESTAMP:
+                # The category timestamps are no configuration values
+                continue
+            config[sysconf.Key] = {
+                "Value": sysconf.Value,
+                "Type": sysconf.Type,
+                "Description": sysconf.Description}
+        return config
+
+    def _load_resolvers(self):
+        resolverconfig = {}
+        definitions = {}
+        for resolver in Resolver.query.all():
+            definition = (resolver.rtype,
+                          sorted((rconf.Key, rconf.Type, rconf.Value) for rconf in resolver.config_list))
+            previous = self._resolver_definitions.get(resolver.name)
+            if previous and previous[0] == definition:
+                # The resolver did not change, we do not need to decrypt the passwords again
+                resolverdef = previous[1]
+            else:
+                resolverdef = {"type": resolver.rtype,
+                               "resolvername": resolver.name,
+                               "censor_keys": []}
+                data = {}
+                for rconf in resolver.config_list:
+                    if rconf.Type == "password":
+                        value = decryptPassword(rconf.Value)
+                        resolverdef["censor_keys"].append(rconf.Key)
+                    else:
+                        value = rconf.Value
+                    data[rconf.Key] = value
+                resolverdef["data"] = data
+            definitions[resolver.name] = (definition, resolverdef)
+            resolverconfig[resolver.name] = resolverdef
+        return resolverconfig, definitions
+
+    @staticmethod
+    def _load_realms():
+        realmconfig = {}
+        default_realm = None
+        for realm in Realm.query.all():
+            if realm.default:
+                default_realm = realm.name
+            realmdef = {"id": realm.id,
+                        "option": realm.option,
+                        "default": realm.default,
+                        "resolver": []}
+            for x in realm.resolver_list:
+                realmdef["resolver"].append({"priority": x.priority,
+                                             "name": x.resolver.name,
+                                             "type": x.resolver.rtype,
+                                             "node": x.node_uuid})
+            realmconfig[realm.name] = realmdef
+        return realmconfig, default_realm
+
+    def _load_caconnectors(self):
+        from privacyidea.lib.caconnector import get_caconnector_object
+        caconnectors = []
+        definitions = {}
+        for ca in CAConnector.query.all():
+            definition = (ca.catype,
+                          sorted((conf.Key, conf.Type, conf.Value) for conf in ca.caconfig))
+            previous = self._caconnector_definitions.get(ca.name)
+            if previous and previous[0] == definition:
+                # The CA connector did not change, we do not need to create a new object
+                definitions[ca.name] = previous
+                caconnectors.append(previous[1])
+                continue
+            try:
+                ca_obj = get_caconnector_object(ca.name)
+                cadef = {"connectorname": ca.name,
+                         "type": ca.catype,
+                         "data": ca_obj.config,
+                         "templates": ca_obj.get_templates()}
+                definitions[ca.name] = (definition, cadef)
+                caconnectors.append(cadef)
+            except Exception as exx:  # pragma: no cover
+                log.debug("{0!s}".format(traceback.format_exc()))
+                log.error(exx)
+        return caconnectors, definitions
 
     def _reload_from_db(self):
         """
         Read the timestamp from the database. If the timestamp is newer than
-        the internal timestamp, then read the complete data
+        the internal timestamp, then read the data of the changed configuration
+        categories.
         :return:
         """
         check_reload_config = get_app_config_value("PI_CHECK_RELOAD_CONFIG", 0)
@@ -104,79 +231,73 @@ class SharedConfigClass(object):
                 self.timestamp + datetime.timedelta(seconds=check_reload_config) < datetime.datetime.now():
             db_ts = Config.query.filter_by(Key=PRIVACYIDEA_TIMESTAMP).first()
             if reload_db(self.timestamp, db_ts):
-                log.debug("Reloading shared config from database")
-                config = {}
-                resolverconfig = {}
-                realmconfig = {}
-                default_realm = None
-                policies = []
-                events = []
-                caconnectors = []
+                start = time.monotonic()
+                changed, category_timestamps = self._get_changed_categories(db_ts)
+                log.debug("Reloading shared config categories {0!s} from database".format(sorted(changed)))
+                config = self.config
+                resolverconfig = self.resolver
+                resolver_definitions = self._resolver_definitions
+                realmconfig = self.realm
+                default_realm = self.default_realm
+                policies = self.policies
+                policy_index = self.policy_index
+                events = self.events
+                caconnectors = self.caconnectors
+                caconnector_definitions = self._caconnector_definitions
                 # Load system configuration
-                for sysconf in Config.query.all():
-                    config[sysconf.Key] = {
-                        "Value": sysconf.Value,
-                        "Type": sysconf.Type,
-                        "Description": sysconf.Description}
+                if "config" in changed:
+                    config = self._load_config()
                 # Load resolver configuration
-                for resolver in Resolver.query.all():
-                    resolverdef = {"type": resolver.rtype,
-                                   "resolvername": resolver.name,
-                                   "censor_keys": []}
-                    data = {}
-                    for rconf in resolver.config_list:
-                        if rconf.Type == "password":
-                            value = decryptPassword(rconf.Value)
-                            resolverdef["censor_keys"].append(rconf.Key)
-                        else:
-                            value = rconf.Value
-                        data[rconf.Key] = value
-                    resolverdef["data"] = data
-                    resolverconfig[resolver.name] = resolverdef
+                if "resolver" in changed:
+                    resolverconfig, resolver_definitions = self._load_resolvers()
                 # Load realm configuration
-                for realm in Realm.query.all():
-                    if realm.default:
-                        default_realm = realm.name
-                    realmdef = {"id": realm.id,
-                                "option": realm.option,
-                                "default": realm.default,
-                                "resolver": []}
-                    for x in realm.resolver_list:
-                        realmdef["resolver"].append({"priority": x.priority,
-                                                     "name": x.resolver.name,
-                                                     "type": x.resolver.rtype,
-                                                     "node": x.node_uuid})
-                    realmconfig[realm.name] = realmdef
+                if "realm" in changed:
+                    realmconfig, default_realm = self._load_realms()
                 # Load all policies
-                for pol in Policy.query.all():
-                    policies.append(pol.get())
+                if "policy" in changed:
+                    policies = [pol.get() for pol in Policy.query.all()]
+                    policy_index = PolicyIndex(policies)
                 # Load all events
-                for event in EventHandler.query.order_by(EventHandler.ordering):
-                    events.append(event.get())
+                if "event" in changed:
+                    events = [event.get() for event in EventHandler.query.order_by(EventHandler.ordering)]
                 # Load all CA connectors
-                from privacyidea.lib.caconnector import get_caconnector_object
-                for ca in CAConnector.query.all():
-                    try:
-                        ca_obj = get_caconnector_object(ca.name)
-                        caconnectors.append({"connectorname": ca.name,
-                                             "type": ca.catype,
-                                             "data": ca_obj.config,
-                                             "templates": ca_obj.get_templates()})
-                    except Exception as exx:  # pragma: no cover
-                        log.debug("{0!s}".format(traceback.format_exc()))
-                        log.error(exx)
+                if "caconnector" in changed:
+                    caconnectors, caconnector_definitions = self._load_caconnectors()
 
                 # Finally, set the current timestamp
                 timestamp = datetime.datetime.now()
+                duration = time.monotonic() - start
                 with self._config_lock:
                     self.config = config
                     self.resolver = resolverconfig
+                    self._resolver_definitions = resolver_definitions
                     self.realm = realmconfig
                     self.default_realm = default_realm
                     self.policies = policies
+                    self.policy_index = policy_index
                     self.events = events
                     self.timestamp = timestamp
+                    self._category_timestamps = category_timestamps
                     self.caconnectors = caconnectors
+                    self._caconnector_definitions = caconnector_definitions
+                    if changed:
+                        self.reload_count += 1
+                        self.reload_duration += duration
+                        self.last_reload_duration = duration
+                    for category in changed:
+                        self.category_reload_count[category] += 1
+
+    def get_reload_stats(self):
+        """
+        :return: a dictionary with the number of reloads of the shared config,
+            the total and the last duration of the reloads in seconds and the
+            number of reloads per configuration category.
+        """
+        with self._config_lock:
+            return {"reload_count": self.reload_count,
+                    "reload_duration": self.reload_duration,
+                    "last_reload_duration": self.last_reload_duration,
+                    "category_reload_count": dict(self.category_reload_count)}
 
     def _clone(self):
         """
@@ -191,7 +312,8 @@ class SharedConfigClass(object):
                 self.policies,
                 self.events,
                 self.caconnectors,
-                self.timestamp
+                self.timestamp,
+                self.policy_index
             )
 
     def reload_and_clone(self):
@@ -213,12 +335,14 @@ class LocalConfigClass(object):
     request and is supposed to stay alive and unchanged during the request.
     """
 
-    def __init__(self, config, resolver, realm, default_realm, policies, events, caconnectors, timestamp):
+    def __init__(self, config, resolver, realm, default_realm, policies, events, caconnectors, timestamp,
+                 policy_index=None):
         self.config = config
         self.resolver = resolver
         self.realm = realm
         self.default_realm = default_realm
         self.policies = policies
+        self.policy_index = policy_index
         self.events = events
         self.caconnectors = caconnectors
         self.timestamp = timestamp
@@ -936,7 +1060,7 @@ def set_privacyidea_config(key, value, typ="", desc=""):
             c1.Type = typ
         if desc:
             c1.Description = desc
-        save_config_timestamp()
+        save_config_timestamp(category="config")
         db.session.commit()
         ret = "update"
     else:
@@ -1081,7 +1205,8 @@ def import_config(data, name=None):
     """Import given server configuration"""
     log.debug('Import server config: {0!s}'.format(data))
     res = {}
-    data.pop('__timestamp__', None)
+    for timestamp_key in CONFIG_TIMESTAMP_KEYS:
+        data.pop(timestamp_key, None)
     for key, values in data.items():
         if name and name != key:
             continue
@@ -44,6 +44,8 @@ This lib.crypto is tested in tests/test_lib_crypto.py
 """
 import hmac
 import logging
+import os
+import re
 from hashlib import sha256
 import secrets
 import random
@@ -58,11 +60,13 @@ from privacyidea.lib.log import log_with
 from privacyidea.lib.error import HSMException, ParameterError
 from privacyidea.lib.framework import (get_app_local_store, get_app_config_value,
                                        get_app_config)
+from privacyidea.lib.requeststats import request_timer, CRYPTO
 from privacyidea.lib.utils import (to_unicode, to_bytes, hexlify_and_unicode,
                                    b64encode_and_unicode)
 
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric import rsa, ed25519, ec
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import padding
@@ -88,6 +92,10 @@ FAILED_TO_DECRYPT_PASSWORD = "FAILED TO DECRYPT PASSWORD!"  # nosec B105 # place
 
 log = logging.getLogger(__name__)
 
+# A PEM file may contain several public keys
+PEM_PUBLIC_KEY_PATTERN = re.compile(rb"-----BEGIN [A-Z ]*PUBLIC KEY-----.+?-----END [A-Z ]*PUBLIC KEY-----",
+                                    re.DOTALL)
+
 
 class SecretObj(object):
     def __init__(self, val, iv, preserve=True):
@@ -115,6 +123,19 @@ class SecretObj(object):
         self._clearKey_(preserve=self.preserve)
         return h
 
+    def hmac_object(self, hash_algo):
+        """
+        Return an HMAC object, which is already keyed. Copies of it can be
+        used to calculate several digests without preparing the key again.
+
+        :param hash_algo: the hash function like hashlib.sha1
+        :rtype: hmac.HMAC
+        """
+        self._setupKey_()
+        h = hmac.new(self.bkey, digestmod=hash_algo)
+        self._clearKey_(preserve=self.preserve)
+        return h
+
     def aes_ecb_decrypt(self, enc_data):
         '''
         support inplace aes decryption for the yubikey (mode ECB)
@@ -149,6 +170,7 @@ class SecretObj(object):
 
 
 @log_with(log, log_entry=False, log_exit=False)
+@request_timer(CRYPTO)
 def hash(val, seed, algo=None):
     """
 
@@ -167,7 +189,35 @@ def hash(val, seed, algo=None):
     return hexlify_and_unicode(m.digest())
 
 
+def get_pass_context():
+    """
+    Return the CryptContext used to hash and verify passwords and PINs.
+
+    The context is created from ``PI_HASH_ALGO_LIST`` and ``PI_HASH_ALGO_PARAMS``
+    and stored in the app-local store. It is only created again, if these
+    config values change.
+
+    All algorithms except the first one in the list are deprecated, so that
+    ``needs_update`` reports hashes of other algorithms or with other
+    parameters.
+
+    :return: a CryptContext object
+    """
+    algo_list = get_app_config_value("PI_HASH_ALGO_LIST", default=DEFAULT_HASH_ALGO_LIST)
+    algo_params = dict(DEFAULT_HASH_ALGO_PARAMS)
+    algo_params.update(get_app_config_value("PI_HASH_ALGO_PARAMS", default={}))
+    context_key = repr((list(algo_list), sorted(algo_params.items())))
+    store = get_app_local_store()
+    cached = store.get("pass_context")
+    if not cached or cached[0] != context_key:
+        log.debug("Creating new crypt context for the hash algorithms {0!s}".format(algo_list))
+        cached = (context_key, CryptContext(algo_list, deprecated="auto", **algo_params))
+        store["pass_context"] = cached
+    return cached[1]
+
+
 @log_with(log, log_entry=False, log_exit=False)
+@request_timer(CRYPTO)
 def pass_hash(password):
     """
     Hash password with crypt context
@@ -175,16 +225,12 @@ def pass_hash(password):
     :type password: str
     :return: The hash string of the password
     """
-    DEFAULT_HASH_ALGO_PARAMS.update(get_app_config_value("PI_HASH_ALGO_PARAMS",
-                                                         default={}))
-    pass_ctx = CryptContext(get_app_config_value("PI_HASH_ALGO_LIST",
-                                                 default=DEFAULT_HASH_ALGO_LIST),
-                            **DEFAULT_HASH_ALGO_PARAMS)
-    pw_dig = pass_ctx.hash(password)
+    pw_dig = get_pass_context().hash(password)
     return pw_dig
 
 
 @log_with(log, log_entry=False, log_exit=False)
+@request_timer(CRYPTO)
 def verify_pass_hash(password, hvalue):
     """
     Verify the hashed password value
@@ -195,11 +241,34 @@ def verify_pass_hash(password, hvalue):
     :return: True if the password matches
     :rtype: bool
     """
-    pass_ctx = CryptContext(get_app_config_value("PI_HASH_ALGO_LIST",
-                                                 default=DEFAULT_HASH_ALGO_LIST))
-    return pass_ctx.verify(password, hvalue)
+    return get_pass_context().verify(password, hvalue)
 
 
+@log_with(log, log_entry=False, log_exit=False)
+@request_timer(CRYPTO)
+def verify_and_update_pass_hash(password, hvalue):
+    """
+    Verify the hashed password value and return a new hash, if the hashed
+    password was created with another algorithm or other parameters than
+    configured in ``PI_HASH_ALGO_LIST`` and ``PI_HASH_ALGO_PARAMS``.
+
+    The rehashing can be switched off with ``PI_HASH_ALGO_REHASH = False``.
+
+    :param password: The plaintext password to verify
+    :type password: str
+    :param hvalue: The hashed password
+    :type hvalue: str
+    :return: tuple of a bool, whether the password matches, and the new hash
+        or None, if the hash does not need to be updated
+    :rtype: tuple
+    """
+    pass_ctx = get_pass_context()
+    if not get_app_config_value("PI_HASH_ALGO_REHASH", True):
+        return pass_ctx.verify(password, hvalue), None
+    return pass_ctx.verify_and_update(password, hvalue)
+
+
+@request_timer(CRYPTO)
 def hash_with_pepper(password):
     """
     Hash function to hash with salt and pepper. The pepper is read from
@@ -216,6 +285,7 @@ def hash_with_pepper(password):
     return pass_hash(key + password)
 
 
+@request_timer(CRYPTO)
 def verify_with_pepper(passwordhash, password):
     """
     verify the password hash with the given password and pepper
@@ -282,6 +352,7 @@ def set_hsm_password(password):
 
 
 @log_with(log, log_entry=False)
+@request_timer(CRYPTO)
 def encryptPassword(password):
     """
     Encrypt given password with hsm
@@ -307,6 +378,7 @@ def encryptPassword(password):
 
 
 @log_with(log, log_entry=False)
+@request_timer(CRYPTO)
 def encryptPin(cryptPin):
     """
     :param cryptPin: the pin to encrypt
@@ -319,6 +391,7 @@ def encryptPin(cryptPin):
 
 
 @log_with(log, log_exit=False)
+@request_timer(CRYPTO)
 def decryptPassword(cryptPass):
     """
     Decrypt the encrypted password ``cryptPass`` and return it.
@@ -338,6 +411,7 @@ def decryptPassword(cryptPass):
 
 
 @log_with(log, log_exit=False)
+@request_timer(CRYPTO)
 def decryptPin(cryptPin):
     """
 
@@ -351,6 +425,7 @@ def decryptPin(cryptPin):
 
 
 @log_with(log, log_entry=False)
+@request_timer(CRYPTO)
 def encrypt(data, iv, key_id=0):
     """
     encrypt a variable from the given input with an initialisation vector
@@ -370,6 +445,7 @@ def encrypt(data, iv, key_id=0):
 
 
 @log_with(log, log_exit=False)
+@request_timer(CRYPTO)
 def decrypt(enc_data, iv, key_id=0):
     """
     decrypt a variable from the given input with an initialisation vector
@@ -685,47 +761,127 @@ def _slow_rsa_verify_raw(key, sig, msg):
     return msg == pow(sig, pn.e, pn.n)
 
 
+# The signature versions, which are the prefix of the signatures
+SIG_VER_RSA = 'rsa_sha256_pss'
+SIG_VER_ED25519 = 'ed25519'
+SIG_VER_ECDSA = 'ecdsa_p256_sha256'
+SIG_VER_HMAC = 'hmac_sha256'
+
+
+def get_signature_version(key):
+    """
+    Return the signature version, which is created with the given private key
+
+    :param key: A RSA, Ed25519 or EC (P-256) private key object
+    :return: the signature version
+    :rtype: str
+    """
+    if isinstance(key, rsa.RSAPrivateKey):
+        return SIG_VER_RSA
+    if isinstance(key, ed25519.Ed25519PrivateKey):
+        return SIG_VER_ED25519
+    if isinstance(key, ec.EllipticCurvePrivateKey) and isinstance(key.curve, ec.SECP256R1):
+        return SIG_VER_ECDSA
+    raise ParameterError("Unsupported signing key type {0!s}".format(type(key).__name__))
+
+
 class Sign(object):
     """
     Signing class that is used to sign Audit Entries and to sign API responses.
+
+    The type of the private key determines the signature version (RSA-PSS,
+    Ed25519 or ECDSA with P-256). If a secret ``hmac_key`` is given, an
+    HMAC-SHA256 is created instead, which can only be verified with the same
+    key. Signatures of all versions can be verified, if the matching public key
+    (or HMAC key) is available, so the public key data may contain several keys.
     """
-    sig_ver = 'rsa_sha256_pss'
 
-    def __init__(self, private_key=None, public_key=None, check_private_key=True):
+    def __init__(self, private_key=None, public_key=None, check_private_key=True,
+                 hmac_key=None):
         """
         Initialize the Sign object with the given Keys.
 
         :param private_key: The private Key data in PEM format
         :type private_key: bytes or None
-        :param public_key:  The public key data in PEM format
+        :param public_key:  The public key data in PEM format. This may contain
+            several public keys.
         :type public_key: bytes or None
         :param check_private_key: Check the private key when loading (default: True)
         :type check_private_key: bool
+        :param hmac_key: The secret key for HMAC signatures
+        :type hmac_key: bytes or None
         :return: The Sign Object
         :rtype: Sign
         """
         self.private = None
-        self.public = None
-        backend = default_backend()
+        self.public_keys = []
+        self.hmac_key = hmac_key
         if private_key:
-            try:
-                self.private = serialization.load_pem_private_key(private_key,
-                                                                  password=None,
-                                                                  backend=backend,
-                                                                  unsafe_skip_rsa_key_validation=not check_private_key)
-            except Exception as e:
-                log.error("Error loading private key: ({0!r})".format(e))
-                log.debug(traceback.format_exc())
-                raise e
-
+            self.private = self.load_private_key(private_key, check_private_key)
         if public_key:
-            try:
-                self.public = serialization.load_pem_public_key(public_key,
-                                                                backend=backend)
-            except Exception as e:
-                log.error("Error loading public key: ({0!r})".format(e))
-                log.debug(traceback.format_exc())
-                raise e
+            self.public_keys = self.load_public_keys(public_key)
+
+    @property
+    def public(self):
+        """
+        The first public key
+        """
+        return self.public_keys[0] if self.public_keys else None
+
+    @property
+    def sig_ver(self):
+        """
+        The version of the signatures created by this object
+        """
+        if self.hmac_key:
+            return SIG_VER_HMAC
+        if self.private is not None:
+            return get_signature_version(self.private)
+        return SIG_VER_RSA
+
+    @staticmethod
+    def load_private_key(private_key, check_private_key=True):
+        """
+        Load the private key from PEM data
+
+        :param private_key: The private Key data in PEM format
+        :type private_key: bytes
+        :param check_private_key: Check the private key when loading (default: True)
+        :type check_private_key: bool
+        :return: the private key object
+        """
+        try:
+            key = serialization.load_pem_private_key(private_key,
+                                                     password=None,
+                                                     backend=default_backend(),
+                                                     unsafe_skip_rsa_key_validation=not check_private_key)
+            get_signature_version(key)
+            return key
+        except Exception as e:
+            log.error("Error loading private key: ({0!r})".format(e))
+            log.debug(traceback.format_exc())
+            raise e
+
+    @staticmethod
+    def load_public_keys(public_key):
+        """
+        Load the public keys from PEM data
+
+        :param public_key: The public key data in PEM format, which may contain
+            several keys
+        :type public_key: bytes
+        :return: list of public key objects
+        """
+        try:
+            keys = [serialization.load_pem_public_key(pem, backend=default_backend())
+                    for pem in PEM_PUBLIC_KEY_PATTERN.findall(to_bytes(public_key))]
+            if not keys:
+                raise ValueError("No public key found.")
+            return keys
+        except Exception as e:
+            log.error("Error loading public key: ({0!r})".format(e))
+            log.debug(traceback.format_exc())
+            raise e
 
     def sign(self, s):
         """
@@ -736,20 +892,53 @@ class Sign(object):
         :return: The hexlified and versioned signature of the string
         :rtype: str
         """
+        if self.hmac_key:
+            signature = hmac.new(self.hmac_key, to_bytes(s), sha256).digest()
+            return ':'.join([SIG_VER_HMAC, hexlify_and_unicode(signature)])
+
         if not self.private:
             log.info('Could not sign message {0!s}, no private key!'.format(s))
             # TODO: should we throw an exception in this case?
             return ''
 
-        signature = self.private.sign(
-            to_bytes(s),
-            asym_padding.PSS(
-                mgf=asym_padding.MGF1(hashes.SHA256()),
-                salt_length=asym_padding.PSS.MAX_LENGTH),
-            hashes.SHA256())
-        res = ':'.join([self.sig_ver, hexlify_and_unicode(signature)])
+        sig_ver = self.sig_ver
+        if sig_ver == SIG_VER_ED25519:
+            signature = self.private.sign(to_bytes(s))
+        elif sig_ver == SIG_VER_ECDSA:
+            signature = self.private.sign(to_bytes(s), ec.ECDSA(hashes.SHA256()))
+        else:
+            signature = self.private.sign(
+                to_bytes(s),
+                asym_padding.PSS(
+                    mgf=asym_padding.MGF1(hashes.SHA256()),
+                    salt_length=asym_padding.PSS.MAX_LENGTH),
+                hashes.SHA256())
+        res = ':'.join([sig_ver, hexlify_and_unicode(signature)])
         return res
 
+    @staticmethod
+    def _verify_with_key(key, sver, data, signature):
+        """
+        Verify the signature with the given public key. An exception is raised,
+        if the signature is invalid.
+
+        :return: False, if the key does not match the signature version
+        """
+        if sver == SIG_VER_RSA and isinstance(key, rsa.RSAPublicKey):
+            key.verify(signature, data,
+                       asym_padding.PSS(
+                           mgf=asym_padding.MGF1(hashes.SHA256()),
+                           salt_length=asym_padding.PSS.MAX_LENGTH),
+                       hashes.SHA256())
+        elif sver == SIG_VER_ED25519 and isinstance(key, ed25519.Ed25519PublicKey):
+            key.verify(signature, data)
+        elif sver == SIG_VER_ECDSA and isinstance(key, ec.EllipticCurvePublicKey) \
+                and isinstance(key.curve, ec.SECP256R1):
+            key.verify(signature, data, ec.ECDSA(hashes.SHA256()))
+        else:
+            return False
+        return True
+
     def verify(self, s, signature, verify_old_sigs=False):
         """
         Check the signature of the string s
@@ -764,11 +953,6 @@ class Sign(object):
         :rtype: bool
         """
         r = False
-        if not self.public:
-            log.info('Could not verify signature for message {0!s}, '
-                     'no public key!'.format(s))
-            return r
-
         sver = ''
         try:
             sver, signature = str(signature).split(':')
@@ -776,20 +960,46 @@ class Sign(object):
             # if the signature does not contain a colon we assume an old style signature.
             pass
 
+        if sver == SIG_VER_HMAC:
+            if not self.hmac_key:
+                log.info('Could not verify signature for message {0!s}, '
+                         'no HMAC key!'.format(s))
+                return r
+            try:
+                expected = hmac.new(self.hmac_key, to_bytes(s), sha256).digest()
+                r = hmac.compare_digest(expected, binascii.unhexlify(signature))
+            except Exception:
+                log.error("Failed to verify signature: {0!r}".format(s))
+                log.debug("{0!s}".format(traceback.format_exc()))
+            return r
+
+        if not self.public_keys:
+            log.info('Could not verify signature for message {0!s}, '
+                     'no public key!'.format(s))
+            return r
+
         try:
-            if sver == self.sig_ver:
-                self.public.verify(
-                    binascii.unhexlify(signature),
-                    to_bytes(s),
-                    asym_padding.PSS(
-                        mgf=asym_padding.MGF1(hashes.SHA256()),
-                        salt_length=asym_padding.PSS.MAX_LENGTH),
-                    hashes.SHA256())
-                r = True
+            if sver in (SIG_VER_RSA, SIG_VER_ED25519, SIG_VER_ECDSA):
+                data = to_bytes(s)
+                binary_signature = binascii.unhexlify(signature)
+                for key in self.public_keys:
+                    try:
+                        if self._verify_with_key(key, sver, data, binary_signature):
+                            r = True
+                            break
+                    except InvalidSignature:
+                        # The signature might have been created with another key
+                        continue
+                if not r:
+                    log.error("Failed to verify signature: {0!r}".format(s))
             else:
                 if verify_old_sigs:
                     int_s = int(binascii.hexlify(sha256(to_bytes(s)).digest()), 16)
-                    r = _slow_rsa_verify_raw(self.public, int(signature), int_s)
+                    for key in self.public_keys:
+                        if isinstance(key, rsa.RSAPublicKey) and \
+                                _slow_rsa_verify_raw(key, int(signature), int_s):
+                            r = True
+                            break
                 else:
                     log.debug('Could not verify old style signature {0!s} '
                               'for data {1:s}'.format(signature, s))
@@ -800,6 +1010,71 @@ class Sign(object):
         return r
 
 
+def _load_key_data(key_data, kind, check_private_key=True):
+    if kind == "private":
+        return Sign.load_private_key(key_data, check_private_key)
+    if kind == "public":
+        return Sign.load_public_keys(key_data)
+    # The HMAC key is stored hexlified
+    return binascii.unhexlify(key_data.strip())
+
+
+def _get_cached_key(key_file, kind, check_private_key=True):
+    """
+    Return the loaded key of the given file. The keys are stored in the
+    app-local store and only loaded again, if the file was modified.
+
+    :param key_file: The name of the key file
+    :param kind: "private" or "public" for a PEM file with the private key or
+        the public keys, "hmac" for a file with a hexlified HMAC key
+    :param check_private_key: Check the private key when loading
+    :return: the private key object, the list of public keys or the HMAC key
+    """
+    stat = os.stat(key_file)
+    file_version = (stat.st_mtime_ns, stat.st_size)
+    keys = get_app_local_store().setdefault("signing_keys", {})
+    private = kind == "private"
+    cache_key = (key_file, kind, private and check_private_key)
+    cached = keys.get(cache_key)
+    if private and not check_private_key and not cached:
+        # A checked private key can be used as well
+        cached = keys.get((key_file, kind, True))
+    if not cached or cached[0] != file_version:
+        log.debug("Loading the key from file {0!s}".format(key_file))
+        with open(key_file, "rb") as f:
+            key_data = f.read()
+        cached = (file_version, _load_key_data(key_data, kind, check_private_key))
+        keys[cache_key] = cached
+    return cached[1]
+
+
+def get_sign_object(private_key_file=None, public_key_file=None, check_private_key=True,
+                    hmac_key_file=None):
+    """
+    Return a Sign object with the keys of the given files.
+
+    The loaded keys are cached in the app-local store, so that the API
+    responses and the audit entries are signed with the same key object,
+    which is only loaded again, if the key file was modified.
+
+    :param private_key_file: The name of the file with the private key
+    :param public_key_file: The name of the file with the public keys
+    :param check_private_key: Check the private key when loading (default: True)
+    :param hmac_key_file: The name of the file with the hexlified HMAC key.
+        If given, the Sign object creates HMAC signatures.
+    :return: The Sign object
+    :rtype: Sign
+    """
+    sign_object = Sign()
+    if private_key_file:
+        sign_object.private = _get_cached_key(private_key_file, "private", check_private_key)
+    if public_key_file:
+        sign_object.public_keys = _get_cached_key(public_key_file, "public")
+    if hmac_key_file:
+        sign_object.hmac_key = _get_cached_key(hmac_key_file, "hmac")
+    return sign_object
+
+
 def create_hsm_object(config):
     """
     This creates an HSM object from the given config dictionary.
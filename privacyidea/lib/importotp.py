@@ -52,6 +52,7 @@ XML files, that hold the OTP secrets for eToken PASS.
 import hmac
 import hashlib
 import defusedxml.ElementTree as etree
+from xml.parsers.expat import errors as expat_errors
 import re
 import binascii
 import base64
@@ -74,6 +75,8 @@ from os import path
 import logging
 log = logging.getLogger(__name__)
 
+XML_ERROR_NO_ELEMENTS = expat_errors.codes[expat_errors.XML_ERROR_NO_ELEMENTS]
+
 
 def _create_static_password(key_hex):
     '''
@@ -136,18 +139,28 @@ def parseOATHcsv(csv):
                         'ocrasuite' : xxx  }
         }
     '''
-    TOKENS = {}
-    version = 0
+    return dict(iter_oath_csv(csv.split('\n')))
 
-    csv_array = csv.split('\n')
 
-    m = re.match(r"^#\s*version:\s*(\d+)", csv_array[0])
-    if m:
-        version = m.group(1)
-        log.debug("the file is version {0}.".format(version))
+def iter_oath_csv(lines):
+    """
+    Parse the lines of an OATH CSV file one by one (see :func:`parseOATHcsv`
+    for the file format), so that large files do not need to be read into
+    memory completely.
+
+    :param lines: iterable of the lines like a file object
+    :return: generator of tuples of the serial and the token dictionary
+    """
+    version = 0
+    count = 0
+    for count, line in enumerate(lines, 1):
+        line = line.rstrip('\n')
+        if count == 1:
+            m = re.match(r"^#\s*version:\s*(\d+)", line)
+            if m:
+                version = m.group(1)
+                log.debug("the file is version {0}.".format(version))
 
-    log.debug("the file contains {0:d} lines.".format(len(csv_array)))
-    for line in csv_array:
         # Do not parse comment lines
         if line.startswith("#"):
             continue
@@ -184,9 +197,9 @@ def parseOATHcsv(csv):
             log.debug("read the line {0!s}".format(params))
 
             params["user"] = user
-            TOKENS[serial] = params
+            yield serial, params
 
-    return TOKENS
+    log.debug("the file contains {0:d} lines.".format(count))
 
 
 @log_with(log)
@@ -434,15 +447,19 @@ def derive_key(xml, password):
                               "encryption key, but no password given!")
 
     keymeth = xml.keycontainer.encryptionkey.derivedkey.keyderivationmethod
-    derivation_algo = keymeth["algorithm"].split("#")[-1]
+    return _derive_pbkdf2_key(password, keymeth["algorithm"],
+                              keymeth.find("salt").text,
+                              keymeth.find("keylength").text,
+                              keymeth.find("iterationcount").text)
+
+
+def _derive_pbkdf2_key(password, algorithm, salt, keylength, rounds):
+    derivation_algo = algorithm.split("#")[-1]
     if derivation_algo.lower() != "pbkdf2":
         raise TokenImportException("We only support PBKDF2 as Key derivation "
                               "function!")
-    salt = keymeth.find("salt").text.strip()
-    keylength = keymeth.find("keylength").text.strip()
-    rounds = keymeth.find("iterationcount").text.strip()
-    r = pbkdf2_hmac('sha1', to_utf8(password), base64.b64decode(salt),
-                    rounds=int(rounds), keylen=int(keylength))
+    r = pbkdf2_hmac('sha1', to_utf8(password), base64.b64decode(salt.strip()),
+                    rounds=int(rounds.strip()), keylen=int(keylength.strip()))
     return binascii.hexlify(r)
 
 
@@ -502,15 +519,9 @@ def parsePSKCdata(xml_data,
         serial = key["id"]
 
         # Special treatment for pskc files exported from Yubico
-        yubi_mapping = {"http://www.yubico.com/#yubikey-aes": ("yubikey", "UBAM"),
-                        "urn:ietf:params:xml:ns:keyprov:pskc:hotp": ("hotp", "UBOM")}
-        if algo in yubi_mapping.keys() and re.match(r"\d+:\d+",
-                                                    serial):  # check if the serial fits the pattern "<SerialNo>:<Slot>
-            t_type = yubi_mapping[algo][0]
-            serial_split = serial.split(":")
-            serial_no = serial_split[0]
-            slot = serial_split[1]
-            serial = "{!s}{!s}_{!s}".format(yubi_mapping[algo][1], serial_no, slot)
+        yubico_token = _map_yubico_serial(algo, serial)
+        if yubico_token:
+            t_type, serial = yubico_token
         else:
             try:
                 serial = key_package.deviceinfo.serialno.string.strip()
@@ -600,6 +611,211 @@ def parsePSKCdata(xml_data,
     return tokens, not_imported_serials
 
 
+def _map_yubico_serial(algo, serial):
+    """
+    PSKC files exported from Yubico contain the serial number and the slot
+    of the Yubikey in the key ID like "<SerialNo>:<Slot>".
+
+    :return: tuple of the token type and the serial or None
+    """
+    yubi_mapping = {"http://www.yubico.com/#yubikey-aes": ("yubikey", "UBAM"),
+                    "urn:ietf:params:xml:ns:keyprov:pskc:hotp": ("hotp", "UBOM")}
+    if algo in yubi_mapping.keys() and re.match(r"\d+:\d+", serial):
+        serial_no, slot = serial.split(":")[:2]
+        return yubi_mapping[algo][0], "{!s}{!s}_{!s}".format(yubi_mapping[algo][1], serial_no, slot)
+    return None
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1].lower()
+
+
+def _find(elem, name):
+    """
+    Return the first descendant of the element with the given tag name. The
+    namespace of the tags is ignored and the names are compared case-insensitively
+    like in the Beautiful Soup of :func:`parsePSKCdata`.
+    """
+    if elem is not None:
+        for child in elem.iter():
+            if child is not elem and _local_name(child.tag) == name:
+                return child
+    return None
+
+
+def _text(elem):
+    return "".join(elem.itertext())
+
+
+def _attribute(elem, name):
+    if elem is not None:
+        for key, value in elem.attrib.items():
+            if _local_name(key) == name:
+                return value
+    return None
+
+
+def _parse_pskc_key_package(key_package, preshared_key_hex, mac_key, validate_mac):
+    """
+    Read the token from a KeyPackage element of a PSKC file.
+
+    :return: tuple of the serial, the token dictionary and whether the MAC is valid
+    """
+    token = {}
+    key = _find(key_package, "key")
+    if key is None:
+        raise TokenImportException("Found a KeyPackage without a Key element.")
+    device_info = _find(key_package, "deviceinfo")
+    manufacturer = _find(device_info, "manufacturer")
+    if manufacturer is not None:
+        token["description"] = manufacturer.text
+
+    algo = _attribute(key, "algorithm") or ""
+    serial = _attribute(key, "id")
+    yubico_token = _map_yubico_serial(algo, serial or "")
+    if yubico_token:
+        t_type, serial = yubico_token
+    else:
+        serial_no = _find(device_info, "serialno")
+        if serial_no is not None and serial_no.text:
+            serial = serial_no.text.strip()
+        t_type = algo.split(":")[-1].lower()
+    token["type"] = t_type
+
+    parameters = _find(key, "algorithmparameters")
+    token["otplen"] = _attribute(_find(parameters, "responseformat"), "length") or 6
+    hash_lib = "sha1"
+    suite = _find(parameters, "suite")
+    if suite is not None and suite.text:
+        hash_lib = suite.text.lower()
+    else:
+        log.warning("No hashlib defined, falling back to default {}.".format(hash_lib))
+    token["hashlib"] = hash_lib
+
+    mac_valid = True
+    data = _find(key, "data")
+    secret = _find(data, "secret")
+    try:
+        plain_value = _find(secret, "plainvalue")
+        encrypted_value = _find(secret, "encryptedvalue")
+        if plain_value is not None:
+            token["otpkey"] = hexlify_and_unicode(base64.b64decode(_text(plain_value)))
+        elif encrypted_value is not None:
+            enc_algorithm = _attribute(_find(encrypted_value, "encryptionmethod"),
+                                       "algorithm").split("#")[-1]
+            if enc_algorithm.lower() != "aes128-cbc":
+                raise TokenImportException("We only import PSKC files with "
+                                           "AES128-CBC.")
+            enc_data = _text(_find(encrypted_value, "ciphervalue")).strip()
+            secret_bin = aes_decrypt_b64(binascii.unhexlify(preshared_key_hex), enc_data)
+            if t_type in ["hotp", "totp"]:
+                token["otpkey"] = hexlify_and_unicode(secret_bin)
+            else:
+                token["otpkey"] = to_unicode(secret_bin)
+
+            if validate_mac != 'no_check':
+                hm = hmac.new(key=mac_key, msg=base64.b64decode(enc_data), digestmod=hashlib.sha1)
+                mac_value_xml = _text(_find(data, "valuemac")).strip()
+                mac_valid = hmac.compare_digest(mac_value_xml, b64encode_and_unicode(hm.digest()))
+    except Exception as exx:
+        log.error("Failed to import tokendata: {0!s}".format(exx))
+        log.debug(traceback.format_exc())
+        raise TokenImportException("Failed to import tokendata. Wrong "
+                                   "encryption key? %s" % exx)
+
+    if t_type in ["hotp", "totp"]:
+        counter = _find(data, "counter")
+        if counter is not None:
+            token["counter"] = _text(counter).strip()
+    if t_type == "totp":
+        time_interval = _find(data, "timeinterval")
+        if time_interval is not None:
+            token["timeStep"] = _text(time_interval).strip()
+        time_drift = _find(data, "timedrift")
+        if time_drift is not None:
+            token["timeShift"] = _text(time_drift).strip()
+    return serial, token, mac_valid
+
+
+def iter_pskc_data(xml_file,
+                   preshared_key_hex=None,
+                   password=None,
+                   validate_mac='check_fail_hard'):
+    """
+    Parse the XML data of a PSKC file (RFC6030) like :func:`parsePSKCdata`, but
+    read the key packages one after the other with an incremental parser.
+    Each key package is removed from the tree after it is read, so that the
+    memory usage does not depend on the number of tokens in the file.
+    In contrast to :func:`parsePSKCdata` the XML data needs to be well-formed.
+
+    :param xml_file: The file name or the file object of the XML data
+    :param preshared_key_hex: The preshared key, hexlified
+    :param password: The password that encrypted the keys
+    :param validate_mac: Operation mode of hmac validation. Possible values:
+        - 'check_fail_hard' : A TokenImportException is raised at the first
+          token with an invalid hmac. The tokens before have already been
+          returned, so the complete file needs to be read before importing
+          any token, if no token should be imported in this case.
+        - 'check_fail_soft' : The token dictionary of tokens with an invalid
+          MAC is None.
+        - 'no_check' : Hmac of tokens are not checked, every token is parsed.
+    :return: generator of tuples of the serial and the token dictionary
+    """
+    root = None
+    mac_key = None
+    try:
+        for event, elem in etree.iterparse(xml_file, events=("start", "end")):
+            if root is None:
+                root = elem
+                if _local_name(root.tag) != "keycontainer":
+                    raise TokenImportException("No KeyContainer found in PSKC data. Could not "
+                                               "import any tokens.")
+            if event == "start":
+                continue
+            name = _local_name(elem.tag)
+            if name == "encryptionkey":
+                key_derivation = _find(_find(elem, "derivedkey"), "keyderivationmethod")
+                if key_derivation is not None:
+                    if not password:
+                        raise TokenImportException("The XML KeyContainer specifies a derived "
+                                                   "encryption key, but no password given!")
+                    preshared_key_hex = _derive_pbkdf2_key(password,
+                                                           _attribute(key_derivation, "algorithm"),
+                                                           _text(_find(key_derivation, "salt")),
+                                                           _text(_find(key_derivation, "keylength")),
+                                                           _text(_find(key_derivation, "iterationcount")))
+            elif name == "mackey" and preshared_key_hex and validate_mac != 'no_check':
+                try:
+                    mac_key = aes_decrypt_b64(binascii.unhexlify(preshared_key_hex), _text(elem))
+                except Exception as exx:
+                    raise TokenImportException("Failed to decrypt the MAC key. Wrong "
+                                               "encryption key? {0!s}".format(exx))
+            elif name == "keypackage":
+                serial, token, mac_valid = _parse_pskc_key_package(elem, preshared_key_hex,
+                                                                   mac_key, validate_mac)
+                # The key package is not needed anymore
+                if elem in root:
+                    root.remove(elem)
+                else:
+                    elem.clear()
+                if not mac_valid:
+                    if validate_mac == 'check_fail_hard':
+                        raise TokenImportException("The MAC of token {0!s} is "
+                                                   "invalid.".format(serial))
+                    token = None
+                yield serial, token
+    except etree.ParseError as exx:
+        if root is not None and exx.code == XML_ERROR_NO_ELEMENTS:
+            # Like parsePSKCdata we accept files without the end tag of the
+            # KeyContainer, but an incomplete key package at the end is lost.
+            log.warning("The PSKC data ends before the end of the KeyContainer.")
+        else:
+            raise TokenImportException("Could not parse the PSKC data: {0!s}".format(exx))
+    if root is None:
+        raise TokenImportException("No KeyContainer found in PSKC data. Could not "
+                                   "import any tokens.")
+
+
 class GPGImport(object):
     """
     This class is used to decrypt GPG encrypted import files.
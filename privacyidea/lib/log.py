@@ -26,9 +26,25 @@ from logging import Formatter
 import string
 import logging
 import functools
+import threading
 from copy import deepcopy
+from time import perf_counter_ns
 log = logging.getLogger(__name__)
 
+# The number of buckets of the duration histogram. Bucket k counts the calls,
+# which took less than 2**k microseconds.
+TIMING_BUCKETS = 32
+TIMING_PERCENTILES = [50, 90, 99]
+
+# Timing of the functions decorated with log_with. If it is disabled, the
+# decorator only checks this flag.
+_timing_enabled = False
+_timing_local = threading.local()
+# The timing tables of the threads and of the finished threads
+_timing_tables = {}
+_retired_timings = {}
+_timing_lock = threading.Lock()
+
 
 DEFAULT_LOGGING_CONFIG = {
     "version": 1,
@@ -78,6 +94,118 @@ class SecureFormatter(Formatter):
         return s
 
 
+def enable_timing(enabled=True):
+    """
+    Enable or disable the timing of the functions, which are decorated with
+    :class:`log_with`.
+
+    :param enabled: Whether the calls should be timed
+    :type enabled: bool
+    """
+    global _timing_enabled
+    _timing_enabled = bool(enabled)
+
+
+def is_timing_enabled():
+    return _timing_enabled
+
+
+def _record_timing(name, duration):
+    """
+    Add the duration of a call to the timing table of the current thread.
+    Only the current thread writes to its table, so no lock is needed.
+
+    :param name: The qualified name of the function
+    :param duration: The duration of the call in nanoseconds
+    """
+    try:
+        table = _timing_local.table
+    except AttributeError:
+        table = _timing_local.table = {}
+        with _timing_lock:
+            _timing_tables[threading.current_thread()] = table
+    entry = table.get(name)
+    if entry is None:
+        # count, total and maximum duration, histogram
+        entry = table[name] = [0, 0, 0, [0] * TIMING_BUCKETS]
+    entry[0] += 1
+    entry[1] += duration
+    if duration > entry[2]:
+        entry[2] = duration
+    entry[3][min((duration // 1000).bit_length(), TIMING_BUCKETS - 1)] += 1
+
+
+def _merge_timing(target, table):
+    for name, (count, total, maximum, buckets) in list(table.items()):
+        entry = target.get(name)
+        if entry is None:
+            target[name] = [count, total, maximum, list(buckets)]
+        else:
+            entry[0] += count
+            entry[1] += total
+            entry[2] = max(entry[2], maximum)
+            entry[3] = [a + b for a, b in zip(entry[3], buckets)]
+
+
+def _get_percentile(buckets, count, percentile):
+    """
+    :return: the upper bound of the histogram bucket in milliseconds, which
+        contains the given percentile
+    """
+    rank = count * percentile / 100
+    seen = 0
+    for k, bucket in enumerate(buckets):
+        seen += bucket
+        if seen >= rank:
+            return 2 ** k / 1000
+    return 2 ** (len(buckets) - 1) / 1000
+
+
+def get_timing_stats():
+    """
+    Return the timing of the functions of all threads of this process.
+    The durations are given in milliseconds. The percentiles are the upper
+    bounds of the histogram buckets, i.e. they are powers of two of
+    microseconds.
+
+    :return: dictionary of the qualified function names and dictionaries with
+        the keys "count", "total", "mean", "max" and the percentiles like "p90"
+    :rtype: dict
+    """
+    merged = {}
+    with _timing_lock:
+        for thread, table in list(_timing_tables.items()):
+            if not thread.is_alive():
+                # keep the timings of the finished threads in one table
+                _merge_timing(_retired_timings, table)
+                del _timing_tables[thread]
+        _merge_timing(merged, _retired_timings)
+        for table in _timing_tables.values():
+            _merge_timing(merged, table)
+    stats = {}
+    for name, (count, total, maximum, buckets) in merged.items():
+        if not count:
+            continue
+        entry = {"count": count,
+                 "total": total / 1e6,
+                 "mean": total / count / 1e6,
+                 "max": maximum / 1e6}
+        for percentile in TIMING_PERCENTILES:
+            entry["p{0!s}".format(percentile)] = _get_percentile(buckets, count, percentile)
+        stats[name] = entry
+    return stats
+
+
+def reset_timing_stats():
+    """
+    Delete the timing of the functions of all threads of this process.
+    """
+    with _timing_lock:
+        _retired_timings.clear()
+        for table in _timing_tables.values():
+            table.clear()
+
+
 class log_with(object):
     """
     Logging decorator that allows you to log with a
@@ -125,6 +253,8 @@ class log_with(object):
         :return: function
         """
 
+        name = "{0!s}.{1!s}".format(func.__module__, func.__qualname__)
+
         @functools.wraps(func)
         def log_wrapper(*args, **kwds):
             """
@@ -132,6 +262,7 @@ class log_with(object):
             the exit of the function is logged using the DEBUG log level.
             If the logger does not log DEBUG messages, this just returns
             the result of ``func(*args, **kwds)`` to improve performance.
+            If the timing is enabled, the duration of the call is recorded.
 
             :param args: The positional arguments starting with index
             :type args: tuple
@@ -139,56 +270,70 @@ class log_with(object):
             :type kwds: dict
             :return: The wrapped function
             """
+            if _timing_enabled:
+                start = perf_counter_ns()
+                try:
+                    if not self.logger.isEnabledFor(logging.DEBUG):
+                        return func(*args, **kwds)
+                    return self._log_call(func, args, kwds)
+                finally:
+                    _record_timing(name, perf_counter_ns() - start)
+
             # Exit early if self.logger disregards DEBUG messages.
             if not self.logger.isEnabledFor(logging.DEBUG):
                 return func(*args, **kwds)
+            return self._log_call(func, args, kwds)
 
-            log_args = args
-            log_kwds = kwds
-            if self.hide_args or self.hide_kwargs or \
-                    self.hide_args_keywords:
-                try:
-                    level = self.logger.getEffectiveLevel()
-                    # Check if we should not do the password logging.
-                    # I.e. we only do password logging if log_level < 10.
-                    if level != 0 and level >= 10:
-                        # Hide specific arguments or keyword arguments
-                        log_args = list(deepcopy(args))
-                        log_kwds = deepcopy(kwds)
-                        for arg_index in self.hide_args:
-                            log_args[arg_index] = "HIDDEN"
-                        for keyword in self.hide_kwargs:
-                            log_kwds[keyword] = "HIDDEN"
-                        for k, v in self.hide_args_keywords.items():
-                            for keyword in v:
-                                if keyword in args[k]:
-                                    log_args[k][keyword] = "HIDDEN"
-                except Exception:
-                    # Probably the deepcopy fails, due to special objects in the
-                    # args But as we are asked to hide a parameter, we hide
-                    # them all!
-                    log_args = ()
-                    log_kwds = {}
-            try:
-                if self.log_entry:
-                    self.logger.debug(self.ENTRY_MESSAGE.format(
-                        func.__name__, log_args, log_kwds))
-                else:
-                    self.logger.debug(self.ENTRY_MESSAGE.format(
-                        func.__name__, "HIDDEN", "HIDDEN"))
-            except Exception as exx:
-                self.logger.error(exx)
-                self.logger.error("Error during logging of function {0}! {1}".format(func.__name__, exx))
-
-            f_result = func(*args, **kwds)
+        return log_wrapper
 
+    def _log_call(self, func, args, kwds):
+        """
+        Call the function and log the entry and the exit of the function.
+        """
+        log_args = args
+        log_kwds = kwds
+        if self.hide_args or self.hide_kwargs or \
+                self.hide_args_keywords:
             try:
-                if self.log_exit:
-                    self.logger.debug(self.EXIT_MESSAGE.format(func.__name__, f_result))
-                else:
-                    self.logger.debug(self.EXIT_MESSAGE.format(func.__name__, "HIDDEN"))
-            except Exception as exx:
-                self.logger.error("Error during logging of function {0}! {1}".format(func.__name__, exx))
-            return f_result
+                level = self.logger.getEffectiveLevel()
+                # Check if we should not do the password logging.
+                # I.e. we only do password logging if log_level < 10.
+                if level != 0 and level >= 10:
+                    # Hide specific arguments or keyword arguments
+                    log_args = list(deepcopy(args))
+                    log_kwds = deepcopy(kwds)
+                    for arg_index in self.hide_args:
+                        log_args[arg_index] = "HIDDEN"
+                    for keyword in self.hide_kwargs:
+                        log_kwds[keyword] = "HIDDEN"
+                    for k, v in self.hide_args_keywords.items():
+                        for keyword in v:
+                            if keyword in args[k]:
+                                log_args[k][keyword] = "HIDDEN"
+            except Exception:
+                # Probably the deepcopy fails, due to special objects in the
+                # args But as we are asked to hide a parameter, we hide
+                # them all!
+                log_args = ()
+                log_kwds = {}
+        try:
+            if self.log_entry:
+                self.logger.debug(self.ENTRY_MESSAGE.format(
+                    func.__name__, log_args, log_kwds))
+            else:
+                self.logger.debug(self.ENTRY_MESSAGE.format(
+                    func.__name__, "HIDDEN", "HIDDEN"))
+        except Exception as exx:
+            self.logger.error(exx)
+            self.logger.error("Error during logging of function {0}! {1}".format(func.__name__, exx))
 
-        return log_wrapper
+        f_result = func(*args, **kwds)
+
+        try:
+            if self.log_exit:
+                self.logger.debug(self.EXIT_MESSAGE.format(func.__name__, f_result))
+            else:
+                self.logger.debug(self.EXIT_MESSAGE.format(func.__name__, "HIDDEN"))
+        except Exception as exx:
+            self.logger.error("Error during logging of function {0}! {1}".format(func.__name__, exx))
+        return f_result
@@ -0,0 +1,276 @@
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+__doc__ = """Caches with a least-recently-used eviction and a time to live for each
+entry.
+
+``LRUCache`` is an in-memory cache of a process. ``SQLiteCache`` stores the
+entries in an SQLite file, so that all processes on a node can share the
+entries. ``LayeredCache`` combines a process cache with a shared cache.
+
+All caches count hits, misses and evictions.
+
+This module is tested in tests/test_lib_lrucache.py
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# Marks a missing entry, as ``None`` may be a cached value
+MISSING = object()
+
+
+class CacheStats(object):
+    """
+    Counters of a cache
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def as_dict(self):
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations}
+
+
+class LRUCache(object):
+    """
+    Thread-safe in-memory cache with at most ``max_entries`` entries. If the
+    cache is full, the least recently used entry is evicted. Expired entries
+    are removed, when they are read.
+
+    All operations take constant time.
+    """
+
+    def __init__(self, max_entries=10000, clock=time.time):
+        """
+        :param max_entries: the maximum number of entries
+        :param clock: function returning the current time in seconds
+        """
+        self.max_entries = max_entries
+        self.clock = clock
+        self.stats = CacheStats()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not MISSING
+
+    def get(self, key, count=True):
+        """
+        Return the cached value or ``MISSING``
+
+        :param key: a hashable key
+        :param count: whether the access is counted in the statistics
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > self.clock():
+                    self._entries.move_to_end(key)
+                    if count:
+                        self.stats.hits += 1
+                    return value
+                del self._entries[key]
+                self.stats.expirations += 1
+            if count:
+                self.stats.misses += 1
+            return MISSING
+
+    def set(self, key, value, ttl):
+        """
+        Store the value for ``ttl`` seconds
+        """
+        with self._lock:
+            self._entries[key] = (value, self.clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache(object):
+    """
+    Cache in an SQLite file, which is shared by all processes on the node.
+    The values are stored as JSON, values which can not be converted to JSON
+    are not cached.
+
+    Writing the access time on every read would serialize all readers. So
+    the entries are evicted in the order of their expiration (which is the
+    order of their creation for entries with the same time to live). The
+    cache is checked for its size every ``cleanup_interval`` writes.
+    """
+
+    def __init__(self, filename, max_entries=100000, clock=time.time, cleanup_interval=100):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.clock = clock
+        self.cleanup_interval = cleanup_interval
+        self.stats = CacheStats()
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        connection = self._connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS cache "
+                           "(key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+        connection.commit()
+
+    def _connection(self):
+        """
+        SQLite connections can not be shared between threads. Each thread and
+        each process opens its own connection.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.filename, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @staticmethod
+    def _key(key):
+        return json.dumps(key)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not MISSING
+
+    def get(self, key, count=True):
+        try:
+            row = self._connection().execute("SELECT value, expires FROM cache WHERE key = ?",
+                                             (self._key(key),)).fetchone()
+        except sqlite3.Error as exx:  # pragma: no cover
+            log.warning("Could not read from the cache {0!s}: {1!r}".format(self.filename, exx))
+            row = None
+        if row and row[1] > self.clock():
+            if count:
+                self.stats.hits += 1
+            return json.loads(row[0])
+        if row:
+            self.stats.expirations += 1
+        if count:
+            self.stats.misses += 1
+        return MISSING
+
+    def set(self, key, value, ttl):
+        try:
+            data = json.dumps(value)
+        except (TypeError, ValueError):
+            log.debug("The value for {0!r} can not be stored in the shared cache.".format(key))
+            return
+        try:
+            connection = self._connection()
+            connection.execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                               (self._key(key), data, self.clock() + ttl))
+            connection.commit()
+            with self._lock:
+                self._writes += 1
+                cleanup = self._writes % self.cleanup_interval == 0
+            if cleanup:
+                self.cleanup()
+        except sqlite3.Error as exx:  # pragma: no cover
+            log.warning("Could not write to the cache {0!s}: {1!r}".format(self.filename, exx))
+
+    def cleanup(self):
+        """
+        Remove the expired entries and evict the entries exceeding ``max_entries``.
+        """
+        connection = self._connection()
+        connection.execute("DELETE FROM cache WHERE expires <= ?", (self.clock(),))
+        num = connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if num > self.max_entries:
+            cursor = connection.execute("DELETE FROM cache WHERE key IN "
+                                        "(SELECT key FROM cache ORDER BY expires LIMIT ?)",
+                                        (num - self.max_entries,))
+            self.stats.evictions += cursor.rowcount
+        connection.commit()
+
+    def delete(self, key):
+        connection = self._connection()
+        connection.execute("DELETE FROM cache WHERE key = ?", (self._key(key),))
+        connection.commit()
+
+    def clear(self):
+        connection = self._connection()
+        connection.execute("DELETE FROM cache")
+        connection.commit()
+
+
+class LayeredCache(object):
+    """
+    A process cache in front of a shared cache. Entries found in the shared
+    cache are copied to the process cache with their remaining lifetime
+    unknown, so they are kept at most ``ttl`` seconds again. Thus, the process
+    cache only keeps entries for a short ``local_ttl``.
+    """
+
+    def __init__(self, local, shared, local_ttl=5):
+        self.local = local
+        self.shared = shared
+        self.local_ttl = local_ttl
+        self.stats = local.stats
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not MISSING
+
+    def get(self, key, count=True):
+        value = self.local.get(key, count=False)
+        if value is MISSING:
+            value = self.shared.get(key, count=False)
+            if value is not MISSING:
+                self.local.set(key, value, self.local_ttl)
+        if count:
+            if value is MISSING:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+        return value
+
+    def set(self, key, value, ttl):
+        self.local.set(key, value, min(ttl, self.local_ttl))
+        self.shared.set(key, value, ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        self.shared.delete(key)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
@@ -25,14 +25,33 @@ database table "monitoringstats". This can be arbitrary data for time series of
 This module is tested in tests/test_lib_monitoringstats.py
 """
 import logging
+import threading
+import time
 from dateutil.tz import tzlocal
-from privacyidea.lib.log import log_with
+from privacyidea.lib.log import log_with, is_timing_enabled, get_timing_stats
+from privacyidea.lib.config import get_shared_config_object
+from privacyidea.lib.requeststats import (is_request_stats_enabled, get_request_stats_totals,
+                                          CATEGORIES, DB)
 from privacyidea.lib.utils import get_module_class
-from privacyidea.lib.framework import get_app_config, get_request_local_store
+from privacyidea.lib.framework import get_app_config, get_app_config_value, get_request_local_store
 import datetime
 
 log = logging.getLogger(__name__)
 
+TIMING_STATS_INTERVAL = "PI_TIMING_STATS_INTERVAL"
+TIMING_STATS_TOP = "PI_TIMING_STATS_TOP"
+TIMING_STATS_KEY_PREFIX = "timing_"
+REQUEST_STATS_INTERVAL = "PI_REQUEST_STATS_INTERVAL"
+REQUEST_STATS_KEY_PREFIX = "request_"
+CONFIG_RELOAD_STATS_INTERVAL = "PI_CONFIG_RELOAD_STATS_INTERVAL"
+CONFIG_RELOAD_STATS_KEY_PREFIX = "config_reload_"
+
+# The timing of the functions and the request statistics, when they were
+# written the last time by this process
+_timing_flush = {"time": time.monotonic(), "totals": {}, "lock": threading.Lock()}
+_request_flush = {"time": time.monotonic(), "totals": {}, "lock": threading.Lock()}
+_config_reload_flush = {"time": time.monotonic(), "totals": {}, "lock": threading.Lock()}
+
 
 @log_with(log, log_entry=False)
 def _get_monitoring():
@@ -126,3 +145,144 @@ def get_last_value(stats_key):
     monitoring_obj = _get_monitoring()
     return monitoring_obj.get_last_value(stats_key)
 
+
+def write_timing_stats(force=False):
+    """
+    Write the mean duration of the functions, which took the most time since
+    the last call, to the statistics. The timing of the functions is recorded
+    by the ``log_with`` decorator, if ``PI_TIMING_STATS`` is enabled.
+
+    The timing is written at most every ``PI_TIMING_STATS_INTERVAL`` seconds
+    (default: 300, 0 disables writing) by each process. The stats keys are
+    the qualified names of the ``PI_TIMING_STATS_TOP`` (default: 20) functions
+    with the largest total duration in this interval prefixed with ``timing_``.
+    The values are the mean durations in microseconds.
+
+    :param force: Write the timing, even if the interval has not passed
+    :return: The number of written stats keys
+    """
+    if not is_timing_enabled() or not _start_flush(_timing_flush, TIMING_STATS_INTERVAL, force):
+        return 0
+    try:
+        totals = {name: (entry["count"], entry["total"])
+                  for name, entry in get_timing_stats().items()}
+        durations = []
+        for name, (count, total) in totals.items():
+            last_count, last_total = _timing_flush["totals"].get(name, (0, 0))
+            if count < last_count:
+                # The timing has been reset in the meantime
+                last_count, last_total = 0, 0
+            if count > last_count:
+                durations.append((total - last_total, count - last_count, name))
+        _timing_flush["totals"] = totals
+        durations.sort(reverse=True)
+        top = durations[:int(get_app_config_value(TIMING_STATS_TOP, 20))]
+        for total, count, name in top:
+            write_stats((TIMING_STATS_KEY_PREFIX + name)[:128], int(total * 1000 / count))
+        return len(top)
+    finally:
+        _timing_flush["lock"].release()
+
+
+def write_request_stats(force=False):
+    """
+    Write the mean time per request, which the requests since the last call
+    spent in the database, the resolvers, the cryptographic functions and the
+    policies, to the statistics. The time is recorded, if ``PI_REQUEST_STATS``
+    is enabled (see privacyidea.lib.requeststats).
+
+    The statistics are written at most every ``PI_REQUEST_STATS_INTERVAL``
+    seconds (default: 300, 0 disables writing) by each process. The stats keys
+    are ``request_db``, ``request_resolver``, ``request_crypto`` and
+    ``request_policy`` with the mean time in microseconds and
+    ``request_db_queries`` with the mean number of SQL statements per request.
+
+    :param force: Write the statistics, even if the interval has not passed
+    :return: The number of written stats keys
+    """
+    if not is_request_stats_enabled() or not _start_flush(_request_flush, REQUEST_STATS_INTERVAL, force):
+        return 0
+    try:
+        totals = get_request_stats_totals()
+        last = _request_flush["totals"]
+        if totals["requests"] < last.get("requests", 0):
+            last = {}
+        _request_flush["totals"] = totals
+        requests = totals["requests"] - last.get("requests", 0)
+        if not requests:
+            return 0
+        values = {}
+        for category in CATEGORIES:
+            count, total = totals[category]
+            last_count, last_total = last.get(category, (0, 0))
+            values[category] = int((total - last_total) / 1000 / requests)
+            if category == DB:
+                values[DB + "_queries"] = int(round((count - last_count) / requests))
+        for key, value in values.items():
+            write_stats(REQUEST_STATS_KEY_PREFIX + key, value)
+        return len(values)
+    finally:
+        _request_flush["lock"].release()
+
+
+def write_config_reload_stats(force=False):
+    """
+    Write the number of reloads of the shared configuration since the last
+    call, their mean duration and the number of reloads of each configuration
+    category to the statistics.
+
+    The statistics are written at most every ``PI_CONFIG_RELOAD_STATS_INTERVAL``
+    seconds (default: 0, which disables writing) by each process. The stats keys
+    are ``config_reload_count`` with the number of reloads,
+    ``config_reload_duration`` with the mean duration in microseconds and
+    ``config_reload_`` with the name of the category (like
+    ``config_reload_policy``) with the number of reloads of the category.
+
+    :param force: Write the statistics, even if the interval has not passed
+    :return: The number of written stats keys
+    """
+    if not _start_flush(_config_reload_flush, CONFIG_RELOAD_STATS_INTERVAL, force, default=0):
+        return 0
+    try:
+        totals = get_shared_config_object().get_reload_stats()
+        last = _config_reload_flush["totals"]
+        if totals["reload_count"] < last.get("reload_count", 0):
+            # The shared config object has been replaced in the meantime
+            last = {}
+        _config_reload_flush["totals"] = totals
+        reloads = totals["reload_count"] - last.get("reload_count", 0)
+        if not reloads:
+            return 0
+        values = {"count": reloads,
+                  "duration": int((totals["reload_duration"] - last.get("reload_duration", 0))
+                                  * 1000000 / reloads)}
+        last_categories = last.get("category_reload_count", {})
+        for category, count in totals["category_reload_count"].items():
+            values[category] = count - last_categories.get(category, 0)
+        for key, value in values.items():
+            write_stats(CONFIG_RELOAD_STATS_KEY_PREFIX + key, value)
+        return len(values)
+    finally:
+        _config_reload_flush["lock"].release()
+
+
+def _start_flush(flush, interval_key, force, default=300):
+    """
+    Check if the statistics of this process should be written. Only one
+    thread writes the statistics. If the statistics should be written, the
+    lock of the flush state is acquired and has to be released by the caller.
+
+    :param flush: The state of the last write
+    :param interval_key: The config key of the interval in seconds
+    :param force: Write the statistics, even if the interval has not passed
+    :param default: The interval, if it is not configured
+    :return: True, if the statistics should be written
+    """
+    interval = int(get_app_config_value(interval_key, default))
+    now = time.monotonic()
+    if not force and (not interval or now - flush["time"] < interval):
+        return False
+    if not flush["lock"].acquire(blocking=False):
+        return False
+    flush["time"] = now
+    return True
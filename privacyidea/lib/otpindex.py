@@ -0,0 +1,209 @@
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+import hmac
+import logging
+from hashlib import sha256
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from privacyidea.lib.config import get_app_config_value
+from privacyidea.lib.crypto import hash
+from privacyidea.lib.tokens.HMAC import HmacOtp
+from privacyidea.lib.utils import to_bytes
+from privacyidea.models import OTPIndex, db
+
+__doc__ = """The OTP index contains the upcoming OTP values of HOTP tokens. It is
+used to find the token, which creates a given OTP value, without calculating the
+OTP values of all tokens (see privacyidea.lib.token.get_token_by_otp).
+
+The index is disabled by default. It is enabled by setting the number of OTP
+values, which are stored per token, in pi.cfg::
+
+    PI_OTP_INDEX_SIZE = 100
+
+The OTP values are stored as HMAC-SHA256 hash values keyed with ``PI_PEPPER``.
+Each entry contains a fingerprint of the OTP key, the OTP length and the hash
+algorithm of the token, so that the entries of a token become invalid, if the
+token is changed.
+
+The index is not written while searching a token. It is built and refreshed by
+``pi-manage token update-otp-index`` or the task module ``OTPIndex``, which
+calculate the entries of all HOTP tokens, which are not covered by the index
+yet or whose counter has advanced so far, that the index does not cover the
+window anymore. Tokens, which are not covered by the index, are still checked by
+calculating their OTP values.
+
+This module is tested in tests/test_lib_otpindex.py"""
+
+log = logging.getLogger(__name__)
+
+OTP_INDEX_SIZE = "PI_OTP_INDEX_SIZE"
+# The OTP values of these token types only depend on the counter
+INDEXED_TOKENTYPES = ["hotp"]
+BULK_QUERY_SIZE = 500
+
+
+def get_otp_index_size():
+    """
+    :return: the number of OTP values, which are stored per token. 0 means,
+        that the OTP index is disabled.
+    :rtype: int
+    """
+    return int(get_app_config_value(OTP_INDEX_SIZE, 0))
+
+
+def _hash_otp(otp):
+    pepper = get_app_config_value("PI_PEPPER", "missing")
+    return hmac.new(to_bytes(pepper), to_bytes(otp), sha256).hexdigest()
+
+
+def _fingerprint(tokenobject):
+    db_token = tokenobject.token
+    # A new OTP key always gets a new random IV
+    return hash(db_token.key_iv, "{0!s}:{1!s}".format(db_token.otplen,
+                                                       tokenobject.hashlib))
+
+
+def _is_indexed(tokenobject):
+    return (tokenobject.get_tokentype() or "").lower() in INDEXED_TOKENTYPES
+
+
+def _get_index_ranges(token_ids):
+    """
+    Return the fingerprint and the first and last counter of the index entries
+    of the given tokens.
+
+    :param token_ids: list of token database IDs
+    :return: dictionary of the token ID and a tuple (fingerprint, first, last)
+    """
+    ranges = {}
+    for i in range(0, len(token_ids), BULK_QUERY_SIZE):
+        chunk = token_ids[i:i + BULK_QUERY_SIZE]
+        rows = db.session.query(OTPIndex.token_id, OTPIndex.fingerprint,
+                                func.min(OTPIndex.counter), func.max(OTPIndex.counter)) \
+            .filter(OTPIndex.token_id.in_(chunk)) \
+            .group_by(OTPIndex.token_id, OTPIndex.fingerprint)
+        for token_id, fingerprint, first, last in rows:
+            if token_id in ranges:
+                # entries with different fingerprints can not be used
+                ranges[token_id] = (None, 0, -1)
+            else:
+                ranges[token_id] = (fingerprint, first, last)
+    return ranges
+
+
+def _get_covered_tokens(indexed, window):
+    """
+    :param indexed: dictionary of the token ID and the token object
+    :param window: the look ahead window
+    :return: dictionary of the token ID and the current counter of the tokens,
+        whose index entries cover the window after their current counter
+    """
+    covered = {}
+    for token_id, (fingerprint, first, last) in _get_index_ranges(list(indexed)).items():
+        tokenobject = indexed[token_id]
+        count = tokenobject.token.count
+        if first <= count and count + window - 1 <= last \
+                and fingerprint == _fingerprint(tokenobject):
+            covered[token_id] = count
+    return covered
+
+
+def get_uncovered_tokens(token_list, window=10):
+    """
+    Return the HOTP tokens, whose index entries do not cover the window after
+    their current counter.
+
+    :param token_list: list of token objects
+    :param window: the look ahead window
+    :return: list of token objects
+    """
+    indexed = {tok.token.id: tok for tok in token_list if _is_indexed(tok)}
+    covered = _get_covered_tokens(indexed, window)
+    return [tok for token_id, tok in indexed.items() if token_id not in covered]
+
+
+def lookup_otp_index(token_list, otp, window=10):
+    """
+    Search the OTP value in the OTP index of the given tokens.
+
+    The tokens, whose index entries cover the window after their current
+    counter, are only returned as candidates, if the OTP value is contained in
+    this window. All other tokens are returned to be checked by calculating
+    their OTP values.
+
+    :param token_list: list of token objects
+    :param otp: the OTP value
+    :param window: the look ahead window
+    :return: tuple of the list of candidate tokens and the list of tokens,
+        which are not covered by the index
+    """
+    indexed = {tok.token.id: tok for tok in token_list if _is_indexed(tok)}
+    covered = _get_covered_tokens(indexed, window)
+    matching = set()
+    if covered:
+        for token_id, counter in db.session.query(OTPIndex.token_id, OTPIndex.counter) \
+                .filter(OTPIndex.otp_hash == _hash_otp(otp)):
+            count = covered.get(token_id)
+            if count is not None and count <= counter < count + window:
+                matching.add(token_id)
+    log.debug("The OTP index covers {0!s} of {1!s} tokens".format(len(covered), len(token_list)))
+    candidates = [tok for tok in token_list if tok.token.id in matching]
+    remaining = [tok for tok in token_list if tok.token.id not in covered]
+    return candidates, remaining
+
+
+def update_otp_index(token_list, size):
+    """
+    Calculate the index entries of the next ``size`` OTP values of the given
+    tokens. Existing entries of the tokens are replaced. Tokens of other types
+    than HOTP are ignored.
+
+    :param token_list: list of token objects
+    :param size: the number of OTP values per token
+    :return: the number of updated tokens
+    """
+    updated = 0
+    for tokenobject in token_list:
+        if not _is_indexed(tokenobject):
+            continue
+        db_token = tokenobject.token
+        try:
+            otplen = int(db_token.otplen)
+            count = int(db_token.count)
+            hmac_otp = HmacOtp(db_token.get_otpkey(), count, otplen,
+                               tokenobject.get_hashlib(tokenobject.hashlib))
+            values = hmac_otp.window_values(count, count + size)
+        except Exception as err:
+            log.warning("Error calculating the OTP index of token {0!s}: {1!s}".format(
+                db_token.serial, err))
+            continue
+        fingerprint = _fingerprint(tokenobject)
+        OTPIndex.query.filter(OTPIndex.token_id == db_token.id).delete()
+        db.session.add_all([OTPIndex(db_token.id, counter,
+                                     _hash_otp("{0:0{1}d}".format(value, otplen)), fingerprint)
+                            for counter, value in enumerate(values, count)])
+        updated += 1
+    try:
+        db.session.commit()
+    except IntegrityError as err:
+        # The index of a token was updated by another request in the meantime
+        db.session.rollback()
+        log.info("Could not update the OTP index: {0!s}".format(err))
+        return 0
+    return updated
+
@@ -30,13 +30,15 @@ from privacyidea.lib.error import ParameterError, ResourceNotFoundError
 from privacyidea.lib.utils import fetch_one_resource, parse_date
 from privacyidea.lib.task.eventcounter import EventCounterTask
 from privacyidea.lib.task.simplestats import SimpleStatsTask
+from privacyidea.lib.task.usercachecleanup import UserCacheCleanupTask
+from privacyidea.lib.task.otpindex import OTPIndexTask
 from privacyidea.models import PeriodicTask
 from privacyidea.lib.framework import get_app_config
 from privacyidea.lib.utils.export import (register_import, register_export)
 
 log = logging.getLogger(__name__)
 
-TASK_CLASSES = [EventCounterTask, SimpleStatsTask]
+TASK_CLASSES = [EventCounterTask, SimpleStatsTask, UserCacheCleanupTask, OTPIndexTask]
 #: TASK_MODULES maps task module identifiers to subclasses of BaseTask
 TASK_MODULES = dict((cls.identifier, cls) for cls in TASK_CLASSES)
 
@@ -176,6 +176,8 @@ from privacyidea.lib.config import (get_token_classes, get_token_types,
                                     get_multichallenge_enrollable_tokentypes,
                                     get_email_validators)
 from privacyidea.lib.error import ParameterError, PolicyError, ResourceNotFoundError, ServerError
+from privacyidea.lib.policyindex import PolicyIndex
+from privacyidea.lib.requeststats import request_timer, POLICY
 from privacyidea.lib.realm import get_realms
 from privacyidea.lib.resolver import get_resolver_list
 from privacyidea.lib.smtpserver import get_smtpservers
@@ -520,6 +522,24 @@ class PolicyClass(object):
         """
         return get_config_object().policies
 
+    @property
+    def policy_index(self):
+        """
+        The ``PolicyIndex`` of the set of policies of the request-local config object.
+        It is built by the shared config object whenever the policies are reloaded.
+        """
+        config_object = get_config_object()
+        index = config_object.policy_index
+        if index is None or index.policies is not config_object.policies:
+            index = config_object.policy_index = PolicyIndex(config_object.policies)
+        return index
+
+    @staticmethod
+    def _log_positions(index, positions, searchkey, searchvalue):
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Policies after matching {1!s}={2!s}: {0!s}".format(
+                [p.get("name") for p in index.get_policies(positions)], searchkey, searchvalue))
+
     @classmethod
     def _search_value(cls, policy_attributes, searchvalue):
         """
@@ -600,17 +620,16 @@ class PolicyClass(object):
         :return: list of policies
         :rtype: list of dicts
         """
-        reduced_policies = self.policies
+        index = self.policy_index
+        positions = index.all
 
         # Do exact matches for "name", "active" and "scope", as these fields
         # can only contain one entry
         p = [("name", name), ("active", active), ("scope", scope)]
         for searchkey, searchvalue in p:
             if searchvalue is not None:
-                reduced_policies = [policy for policy in reduced_policies if
-                                    policy.get(searchkey) == searchvalue]
-                log.debug("Policies after matching {1!s}={2!s}: {0!s}".format(
-                    reduced_policies, searchkey, searchvalue))
+                positions = positions & index.exact(searchkey, searchvalue)
+                self._log_positions(index, positions, searchkey, searchvalue)
 
         if additional_realms:
             if realm and realm not in additional_realms:
@@ -625,98 +644,49 @@ class PolicyClass(object):
             q.append(("adminuser", adminuser))
         for searchkey, searchvalue in p:
             if searchvalue is not None:
-                new_policies = []
-                # first we find policies, that really match!
+                # We find policies, that really match!
                 # Either with the real value or with a "*"
-                # values can be excluded by a leading "!" or "-"
-                for policy in reduced_policies:
-                    if not policy.get(searchkey):
-                        # We also find the policies with no distinct information
-                        # about the request value
-                        new_policies.append(policy)
-                    else:
-                        value_found, value_excluded = self._search_value(
-                            policy.get(searchkey), searchvalue)
-                        if value_found and not value_excluded:
-                            new_policies.append(policy)
-                reduced_policies = new_policies
-                log.debug("Policies after matching {1!s}={2!s}: {0!s}".format(
-                    reduced_policies, searchkey, searchvalue))
+                # values can be excluded by a leading "!" or "-".
+                # We also find the policies with no distinct information
+                # about the request value
+                positions = index.matching(searchkey, searchvalue, positions)
+                self._log_positions(index, positions, searchkey, searchvalue)
 
         for searchkey, searchvalue in q:
             if searchvalue is not None:
-                new_policies = []
-                # first we find policies, that really match!
-                # Either with the real value or with a "*"
-                # values can be excluded by a leading "!" or "-"
-                for policy in reduced_policies:
-                    if not policy.get(searchkey):
-                        # We also find the policies with no distinct information
-                        # about the request value
-                        new_policies.append(policy)
-                    else:
-                        searchkeys = policy.get(searchkey)
-                        current_searchvalue = searchvalue
-                        if policy.get("user_case_insensitive"):
-                            current_searchvalue = current_searchvalue.lower()
-                            searchkeys = [x.lower() for x in searchkeys]
-                        value_found, value_excluded = self._search_value(searchkeys, current_searchvalue)
-                        if value_found and not value_excluded:
-                            if searchkey == "user" and additional_realms and len(additional_realms) > 1 and realm:
-                                # we need to check if the policy is for the correct user realm
-                                if user in policy.get("user") and realm in policy.get("realm"):
-                                    new_policies.append(policy)
-                            else:
-                                new_policies.append(policy)
-                reduced_policies = new_policies
-                log.debug("Policies after matching {1!s}={2!s}: {0!s}".format(
-                    reduced_policies, searchkey, searchvalue))
+                positions = index.matching_user(searchkey, searchvalue, positions)
+                if searchkey == "user" and additional_realms and len(additional_realms) > 1 and realm:
+                    # we need to check if the policy is for the correct user realm
+                    positions = {position for position in positions
+                                 if not index.policies[position].get(searchkey)
+                                 or (user in index.policies[position].get("user")
+                                     and realm in index.policies[position].get("realm"))}
+                self._log_positions(index, positions, searchkey, searchvalue)
 
         # We need to act individually on the resolver key word
         # We either match the resolver exactly or we match another resolver (
         # which is not the first resolver) of the user, but only if the
         # check_all_resolvers flag in the policy is set.
         if resolver is not None:
-            new_policies = []
-            user_resolvers = []
-            for policy in reduced_policies:
-                if policy.get("check_all_resolvers"):
-                    if realm and user:
-                        # We have a realm and a user and can get all resolvers
-                        # of this user in the realm
-                        if not user_resolvers:
-                            user_resolvers = User(user,
-                                                  realm=realm).get_ordered_resolvers()
-                        for reso in user_resolvers:
-                            value_found, _v_ex = self._search_value(
-                                policy.get("resolver"), reso)
-                            if value_found:
-                                new_policies.append(policy)
-                                break
-                elif not policy.get("resolver"):
-                    # We also find the policies with no distinct information
-                    # about the request value
-                    new_policies.append(policy)
-                else:
-                    value_found, _v_ex = self._search_value(
-                        policy.get("resolver"), resolver)
-                    if value_found:
-                        new_policies.append(policy)
-
-            reduced_policies = new_policies
-            log.debug("Policies after matching resolver={1!s}: {0!s}".format(
-                reduced_policies, resolver))
+            check_all_resolvers = positions & index.check_all_resolvers
+            new_positions = index.matching("resolver", resolver, positions - check_all_resolvers,
+                                           use_excluded=False)
+            if check_all_resolvers and realm and user:
+                # We have a realm and a user and can get all resolvers
+                # of this user in the realm
+                user_resolvers = User(user, realm=realm).get_ordered_resolvers()
+                for reso in user_resolvers:
+                    new_positions |= index.found("resolver", reso, check_all_resolvers)
+            positions = new_positions
+            self._log_positions(index, positions, "resolver", resolver)
 
         # Match the privacyIDEA node
         if pinode is not None:
-            new_policies = []
-            for policy in reduced_policies:
-                # The policy either matches if it has no pinode defined or if the pinode is contained in the list
-                if not policy.get("pinode") or pinode in policy.get("pinode"):
-                    new_policies.append(policy)
+            # The policy either matches if it has no pinode defined or if the pinode is contained in the list
+            positions = index.matching_pinode(pinode, positions)
+            self._log_positions(index, positions, "pinode", pinode)
 
-            reduced_policies = new_policies
-            log.debug("Policies after matching pinode={1!s}: {0!s}".format(reduced_policies, pinode))
+        reduced_policies = index.get_policies(positions)
 
         # Match the client IP.
         # Client IPs may be direct match, may be located in subnets or may
@@ -755,6 +725,7 @@ class PolicyClass(object):
         return reduced_policies
 
     @log_with(log)
+    @request_timer(POLICY)
     def match_policies(self, name=None, scope=None, realm=None, active=None,
                        resolver=None, user=None, user_object=None, pinode=None,
                        client=None, action=None, adminrealm=None, adminuser=None, time=None,
@@ -1469,7 +1440,7 @@ def set_policy(name=None, scope=None, action=None, realm=None, resolver=None,
         p1.user_case_insensitive = user_case_insensitive
         if conditions is not None:
             p1.set_conditions(conditions)
-        save_config_timestamp()
+        save_config_timestamp(category="policy")
         db.session.commit()
         ret = p1.id
     else:
@@ -0,0 +1,231 @@
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+"""
+The policy index is an immutable lookup structure, which is built once for a
+list of policy dictionaries (as returned by ``Policy.get()``).
+
+``PolicyClass.list_policies`` uses it to reduce the set of policies by set
+operations on policy positions instead of scanning all policies for each
+filter argument. The matching semantics are exactly those of
+``PolicyClass._search_value``:
+
+ * a value ``*`` matches every search value,
+ * a value with a leading ``!`` or ``-`` excludes the remaining value,
+ * all other values are matched exactly or as a regular expression
+   ``^<value>$``.
+
+The regular expressions are compiled once when the index is built.
+
+The code is tested in tests/test_lib_policyindex.py
+"""
+import re
+
+# Characters which turn a policy value into a regular expression
+REGEX_CHARACTERS = frozenset(".^$*+?{}[]\\|()")
+
+
+class AttributeIndex(object):
+    """
+    Index of a single list-valued policy attribute like ``realm``, ``user``
+    or ``action``.
+    """
+
+    def __init__(self, policies, key, lower=None):
+        """
+        :param policies: list of policy dictionaries
+        :param key: the policy attribute to index
+        :param lower: an optional callable which decides per policy, if the
+            values of the attribute are matched case insensitive.
+        """
+        # Positions of the policies, that do not restrict this attribute
+        self.unrestricted = set()
+        # All values mapped to the positions of the policies, which contain them
+        self.exact = {}
+        # Excluded values (without the leading "!" or "-") mapped to the positions
+        self.excluded = {}
+        # Compiled regular expressions mapped to the positions
+        self.regex = {}
+        for position, policy in enumerate(policies):
+            values = policy.get(key)
+            if not values:
+                self.unrestricted.add(position)
+                continue
+            if lower and lower(policy):
+                values = [value.lower() for value in values]
+            for value in values:
+                self.exact.setdefault(value, set()).add(position)
+                if value and value[0] in ["!", "-"]:
+                    self.excluded.setdefault(value[1:], set()).add(position)
+                if value != "*" and REGEX_CHARACTERS.intersection(value):
+                    self.regex.setdefault(value, set()).add(position)
+        self._patterns = []
+        for value, positions in self.regex.items():
+            try:
+                pattern = re.compile("^{0!s}$".format(value))
+            except re.error:
+                # Keep the raw value, so that matching raises the same
+                # error as the unindexed search.
+                pattern = value
+            self._patterns.append((value, pattern, positions))
+
+    def found(self, searchvalue, candidates):
+        """
+        Return the positions of all candidate policies with a value matching
+        the searchvalue. The searchvalue may be a string or a list of strings.
+
+        :param searchvalue: the value to search for
+        :param candidates: set of positions of the policies to consider
+        :return: set of positions
+        """
+        found = set(self.exact.get("*", ()))
+        if isinstance(searchvalue, list):
+            # The list items are only compared for equality, they may even be unhashable
+            for value, positions in self.exact.items():
+                if value in searchvalue:
+                    found.update(positions)
+            return found & candidates
+        found.update(self.exact.get(searchvalue, ()))
+        if searchvalue.endswith("\n"):
+            # "$" also matches before a trailing newline
+            value = searchvalue[:-1]
+            if not REGEX_CHARACTERS.intersection(value):
+                found.update(self.exact.get(value, ()))
+        found &= candidates
+        for value, pattern, positions in self._patterns:
+            positions = positions & candidates
+            if not positions or value == searchvalue:
+                continue
+            if value[0] in ["!", "-"] and value[1:] == searchvalue:
+                # This value excludes the searchvalue
+                continue
+            if isinstance(pattern, str):
+                # An invalid regular expression raises an error, as before
+                match = re.search("^{0!s}$".format(pattern), searchvalue)
+            elif positions.issubset(found):
+                continue
+            else:
+                match = pattern.search(searchvalue)
+            if match:
+                found.update(positions)
+        return found
+
+    def matching(self, searchvalue, candidates, use_excluded=True):
+        """
+        Return the positions of all candidate policies, that either do not
+        restrict this attribute or contain a value matching the searchvalue
+        (which is not excluded, if ``use_excluded`` is set).
+
+        :return: set of positions
+        """
+        found = self.found(searchvalue, candidates)
+        if use_excluded and not isinstance(searchvalue, list):
+            found.difference_update(self.excluded.get(searchvalue, ()))
+        return found | (self.unrestricted & candidates)
+
+
+class PolicyIndex(object):
+    """
+    Immutable index of a list of policies. The policies themselves are
+    referenced by their position in the list.
+    """
+
+    def __init__(self, policies):
+        """
+        :param policies: list of policy dictionaries
+        """
+        self.policies = policies
+        self.all = frozenset(range(len(policies)))
+        self.name = {}
+        self.active = {}
+        self.scope = {}
+        self.pinode = {}
+        self.pinode_unrestricted = set()
+        self.check_all_resolvers = set()
+        self.case_insensitive = set()
+        for position, policy in enumerate(policies):
+            self.name.setdefault(policy.get("name"), set()).add(position)
+            self.active.setdefault(policy.get("active"), set()).add(position)
+            self.scope.setdefault(policy.get("scope"), set()).add(position)
+            if policy.get("pinode"):
+                for pinode in policy.get("pinode"):
+                    self.pinode.setdefault(pinode, set()).add(position)
+            else:
+                self.pinode_unrestricted.add(position)
+            if policy.get("check_all_resolvers"):
+                self.check_all_resolvers.add(position)
+            if policy.get("user_case_insensitive"):
+                self.case_insensitive.add(position)
+
+        def lower(policy):
+            return policy.get("user_case_insensitive")
+
+        self.attributes = {"action": AttributeIndex(policies, "action"),
+                           "realm": AttributeIndex(policies, "realm"),
+                           "adminrealm": AttributeIndex(policies, "adminrealm"),
+                           "resolver": AttributeIndex(policies, "resolver"),
+                           "user": AttributeIndex(policies, "user", lower),
+                           "adminuser": AttributeIndex(policies, "adminuser", lower)}
+
+    def exact(self, key, value):
+        """
+        Return the positions of the policies, whose attribute ``key`` is
+        exactly ``value``. This is used for "name", "active" and "scope".
+        """
+        return getattr(self, key).get(value, set())
+
+    def found(self, key, searchvalue, candidates):
+        """
+        Return the positions of the candidate policies, which contain a value
+        matching the searchvalue in the list-valued attribute ``key``.
+        Excluded values and policies without the attribute are not considered.
+        """
+        return self.attributes[key].found(searchvalue, candidates)
+
+    def matching(self, key, searchvalue, candidates, use_excluded=True):
+        """
+        Return the positions of the candidate policies matching the
+        searchvalue in the list-valued attribute ``key``.
+        """
+        return self.attributes[key].matching(searchvalue, candidates, use_excluded=use_excluded)
+
+    def matching_user(self, key, searchvalue, candidates):
+        """
+        Return the positions of the candidate policies matching the user
+        (or adminuser). Policies with ``user_case_insensitive`` were indexed
+        with lower case values and are matched against the lower case
+        searchvalue.
+        """
+        insensitive = (self.case_insensitive & candidates) - self.attributes[key].unrestricted
+        if not insensitive:
+            return self.matching(key, searchvalue, candidates)
+        lowered = searchvalue.lower()
+        if lowered == searchvalue:
+            return self.matching(key, searchvalue, candidates)
+        return (self.matching(key, searchvalue, candidates - insensitive)
+                | self.matching(key, lowered, insensitive))
+
+    def matching_pinode(self, pinode, candidates):
+        """
+        Return the positions of the candidate policies, which either have no
+        pinode or contain the given pinode.
+        """
+        return (self.pinode.get(pinode, set()) | self.pinode_unrestricted) & candidates
+
+    def get_policies(self, positions):
+        """
+        Return the policies at the given positions in their original order
+        """
+        return [self.policies[position] for position in sorted(positions)]
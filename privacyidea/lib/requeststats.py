@@ -0,0 +1,226 @@
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+import functools
+import json
+import threading
+from time import perf_counter_ns
+
+from flask import has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from privacyidea.lib.framework import get_request_local_store
+
+__doc__ = """The request statistics record, how much time a request spent in the
+database, in the user resolvers, in the cryptographic functions and in the
+evaluation of the policies.
+
+The statistics are disabled by default. They are enabled in pi.cfg::
+
+    PI_REQUEST_STATS = True
+
+Then the statistics of each request are written to the column "performance"
+of the audit entry as a JSON object like::
+
+    {"db": [12, 3.52], "resolver": [2, 10.17], "crypto": [4, 0.31], "policy": [9, 1.02]}
+
+Each category contains the number of calls (or SQL statements) and the time in
+milliseconds. Nested calls of the same category are only counted once. The
+categories can overlap, e.g. the queries of an SQL resolver are also counted as
+database time and a policy may read the attributes of a user from a resolver.
+
+The totals of all requests of a process are written to the monitoring
+statistics (see privacyidea.lib.monitoringstats.write_request_stats).
+
+This module is tested in tests/test_lib_requeststats.py"""
+
+REQUEST_STATS = "PI_REQUEST_STATS"
+
+DB = "db"
+RESOLVER = "resolver"
+CRYPTO = "crypto"
+POLICY = "policy"
+CATEGORIES = [DB, RESOLVER, CRYPTO, POLICY]
+
+# The key of the statistics in the request local store
+_STORE_KEY = "request_stats"
+# The key of the start times of the statements in the connection info
+_QUERY_START = "pi_query_start"
+
+# If the statistics are disabled, the timers only check this flag.
+_enabled = False
+# The totals of all finished requests of this process
+_totals = {"requests": 0}
+_totals.update({category: [0, 0] for category in CATEGORIES})
+_totals_lock = threading.Lock()
+
+
+def _get_stats():
+    """
+    :return: the statistics of the current request or None, if the current
+        request does not record statistics
+    """
+    if not has_app_context():
+        return None
+    return get_request_local_store().get(_STORE_KEY)
+
+
+def _add(category, duration):
+    stats = _get_stats()
+    if stats is not None:
+        entry = stats[category]
+        entry[0] += 1
+        entry[1] += duration
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault(_QUERY_START, []).append(perf_counter_ns())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get(_QUERY_START)
+    if starts:
+        _add(DB, perf_counter_ns() - starts.pop())
+
+
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None:
+        starts = connection.info.get(_QUERY_START)
+        if starts:
+            _add(DB, perf_counter_ns() - starts.pop())
+
+
+_ENGINE_EVENTS = [("before_cursor_execute", _before_cursor_execute),
+                  ("after_cursor_execute", _after_cursor_execute),
+                  ("handle_error", _handle_error)]
+
+
+def enable_request_stats(enabled=True):
+    """
+    Enable or disable the request statistics. The SQL statements are timed
+    by event listeners on all database engines, which are only registered,
+    while the statistics are enabled.
+
+    :param enabled: Whether the statistics should be recorded
+    :type enabled: bool
+    """
+    global _enabled
+    _enabled = bool(enabled)
+    for name, listener in _ENGINE_EVENTS:
+        if _enabled and not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+        elif not _enabled and event.contains(Engine, name, listener):
+            event.remove(Engine, name, listener)
+
+
+def is_request_stats_enabled():
+    return _enabled
+
+
+def start_request_stats():
+    """
+    Start recording the statistics of the current request.
+    """
+    if _enabled:
+        # count, total duration in nanoseconds, nesting depth, start
+        get_request_local_store()[_STORE_KEY] = {category: [0, 0, 0, 0]
+                                                 for category in CATEGORIES}
+
+
+def end_request_stats():
+    """
+    Stop recording the statistics of the current request and add them to the
+    totals of this process.
+
+    :return: the statistics of the request as JSON string or None, if the
+        request did not record statistics
+    :rtype: str
+    """
+    if not has_app_context():
+        return None
+    stats = get_request_local_store().pop(_STORE_KEY, None)
+    if stats is None:
+        return None
+    with _totals_lock:
+        _totals["requests"] += 1
+        for category in CATEGORIES:
+            _totals[category][0] += stats[category][0]
+            _totals[category][1] += stats[category][1]
+    return json.dumps({category: [stats[category][0], round(stats[category][1] / 1e6, 2)]
+                       for category in CATEGORIES}, separators=(",", ":"))
+
+
+def get_request_stats_totals():
+    """
+    :return: the number of finished requests of this process with the key
+        "requests" and for each category a list of the number of calls and the
+        total duration in nanoseconds
+    :rtype: dict
+    """
+    with _totals_lock:
+        totals = {category: list(_totals[category]) for category in CATEGORIES}
+        totals["requests"] = _totals["requests"]
+    return totals
+
+
+class request_timer(object):
+    """
+    Add the time of a block or of the calls of a function to a category of the
+    statistics of the current request. It can be used as a context manager::
+
+        with request_timer(RESOLVER):
+            uid = y.getUserId(login)
+
+    or as a decorator::
+
+        @request_timer(CRYPTO)
+        def pass_hash(password):
+            ...
+    """
+
+    def __init__(self, category):
+        self.category = category
+
+    def __enter__(self):
+        if _enabled:
+            stats = _get_stats()
+            if stats is not None:
+                entry = stats[self.category]
+                if not entry[2]:
+                    entry[0] += 1
+                    entry[3] = perf_counter_ns()
+                entry[2] += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if _enabled:
+            stats = _get_stats()
+            if stats is not None:
+                entry = stats[self.category]
+                if entry[2]:
+                    entry[2] -= 1
+                    if not entry[2]:
+                        entry[1] += perf_counter_ns() - entry[3]
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def timer_wrapper(*args, **kwds):
+            if not _enabled:
+                return func(*args, **kwds)
+            with self:
+                return func(*args, **kwds)
+
+        return timer_wrapper
@@ -44,11 +44,13 @@ webservice!
 """
 
 import logging
+import threading
 
 from .log import log_with
 from .config import (get_resolver_types, get_resolver_classes, get_config_object)
 from privacyidea.lib.usercache import delete_user_cache
-from privacyidea.lib.framework import get_request_local_store
+from privacyidea.lib.framework import get_request_local_store, get_app_local_store
+from privacyidea.lib.lifecycle import register_finalizer
 from ..models import (Resolver,
                       ResolverConfig)
 from ..api.lib.utils import required
@@ -231,6 +233,10 @@ def delete_resolver(resolvername):
     if 'resolver_objects' in store:
         if resolvername in store['resolver_objects']:
             del store['resolver_objects'][resolvername]
+    app_store = get_app_local_store()
+    app_store.get('shared_resolver_objects', {}).pop(resolvername, None)
+    if 'thread_resolver_objects' in app_store:
+        getattr(app_store['thread_resolver_objects'], 'resolver_objects', {}).pop(resolvername, None)
 
     # Remove corresponding entries from the user cache
     delete_user_cache(resolver=resolvername)
@@ -316,6 +322,11 @@ def get_resolver_object(resolvername):
     Return the cached resolver object for the given resolver name (stored in the request context).
     If no resolver object is cached, create it and add it to the cache.
 
+    Resolver objects are reused by later requests, as long as the configuration
+    of the resolver does not change (see :func:`_get_shared_resolver_objects`).
+    The ``close`` method of the resolver object is called at the end of each
+    request.
+
     :param resolvername: the resolver string as from the token including
                          the config as last part
     :return: instance of the resolver with the loaded config
@@ -333,13 +344,45 @@ def get_resolver_object(resolvername):
             store['resolver_objects'] = {}
         resolver_objects = store['resolver_objects']
         if resolvername not in resolver_objects:
-            # create the resolver instance and load the config
-            r_obj = resolver_objects[resolvername] = r_obj_class()
-            if r_obj is not None:
-                resolver_config = get_resolver_config(resolvername)
+            resolver_config = get_resolver_config(resolvername)
+            shared_objects = _get_shared_resolver_objects(r_obj_class)
+            # The shared config object only creates a new configuration
+            # dictionary, if the definition of the resolver changed.
+            config_and_object = shared_objects.get(resolvername)
+            if config_and_object and config_and_object[0] is resolver_config \
+                    and not config_and_object[1].is_outdated():
+                r_obj = config_and_object[1]
+            else:
+                # create the resolver instance and load the config
+                r_obj = r_obj_class()
                 r_obj.loadConfig(resolver_config)
+                shared_objects[resolvername] = (resolver_config, r_obj)
+            resolver_objects[resolvername] = r_obj
+            register_finalizer(r_obj.close)
         return resolver_objects[resolvername]
 
+
+def _get_shared_resolver_objects(r_obj_class):
+    """
+    Return the dictionary of resolver objects, which are reused by the following
+    requests, so that the configuration does not need to be loaded again.
+    Thread-safe resolver objects are shared by all threads of the process,
+    other resolver objects are only shared by the requests of one thread.
+
+    :param r_obj_class: the resolver class
+    :return: dictionary of resolver names and tuples of the resolver configuration
+        and the resolver object
+    """
+    store = get_app_local_store()
+    if r_obj_class.thread_safe:
+        return store.setdefault('shared_resolver_objects', {})
+    if 'thread_resolver_objects' not in store:
+        store.setdefault('thread_resolver_objects', threading.local())
+    thread_objects = store['thread_resolver_objects']
+    if not hasattr(thread_objects, 'resolver_objects'):
+        thread_objects.resolver_objects = {}
+    return thread_objects.resolver_objects
+
 @log_with(log)
 def pretestresolver(resolvertype, params):
     """
@@ -51,6 +51,9 @@ class HTTPResolver(UserIdResolver):
         "errorResponse": 0
     }
 
+    # Each request to the endpoint only uses the loaded configuration
+    thread_safe = True
+
     def __init__(self):
         super(HTTPResolver, self).__init__()
         self.config = {}
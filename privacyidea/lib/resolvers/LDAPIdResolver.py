@@ -62,13 +62,15 @@ import logging
 import yaml
 import threading
 import functools
+import time
+from collections import deque
 
 from .UserIdResolver import UserIdResolver
 
 import ldap3
 from ldap3 import MODIFY_REPLACE, MODIFY_ADD, MODIFY_DELETE
 from ldap3 import Tls
-from ldap3.core.exceptions import LDAPOperationResult
+from ldap3.core.exceptions import LDAPOperationResult, LDAPCommunicationError
 from ldap3.core.results import RESULT_SIZE_LIMIT_EXCEEDED
 import ssl
 
@@ -79,6 +81,8 @@ from passlib.hash import ldap_salted_sha1
 import hashlib
 import binascii
 from privacyidea.lib.framework import get_app_local_store, get_app_config_value
+from privacyidea.lib.lifecycle import register_finalizer
+from privacyidea.lib.lrucache import LRUCache, SQLiteCache, LayeredCache, CacheStats, MISSING
 import datetime
 
 from privacyidea.lib import _
@@ -87,7 +91,7 @@ from privacyidea.lib.utils import (is_true, to_bytes, to_unicode,
                                    convert_column_to_unicode)
 from privacyidea.lib.error import privacyIDEAError, ResolverError
 import uuid
-from ldap3.utils.conv import escape_bytes
+from ldap3.utils.conv import escape_bytes, escape_filter_chars
 from operator import itemgetter
 
 log = logging.getLogger(__name__)
@@ -99,7 +103,9 @@ except ImportError:
     log.info('Could not import gssapi package. Kerberos authentication not available')
     have_gssapi = False
 
-CACHE = {}
+# The cache of the user lookups, see get_user_cache()
+CACHE = None
+CACHE_LOCK = threading.Lock()
 
 ENCODING = "utf-8"
 # The number of rounds the resolver tries to reach a responding server in the
@@ -110,6 +116,8 @@ SERVERPOOL_SKIP = 30
 # The pooling strategy for the ldap servers
 LDAP_STRATEGY = {"ROUND_ROBIN": ldap3.ROUND_ROBIN, "FIRST": ldap3.FIRST, "RANDOM": ldap3.RANDOM}
 SERVERPOOL_STRATEGY = "ROUND_ROBIN"
+# The maximum number of users, which are searched with one filter
+BULK_SEARCH_SIZE = 100
 
 # 1 sec == 10^9 nano secs == 10^7 * (100 nano secs)
 MS_AD_MULTIPLYER = 10 ** 7
@@ -158,6 +166,88 @@ class LockingServerPool(ldap3.ServerPool):
             return ldap3.ServerPool.get_current_server(self, connection)
 
 
+class LDAPConnectionPool(object):
+    """
+    A per-process pool of bound service connections of one LDAP resolver
+    configuration.
+
+    A connection is only used by one request at a time. The request takes an
+    idle connection with ``acquire`` and returns it with ``release`` at the end
+    of the request. At most ``max_size`` idle connections are kept. Connections,
+    which have been idle for more than ``idle_timeout`` seconds or which are not
+    bound anymore, are closed.
+    """
+
+    def __init__(self, max_size=10, idle_timeout=60, clock=time.monotonic):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.pid = os.getpid()
+        # (connection, time of release), the most recently released connection is on the right
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self.stats = {"created": 0, "reused": 0, "closed": 0}
+
+    @staticmethod
+    def is_usable(connection):
+        """
+        Check, if a connection is still bound and open
+        """
+        return connection.bound and not getattr(connection, "closed", False)
+
+    def __len__(self):
+        return len(self._idle)
+
+    def acquire(self):
+        """
+        Return a bound idle connection or None, if there is no such connection
+        """
+        stale = []
+        connection = None
+        with self._lock:
+            # Remove the connections, which have been idle for too long
+            while self._idle and self.clock() - self._idle[0][1] >= self.idle_timeout:
+                stale.append(self._idle.popleft()[0])
+            while self._idle:
+                candidate = self._idle.pop()[0]
+                if self.is_usable(candidate):
+                    connection = candidate
+                    self.stats["reused"] += 1
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            self._close(candidate)
+        return connection
+
+    def release(self, connection):
+        """
+        Return a connection to the pool or close it, if the pool is full
+        """
+        if self.is_usable(connection):
+            with self._lock:
+                if len(self._idle) < self.max_size:
+                    self._idle.append((connection, self.clock()))
+                    return
+        self._close(connection)
+
+    def _close(self, connection):
+        self.stats["closed"] += 1
+        try:
+            connection.unbind()
+        except Exception as exx:  # pragma: no cover
+            log.debug("Could not unbind the pooled connection: {0!r}".format(exx))
+
+    def clear(self):
+        """
+        Close all idle connections
+        """
+        with self._lock:
+            connections = [connection for connection, _released in self._idle]
+            self._idle.clear()
+        for connection in connections:
+            self._close(connection)
+
+
 def get_ad_timestamp_now():
     """
     returns the current UTC time as it is used in Active Directory in the
@@ -232,56 +322,76 @@ def ignore_sizelimit_exception(conn, generator):
                 raise
 
 
+def get_user_cache():
+    """
+    Return the cache for the LDAP user lookups of this process.
+
+    The cache is configured in ``pi.cfg``:
+
+    * ``PI_LDAP_CACHE_MAX_ENTRIES``: the maximum number of entries in the
+      cache of each process (default: 10000).
+    * ``PI_LDAP_CACHE_FILE``: if set, the entries are also stored in this
+      SQLite file, which is shared by all processes of the node.
+    * ``PI_LDAP_CACHE_SHARED_MAX_ENTRIES``: the maximum number of entries in
+      the shared cache (default: 100000).
+
+    :rtype: LRUCache or LayeredCache
+    """
+    global CACHE
+    if CACHE is None:
+        with CACHE_LOCK:
+            if CACHE is None:
+                user_cache = LRUCache(int(get_app_config_value("PI_LDAP_CACHE_MAX_ENTRIES", 10000)))
+                cache_file = get_app_config_value("PI_LDAP_CACHE_FILE")
+                if cache_file:
+                    shared = SQLiteCache(cache_file,
+                                         int(get_app_config_value("PI_LDAP_CACHE_SHARED_MAX_ENTRIES", 100000)))
+                    user_cache = LayeredCache(user_cache, shared)
+                CACHE = user_cache
+    return CACHE
+
+
+def get_user_cache_stats():
+    """
+    Return the hits, misses, evictions and expirations of the LDAP user cache
+    of this process.
+
+    :rtype: dict
+    """
+    if CACHE is None:
+        return CacheStats().as_dict()
+    return CACHE.stats.as_dict()
+
+
 def cache(func):
     """
-    cache the user with his loginname, resolver and UID in a local
-    dictionary cache.
-    This is a per process cache.
+    cache the user with his loginname, resolver and UID in the LDAP user
+    cache (see :func:`get_user_cache`).
+
+    Results for unknown users are cached as well. Their time to live can be
+    reduced with ``PI_LDAP_CACHE_NEGATIVE_TIMEOUT`` in ``pi.cfg``. A value of
+    ``0`` disables caching unknown users.
     """
     @functools.wraps(func)
     def cache_wrapper(self, *args, **kwds):
         # Only run the code, in case we have a configured cache!
         if self.cache_timeout > 0:
-            # If it does not exist, create the node for this instance
-            resolver_id = self.getResolverId()
-            now = datetime.datetime.now(tz=datetime.timezone.utc)
-            tdelta = datetime.timedelta(seconds=self.cache_timeout)
-            if resolver_id not in CACHE:
-                CACHE[resolver_id] = {"getUserId": {},
-                                      "getUserInfo": {},
-                                      "_getDN": {}}
-            else:
-                # Clean up the cache in the current resolver and the current function
-                _to_be_deleted = []
-                try:
-                    for user, cached_result in CACHE[resolver_id].get(func.__name__).items():
-                        if now > cached_result.get("timestamp") + tdelta:
-                            _to_be_deleted.append(user)
-                except RuntimeError:
-                    # This might happen if thread A evicts an expired
-                    # cache entry while thread B looks for expired cache entries
-                    pass
-                for user in _to_be_deleted:
-                    try:
-                        del CACHE[resolver_id][func.__name__][user]
-                    except KeyError:
-                        pass
-                del _to_be_deleted
-
-            # get the portion of the cache for this very LDAP resolver
-            r_cache = CACHE.get(resolver_id).get(func.__name__)
-            entry = r_cache.get(args[0])
-            if entry and now < entry.get("timestamp") + tdelta:
+            key = (self.getResolverId(), func.__name__, args[0])
+            user_cache = get_user_cache()
+            value = user_cache.get(key)
+            if value is not MISSING:
                 log.debug("Reading {0!r} from cache for {1!r}".format(args[0], func.__name__))
-                return entry.get("value")
+                return value
 
         f_result = func(self, *args, **kwds)
 
         if self.cache_timeout > 0:
             # now we cache the result
-            CACHE[resolver_id][func.__name__][args[0]] = {
-                "value": f_result,
-                "timestamp": now}
+            ttl = self.cache_timeout
+            if not f_result:
+                ttl = min(ttl, int(get_app_config_value("PI_LDAP_CACHE_NEGATIVE_TIMEOUT", ttl)))
+            if ttl > 0:
+                user_cache.set(key, f_result, ttl)
 
         return f_result
 
@@ -327,6 +437,8 @@ class IdResolver(UserIdResolver):
         self.serverpool_strategy = SERVERPOOL_STRATEGY
         self.serverpool = None
         self.keytabfile = None
+        # The connection pool, to which the current connection is returned
+        self.connection_pool = None
         # The number of seconds that ldap3 waits if no server is left in the pool, before
         # starting the next round
         pooling_loop_timeout = get_app_config_value("PI_LDAP_POOLING_LOOP_TIMEOUT", 10)
@@ -487,6 +599,18 @@ class IdResolver(UserIdResolver):
             user_id = trim_objectGUID(user_id)
         return user_id
 
+    def _escape_user_id(self, user_id):
+        """
+        Return the userId for a search filter. The objectGUID is already
+        escaped by :meth:`_trim_user_id`, the other userIds are escaped here.
+
+        :param user_id: The userId
+        :return: the escaped userId
+        """
+        if self.uidtype == "objectGUID":
+            return to_unicode(self._trim_user_id(user_id))
+        return escape_filter_chars(to_unicode(user_id))
+
     @cache
     def _getDN(self, user_id):
         """
@@ -518,8 +642,20 @@ class IdResolver(UserIdResolver):
         """
         Perform LDAP bind operation on a connection.
         Create the connection if it doesn't exist yet
+
+        If ``PI_LDAP_CONNECTION_POOL_SIZE`` is set in the pi.cfg, a bound
+        connection of the per-process connection pool is used. The connection
+        is returned to the pool at the end of the request.
         """
         if not self.i_am_bound:
+            connection_pool = self.get_connection_pool()
+            if connection_pool is not None:
+                connection = connection_pool.acquire()
+                if connection:
+                    log.debug("Reusing a bound connection of the connection pool.")
+                    self.connection = connection
+                    self._use_connection_pool(connection_pool)
+                    return
             if not self.serverpool:
                 self.serverpool = self.get_serverpool_instance(self.get_info)
             try:
@@ -542,14 +678,66 @@ class IdResolver(UserIdResolver):
                           f"{result.get('description')} ({result.get('result')})!")
                 raise ResolverError(f"Unable to perform bind operation: "
                                     f"{result.get('description')} ({result.get('result')})")
+            if connection_pool is not None:
+                connection_pool.stats["created"] += 1
+                self._use_connection_pool(connection_pool)
             self.i_am_bound = True
 
+    def _use_connection_pool(self, connection_pool):
+        """
+        Return the current connection to the connection pool at the end of the
+        request
+        """
+        self.connection_pool = connection_pool
+        self.i_am_bound = True
+        register_finalizer(self._release_connection)
+
+    def _release_connection(self):
+        """
+        Return the current connection to the connection pool
+        """
+        if self.connection_pool is not None:
+            self.connection_pool.release(self.connection)
+            self.connection_pool = None
+            self.i_am_bound = False
+
+    def close(self):
+        """
+        Return the connection to the connection pool or unbind it at the end of
+        the request. The resolver object may be used in the next request of this
+        thread.
+        """
+        if self.connection_pool is not None:
+            self._release_connection()
+        elif self.i_am_bound:
+            self.i_am_bound = False
+            try:
+                self.connection.unbind()
+            except Exception as exx:  # pragma: no cover
+                log.debug(f"Could not unbind the connection: {exx!r}")
+
     def _search(self, search_base, search_filter, attributes):
         self._bind()
-        self.connection.search(search_base=search_base,
-                               search_scope=self.scope,
-                               search_filter=search_filter,
-                               attributes=attributes)
+        try:
+            self.connection.search(search_base=search_base,
+                                   search_scope=self.scope,
+                                   search_filter=search_filter,
+                                   attributes=attributes)
+        except LDAPCommunicationError as exx:
+            connection_pool = self.connection_pool
+            if connection_pool is None:
+                raise
+            # The pooled connection may have been closed by the server in the
+            # meantime. Most likely this also happened to the other idle connections.
+            log.info(f"Pooled LDAP connection failed, creating a new connection: {exx!r}")
+            self.connection_pool = None
+            self.i_am_bound = False
+            connection_pool.clear()
+            self._bind()
+            self.connection.search(search_base=search_base,
+                                   search_scope=self.scope,
+                                   search_filter=search_filter,
+                                   attributes=attributes)
         result = self.connection.response
         result = self._trim_result(result)
         log.debug(f"LDAP search operation took {self.connection.usage.elapsed_time}")
@@ -614,6 +802,65 @@ class IdResolver(UserIdResolver):
 
         return user_info
 
+    def getUserInfoMany(self, user_ids):
+        """
+        This function returns the user info of several users. The users,
+        which are not in the user cache, are searched with a filter like
+        ``(|(uid=...)(uid=...))`` for at most ``BULK_SEARCH_SIZE`` users.
+        The results are added to the user cache.
+
+        :param user_ids: The userids of the objects
+        :type user_ids: list
+        :return: A dictionary of the userids and the user info
+        :rtype: dict
+        """
+        user_infos = {}
+        missing = []
+        use_cache = self.cache_timeout > 0
+        user_cache = get_user_cache() if use_cache else None
+        for user_id in dict.fromkeys(user_ids):
+            if use_cache:
+                value = user_cache.get((self.getResolverId(), "getUserInfo", user_id))
+                if value is not MISSING:
+                    user_infos[user_id] = value
+                    continue
+            missing.append(user_id)
+
+        if self.uidtype.lower() == "dn":
+            # The DN is the search base, so each user needs its own search
+            for user_id in missing:
+                user_infos[user_id] = self.getUserInfo(user_id)
+            return user_infos
+
+        attributes = list(self.userinfo.values())
+        attributes.append(str(self.uidtype))
+        for i in range(0, len(missing), BULK_SEARCH_SIZE):
+            chunk = missing[i:i + BULK_SEARCH_SIZE]
+            uid_filter = "".join(f"({self.uidtype}={self._escape_user_id(user_id)})" for user_id in chunk)
+            search_filter = f"(&{self.searchfilter}(|{uid_filter}))"
+            result = self._search(search_base=self.basedn, search_filter=search_filter,
+                                  attributes=attributes)
+            found = {}
+            for entry in result:
+                if entry.get("type", "searchResEntry") != "searchResEntry":
+                    continue
+                # LDAP compares the uid case-insensitive
+                uid = str(self._get_uid(entry, self.uidtype)).lower()
+                found.setdefault(uid, []).append(entry)
+            for user_id in chunk:
+                entries = found.get(str(user_id).lower(), [])
+                if len(entries) > 1:  # pragma: no cover
+                    raise ResolverError(f"Found more than one object for uid {user_id!r}")
+                user_info = self._ldap_attributes_to_user_object(entries[0].get("attributes")) if entries else {}
+                user_infos[user_id] = user_info
+                if use_cache:
+                    ttl = self.cache_timeout
+                    if not user_info:
+                        ttl = min(ttl, int(get_app_config_value("PI_LDAP_CACHE_NEGATIVE_TIMEOUT", ttl)))
+                    if ttl > 0:
+                        user_cache.set((self.getResolverId(), "getUserInfo", user_id), user_info, ttl)
+        return user_infos
+
     def _ldap_attributes_to_user_object(self, attributes):
         """
         This helper function converts the LDAP attributes to a dictionary for
@@ -657,6 +904,18 @@ class IdResolver(UserIdResolver):
         info = self.getUserInfo(user_id)
         return info.get('username', "")
 
+    def getUsernameMany(self, userids):
+        """
+        Returns the usernames of several users
+
+        :param userids: The userids in this resolver
+        :type userids: list
+        :return: dictionary of the userids and usernames
+        :rtype: dict
+        """
+        return {userid: info.get('username', "")
+                for userid, info in self.getUserInfoMany(userids).items()}
+
     @cache
     def getUserId(self, login_name):
         """
@@ -868,6 +1127,7 @@ class IdResolver(UserIdResolver):
         self.serverpool_strategy = config.get("SERVERPOOL_STRATEGY") or SERVERPOOL_STRATEGY
         # The configuration might have changed. We reset the serverpool
         self.serverpool = None
+        self._release_connection()
         self.i_am_bound = False
 
         return self
@@ -1013,6 +1273,46 @@ class IdResolver(UserIdResolver):
             # outdated ``LockingServerPool`` instances will survive until the next server restart.
             return pools[pool_description]
 
+    def get_connection_pool(self):
+        """
+        Return the process-level ``LDAPConnectionPool`` for the current LDAP
+        resolver configuration from the app-local store. If such an instance
+        does not exist yet, create one.
+
+        The pool is configured in the pi.cfg with ``PI_LDAP_CONNECTION_POOL_SIZE``
+        (the maximum number of idle connections, default 0, i.e. no pool) and
+        ``PI_LDAP_CONNECTION_POOL_IDLE_TIMEOUT`` (default 60 seconds).
+
+        :return: a ``LDAPConnectionPool`` instance or None
+        """
+        max_size = int(get_app_config_value("PI_LDAP_CONNECTION_POOL_SIZE", 0))
+        if max_size <= 0:
+            return None
+        pools = get_app_local_store().setdefault('ldap_connection_pools', {})
+        # The connections are bound with the credentials of the service account
+        pool_description = (self.uri,
+                            self.timeout,
+                            self.get_info,
+                            repr(self.tls_context),
+                            self.start_tls,
+                            self.noreferrals,
+                            self.authtype,
+                            self.binddn,
+                            hashlib.sha256(to_bytes(self.bindpw or "")).hexdigest(),
+                            self.keytabfile,
+                            self.serverpool_persistent,
+                            self.serverpool_rounds,
+                            self.serverpool_skip,
+                            self.serverpool_strategy)
+        connection_pool = pools.get(pool_description)
+        # The connections of the parent process must not be used after forking
+        if connection_pool is None or connection_pool.pid != os.getpid():
+            log.debug("Creating a connection pool for {0!r}.".format(self.uri))
+            idle_timeout = int(get_app_config_value("PI_LDAP_CONNECTION_POOL_IDLE_TIMEOUT", 60))
+            connection_pool = LDAPConnectionPool(max_size, idle_timeout)
+            pools[pool_description] = connection_pool
+        return connection_pool
+
     @classmethod
     def getResolverClassDescriptor(cls):
         """
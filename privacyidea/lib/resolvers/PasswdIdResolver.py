@@ -83,6 +83,9 @@ class IdResolver (UserIdResolver):
           "email": 4,
           }
 
+    # The file is only read in loadConfig
+    thread_safe = True
+
     @staticmethod
     def setup(config=None, cache_dir=None):
         """
@@ -112,6 +115,7 @@ class IdResolver (UserIdResolver):
         self.surnameDict = {}
         self.givennameDict = {}
         self.emailDict = {}
+        self.file_mtime = None
 
     def loadFile(self):
 
@@ -126,6 +130,7 @@ class IdResolver (UserIdResolver):
 
         log.info('loading users from file {0!s} from within {1!r}'.format(self.fileName,
                                                                 os.getcwd()))
+        self.file_mtime = self._get_file_mtime()
         with codecs.open(self.fileName, "r", ENCODING) as fileHandle:
             ID = self.sF["userid"]
             NAME = self.sF["username"]
@@ -171,6 +176,18 @@ class IdResolver (UserIdResolver):
                         if email_match:
                             self.emailDict[fields[ID]] = email_match.group(0)
 
+    def _get_file_mtime(self):
+        try:
+            return os.stat(self.fileName).st_mtime_ns
+        except OSError:
+            return None
+
+    def is_outdated(self):
+        """
+        The file needs to be read again, if it was modified
+        """
+        return self._get_file_mtime() != self.file_mtime
+
     def checkPass(self, uid, password):
         """
         This function checks the password for a given uid.
@@ -251,6 +268,20 @@ class IdResolver (UserIdResolver):
         index = self.sF["username"]
         return fields[index]
 
+    def getUsernameMany(self, userIds):
+        '''
+        Returns the usernames for several userids. Unknown userids get an
+        empty username.
+
+        :param userIds: The userids in this resolver
+        :type userIds: list
+        :return: dict of the userids and usernames
+        :rtype: dict
+        '''
+        index = self.sF["username"]
+        return {userId: self.descDict[userId][index] if userId in self.descDict else ""
+                for userId in userIds}
+
     def getUserId(self, LoginName):
         """
         search the user id from the login name
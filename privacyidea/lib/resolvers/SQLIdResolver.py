@@ -153,6 +153,9 @@ hash_type_dict = {"PHPASS": 'phpass',
 
 log = logging.getLogger(__name__)
 
+# The maximum number of users, which are read with one query
+BULK_QUERY_SIZE = 500
+
 
 class IdResolver (UserIdResolver):
 
@@ -295,6 +298,52 @@ class IdResolver (UserIdResolver):
 
         return userinfo
 
+    def getUserInfoMany(self, userIds):
+        """
+        This function returns the user information of several users. The
+        users are read with ``IN (...)`` queries for at most
+        ``BULK_QUERY_SIZE`` users.
+
+        :param userIds: The userids of the objects
+        :type userIds: list
+        :return: A dictionary of the userids and the user information
+        :rtype: dict
+        """
+        userinfos = {}
+        userIds = list(dict.fromkeys(userIds))
+        for i in range(0, len(userIds), BULK_QUERY_SIZE):
+            chunk = userIds[i:i + BULK_QUERY_SIZE]
+            found = {}
+            try:
+                conditions = [self._get_userids_filter(chunk)]
+                conditions = self._append_where_filter(conditions, self.TABLE,
+                                                       self.where)
+                result = self.session.execute(select(self.TABLE).filter(and_(*conditions)))
+                for r in result.mappings():
+                    userid = convert_column_to_unicode(r.get(self.map.get("userid")))
+                    found.setdefault(str(userid).lower(), []).append(self._get_user_from_mapped_object(r))
+            except Exception as exx:  # pragma: no cover
+                log.error("Could not get the user information: {0!r}".format(exx))
+            for userId in chunk:
+                userinfo = found.get(str(userId).lower(), [])
+                if len(userinfo) > 1:  # pragma: no cover
+                    log.error("Could not get the user information: More than one user "
+                              "with userid {0!s} found!".format(userId))
+                    userinfo = []
+                userinfos[userId] = userinfo[0] if userinfo else {}
+        return userinfos
+
+    def _get_userids_filter(self, userIds):
+        column = self.TABLE.columns[self.map.get("userid")]
+        if isinstance(column.type, String):
+            return column.in_([str(userId) for userId in userIds])
+        elif isinstance(column.type, Integer):
+            # since our user ID is usually a string we need to cast
+            return column.in_([int(userId) for userId in userIds if str(userId).strip().lstrip("-").isdigit()])
+
+        # otherwise we cast the column to string (in case of postgres UUIDs)
+        return cast(column, String).in_([str(userId) for userId in userIds])
+
     def _get_userid_filter(self, userId):
         column = self.TABLE.columns[self.map.get("userid")]
         if isinstance(column.type, String):
@@ -318,6 +367,18 @@ class IdResolver (UserIdResolver):
         info = self.getUserInfo(userId)
         return info.get('username', "")
 
+    def getUsernameMany(self, userids):
+        """
+        Returns the usernames of several users
+
+        :param userids: The userids in this resolver
+        :type userids: list
+        :return: dictionary of the userids and usernames
+        :rtype: dict
+        """
+        return {userid: info.get('username', "")
+                for userid, info in self.getUserInfoMany(userids).items()}
+
     def getUserId(self, LoginName):
         """
         resolve the loginname to the userid.
@@ -416,6 +477,14 @@ class IdResolver (UserIdResolver):
 
         return users
 
+    def close(self):
+        """
+        Close the session at the end of the request. The resolver object may be
+        used in the next request of this thread.
+        """
+        if self.session is not None:
+            self.session.close()
+
     def getResolverId(self):
         """
         Returns the resolver Id
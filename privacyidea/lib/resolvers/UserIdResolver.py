@@ -62,12 +62,23 @@ class UserIdResolver(object):
     # If the resolver could be configured editable
     updateable = False
 
+    # If a resolver object with a loaded configuration can be used by several
+    # threads at the same time. Otherwise, each thread gets its own object.
+    thread_safe = False
+
     def close(self):
         """
         Hook to close down the resolver after one request
         """
         return
 
+    def is_outdated(self):
+        """
+        Hook to check, if the resolver object needs to load its configuration
+        again, before it is used in another request (e.g. because a file changed).
+        """
+        return False
+
     @staticmethod
     def getResolverClassType():
         """
@@ -153,6 +164,33 @@ class UserIdResolver(object):
         """
         return {}
 
+    def getUserInfoMany(self, userids):
+        """
+        This function returns the user information of several users.
+        Resolvers, which can look up several users with one request to
+        the user store, overwrite this method. By default, ``getUserInfo``
+        is called for each user.
+
+        :param userids: IDs of the users in the resolver
+        :type userids: list
+        :return: dictionary of the userids and their user information. The
+            user information of users, which do not exist, is empty.
+        :rtype: dict
+        """
+        return {userid: self.getUserInfo(userid) for userid in userids}
+
+    def getUsernameMany(self, userids):
+        """
+        Returns the usernames of several users. By default, ``getUsername``
+        is called for each user.
+
+        :param userids: IDs of the users in the resolver
+        :type userids: list
+        :return: dictionary of the userids and their usernames
+        :rtype: dict
+        """
+        return {userid: self.getUsername(userid) for userid in userids}
+
     def getUserList(self, searchDict=None):
         """
         This function finds the user objects,
@@ -15,11 +15,15 @@
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 #
+from contextlib import contextmanager
 
 from sqlalchemy import select
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql.expression import ClauseElement, Delete
 
+# The key in the info dictionary of a session, which marks a unit of work
+UNIT_OF_WORK = "privacyidea_unit_of_work"
+
 
 class DeleteLimit(Delete, ClauseElement):
     """
@@ -79,7 +83,7 @@ def visit_delete_limit_mysql(element, compiler, **kw):
         compiler.process(element.filter), element.limit)
 
 
-def delete_chunked(session, table, filter, limit=1000):
+def delete_chunked(session, table, filter, limit=1000, progress=None):
     """
     Delete all rows matching a given filter criterion from a table,
     but only delete *limit* rows at a time. Commit after each DELETE.
@@ -88,6 +92,8 @@ def delete_chunked(session, table, filter, limit=1000):
     :param table: SQLAlchemy table object (e.g. ``LogEntry.__table__``)
     :param filter: A filter criterion (e.g. ``LogEntry.age < now``)
     :param limit: Number of rows to delete in one chunk
+    :param progress: A function, which is called with the number of deleted
+        rows after each chunk
     :return: total number of deleted rows
     """
     deleted = 0
@@ -96,11 +102,13 @@ def delete_chunked(session, table, filter, limit=1000):
         result = session.execute(statement)
         deleted += result.rowcount
         session.commit()
+        if progress:
+            progress(deleted)
         if result.rowcount < limit:
             return deleted
 
 
-def delete_matching_rows(session, table, filter, chunksize=None):
+def delete_matching_rows(session, table, filter, chunksize=None, progress=None):
     """
     Delete all rows matching a given filter criterion from a table,
     using chunked deletes if *chunksize* is not None.
@@ -109,11 +117,104 @@ def delete_matching_rows(session, table, filter, chunksize=None):
     :param table: table object
     :param filter: filter criterion
     :param chunksize: An integer (a chunksize), or None.
+    :param progress: A function, which is called with the number of deleted
+        rows after each chunk
     :return: total number of deleted rows
     """
     if chunksize is None:
         result = session.execute(table.delete().where(filter))
         session.commit()
+        if progress:
+            progress(result.rowcount)
         return result.rowcount
     else:
-        return delete_chunked(session, table, filter, chunksize)
+        return delete_chunked(session, table, filter, chunksize, progress)
+
+
+def begin_unit_of_work(session):
+    """
+    Begin a unit of work in the given session. Within the unit of work,
+    :func:`commit_or_flush` only flushes the changes to the database, so that
+    they are committed together by :func:`end_unit_of_work`. A direct
+    ``session.commit()`` still commits all changes immediately, e.g. for
+    changes, which must not get lost, like the increased OTP counter of a
+    token.
+
+    :param session: SQLAlchemy (scoped) session object
+    :return: True, if the unit of work has begun, False, if the session is
+        already in a unit of work
+    """
+    info = session().info
+    if info.get(UNIT_OF_WORK):
+        return False
+    info[UNIT_OF_WORK] = True
+    return True
+
+
+def in_unit_of_work(session):
+    """
+    :param session: SQLAlchemy (scoped) session object
+    :return: True, if the session is in a unit of work
+    """
+    return bool(session().info.get(UNIT_OF_WORK))
+
+
+def commit_or_flush(session):
+    """
+    Commit the changes of the given session or, if the session is in a unit
+    of work, only flush them to the database.
+
+    :param session: SQLAlchemy (scoped) session object
+    """
+    sess = session()
+    if sess.info.get(UNIT_OF_WORK):
+        sess.flush()
+        # like a commit, so that e.g. deleted objects are removed from the
+        # relationships of the other objects
+        sess.expire_all()
+    else:
+        sess.commit()
+
+
+def end_unit_of_work(session, commit=True):
+    """
+    End the unit of work of the given session and commit or roll back the
+    pending changes. If the commit fails, the changes are rolled back.
+    If the session is not in a unit of work, nothing is done.
+
+    :param session: SQLAlchemy (scoped) session object
+    :param commit: Commit the changes, otherwise they are rolled back
+    """
+    sess = session()
+    if not sess.info.pop(UNIT_OF_WORK, False):
+        return
+    if commit:
+        try:
+            sess.commit()
+        except Exception:
+            sess.rollback()
+            raise
+    else:
+        sess.rollback()
+
+
+@contextmanager
+def unit_of_work(session):
+    """
+    Context manager, within which :func:`commit_or_flush` only flushes the
+    changes to the database. The changes are committed together, when the
+    context is left, and rolled back, if an exception is raised.
+    If the session is already in a unit of work, the changes are committed
+    by the outer unit of work.
+
+    :param session: SQLAlchemy (scoped) session object
+    """
+    if not begin_unit_of_work(session):
+        yield
+        return
+    try:
+        yield
+    except Exception:
+        end_unit_of_work(session, commit=False)
+        raise
+    end_unit_of_work(session)
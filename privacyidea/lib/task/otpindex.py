@@ -0,0 +1,68 @@
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+import logging
+
+from privacyidea.lib.task.base import BaseTask
+from privacyidea.lib.token import update_otp_index_of_tokens
+from privacyidea.lib.monitoringstats import write_stats
+from privacyidea.lib.error import ParameterError
+from privacyidea.lib import _
+
+__doc__ = """This task module builds and refreshes the index of the upcoming OTP
+values of HOTP tokens (see privacyidea.lib.otpindex), so that the index is not
+calculated while searching a token by its OTP value.
+
+This module is tested in tests/test_lib_task_otpindex.py"""
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 10
+DEFAULT_CHUNKSIZE = 1000
+
+
+class OTPIndexTask(BaseTask):
+    identifier = "OTPIndex"
+    description = "Build and refresh the index of the upcoming OTP values of HOTP tokens"
+
+    @property
+    def options(self):
+        return {
+            "window": {
+                "type": "str",
+                "description": _("The look ahead window, which the index has to "
+                                 "cover (default: 10).")},
+            "chunksize": {
+                "type": "str",
+                "description": _("The number of tokens, which are read and committed "
+                                 "together (default: 1000).")},
+            "stats_key": {
+                "type": "str",
+                "description": _("The name of the stats key to write the number of updated "
+                                 "tokens to the MonitoringStats table.")}
+        }
+
+    def do(self, params):
+        try:
+            window = int(params.get("window") or DEFAULT_WINDOW)
+            chunksize = int(params.get("chunksize") or DEFAULT_CHUNKSIZE)
+        except ValueError:
+            raise ParameterError("The window and the chunksize must be integers.")
+
+        updated = update_otp_index_of_tokens(window=window, chunksize=chunksize)
+        stats_key = params.get("stats_key")
+        if stats_key:
+            write_stats(stats_key, updated)
+        return True
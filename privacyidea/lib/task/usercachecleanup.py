@@ -0,0 +1,68 @@
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+import logging
+
+from privacyidea.lib.task.base import BaseTask
+from privacyidea.lib.usercache import delete_user_cache, is_cache_enabled
+from privacyidea.lib.monitoringstats import write_stats
+from privacyidea.lib.error import ParameterError
+from privacyidea.lib import _
+
+__doc__ = """This task module deletes the expired entries from the user cache
+in chunks, so that the table does not grow without bound.
+
+This module is tested in tests/test_lib_task_usercachecleanup.py"""
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CHUNKSIZE = 1000
+
+
+class UserCacheCleanupTask(BaseTask):
+    identifier = "UserCacheCleanup"
+    description = "Delete the expired entries from the user cache"
+
+    @property
+    def options(self):
+        return {
+            "chunksize": {
+                "type": "str",
+                "description": _("The number of entries, which are deleted with one "
+                                 "statement (default: 1000).")},
+            "stats_key": {
+                "type": "str",
+                "description": _("The name of the stats key to write the number of deleted "
+                                 "entries to the MonitoringStats table.")}
+        }
+
+    def do(self, params):
+        chunksize = params.get("chunksize") or DEFAULT_CHUNKSIZE
+        try:
+            chunksize = int(chunksize)
+        except ValueError:
+            raise ParameterError("The chunksize must be an integer.")
+        if chunksize <= 0:
+            raise ParameterError("The chunksize must be positive.")
+
+        if not is_cache_enabled():
+            log.debug("The user cache is disabled, not deleting any entries.")
+            return True
+
+        deleted = delete_user_cache(expired=True, chunksize=chunksize)
+        stats_key = params.get("stats_key")
+        if stats_key:
+            write_stats(stats_key, deleted)
+        return True
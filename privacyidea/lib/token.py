@@ -60,6 +60,7 @@ This is the middleware/glue between the HTTP API and the database
 """
 
 import datetime
+import itertools
 import logging
 import os
 import string
@@ -70,6 +71,7 @@ from dateutil.tz import tzlocal
 from sqlalchemy import (and_, func)
 from sqlalchemy import or_, select
 from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import selectinload, joinedload
 from sqlalchemy.sql.expression import FunctionElement
 
 from privacyidea.lib import _
@@ -84,7 +86,7 @@ from privacyidea.lib.decorators import (check_user_or_serial,
 from privacyidea.lib.error import (TokenAdminError,
                                    ParameterError,
                                    privacyIDEAError, ResourceNotFoundError)
-from privacyidea.lib.framework import get_app_config_value
+from privacyidea.lib.framework import get_app_config_value, get_request_local_store
 from privacyidea.lib.log import log_with
 from privacyidea.lib.policy import ACTION
 from privacyidea.lib.policydecorators import (libpolicy,
@@ -102,15 +104,21 @@ from privacyidea.lib.tokenclass import DATE_FORMAT
 from privacyidea.lib.tokenclass import TOKENKIND
 from privacyidea.lib.tokenclass import TokenClass
 from privacyidea.lib.user import User
-from privacyidea.lib.user import get_username
+from privacyidea.lib.user import get_username, get_usernames
+from privacyidea.lib.otpindex import (get_otp_index_size, lookup_otp_index, update_otp_index,
+                                      get_uncovered_tokens)
+from privacyidea.lib.sqlutils import unit_of_work
 from privacyidea.lib.utils import is_true, BASE58, hexlify_and_unicode, check_serial_valid, create_tag_dict
 from privacyidea.models import (Token, Realm, TokenRealm, Challenge,
                                 TokenInfo, TokenOwner, TokenTokengroup, Tokengroup, TokenContainer,
-                                TokenContainerToken)
+                                TokenContainerToken, PIN_VERIFICATION_CACHE)
 from privacyidea.models import (db)
 
 log = logging.getLogger(__name__)
 
+# The number of tokens, whose data is loaded with one query
+PREFETCH_CHUNK_SIZE = 500
+
 optional = True
 required = False
 
@@ -422,61 +430,182 @@ def get_tokens_paginated_generator(tokentype=None, realm=None, assigned=None, us
             break
 
 
-def convert_token_objects_to_dicts(tokens, user, user_role="user", allowed_realms=None):
+class prefetch_token_list_data(object):
+    """
+    Context manager to load the data of a list of tokens, which is needed
+    to display the tokens, with a few queries for all tokens instead of
+    several queries for each token::
+
+        with prefetch_token_list_data(db_tokens) as containers:
+            ...
+
+    The token info, the realms and the tokengroups are loaded into the
+    token objects. The owners are only used within the context, since
+    they can be changed by other functions. The context returns a dict of
+    the token ids and the serials of their containers.
+    """
+
+    def __init__(self, db_tokens):
+        self.db_tokens = list(db_tokens)
+        self.containers = {}
+
+    def __enter__(self):
+        token_ids = [db_token.id for db_token in self.db_tokens]
+        owners = {}
+        for i in range(0, len(token_ids), PREFETCH_CHUNK_SIZE):
+            chunk = token_ids[i:i + PREFETCH_CHUNK_SIZE]
+            # Load the relationships of the tokens, which are already in the session
+            Token.query.options(selectinload(Token.info_list),
+                                selectinload(Token.realm_list).joinedload(TokenRealm.realm),
+                                selectinload(Token.tokengroup_list).joinedload(TokenTokengroup.tokengroup)) \
+                .filter(Token.id.in_(chunk)).all()
+            for owner in TokenOwner.query.filter(TokenOwner.token_id.in_(chunk)) \
+                    .options(joinedload(TokenOwner.realm)).order_by(TokenOwner.id):
+                owners.setdefault(owner.token_id, owner)
+            for token_id, container_serial in db.session.query(TokenContainerToken.token_id, TokenContainer.serial) \
+                    .join(TokenContainer, TokenContainer.id == TokenContainerToken.container_id) \
+                    .filter(TokenContainerToken.token_id.in_(chunk)) \
+                    .order_by(TokenContainerToken.container_id):
+                self.containers.setdefault(token_id, container_serial)
+        for db_token in self.db_tokens:
+            db_token._prefetched_owner = (owners.get(db_token.id),)
+        return self.containers
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for db_token in self.db_tokens:
+            db_token.__dict__.pop("_prefetched_owner", None)
+
+
+def _get_token_owner(db_token, owners, usernames):
+    """
+    Resolve the owner of the token. Each distinct owner is only resolved
+    once for a list of tokens.
+
+    :param db_token: The database token object
+    :param owners: dict to store the resolved owners
+    :param usernames: dict of the resolver names and the usernames of the
+        owners in the resolver (or the exception raised by the resolver)
+    :return: tuple of the User object (or None), whether the user is
+        editable and the traceback of a resolver error
+    """
+    tokenowner = db_token.first_owner
+    if not tokenowner:
+        return None, None, None
+    key = (tokenowner.resolver, tokenowner.user_id, tokenowner.realm.name)
+    if key not in owners:
+        user = editable = error = None
+        try:
+            resolver_usernames = usernames.get(tokenowner.resolver, {})
+            if isinstance(resolver_usernames, Exception):
+                raise resolver_usernames
+            username = resolver_usernames.get(tokenowner.user_id, "")
+            if username:
+                user = User(login=username, resolver=tokenowner.resolver,
+                            realm=tokenowner.realm.name, uid=tokenowner.user_id)
+            else:
+                user = User(login="")
+            if user:
+                editable = get_resolver_object(user.resolver).editable
+        except Exception as exx:
+            log.error("User information can not be retrieved: {0!s}".format(exx))
+            error = traceback.format_exc()
+        owners[key] = (user, editable, error)
+    return owners[key]
+
+
+def _get_owner_usernames(db_tokens):
+    """
+    Look up the usernames of the owners of the tokens with one request per
+    resolver.
+
+    :param db_tokens: The database token objects with prefetched owners
+    :return: dict of the resolver names and a dict of the user ids and the
+        usernames. If the resolver failed, the exception is returned instead.
+    """
+    user_ids = {}
+    for db_token in db_tokens:
+        tokenowner = db_token.first_owner
+        if tokenowner:
+            user_ids.setdefault(tokenowner.resolver, []).append(tokenowner.user_id)
+    usernames = {}
+    for resolver, resolver_user_ids in user_ids.items():
+        try:
+            usernames[resolver] = get_usernames(resolver_user_ids, resolver)
+        except Exception as exx:
+            usernames[resolver] = exx
+    return usernames
+
+
+def get_token_list_dicts(tokens):
     """
-    Convert a list of token objects to a list of dictionaries.
-    Additionally, checks whether the requesting user is allowed to see the token information.
-    If not it is reduced to the tokens serial.
+    Return the dictionaries of the tokens with the user information and the
+    serial of the container, as they are displayed in the token list.
+    The data of all tokens is loaded together and each owner is only
+    resolved once.
 
     :param tokens: A list of token objects
     :type tokens: list
-    :param user: The user object performing the request
-    :type user: User object
-    :param user_role: The role of the logged-in user
-    :type user_role: str
-    :param allowed_realms: A list of the realms the admin is allowed to see, None if the admin is allowed to see all
-                           realms
     :return: A list of dictionaries
     :rtype: list
     """
+    tokens = [token for token in tokens if isinstance(token, TokenClass)]
     token_dict_list = []
-    for token in tokens:
-        if isinstance(token, TokenClass):
+    owners = {}
+    with prefetch_token_list_data([token.token for token in tokens]) as containers:
+        usernames = _get_owner_usernames([token.token for token in tokens])
+        for token in tokens:
             token_dict = token.get_as_dict()
             # add user information
             # In certain cases the LDAP or SQL server might not be reachable.
             # Then an exception is raised
             token_dict["username"] = ""
             token_dict["user_realm"] = ""
-            try:
-                user = token.user
-                if user:
-                    token_dict["username"] = user.login
-                    token_dict["user_realm"] = user.realm
-                    token_dict["user_editable"] = get_resolver_object(user.resolver).editable
-            except Exception as exx:
-                log.error("User information can not be retrieved: {0!s}".format(exx))
-                log.debug(traceback.format_exc())
+            user, editable, error = _get_token_owner(token.token, owners, usernames)
+            if user:
+                token_dict["username"] = user.login
+                token_dict["user_realm"] = user.realm
+                if not error:
+                    token_dict["user_editable"] = editable
+            if error:
+                log.debug(error)
                 token_dict["username"] = "**resolver error**"
 
             # check if token is in a container
-            token_dict["container_serial"] = ""
-            from privacyidea.lib.container import find_container_for_token
-            container = find_container_for_token(token.get_serial())
-            if container:
-                token_dict["container_serial"] = container.serial
-
-            # Reduce token info if the user is not the owner
-            if user_role != "admin":
-                if not user or user.login != token_dict["username"] or user.realm != token_dict["user_realm"]:
-                    token_dict = {"serial": token_dict["serial"]}
-            elif user_role == "admin" and allowed_realms is not None:
-                same_realms = list(set(token_dict["realms"]).intersection(allowed_realms))
-                if len(same_realms) == 0:
-                    # The token is in no realm the admin is allowed to see
-                    token_dict = {"serial": token_dict["serial"]}
-
+            token_dict["container_serial"] = containers.get(token.token.id, "")
             token_dict_list.append(token_dict)
+    return token_dict_list
+
+
+def convert_token_objects_to_dicts(tokens, user, user_role="user", allowed_realms=None):
+    """
+    Convert a list of token objects to a list of dictionaries.
+    Additionally, checks whether the requesting user is allowed to see the token information.
+    If not it is reduced to the tokens serial.
+
+    :param tokens: A list of token objects
+    :type tokens: list
+    :param user: The user object performing the request
+    :type user: User object
+    :param user_role: The role of the logged-in user
+    :type user_role: str
+    :param allowed_realms: A list of the realms the admin is allowed to see, None if the admin is allowed to see all
+                           realms
+    :return: A list of dictionaries
+    :rtype: list
+    """
+    token_dict_list = []
+    for token_dict in get_token_list_dicts(tokens):
+        # Reduce token info if the user is not the owner
+        if user_role != "admin":
+            if not user or user.login != token_dict["username"] or user.realm != token_dict["user_realm"]:
+                token_dict = {"serial": token_dict["serial"]}
+        elif user_role == "admin" and allowed_realms is not None:
+            same_realms = list(set(token_dict["realms"]).intersection(allowed_realms))
+            if len(same_realms) == 0:
+                # The token is in no realm the admin is allowed to see
+                token_dict = {"serial": token_dict["serial"]}
+
+        token_dict_list.append(token_dict)
 
     return token_dict_list
 
@@ -660,41 +789,12 @@ def get_tokens_paginate(tokentype=None, token_type_list=None, realm=None, assign
     next_page = None
     if pagination.has_next:
         next_page = page + 1
-    token_list = []
-    for token in tokens:
-        token = create_tokenclass_object(token)
-        if isinstance(token, TokenClass):
-            token_dict = token.get_as_dict()
-            # add user information
-            # In certain cases the LDAP or SQL server might not be reachable.
-            # Then an exception is raised
-            token_dict["username"] = ""
-            token_dict["user_realm"] = ""
-            try:
-                user = token.user
-                if user:
-                    token_dict["username"] = user.login
-                    token_dict["user_realm"] = user.realm
-                    token_dict["user_editable"] = get_resolver_object(
-                        user.resolver).editable
-            except Exception as exx:
-                log.error("User information can not be retrieved: {0!s}".format(exx))
-                log.debug(traceback.format_exc())
-                token_dict["username"] = "**resolver error**"
-
-            if hidden_tokeninfo:
-                for key in list(token_dict['info']):
-                    if key in hidden_tokeninfo:
-                        token_dict['info'].pop(key)
-
-            # check if token is in a container
-            token_dict["container_serial"] = ""
-            from privacyidea.lib.container import find_container_for_token
-            container = find_container_for_token(token.get_serial())
-            if container:
-                token_dict["container_serial"] = container.serial
-
-            token_list.append(token_dict)
+    token_list = get_token_list_dicts([create_tokenclass_object(token) for token in tokens])
+    if hidden_tokeninfo:
+        for token_dict in token_list:
+            for key in list(token_dict['info']):
+                if key in hidden_tokeninfo:
+                    token_dict['info'].pop(key)
 
     ret = {"tokens": token_list,
            "prev": previous_page,
@@ -1013,6 +1113,16 @@ def get_token_by_otp(token_list, otp="", window=10):
     result_token = None
     result_list = []
 
+    index_size = get_otp_index_size()
+    if index_size and index_size < window:
+        log.warning("The OTP index of size {0!s} can not be used for the "
+                    "window {1!s}.".format(index_size, window))
+    elif index_size and window > 0:
+        # Only the candidates and the tokens, which are not covered by the
+        # OTP index, need to be checked.
+        candidates, token_list = lookup_otp_index(token_list, otp, window=window)
+        token_list = candidates + token_list
+
     for token in token_list:
         log.debug(f"Checking token {token.get_serial()}")
         try:
@@ -1032,6 +1142,42 @@ def get_token_by_otp(token_list, otp="", window=10):
     return result_token
 
 
+@log_with(log)
+def update_otp_index_of_tokens(window=10, chunksize=1000, progress=None):
+    """
+    Build or refresh the OTP index of all HOTP tokens, which are not covered
+    by the index for the given window. The tokens are read and the index
+    entries are committed in chunks.
+
+    :param window: the look ahead window, which the index has to cover
+    :type window: int
+    :param chunksize: the number of tokens, which are read and committed together
+    :type chunksize: int
+    :param progress: optional function, which is called with the number of
+        checked and updated tokens after each chunk
+    :return: the number of updated tokens
+    :rtype: int
+    """
+    index_size = get_otp_index_size()
+    if not index_size:
+        log.info("The OTP index is disabled.")
+        return 0
+    if window < 1 or chunksize < 1:
+        raise ParameterError("The window and the chunksize must be positive.")
+    if index_size < window:
+        raise ParameterError("The OTP index size {0!s} is smaller than the "
+                             "window {1!s}.".format(index_size, window))
+    checked = updated = 0
+    for token_list in get_tokens_paginated_generator(tokentype="hotp", psize=chunksize):
+        checked += len(token_list)
+        uncovered = get_uncovered_tokens(token_list, window=window)
+        if uncovered:
+            updated += update_otp_index(uncovered, index_size)
+        if progress:
+            progress(checked, updated)
+    return updated
+
+
 @log_with(log)
 def get_serial_by_otp(token_list, otp="", window=10):
     """
@@ -1142,12 +1288,64 @@ def import_token(serial, token_dict, tokenrealms=None):
                        tokenrealms=tokenrealms,
                        tokenkind=TOKENKIND.HARDWARE)
     if token_dict.get("counter"):
-        token.set_otp_count(token_dict.get("counter"))
+        # Not using set_otp_count, which commits immediately
+        token.token.count = int(token_dict.get("counter"))
+        token.token.save()
     if token_dict.get("timeShift"):
         token.add_tokeninfo("timeShift", token_dict.get("timeShift"))
     return token
 
 
+def import_tokens(tokens, tokenrealms=None, batch_size=1000, progress=None):
+    """
+    Import many tokens like :func:`import_token`, but commit the tokens of a
+    batch together. If a token of a batch fails, the tokens of this batch are
+    imported one by one again.
+
+    :param tokens: iterable of tuples of the serial and the token dictionary
+        like the generators :func:`privacyidea.lib.importotp.iter_pskc_data`
+        and :func:`privacyidea.lib.importotp.iter_oath_csv`
+    :param tokenrealms: List of realms to set as realms of the tokens
+    :type tokenrealms: list
+    :param batch_size: The number of tokens, which are committed together
+    :type batch_size: int
+    :param progress: A function, which is called after each batch with the
+        number of imported tokens and the list of the serials of the tokens,
+        which failed
+    :return: tuple of the number of imported tokens and the list of the
+        serials of the tokens, which failed
+    """
+    if batch_size < 1:
+        # An empty batch would end the import without importing any token
+        raise ParameterError("The batch size must be positive.")
+    imported = 0
+    failed = []
+    token_iter = iter(tokens)
+    while True:
+        batch = list(itertools.islice(token_iter, batch_size))
+        if not batch:
+            break
+        try:
+            with unit_of_work(db.session):
+                for serial, token_dict in batch:
+                    import_token(serial, token_dict, tokenrealms=tokenrealms)
+            imported += len(batch)
+        except Exception as e:
+            log.warning(f"Failed to import a batch of {len(batch)} tokens, "
+                        f"importing them one by one: {e}")
+            for serial, token_dict in batch:
+                try:
+                    import_token(serial, token_dict, tokenrealms=tokenrealms)
+                    imported += 1
+                except Exception as e:
+                    db.session.rollback()
+                    log.warning(f"Failed to import token {serial}: {e}")
+                    failed.append(serial)
+        if progress:
+            progress(imported, failed)
+    return imported, failed
+
+
 @log_with(log)
 def init_token(param, user=None, tokenrealms=None, tokenkind=None):
     """
@@ -2381,6 +2579,12 @@ def check_token_list(token_object_list, passw, user=None, options=None, allow_re
     if len(token_object_list) > 0:
         token_object_list = [token for token in token_object_list if token.use_for_authentication(options)]
 
+    # Several tokens may share the same PIN hash and the PIN of a token may be checked
+    # several times (e.g. for a challenge request and the authentication). The result of
+    # the costly hash verification only depends on the PIN hash and the given PIN, so it
+    # is remembered for the rest of the request.
+    get_request_local_store().setdefault(PIN_VERIFICATION_CACHE, {})
+
     for token_object in sorted(token_object_list, key=weigh_token_type):
         if log.isEnabledFor(logging.DEBUG):
             # Avoid a SQL query triggered by ``token_object.user`` in case the log level is not DEBUG
@@ -89,7 +89,7 @@ from .log import log_with
 from .config import (get_from_config, get_prepend_pin)
 from .user import (User,
                    get_username)
-from ..models import (TokenOwner, TokenTokengroup, Challenge, cleanup_challenges)
+from ..models import (TokenOwner, TokenTokengroup, Challenge, cleanup_challenges, db)
 from .challenge import get_challenges
 from privacyidea.lib.crypto import (encryptPassword, decryptPassword,
                                     generate_otpkey)
@@ -187,6 +187,9 @@ class TokenClass(object):
         # These are temporary details to store during authentication
         # like the "matched_otp_counter".
         self.auth_details = {}
+        # The token info and the decrypted password entries, which are valid
+        # as long as the info_list of the database token is not reloaded
+        self._tokeninfo_cache = None
 
     def set_type(self, tokentype):
         """
@@ -378,6 +381,7 @@ class TokenClass(object):
         :return:
         """
         self.token.del_info()
+        self._tokeninfo_cache = None
         for k, v in info.items():
             # check if type is a password
             if k.endswith(".type") and v == "password":
@@ -387,6 +391,7 @@ class TokenClass(object):
                 info[orig_key] = encryptPassword(info.get(orig_key, ""))
 
         self.token.set_info(info)
+        self._tokeninfo_cache = None
 
     @check_token_locked
     def add_tokeninfo(self, key, value, value_type=None):
@@ -404,10 +409,12 @@ class TokenClass(object):
                 # encrypt the value
                 add_info[key] = encryptPassword(value)
         self.token.set_info(add_info)
+        self._tokeninfo_cache = None
 
     @check_token_locked
     def add_tokeninfo_dict(self, info: dict):
         self.token.set_info(info)
+        self._tokeninfo_cache = None
 
     @check_token_locked
     def check_otp(self, otpval, counter=None, window=None, options=None):
@@ -835,6 +842,8 @@ class TokenClass(object):
     def set_otp_count(self, otpCount):
         self.token.count = int(otpCount)
         self.token.save()
+        # The counter must not get lost, also in a unit of work
+        db.session.commit()
 
     @check_token_locked
     def set_pin(self, pin, encrypt=False):
@@ -912,6 +921,8 @@ class TokenClass(object):
                                        DATE_FORMAT))
         try:
             self.token.save()
+            # The fail counter must not get lost, also in a unit of work
+            db.session.commit()
         except:  # pragma: no cover
             log.error('update failed')
             raise TokenAdminError("Token Fail Counter update failed", id=1106)
@@ -981,22 +992,44 @@ class TokenClass(object):
         :return: the value for the key
         :rtype: int or str or dict
         """
-        tokeninfo = self.token.get_info()
-        ret = tokeninfo
+        tokeninfo = self._get_tokeninfo_cache()
 
         if key:
             ret = tokeninfo.get(key, default)
-            key_type = tokeninfo.get(key + ".type")
-            if key_type == "password":
-                ret = decryptPassword(ret)
+            if tokeninfo.get(key + ".type") == "password":
+                ret = self._decrypt_tokeninfo(key, ret)
         elif decrypted:
-            ret = {x: (decryptPassword(y) if tokeninfo.get(x + ".type") == "password" else y)
+            ret = {x: (self._decrypt_tokeninfo(x, y) if tokeninfo.get(x + ".type") == "password" else y)
                    for x, y in tokeninfo.items()}
+        else:
+            # the caller may modify the dictionary
+            ret = dict(tokeninfo)
 
         return ret
 
+    def _get_tokeninfo_cache(self):
+        """
+        Return the token info dictionary. It is built again, if the token info
+        has been changed by this object or if the info_list of the database
+        token has been loaded again, e.g. after a commit.
+        """
+        info_list = self.token.info_list
+        if self._tokeninfo_cache is None or self._tokeninfo_cache[0] is not info_list:
+            self._tokeninfo_cache = (info_list, self.token.get_info(), {})
+        return self._tokeninfo_cache[1]
+
+    def _decrypt_tokeninfo(self, key, value):
+        """
+        Decrypt the password entry of the token info only once.
+        """
+        decrypted_values = self._tokeninfo_cache[2]
+        if key not in decrypted_values:
+            decrypted_values[key] = decryptPassword(value)
+        return decrypted_values[key]
+
     def del_tokeninfo(self, key=None):
         self.token.del_info(key)
+        self._tokeninfo_cache = None
 
     def del_tokengroup(self, tokengroup=None, tokengroup_id=None):
         """
@@ -1194,8 +1227,8 @@ class TokenClass(object):
         succcess_counter += 1
         auth_counter = self.get_count_auth()
         auth_counter += 1
-        self.token.set_info({"count_auth_success": int(succcess_counter),
-                             "count_auth": int(auth_counter)})
+        self.add_tokeninfo_dict({"count_auth_success": int(succcess_counter),
+                                 "count_auth": int(auth_counter)})
         return succcess_counter
 
     @check_token_locked
@@ -1357,8 +1390,10 @@ class TokenClass(object):
                 self.token.maxfail):
             self.set_failcount(0)
 
-        # make DB persistent immediately, to avoid the re-usage of the counter
+        # make DB persistent immediately, to avoid the re-usage of the counter.
+        # This is also done in a unit of work.
         self.token.save()
+        db.session.commit()
         return self.token.count
 
     def check_otp_exist(self, otp, window=None):
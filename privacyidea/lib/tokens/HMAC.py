@@ -36,12 +36,13 @@ import binascii
 
 from hashlib import sha1
 
-from privacyidea.lib.utils import hexlify_and_unicode
+from privacyidea.lib.utils import hexlify_and_unicode, to_unicode
 from privacyidea.lib.log import log_with
-from privacyidea.lib.crypto import safe_compare
 
 
 log = logging.getLogger(__name__)
+# The counter is the 8 byte big endian data input of the HMAC
+COUNTER_STRUCT = struct.Struct(">Q")
 
 
 class HmacOtp(object):
@@ -127,6 +128,36 @@ class HmacOtp(object):
             self.counter = counter + 1
         return sotp
 
+    def window_values(self, start, end):
+        """
+        Calculate the truncated OTP values of all counters from ``start`` to
+        ``end`` (excluding) in one call. The key is only prepared once and
+        the values are returned as integers without leading zeros.
+
+        :param start: The first counter
+        :type start: int
+        :param end: The counter after the last counter
+        :type end: int
+        :return: list of the OTP values
+        :rtype: list of int
+        """
+        return [value for _counter, value in self._iter_window(start, end)]
+
+    def _iter_window(self, start, end):
+        """
+        Yield the counter and the truncated OTP value of each counter from
+        ``start`` to ``end`` (excluding).
+        """
+        keyed_hmac = self.secretObj.hmac_object(self.hashfunc)
+        pack = COUNTER_STRUCT.pack
+        modulo = 10 ** self.digits
+        for counter in range(start, end):
+            h = keyed_hmac.copy()
+            h.update(pack(counter))
+            digest = h.digest()
+            offset = digest[-1] & 0x0f
+            yield counter, (int.from_bytes(digest[offset:offset + 4], "big") & 0x7fffffff) % modulo
+
     @log_with(log)
     def checkOtp(self, anOtpVal, window, symetric=False):
         """
@@ -148,12 +179,20 @@ class HmacOtp(object):
             end = self.counter + (window)
 
         log.debug("OTP range counter: {0!r} - {1!r}".format(start, end))
-        for c in range(start, end):
-            otpval = self.generate(c)
-            #log.debug("calculating counter {0!r}".format(c))
-
-            if safe_compare(otpval, anOtpVal):
-                res = c
-                break
+        # Only a value with all digits can match. It is compared as an integer,
+        # so that the OTP values do not need to be formatted.
+        anOtpVal = to_unicode(anOtpVal)
+        if isinstance(anOtpVal, str) and len(anOtpVal) == self.digits \
+                and anOtpVal.isascii() and anOtpVal.isdigit():
+            otp_int = int(anOtpVal)
+            for c, otpval in self._iter_window(start, end):
+                if otpval == otp_int:
+                    res = c
+                    break
+        # The counter is set behind the last checked counter like generate() does
+        if res != -1:
+            self.counter = res + 1
+        elif end > start:
+            self.counter = end
         # return -1 or the counter
         return res
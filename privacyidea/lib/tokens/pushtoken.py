@@ -60,6 +60,7 @@ from privacyidea.lib.apps import _construct_extra_parameters
 from privacyidea.lib.crypto import geturandom, generate_keypair
 from privacyidea.lib.smsprovider.SMSProvider import get_smsgateway, create_sms_instance
 from privacyidea.lib.challenge import get_challenges
+from privacyidea.lib.challengenotify import get_challenge_notifier, notify_challenge_answered
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
@@ -678,6 +679,7 @@ class PushTokenClass(TokenClass):
                         and challenges[0].get_session() == CHALLENGE_SESSION.ENROLLMENT):
                     challenges[0].set_otp_status(True)
                     challenges[0].save()
+                    notify_challenge_answered(challenges[0].transaction_id)
             except ResourceNotFoundError:
                 raise ResourceNotFoundError("No token with this serial number in the rollout state 'clientwait'.")
             init_detail_dict = request_data
@@ -722,6 +724,8 @@ class PushTokenClass(TokenClass):
                             else:
                                 challenge.set_otp_status(True)
                         challenge.save()
+                        if result and not decline:
+                            notify_challenge_answered(challenge.transaction_id)
                     except InvalidSignature as _e:
                         pass
         elif all(k in request_data for k in ('new_fb_token', 'timestamp', 'signature')):
@@ -1038,6 +1042,9 @@ class PushTokenClass(TokenClass):
                                          session=options.get("session"),
                                          validitytime=validity)
                 db_challenge.save()
+                # The smartphone answers in another request, so the challenge
+                # must be visible at once, also in a unit of work
+                db.session.commit()
                 self.challenge_janitor()
                 transactionid = db_challenge.transaction_id
 
@@ -1090,15 +1097,21 @@ class PushTokenClass(TokenClass):
                 waiting = int(options.get(PUSH_ACTION.WAIT, 20))
                 # Trigger the challenge
                 _t, _m, transaction_id, _attr = self.create_challenge(options=options)
-                # now we need to check and wait for the response to be answered in the challenge table
-                starttime = time.time()
-                while True:
-                    db.session.commit()
-                    otp_counter = self.check_challenge_response(options={"transaction_id": transaction_id})
-                    elapsed_time = time.time() - starttime
-                    if otp_counter >= 0 or elapsed_time > waiting or elapsed_time < 0:
-                        break
-                    time.sleep(DELAY - (elapsed_time % DELAY))
+                # now we need to check and wait for the response to be answered in the challenge table.
+                # We are woken up as soon as the challenge is answered, but we also check the
+                # database regularly, in case the notification gets lost.
+                notifier = get_challenge_notifier()
+                with notifier.waiting(transaction_id) as answered:
+                    starttime = time.time()
+                    while True:
+                        # start a new transaction to see the answer of the smartphone
+                        db.session.commit()
+                        otp_counter = self.check_challenge_response(options={"transaction_id": transaction_id})
+                        elapsed_time = time.time() - starttime
+                        if otp_counter >= 0 or elapsed_time > waiting or elapsed_time < 0:
+                            break
+                        answered.wait(min(notifier.poll_interval, waiting - elapsed_time + DELAY))
+                        answered.clear()
 
         return pin_match, otp_counter, reply
 
@@ -60,7 +60,9 @@ from .realm import (get_realms, realm_is_defined,
                     get_realm, get_realm_id)
 from .config import get_from_config, SYSCONF
 from .framework import get_app_config_value
-from .usercache import (user_cache, cache_username, user_init, delete_user_cache)
+from .requeststats import request_timer, RESOLVER
+from .usercache import (user_cache, cache_username, user_init, delete_user_cache,
+                        is_cache_enabled, get_cached_usernames, add_usernames_to_cache)
 from privacyidea.models import CustomUserAttribute, db
 
 log = logging.getLogger(__name__)
@@ -124,15 +126,16 @@ class User(object):
             if y is None:
                 raise UserError("The resolver '{0!s}' does not exist!".format(
                     self.resolver))
-            if self.uid is None:
-                # Determine the uid
-                self.uid = y.getUserId(self.login)
-            if not self.login:
-                # Determine the login if it does not exist or
-                self.used_login = self.login = y.getUsername(self.uid)
-            if y.has_multiple_loginnames:
-                # if the resolver has multiple logins the primary login might be another value!
-                self.login = y.getUsername(self.uid)
+            with request_timer(RESOLVER):
+                if self.uid is None:
+                    # Determine the uid
+                    self.uid = y.getUserId(self.login)
+                if not self.login:
+                    # Determine the login if it does not exist or
+                    self.used_login = self.login = y.getUsername(self.uid)
+                if y.has_multiple_loginnames:
+                    # if the resolver has multiple logins the primary login might be another value!
+                    self.login = y.getUsername(self.uid)
 
     def is_empty(self):
         # ignore if only resolver is set! as it makes no sense
@@ -266,7 +269,8 @@ class User(object):
             log.info("Resolver {0!r} not found!".format(resolvername))
             return False
         else:
-            uid = y.getUserId(self.login)
+            with request_timer(RESOLVER):
+                uid = y.getUserId(self.login)
             if uid not in ["", None]:
                 log.info("user {0!r} found in resolver {1!r}".format(self.login,
                                                                      resolvername))
@@ -317,7 +321,8 @@ class User(object):
         if uid is None:
             return {}
         y = get_resolver_object(self.resolver)
-        user_info = y.getUserInfo(uid)
+        with request_timer(RESOLVER):
+            user_info = y.getUserInfo(uid)
         # Now add the custom attributes, this is used e.g. in ADDUSERINRESPONSE
         user_info.update(self.attributes)
         return user_info
@@ -458,7 +463,9 @@ class User(object):
             if len(res) == 1:
                 y = get_resolver_object(self.resolver)
                 uid, _rtype, _rname = self.get_user_identifiers()
-                if y.checkPass(uid, password):
+                with request_timer(RESOLVER):
+                    password_ok = y.checkPass(uid, password)
+                if password_ok:
                     success = f"{self.login}@{self.realm}"
                     log.debug(f"Successfully authenticated user {self}.")
                     self._checked_passwords[password_hash] = True
@@ -527,7 +534,9 @@ class User(object):
                     log.warning("The resolver {0!r} is not updateable.".format(y))
                 else:
                     uid, _rtype, _rname = self.get_user_identifiers()
-                    if y.update_user(uid, attributes):
+                    with request_timer(RESOLVER):
+                        updated = y.update_user(uid, attributes)
+                    if updated:
                         success = True
                         # Delete entries corresponding to the old username from the user cache
                         delete_user_cache(username=self.login, resolver=self.resolver)
@@ -564,7 +573,9 @@ class User(object):
                     log.warning("The resolver {0!r} is not updateable.".format(y))
                 else:
                     uid, _rtype, _rname = self.get_user_identifiers()
-                    if y.delete_user(uid):
+                    with request_timer(RESOLVER):
+                        deleted = y.delete_user(uid)
+                    if deleted:
                         success = True
                         log.info("Successfully deleted user {0!r}.".format(self))
                         # Delete corresponding entry from the user cache
@@ -607,7 +618,8 @@ def create_user(resolvername, attributes, password=None):
     if password is not None:
         attributes["password"] = password
     y = get_resolver_object(resolvername)
-    uid = y.add_user(attributes)
+    with request_timer(RESOLVER):
+        uid = y.add_user(attributes)
     return uid
 
 
@@ -760,7 +772,8 @@ def get_user_list(param=None, user=None, custom_attributes=False):
             log.debug("Check for resolver class: {0!r}".format(resolver_name))
             y = get_resolver_object(resolver_name)
             log.debug("with this search dictionary: {0!r} ".format(searchDict))
-            ulist = y.getUserList(searchDict)
+            with request_timer(RESOLVER):
+                ulist = y.getUserList(searchDict)
             # Add resolvername to the list
             realm_id = get_realm_id(param_realm or user_realm)
             for ue in ulist:
@@ -803,10 +816,40 @@ def get_username(userid, resolvername):
     if userid:
         y = get_resolver_object(resolvername)
         if y:
-            username = y.getUsername(userid)
+            with request_timer(RESOLVER):
+                username = y.getUsername(userid)
     return username
 
 
+@log_with(log)
+def get_usernames(userids, resolvername):
+    """
+    Determine the usernames for several ids of a resolver. The user cache is
+    checked for all ids at once and the remaining users are looked up with
+    a bulk request to the resolver. These are added to the user cache.
+
+    :param userids: The ids of the users in the resolver
+    :type userids: list
+    :param resolvername: The name of the resolver
+    :return: dictionary of the ids and the usernames. The username is ""
+        if the user does not exist.
+    :rtype: dict
+    """
+    userids = [userid for userid in dict.fromkeys(userids) if userid]
+    usernames = {}
+    if userids and is_cache_enabled():
+        usernames = get_cached_usernames(resolvername, userids)
+    missing = [userid for userid in userids if userid not in usernames]
+    if missing:
+        y = get_resolver_object(resolvername)
+        if y:
+            with request_timer(RESOLVER):
+                found = y.getUsernameMany(missing)
+            add_usernames_to_cache(resolvername, found)
+            usernames.update(found)
+    return usernames
+
+
 def log_used_user(user: User, other_text: str = "") -> str:
     """
     This creates a log message combined of a user and another text.
@@ -14,18 +14,47 @@
 # You should have received a copy of the GNU Affero General Public
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+__doc__ = """The user cache stores the login names and user IDs of the users of
+the resolvers in the database table ``usercache``.
+
+Each process keeps the recently used entries in memory in front of the
+database table. This local cache is configured in ``pi.cfg``:
+
+* ``PI_USERCACHE_LOCAL_TTL``: the seconds an entry is kept in memory
+  (default: 5). ``0`` disables the local cache.
+* ``PI_USERCACHE_LOCAL_MAX_ENTRIES``: the maximum number of entries in
+  memory (default: 10000).
+* ``PI_USERCACHE_STATS_INTERVAL``: the seconds between two hit ratios
+  written to the monitoring statistics (default: 0, which disables writing
+  the statistics).
+
+This module is tested in tests/test_lib_usercache.py
+"""
 import functools
 
 import logging
 
 import datetime
+import threading
+import time
 
 from privacyidea.lib.config import get_from_config
+from privacyidea.lib.framework import get_app_local_store, get_app_config_value
+from privacyidea.lib.lifecycle import register_finalizer
+from privacyidea.lib.lrucache import LRUCache, CacheStats, MISSING
+from privacyidea.lib.monitoringstats import write_stats
+from privacyidea.lib.sqlutils import delete_chunked, commit_or_flush
 from privacyidea.models import UserCache, db
 from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
 
 log = logging.getLogger(__name__)
 EXPIRATION_SECONDS = "UserCacheExpiration"
+# The maximum number of users, which are read from the cache with one query
+BULK_QUERY_SIZE = 500
+# The keys of the hit ratios in the monitoring statistics
+STATS_HIT_RATIO = "usercache_hit_ratio"
+STATS_LOCAL_HIT_RATIO = "usercache_local_hit_ratio"
 
 
 class user_cache(object):
@@ -84,7 +113,144 @@ def is_cache_enabled():
     return bool(get_cache_time())
 
 
-def delete_user_cache(resolver=None, username=None, expired=None):
+class LocalUserCache(LRUCache):
+    """
+    The in-memory cache of a process in front of the user cache table. The
+    entries keep the timestamp of the database entry, so that they expire
+    with the database entry, even if the expiration timeout is changed.
+
+    The statistics of the local cache count the hits in memory. The lookups
+    in the database table are counted in ``db_stats``.
+    """
+
+    def __init__(self, max_entries=10000, ttl=5):
+        super(LocalUserCache, self).__init__(max_entries)
+        self.ttl = ttl
+        self.db_stats = CacheStats()
+        self._stats_lock = threading.Lock()
+        # time and counters of the last statistics written to the database
+        self._last_stats = (time.monotonic(), 0, 0, 0)
+
+    def lookup(self, key, cache_time):
+        """
+        Return the cached value or ``MISSING``. Each lookup is counted as a
+        local hit or as a local miss.
+        """
+        value = MISSING
+        if self.ttl > 0:
+            entry = self.get(key, count=False)
+            if entry is not MISSING:
+                value, timestamp = entry
+                if timestamp < datetime.datetime.now() - cache_time:
+                    self.delete(key)
+                    value = MISSING
+        if value is MISSING:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        return value
+
+    def store(self, key, value, timestamp, cache_time):
+        """
+        Keep the value of a database entry with the given timestamp
+        """
+        remaining = (timestamp + cache_time - datetime.datetime.now()).total_seconds()
+        ttl = min(self.ttl, remaining)
+        if ttl > 0:
+            self.set(key, (value, timestamp), ttl)
+
+    def get_stats(self):
+        """
+        Return the hits in memory and in the database table, the misses and
+        the hit ratios in percent.
+
+        :rtype: dict
+        """
+        local_hits = self.stats.hits
+        db_hits = self.db_stats.hits
+        misses = self.db_stats.misses
+        lookups = local_hits + db_hits + misses
+        return {"local_hits": local_hits,
+                "db_hits": db_hits,
+                "misses": misses,
+                "evictions": self.stats.evictions,
+                "hit_ratio": 100 * (local_hits + db_hits) // lookups if lookups else 0,
+                "local_hit_ratio": 100 * local_hits // lookups if lookups else 0}
+
+    def stats_due(self, interval):
+        """
+        Check if the statistics need to be written. Only one caller gets
+        ``True`` within the interval.
+        """
+        with self._stats_lock:
+            last_time = self._last_stats[0]
+            if interval <= 0 or time.monotonic() - last_time < interval:
+                return False
+            self._last_stats = (time.monotonic(),) + self._last_stats[1:]
+            return True
+
+    def write_stats(self):
+        """
+        Write the hit ratios since the last call to the monitoring statistics
+        """
+        with self._stats_lock:
+            counters = (self.stats.hits, self.db_stats.hits, self.db_stats.misses)
+            last_counters = self._last_stats[1:]
+            self._last_stats = (self._last_stats[0],) + counters
+        local_hits, db_hits, misses = [new - old for new, old in zip(counters, last_counters)]
+        lookups = local_hits + db_hits + misses
+        if lookups:
+            write_stats(STATS_HIT_RATIO, 100 * (local_hits + db_hits) // lookups)
+            write_stats(STATS_LOCAL_HIT_RATIO, 100 * local_hits // lookups)
+
+
+def get_local_user_cache():
+    """
+    Return the in-memory user cache of this process.
+
+    :rtype: LocalUserCache
+    """
+    store = get_app_local_store()
+    local_cache = store.get("user_cache")
+    if local_cache is None:
+        local_cache = LocalUserCache(int(get_app_config_value("PI_USERCACHE_LOCAL_MAX_ENTRIES", 10000)),
+                                     float(get_app_config_value("PI_USERCACHE_LOCAL_TTL", 5)))
+        local_cache = store.setdefault("user_cache", local_cache)
+    return local_cache
+
+
+def get_user_cache_stats():
+    """
+    Return the hits, misses and hit ratios of the user cache of this process.
+
+    :rtype: dict
+    """
+    return get_local_user_cache().get_stats()
+
+
+def _count_db_lookup(local_cache, hit):
+    """
+    Count a lookup in the database table and register writing the
+    statistics at the end of the request, if they are due.
+    """
+    if hit:
+        local_cache.db_stats.hits += 1
+    else:
+        local_cache.db_stats.misses += 1
+    if local_cache.stats_due(float(get_app_config_value("PI_USERCACHE_STATS_INTERVAL", 0))):
+        register_finalizer(local_cache.write_stats)
+
+
+def _store_locally(local_cache, username, used_login, resolver, user_id, timestamp, cache_time):
+    """
+    Keep a database entry in the in-memory cache for the lookups by user ID
+    and by login name.
+    """
+    local_cache.store(("uid", resolver, user_id), username, timestamp, cache_time)
+    local_cache.store(("login", resolver, used_login), (username, user_id), timestamp, cache_time)
+
+
+def delete_user_cache(resolver=None, username=None, expired=None, chunksize=None):
     """
     This completely deletes the user cache.
     If no parameter is given, it deletes the user cache completely.
@@ -93,36 +259,146 @@ def delete_user_cache(resolver=None, username=None, expired=None):
     :param username: Will only delete entries of this username
     :param expired: Will delete expired (True) or non-expired (False) entries
         or will not care about the expiration date (None)
+    :param chunksize: If given, the entries are deleted in chunks of this
+        size with a commit after each chunk
 
     :return: number of deleted entries
     :rtype: int
     """
     filter_condition = create_filter(username=username, resolver=resolver,
                                      expired=expired)
-    rowcount = db.session.query(UserCache).filter(filter_condition).delete()
-    db.session.commit()
+    if chunksize is None:
+        rowcount = db.session.query(UserCache).filter(filter_condition).delete()
+        db.session.commit()
+    else:
+        rowcount = delete_chunked(db.session, UserCache.__table__, filter_condition, chunksize)
+    # The entries can not be found in memory by their username, so the
+    # in-memory cache of this process is cleared completely.
+    get_local_user_cache().clear()
     log.info('Deleted {} entries from the user cache (resolver={!r}, username={!r}, expired={!r})'.format(
         rowcount, resolver, username, expired
     ))
     return rowcount
 
 
+def _update_entry(username, used_login, resolver, user_id, timestamp):
+    """
+    Update the entry of the login name in the resolver
+
+    :return: True, if the entry exists
+    """
+    return bool(UserCache.query.filter(UserCache.used_login == used_login,
+                                       UserCache.resolver == resolver)
+                .update({UserCache.username: username,
+                         UserCache.user_id: user_id,
+                         UserCache.timestamp: timestamp}, synchronize_session=False))
+
+
 def add_to_cache(username, used_login, resolver, user_id):
     """
     Add the given record to the user cache, if it is enabled.
     The user cache is considered disabled if the config option
     EXPIRATION_SECONDS is set to 0.
+    The user cache contains one entry per login name and resolver. If the
+    entry already exists, it is updated.
+
     :param username: login name of the user
     :param used_login: login name that was used in request
     :param resolver: resolver name of the user
     :param user_id: ID of the user in its resolver
     """
-    if is_cache_enabled():
+    cache_time = get_cache_time()
+    if cache_time:
         timestamp = datetime.datetime.now()
         log.debug('Adding record to cache: ({!r}, {!r}, {!r}, {!r}, {!r})'.format(
             username, used_login, resolver, user_id, timestamp))
-        record = UserCache(username, used_login, resolver, user_id, timestamp)
-        record.save()
+        try:
+            # A savepoint keeps the other changes of a unit of work, if the
+            # entry was added by another request in the meantime
+            with db.session.begin_nested():
+                if not _update_entry(username, used_login, resolver, user_id, timestamp):
+                    db.session.add(UserCache(username, used_login, resolver, user_id, timestamp))
+        except IntegrityError:
+            _update_entry(username, used_login, resolver, user_id, timestamp)
+        commit_or_flush(db.session)
+        _store_locally(get_local_user_cache(), username, used_login, resolver, user_id,
+                       timestamp, cache_time)
+
+
+def add_usernames_to_cache(resolver, usernames):
+    """
+    Add the usernames of several users of a resolver to the user cache with
+    one commit, if the cache is enabled. Existing entries of the usernames
+    are updated.
+
+    :param resolver: resolver name of the users
+    :param usernames: dictionary of the user IDs and the login names
+    """
+    cache_time = get_cache_time()
+    # The entries are unique per login name
+    user_ids = {username: user_id for user_id, username in usernames.items() if username}
+    if cache_time and user_ids:
+        timestamp = datetime.datetime.now()
+        log.debug('Adding {0!s} records of resolver {1!r} to cache'.format(len(user_ids), resolver))
+        missing = dict(user_ids)
+        names = list(user_ids)
+        try:
+            with db.session.begin_nested():
+                for i in range(0, len(names), BULK_QUERY_SIZE):
+                    for entry in UserCache.query.filter(UserCache.resolver == resolver,
+                                                        UserCache.used_login.in_(names[i:i + BULK_QUERY_SIZE])):
+                        if entry.used_login in missing:
+                            entry.username = entry.used_login
+                            entry.user_id = missing.pop(entry.used_login)
+                            entry.timestamp = timestamp
+                db.session.add_all([UserCache(username, username, resolver, user_id, timestamp)
+                                    for username, user_id in missing.items()])
+        except IntegrityError:
+            # Some entries were added by another request in the meantime
+            for username, user_id in user_ids.items():
+                add_to_cache(username, username, resolver, user_id)
+            return
+        commit_or_flush(db.session)
+        local_cache = get_local_user_cache()
+        for username, user_id in user_ids.items():
+            _store_locally(local_cache, username, username, resolver, user_id, timestamp, cache_time)
+
+
+def get_cached_usernames(resolver, user_ids):
+    """
+    Return the usernames of several users of a resolver, which are found in
+    the user cache.
+
+    :param resolver: resolver name of the users
+    :param user_ids: list of user IDs
+    :return: dictionary of the user IDs and the login names
+    """
+    usernames = {}
+    cache_time = get_cache_time()
+    local_cache = get_local_user_cache()
+    missing = []
+    for user_id in user_ids:
+        username = local_cache.lookup(("uid", resolver, user_id), cache_time)
+        if username is MISSING:
+            missing.append(user_id)
+        else:
+            usernames[user_id] = username
+    for i in range(0, len(missing), BULK_QUERY_SIZE):
+        chunk = missing[i:i + BULK_QUERY_SIZE]
+        entries = UserCache.query.filter(create_filter(resolver=resolver),
+                                         UserCache.user_id.in_(chunk)) \
+            .order_by(UserCache.timestamp)
+        # The most recently added entry wins
+        found = {}
+        for entry in entries:
+            found[entry.user_id] = entry
+        for user_id in chunk:
+            entry = found.get(user_id)
+            if entry:
+                usernames[user_id] = entry.username
+                local_cache.store(("uid", resolver, user_id), entry.username, entry.timestamp, cache_time)
+            _count_db_lookup(local_cache, bool(entry))
+    return usernames
 
 
 def retrieve_latest_entry(filter_condition):
@@ -177,14 +453,22 @@ def cache_username(wrapped_function, userid, resolvername):
     names based on a user ID and a resolver name.
     After a successful lookup, the entry is added to the cache.
     """
+    cache_time = get_cache_time()
+    local_cache = get_local_user_cache()
+    username = local_cache.lookup(("uid", resolvername, userid), cache_time)
+    if username is not MISSING:
+        log.debug('Found username of {!r}/{!r} in memory: {!r}'.format(userid, resolvername, username))
+        return username
 
     # try to fetch the record from the UserCache
     filter_conditions = create_filter(user_id=userid,
                                       resolver=resolvername)
     result = retrieve_latest_entry(filter_conditions)
+    _count_db_lookup(local_cache, bool(result))
     if result:
         username = result.username
         log.debug('Found username of {!r}/{!r} in cache: {!r}'.format(userid, resolvername, username))
+        local_cache.store(("uid", resolvername, userid), username, result.timestamp, cache_time)
         return username
     else:
         # record was not found in the cache
@@ -208,15 +492,23 @@ def user_init(wrapped_function, self):
     else:
         # In order to query the user cache, we need to find out the resolver
         resolvers = self.get_ordered_resolvers()
+    cache_time = get_cache_time()
+    local_cache = get_local_user_cache()
     for resolvername in resolvers:
         # If we could figure out a resolver, we can query the user cache
-        filter_conditions = create_filter(used_login=self.used_login, resolver=resolvername)
-        result = retrieve_latest_entry(filter_conditions)
-        if result:
+        cached = local_cache.lookup(("login", resolvername, self.used_login), cache_time)
+        if cached is MISSING:
+            filter_conditions = create_filter(used_login=self.used_login, resolver=resolvername)
+            result = retrieve_latest_entry(filter_conditions)
+            _count_db_lookup(local_cache, bool(result))
+            if result:
+                cached = (result.username, result.user_id)
+                local_cache.store(("login", resolvername, self.used_login), cached,
+                                  result.timestamp, cache_time)
+        if cached is not MISSING:
             # Cached user exists, retrieve information and exit early
-            self.login = result.username
-            self.resolver = result.resolver
-            self.uid = result.user_id
+            self.login, self.uid = cached
+            self.resolver = resolvername
             return
         else:
             # If the user does not exist in the cache, we actually query the resolver
@@ -35,6 +35,7 @@
 """privacyIDEA Database definition"""
 
 import binascii
+import hashlib
 import logging
 import traceback
 from datetime import datetime, timedelta, timezone
@@ -45,16 +46,18 @@ from flask_sqlalchemy import SQLAlchemy
 
 from privacyidea.lib.crypto import (encrypt, encryptPin, decryptPin,
                                     geturandom, hash, SecretObj, pass_hash,
-                                    verify_pass_hash, get_rand_digit_str)
-from sqlalchemy import and_
+                                    verify_and_update_pass_hash, get_rand_digit_str)
+from sqlalchemy import and_, bindparam
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.schema import Sequence, CreateSequence
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.exc import IntegrityError
 from .lib.log import log_with
 from privacyidea.lib.utils import (is_true, convert_column_to_unicode,
-                                   hexlify_and_unicode)
-from privacyidea.lib.framework import get_app_config_value
+                                   hexlify_and_unicode, to_bytes)
+from privacyidea.lib.framework import get_app_config_value, get_request_local_store
 from privacyidea.lib.error import DatabaseError
+from privacyidea.lib.sqlutils import commit_or_flush
 
 log = logging.getLogger(__name__)
 
@@ -66,7 +69,12 @@ log = logging.getLogger(__name__)
 
 implicit_returning = True
 PRIVACYIDEA_TIMESTAMP = "__timestamp__"
+# The shared configuration is divided into these categories. Each category has
+# its own timestamp, so that only the changed categories need to be reloaded.
+CONFIG_CATEGORIES = ["config", "resolver", "realm", "policy", "event", "caconnector"]
 SAFE_STORE = "PI_DB_SAFE_STORE"
+# Key in the request local store for the results of the PIN hash verification
+PIN_VERIFICATION_CACHE = "pin_verification_cache"
 
 db = SQLAlchemy()
 
@@ -95,30 +103,57 @@ class MethodsMixin(object):
 
     def save(self):
         db.session.add(self)
-        db.session.commit()
+        commit_or_flush(db.session)
         return self.id
 
     def delete(self):
         ret = self.id
         db.session.delete(self)
-        db.session.commit()
+        commit_or_flush(db.session)
         return ret
 
 
-def save_config_timestamp(invalidate_config=True):
+def get_config_timestamp_key(category):
+    """
+    Return the key of the config entry, which holds the timestamp of the
+    given configuration category.
+
+    :param category: one of ``CONFIG_CATEGORIES``
+    :return: the config key like ``__timestamp_policy__``
+    """
+    return "__timestamp_{0!s}__".format(category)
+
+
+CONFIG_TIMESTAMP_KEYS = [PRIVACYIDEA_TIMESTAMP] + [get_config_timestamp_key(c) for c in CONFIG_CATEGORIES]
+
+
+def save_config_timestamp(invalidate_config=True, category=None):
     """
     Save the current timestamp to the database, and optionally
     invalidate the current request-local config object.
+
+    The global timestamp is always updated. Additionally, the timestamp of the
+    given configuration category is updated. If no category is given, the
+    timestamps of all categories are updated, so that the complete
+    configuration will be reloaded.
+
     :param invalidate_config: defaults to True
-    """
-    c1 = Config.query.filter_by(Key=PRIVACYIDEA_TIMESTAMP).first()
-    if c1:
-        c1.Value = datetime.now().strftime("%s")
-    else:
-        new_timestamp = Config(PRIVACYIDEA_TIMESTAMP,
-                               datetime.now().strftime("%s"),
-                               Description="config timestamp. last changed.")
-        db.session.add(new_timestamp)
+    :param category: The changed configuration category (one of ``CONFIG_CATEGORIES``)
+    """
+    now = datetime.now()
+    # The global timestamp is compared against the time of the last reload,
+    # the category timestamps need to be distinct for each change.
+    timestamps = {PRIVACYIDEA_TIMESTAMP: (now.strftime("%s"), "config timestamp. last changed.")}
+    for c in ([category] if category else CONFIG_CATEGORIES):
+        timestamps[get_config_timestamp_key(c)] = (now.strftime("%s.%f"),
+                                                   "config timestamp of the {0!s} "
+                                                   "configuration. last changed.".format(c))
+    entries = {c.Key: c for c in Config.query.filter(Config.Key.in_(list(timestamps)))}
+    for key, (timestamp, description) in timestamps.items():
+        if key in entries:
+            entries[key].Value = timestamp
+        else:
+            db.session.add(Config(key, timestamp, Description=description))
     if invalidate_config:
         # We have just modified the config. From now on, the request handling
         # should operate on the *new* config. Hence, we need to invalidate
@@ -133,17 +168,19 @@ class TimestampMethodsMixin(object):
     """
     This class mixes in the table functions including update of the timestamp
     """
+    # The configuration category, which is changed by this table
+    config_category = None
 
     def save(self):
         db.session.add(self)
-        save_config_timestamp()
+        save_config_timestamp(category=self.config_category)
         db.session.commit()
         return self.id
 
     def delete(self):
         ret = self.id
         db.session.delete(self)
-        save_config_timestamp()
+        save_config_timestamp(category=self.config_category)
         db.session.commit()
         return ret
 
@@ -271,10 +308,15 @@ class Token(MethodsMixin, db.Model):
                 db.session.add(to)
 
             if tr or to:
-                db.session.commit()
+                commit_or_flush(db.session)
 
     @property
     def first_owner(self):
+        # The owners of a list of tokens can be loaded together, see
+        # privacyidea.lib.token.prefetch_token_list_data
+        prefetched_owner = getattr(self, "_prefetched_owner", None)
+        if prefetched_owner is not None:
+            return prefetched_owner[0]
         return self.owners.first()
 
     @property
@@ -303,8 +345,11 @@ class Token(MethodsMixin, db.Model):
         db.session.query(TokenTokengroup) \
             .filter(TokenTokengroup.token_id == self.id) \
             .delete()
+        db.session.query(OTPIndex) \
+            .filter(OTPIndex.token_id == self.id) \
+            .delete()
         db.session.delete(self)
-        db.session.commit()
+        commit_or_flush(db.session)
         return ret
 
     @staticmethod
@@ -368,7 +413,7 @@ class Token(MethodsMixin, db.Model):
                     # If the Tokengroup is not yet attached to the token
                     Tg = TokenTokengroup(token_id=self.id, tokengroup_id=g.id)
                     db.session.add(Tg)
-        db.session.commit()
+        commit_or_flush(db.session)
 
     def set_realms(self, realms, add=False):
         """
@@ -403,7 +448,7 @@ class Token(MethodsMixin, db.Model):
                     # If the realm is not yet attached to the token
                     token_realm = TokenRealm(token_id=self.id, realm_id=realm_db.id)
                     db.session.add(token_realm)
-        db.session.commit()
+        commit_or_flush(db.session)
 
     def get_realms(self):
         """
@@ -511,16 +556,44 @@ class Token(MethodsMixin, db.Model):
                 if self.pin_hash:
                     try:
                         # New PIN verification
-                        return verify_pass_hash(pin, self.pin_hash)
+                        res, new_pin_hash = self._verify_pin_hash(pin)
                     except ValueError as _e:
                         # old PIN verification
                         pin_hash = self.get_hashed_pin(pin)
+                    else:
+                        if new_pin_hash:
+                            # The PIN hash was created with another hash algorithm or
+                            # other parameters, so we store the PIN with the current ones.
+                            log.info("Updating the PIN hash of token {0!s}.".format(self.serial))
+                            self.pin_hash = new_pin_hash
+                            self.save()
+                        return res
                 else:
                     pin_hash = pin
                 if pin_hash == (self.pin_hash or ""):
                     res = True
         return res
 
+    def _verify_pin_hash(self, pin):
+        """
+        Verify the PIN against the PIN hash of the token.
+
+        If the verification cache was enabled for this request (see
+        ``check_token_list``), the result of the expensive hash verification is
+        remembered for the combination of PIN hash and PIN. Thus, tokens with the
+        same PIN hash (e.g. after copying the PIN) or repeated checks of the same
+        token only verify the hash once per request.
+
+        :return: tuple of the verification result and the new PIN hash or None
+        """
+        cache = get_request_local_store().get(PIN_VERIFICATION_CACHE)
+        if cache is None:
+            return verify_and_update_pass_hash(pin, self.pin_hash)
+        key = (self.pin_hash, hashlib.sha256(to_bytes(pin)).digest())
+        if key not in cache:
+            cache[key] = verify_and_update_pass_hash(pin, self.pin_hash)
+        return cache[key]
+
     def is_pin_encrypted(self, pin=None):
         ret = False
         if pin is None:
@@ -640,10 +713,9 @@ class Token(MethodsMixin, db.Model):
         for k, v in info.items():
             if k.endswith(".type"):
                 types[".".join(k.split(".")[:-1])] = v
-        for k, v in info.items():
-            if not k.endswith(".type"):
-                TokenInfo(self.id, k, v, Type=types.get(k)).save(persistent=False)
-        db.session.commit()
+        upsert_tokeninfo(self.id, {k: (v, types.get(k)) for k, v in info.items()
+                                   if not k.endswith(".type")})
+        commit_or_flush(db.session)
 
     def del_info(self, key=None):
         """
@@ -657,8 +729,8 @@ class Token(MethodsMixin, db.Model):
             tokeninfos = TokenInfo.query.filter_by(token_id=self.id, Key=key)
         else:
             tokeninfos = TokenInfo.query.filter_by(token_id=self.id)
-        for ti in tokeninfos:
-            ti.delete()
+        tokeninfos.delete()
+        commit_or_flush(db.session)
 
     def del_tokengroup(self, tokengroup=None, tokengroup_id=None):
         """
@@ -768,7 +840,7 @@ class TokenInfo(MethodsMixin, db.Model):
         if ti is None:
             # create a new one
             db.session.add(self)
-            db.session.commit()
+            commit_or_flush(db.session)
             if get_app_config_value(SAFE_STORE, False):
                 ti = ti_func()
                 ret = ti.id
@@ -782,10 +854,100 @@ class TokenInfo(MethodsMixin, db.Model):
                                                             'Type': self.Type})
             ret = ti.id
         if persistent:
-            db.session.commit()
+            commit_or_flush(db.session)
         return ret
 
 
+def _get_tokeninfo_upsert(dialect, rows):
+    """
+    Return the upsert statement for the given token info rows, if the database
+    dialect supports it.
+
+    :param dialect: The name of the database dialect
+    :param rows: list of dictionaries with the column values
+    :return: The statement or None
+    """
+    table = TokenInfo.__table__
+    if dialect in ["postgresql", "sqlite"]:
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(table).values(rows)
+        return stmt.on_conflict_do_update(
+            index_elements=[table.c.token_id, table.c.Key],
+            set_={"Value": stmt.excluded.Value, "Type": stmt.excluded.Type,
+                  "Description": stmt.excluded.Description})
+    if dialect in ["mysql", "mariadb"]:
+        stmt = mysql.insert(table).values(rows)
+        return stmt.on_duplicate_key_update(Value=stmt.inserted.Value, Type=stmt.inserted.Type,
+                                            Description=stmt.inserted.Description)
+    return None
+
+
+def upsert_tokeninfo(token_id, entries):
+    """
+    Insert or update the token info entries of a token. With PostgreSQL,
+    MySQL/MariaDB and SQLite all entries are written with one upsert
+    statement. With other databases the existing keys are read with one query
+    and the entries are updated and inserted with one statement each.
+
+    :param token_id: The database ID of the token
+    :param entries: dictionary of the keys and tuples of the value and the type
+    :type entries: dict
+    """
+    if not entries:
+        return
+    rows = [{"token_id": token_id, "Key": key, "Value": convert_column_to_unicode(value),
+             "Type": value_type, "Description": None}
+            for key, (value, value_type) in entries.items()]
+    stmt = _get_tokeninfo_upsert(db.session.get_bind().dialect.name, rows)
+    if stmt is not None:
+        db.session.execute(stmt)
+        return
+    table = TokenInfo.__table__
+    existing = {key for key, in db.session.query(TokenInfo.Key).filter(
+        TokenInfo.token_id == token_id, TokenInfo.Key.in_(list(entries)))}
+    updates = [{"b_token_id": row["token_id"], "b_Key": row["Key"], "Value": row["Value"],
+                "Type": row["Type"], "Description": row["Description"]}
+               for row in rows if row["Key"] in existing]
+    inserts = [row for row in rows if row["Key"] not in existing]
+    if updates:
+        db.session.execute(table.update()
+                           .where(and_(table.c.token_id == bindparam("b_token_id"),
+                                       table.c.Key == bindparam("b_Key")))
+                           .values(Value=bindparam("Value"), Type=bindparam("Type"),
+                                   Description=bindparam("Description")),
+                           updates)
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+
+
+class OTPIndex(MethodsMixin, db.Model):
+    """
+    The table "otpindex" contains the upcoming OTP values of HOTP tokens, so that
+    a token can be found by its OTP value without calculating the OTP values of
+    all tokens. The OTP values are only stored as keyed hash values.
+
+    The fingerprint identifies the OTP key, the OTP length and the hash
+    algorithm, with which the values were calculated.
+    """
+    __tablename__ = 'otpindex'
+    __table_args__ = (db.UniqueConstraint('token_id',
+                                          'counter',
+                                          name='otpiix_1'),
+                      {'mysql_row_format': 'DYNAMIC'})
+    id = db.Column(db.Integer, Sequence("otpindex_seq"), primary_key=True)
+    token_id = db.Column(db.Integer(),
+                         db.ForeignKey('token.id'), index=True)
+    counter = db.Column(db.Integer(), nullable=False)
+    otp_hash = db.Column(db.Unicode(64), nullable=False, index=True)
+    fingerprint = db.Column(db.Unicode(64), nullable=False)
+
+    def __init__(self, token_id, counter, otp_hash, fingerprint):
+        self.token_id = token_id
+        self.counter = counter
+        self.otp_hash = otp_hash
+        self.fingerprint = fingerprint
+
+
 class CustomUserAttribute(MethodsMixin, db.Model):
     """
     The table "customuserattribute" is used to store additional, custom attributes
@@ -901,6 +1063,7 @@ class Config(TimestampMethodsMixin, db.Model):
     stored in specific tables.
     """
     __tablename__ = "config"
+    config_category = "config"
     __table_args__ = {'mysql_row_format': 'DYNAMIC'}
     Key = db.Column(db.Unicode(255),
                     primary_key=True,
@@ -921,14 +1084,14 @@ class Config(TimestampMethodsMixin, db.Model):
 
     def save(self):
         db.session.add(self)
-        save_config_timestamp()
+        save_config_timestamp(category="config")
         db.session.commit()
         return self.Key
 
     def delete(self):
         ret = self.Key
         db.session.delete(self)
-        save_config_timestamp()
+        save_config_timestamp(category="config")
         db.session.commit()
         return ret
 
@@ -940,6 +1103,7 @@ class Realm(TimestampMethodsMixin, db.Model):
     the realms. The linking to resolvers is stored in the table "resolverrealm".
     """
     __tablename__ = 'realm'
+    config_category = "realm"
     __table_args__ = {'mysql_row_format': 'DYNAMIC'}
     id = db.Column(db.Integer, Sequence("realm_seq"), primary_key=True,
                    nullable=False)
@@ -968,7 +1132,7 @@ class Realm(TimestampMethodsMixin, db.Model):
             .delete()
         # delete the realm
         db.session.delete(self)
-        save_config_timestamp()
+        save_config_timestamp(category="realm")
         db.session.commit()
         return ret
 
@@ -980,6 +1144,7 @@ class CAConnector(TimestampMethodsMixin, db.Model):
     stored in the table "caconnectorconfig".
     """
     __tablename__ = 'caconnector'
+    config_category = "caconnector"
     __table_args__ = {'mysql_row_format': 'DYNAMIC'}
     id = db.Column(db.Integer, Sequence("caconnector_seq"), primary_key=True,
                    nullable=False)
@@ -1003,7 +1168,7 @@ class CAConnector(TimestampMethodsMixin, db.Model):
             .delete()
         # Delete the CA itself
         db.session.delete(self)
-        save_config_timestamp()
+        save_config_timestamp(category="caconnector")
         db.session.commit()
         return ret
 
@@ -1050,7 +1215,7 @@ class CAConnectorConfig(db.Model):
     def save(self):
         c = CAConnectorConfig.query.filter_by(caconnector_id=self.caconnector_id,
                                               Key=self.Key).first()
-        save_config_timestamp()
+        save_config_timestamp(category="caconnector")
         if c is None:
             # create a new one
             db.session.add(self)
@@ -1085,6 +1250,7 @@ class Resolver(TimestampMethodsMixin, db.Model):
     configuration of the resolvers is stored in the table "resolverconfig".
     """
     __tablename__ = 'resolver'
+    config_category = "resolver"
     __table_args__ = {'mysql_row_format': 'DYNAMIC'}
     id = db.Column(db.Integer, Sequence("resolver_seq"), primary_key=True,
                    nullable=False)
@@ -1111,7 +1277,7 @@ class Resolver(TimestampMethodsMixin, db.Model):
             .delete()
         # delete the Resolver itself
         db.session.delete(self)
-        save_config_timestamp()
+        save_config_timestamp(category="resolver")
         db.session.commit()
         return ret
 
@@ -1127,6 +1293,7 @@ class ResolverConfig(TimestampMethodsMixin, db.Model):
     The config entries are referenced by the id of the resolver.
     """
     __tablename__ = 'resolverconfig'
+    config_category = "resolver"
     id = db.Column(db.Integer, Sequence("resolverconf_seq"), primary_key=True)
     resolver_id = db.Column(db.Integer,
                             db.ForeignKey('resolver.id'))
@@ -1172,7 +1339,7 @@ class ResolverConfig(TimestampMethodsMixin, db.Model):
                                                      'Descrip'
                                                      'tion': self.Description})
             ret = c.id
-        save_config_timestamp()
+        save_config_timestamp(category="resolver")
         db.session.commit()
         return ret
 
@@ -1183,6 +1350,7 @@ class ResolverRealm(TimestampMethodsMixin, db.Model):
     This is a N:M relation
     """
     __tablename__ = 'resolverrealm'
+    config_category = "realm"
     id = db.Column(db.Integer, Sequence("resolverrealm_seq"), primary_key=True)
     resolver_id = db.Column(db.Integer, db.ForeignKey("resolver.id"))
     realm_id = db.Column(db.Integer, db.ForeignKey("realm.id"))
@@ -1288,7 +1456,7 @@ class TokenOwner(MethodsMixin, db.Model):
         if to is None:
             # This very assignment does not exist, yet:
             db.session.add(self)
-            db.session.commit()
+            commit_or_flush(db.session)
             if get_app_config_value(SAFE_STORE, False):
                 to = to_func()
                 ret = to.id
@@ -1299,7 +1467,7 @@ class TokenOwner(MethodsMixin, db.Model):
             # There is nothing to update
 
         if persistent:
-            db.session.commit()
+            commit_or_flush(db.session)
         return ret
 
 
@@ -1352,7 +1520,7 @@ class TokenRealm(MethodsMixin, db.Model):
         if tr is None:
             # create a new one
             db.session.add(self)
-            db.session.commit()
+            commit_or_flush(db.session)
             if get_app_config_value(SAFE_STORE, False):
                 tr = tr_func()
                 ret = tr.id
@@ -1554,6 +1722,7 @@ class PolicyDescription(TimestampMethodsMixin, db.Model):
     The description table is used to store the description of policy
     """
     __tablename__ = 'description'
+    config_category = "policy"
     id = db.Column(db.Integer, Sequence("description_seq"), primary_key=True)
     object_id = db.Column(db.Integer, db.ForeignKey('policy.id'), nullable=False)
     object_type = db.Column(db.Unicode(64), unique=False, nullable=False)
@@ -1589,6 +1758,7 @@ class Policy(TimestampMethodsMixin, db.Model):
      * webui
     """
     __tablename__ = "policy"
+    config_category = "policy"
     __table_args__ = {'mysql_row_format': 'DYNAMIC'}
     id = db.Column(db.Integer, Sequence("policy_seq"), primary_key=True)
     active = db.Column(db.Boolean, default=True)
@@ -2022,7 +2192,7 @@ class EventHandler(MethodsMixin, db.Model):
                 "condition": self.condition,
                 "action": self.action
             })
-        save_config_timestamp()
+        save_config_timestamp(category="event")
         db.session.commit()
         return self.id
 
@@ -2038,7 +2208,7 @@ class EventHandler(MethodsMixin, db.Model):
             .delete()
         # delete the event handler itself
         db.session.delete(self)
-        save_config_timestamp()
+        save_config_timestamp(category="event")
         db.session.commit()
         return ret
 
@@ -2683,20 +2853,22 @@ class ClientApplication(MethodsMixin, db.Model):
             ClientApplication.clienttype == self.clienttype,
             ClientApplication.node == self.node).first()
         self.lastseen = datetime.now()
-        if clientapp is None:
-            # create a new one
-            db.session.add(self)
-        else:
-            # update
-            values = {"lastseen": self.lastseen}
-            if self.hostname is not None:
-                values["hostname"] = self.hostname
-            ClientApplication.query.filter(ClientApplication.id == clientapp.id).update(values)
         try:
-            db.session.commit()
+            # A failing entry must not roll back the other changes of a unit of work
+            with db.session.begin_nested():
+                if clientapp is None:
+                    # create a new one
+                    db.session.add(self)
+                else:
+                    # update
+                    values = {"lastseen": self.lastseen}
+                    if self.hostname is not None:
+                        values["hostname"] = self.hostname
+                    ClientApplication.query.filter(ClientApplication.id == clientapp.id).update(values)
         except IntegrityError as e:  # pragma: no cover
             log.info('Unable to write ClientApplication entry to db: {0!s}'.format(e))
             log.debug(traceback.format_exc())
+        commit_or_flush(db.session)
 
     def __repr__(self):
         return "<ClientApplication [{0!s}][{1!s}:{2!s}] on {3!s}>".format(
@@ -2840,7 +3012,8 @@ audit_column_length = {"signature": 620,
                        "user_agent_version": 20,
                        "policies": 255,
                        "container_serial": 20,
-                       "container_type": 20}
+                       "container_type": 20,
+                       "performance": 120}
 AUDIT_TABLE_NAME = 'pidea_audit'
 
 
@@ -2880,6 +3053,7 @@ class Audit(MethodsMixin, db.Model):
         "clearance_level")))
     thread_id = db.Column(db.Unicode(audit_column_length.get("thread_id")))
     policies = db.Column(db.Unicode(audit_column_length.get("policies")))
+    performance = db.Column(db.Unicode(audit_column_length.get("performance")))
 
     def __init__(self,
                  action="",
@@ -2904,7 +3078,8 @@ class Audit(MethodsMixin, db.Model):
                  thread_id="0",
                  policies="",
                  startdate=None,
-                 duration=None
+                 duration=None,
+                 performance=""
                  ):
         self.signature = ""
         self.date = datetime.now()
@@ -2931,13 +3106,17 @@ class Audit(MethodsMixin, db.Model):
         self.policies = convert_column_to_unicode(policies)
         self.user_agent = convert_column_to_unicode(user_agent)
         self.user_agent_version = convert_column_to_unicode(user_agent_version)
+        self.performance = convert_column_to_unicode(performance)
 
 
 ### User Cache
 
 class UserCache(MethodsMixin, db.Model):
     __tablename__ = 'usercache'
-    __table_args__ = {'mysql_row_format': 'DYNAMIC'}
+    # Each login name is cached only once per resolver
+    __table_args__ = (db.UniqueConstraint('used_login', 'resolver',
+                                          name='ucix_1'),
+                      {'mysql_row_format': 'DYNAMIC'})
     id = db.Column(db.Integer, Sequence("usercache_seq"), primary_key=True)
     username = db.Column(db.Unicode(64), default="", index=True)
     used_login = db.Column(db.Unicode(64), default="", index=True)
@@ -0,0 +1,86 @@
+"""
+Benchmark of the database commits of an authentication request. It counts the
+commits and measures the time of successful and failed HOTP authentications
+via ``/validate/check`` with the commits committed immediately (as before) and
+with the changes committed together in the unit of work of the request.
+
+Run it with
+
+    python -m tests.benchmarks.bench_auth_commits
+
+The database can be set with the environment variable TEST_DATABASE_URL.
+"""
+import binascii
+import os
+import time
+from contextlib import nullcontext
+
+import mock
+from sqlalchemy import event
+
+os.environ.setdefault("TEST_DATABASE_URL", "sqlite://")
+
+from privacyidea.app import create_app  # noqa: E402
+from privacyidea.lib.token import init_token, remove_token  # noqa: E402
+from privacyidea.lib.tokens.HMAC import HmacOtp  # noqa: E402
+from privacyidea.models import db  # noqa: E402
+
+OTPKEY = binascii.hexlify(b"12345678901234567890").decode()
+SERIAL = "BENCH0001"
+
+
+def authenticate(client, otp):
+    res = client.post("/validate/check", data={"serial": SERIAL, "pass": otp})
+    return res.json["result"]["value"]
+
+
+def measure(app, number, deferred):
+    """
+    :return: dictionary of the commits per request and the requests per second
+        of successful and failed authentications
+    """
+    tok = init_token({"serial": SERIAL, "type": "hotp", "otpkey": OTPKEY, "pin": ""})
+    # the token must not be locked by the failed authentications
+    tok.set_maxfail(number + 1)
+    hmac_otp = HmacOtp(tok.token.get_otpkey(), 0, 6)
+    commits = []
+
+    def count_commit(conn):
+        commits.append(conn)
+
+    event.listen(db.engine, "commit", count_commit)
+    results = {}
+    try:
+        with (nullcontext() if deferred else
+              mock.patch("privacyidea.api.validate.begin_unit_of_work", return_value=False)):
+            client = app.test_client()
+            for name, otps in [("success", [hmac_otp.generate(i, inc_counter=False)
+                                            for i in range(number)]),
+                               ("fail", ["000000"] * number)]:
+                del commits[:]
+                start = time.perf_counter()
+                for otp in otps:
+                    authenticate(client, otp)
+                elapsed = time.perf_counter() - start
+                results[name] = (len(commits) / number, number / elapsed)
+    finally:
+        event.remove(db.engine, "commit", count_commit)
+        remove_token(SERIAL)
+    return results
+
+
+def run(number):
+    app = create_app("testing", "", silent=True)
+    with app.app_context():
+        db.create_all()
+        for deferred in (False, True):
+            results = measure(app, number, deferred)
+            for name, (commits, rate) in results.items():
+                print("{0:<10} {1:<8} {2:5.1f} commits/request {3:8.1f} requests/s".format(
+                    "deferred" if deferred else "immediate", name, commits, rate))
+        db.session.remove()
+        db.drop_all()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    run(200)
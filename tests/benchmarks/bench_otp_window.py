@@ -0,0 +1,55 @@
+"""
+Benchmark of the OTP window search in ``HmacOtp.checkOtp``. It compares the
+former calculation, which prepared the key and formatted the OTP value for each
+counter, with the evaluation of the window with a prepared HMAC key and
+integer comparison for the windows 10, 100 and 1000 and SHA1, SHA256 and SHA512.
+The OTP value is not in the window, so that all counters are calculated.
+
+The benchmark does not need a database. Run it with
+
+    python -m tests.benchmarks.bench_otp_window
+"""
+import hashlib
+import timeit
+
+from privacyidea.lib.crypto import SecretObj, safe_compare
+from privacyidea.lib.tokens.HMAC import HmacOtp
+
+OTPKEY = b"12345678901234567890"
+HASHFUNCS = [("sha1", hashlib.sha1), ("sha256", hashlib.sha256), ("sha512", hashlib.sha512)]
+WINDOWS = [10, 100, 1000]
+
+
+def create_hmac_otp(hashfunc):
+    secret_obj = SecretObj(b"", b"", preserve=True)
+    # The key is already set up, so the benchmark does not need an encryption module
+    secret_obj.bkey = OTPKEY
+    return HmacOtp(secret_obj, counter=0, digits=6, hashfunc=hashfunc)
+
+
+def former_check(hmac_otp, otp, window):
+    for c in range(0, window):
+        if safe_compare(hmac_otp.generate(c, inc_counter=False), otp):
+            return c
+    return -1
+
+
+def run(number):
+    for name, hashfunc in HASHFUNCS:
+        hmac_otp = create_hmac_otp(hashfunc)
+        for window in WINDOWS:
+            otp = hmac_otp.generate(window + 1, inc_counter=False)
+
+            def check():
+                hmac_otp.counter = 0
+                return hmac_otp.checkOtp(otp, window)
+            assert former_check(hmac_otp, otp, window) == check() == -1
+            former = timeit.timeit(lambda: former_check(hmac_otp, otp, window), number=number)
+            current = timeit.timeit(check, number=number)
+            print("{0:<7} window {1:5d} former {2:8.0f} checks/s current {3:8.0f} checks/s "
+                  "({4:4.1f}x)".format(name, window, number / former, number / current,
+                                       former / current))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    run(200)
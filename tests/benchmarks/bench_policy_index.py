@@ -0,0 +1,154 @@
+"""
+Benchmark of ``PolicyClass.list_policies`` with the policy index against the
+former linear scan over all policies.
+
+The benchmark does not need a database. Run it with
+
+    python -m tests.benchmarks.bench_policy_index
+
+It also verifies, that both implementations return identical results.
+"""
+import random
+import timeit
+from operator import itemgetter
+
+import mock
+
+from privacyidea.lib.config import LocalConfigClass
+from privacyidea.lib.policy import PolicyClass, SCOPE
+
+REALMS = ["realm{0!s}".format(i) for i in range(20)]
+RESOLVERS = ["resolver{0!s}".format(i) for i in range(10)]
+ACTIONS = ["action{0!s}".format(i) for i in range(30)]
+USERS = ["user{0!s}".format(i) for i in range(50)]
+SCOPES = [SCOPE.AUTH, SCOPE.AUTHZ, SCOPE.ADMIN, SCOPE.USER, SCOPE.ENROLL, SCOPE.WEBUI]
+
+
+def _sample(values, wildcards=("*",)):
+    choice = random.random()
+    if choice < 0.3:
+        return []
+    if choice < 0.35:
+        return [random.choice(wildcards)]
+    ret = random.sample(values, random.randint(1, 3))
+    if random.random() < 0.1:
+        ret.append("!" + random.choice(values))
+    return ret
+
+
+def create_policies(count):
+    policies = []
+    for i in range(count):
+        users = _sample(USERS)
+        if random.random() < 0.1:
+            users.append("user1.*")
+        policies.append({"name": "policy{0!s}".format(i),
+                         "active": random.random() < 0.9,
+                         "scope": random.choice(SCOPES),
+                         "action": {action: True for action in random.sample(ACTIONS, random.randint(1, 4))},
+                         "realm": _sample(REALMS),
+                         "adminrealm": _sample(REALMS),
+                         "adminuser": _sample(USERS),
+                         "resolver": _sample(RESOLVERS),
+                         "pinode": [],
+                         "user": users,
+                         "user_case_insensitive": random.random() < 0.1,
+                         "check_all_resolvers": False,
+                         "client": [],
+                         "time": "",
+                         "conditions": [],
+                         "priority": random.randint(1, 5)})
+    return policies
+
+
+def create_queries(count):
+    queries = []
+    for _i in range(count):
+        queries.append({"scope": random.choice(SCOPES),
+                        "action": random.choice(ACTIONS),
+                        "realm": random.choice(REALMS),
+                        "resolver": random.choice(RESOLVERS),
+                        "user": random.choice(USERS),
+                        "adminrealm": random.choice(REALMS),
+                        "adminuser": random.choice(USERS),
+                        "active": True})
+    return queries
+
+
+def list_policies_scan(policies, name=None, scope=None, realm=None, active=None,
+                       resolver=None, user=None, action=None, adminrealm=None,
+                       adminuser=None):
+    """
+    The former implementation of ``list_policies`` (without client and
+    check_all_resolvers handling, which are not part of this benchmark)
+    """
+    reduced_policies = policies
+    for searchkey, searchvalue in [("name", name), ("active", active), ("scope", scope)]:
+        if searchvalue is not None:
+            reduced_policies = [policy for policy in reduced_policies if
+                                policy.get(searchkey) == searchvalue]
+    p = [("action", action), ("realm", realm)]
+    q = [("user", user)]
+    if scope == SCOPE.ADMIN:
+        p.append(("adminrealm", adminrealm))
+        q.append(("adminuser", adminuser))
+    for searchkey, searchvalue in p:
+        if searchvalue is not None:
+            new_policies = []
+            for policy in reduced_policies:
+                if not policy.get(searchkey):
+                    new_policies.append(policy)
+                else:
+                    value_found, value_excluded = PolicyClass._search_value(
+                        policy.get(searchkey), searchvalue)
+                    if value_found and not value_excluded:
+                        new_policies.append(policy)
+            reduced_policies = new_policies
+    for searchkey, searchvalue in q:
+        if searchvalue is not None:
+            new_policies = []
+            for policy in reduced_policies:
+                if not policy.get(searchkey):
+                    new_policies.append(policy)
+                else:
+                    searchkeys = policy.get(searchkey)
+                    current_searchvalue = searchvalue
+                    if policy.get("user_case_insensitive"):
+                        current_searchvalue = current_searchvalue.lower()
+                        searchkeys = [x.lower() for x in searchkeys]
+                    value_found, value_excluded = PolicyClass._search_value(searchkeys, current_searchvalue)
+                    if value_found and not value_excluded:
+                        new_policies.append(policy)
+            reduced_policies = new_policies
+    if resolver is not None:
+        new_policies = []
+        for policy in reduced_policies:
+            if not policy.get("resolver"):
+                new_policies.append(policy)
+            else:
+                value_found, _v_ex = PolicyClass._search_value(policy.get("resolver"), resolver)
+                if value_found:
+                    new_policies.append(policy)
+        reduced_policies = new_policies
+    return sorted(reduced_policies, key=itemgetter("priority"))
+
+
+def run(count, queries):
+    policies = create_policies(count)
+    config_object = LocalConfigClass({}, {}, {}, None, policies, [], [], None)
+    with mock.patch("privacyidea.lib.policy.get_config_object", return_value=config_object):
+        P = PolicyClass()
+        for query in queries:
+            assert P.list_policies(**query) == list_policies_scan(policies, **query), query
+        scan = timeit.timeit(lambda: [list_policies_scan(policies, **query) for query in queries], number=3)
+        indexed = timeit.timeit(lambda: [P.list_policies(**query) for query in queries], number=3)
+    calls = 3 * len(queries)
+    print("{0:>5} policies: scan {1:8.1f} us/call, index {2:8.1f} us/call, speedup {3:5.1f}x".format(
+        count, 1e6 * scan / calls, 1e6 * indexed / calls, scan / indexed))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    random.seed(4711)
+    queries = create_queries(200)
+    for count in [10, 100, 1000]:
+        run(count, queries)
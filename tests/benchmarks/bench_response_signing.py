@@ -0,0 +1,58 @@
+"""
+Benchmark of the response signing. It compares the responses per second
+without signing, with loading the private key for each response (as
+``sign_response`` did before) and with the cached key of ``get_sign_object``.
+
+Run it with
+
+    python -m tests.benchmarks.bench_response_signing
+"""
+import json
+import os
+import timeit
+
+from flask import Flask
+
+from privacyidea.lib.crypto import Sign, get_sign_object
+
+KEY_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "testdata", "private.pem")
+RESPONSE = {"id": 1,
+            "jsonrpc": "2.0",
+            "result": {"status": True, "value": True,
+                       "authentication": "ACCEPT"},
+            "detail": {"message": "matching 1 tokens", "serial": "HOTP0001",
+                       "otplen": 6, "type": "hotp", "threadid": 140000000000000},
+            "time": 1700000000.0,
+            "version": "privacyIDEA 3.10",
+            "versionnumber": "3.10"}
+
+
+def respond(sign_object=None):
+    content = dict(RESPONSE)
+    if sign_object:
+        content["signature"] = sign_object.sign(json.dumps(content, sort_keys=True))
+    return json.dumps(content)
+
+
+def load_and_sign(check_private_key):
+    with open(KEY_FILE, "rb") as f:
+        sign_object = Sign(f.read(), check_private_key=check_private_key)
+    return respond(sign_object)
+
+
+def run(number):
+    app = Flask(__name__)
+    with app.app_context():
+        results = [("no signing", lambda: respond()),
+                   ("load key, checked", lambda: load_and_sign(True)),
+                   ("load key, unchecked", lambda: load_and_sign(False)),
+                   ("cached key", lambda: respond(get_sign_object(KEY_FILE)))]
+        for name, func in results:
+            # warm up, the cached key is loaded here
+            func()
+            duration = timeit.timeit(func, number=number)
+            print("{0:<20} {1:10.0f} responses/s".format(name, number / duration))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    run(200)
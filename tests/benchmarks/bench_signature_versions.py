@@ -0,0 +1,70 @@
+"""
+Benchmark of the signature versions. It compares the signatures per second
+created and verified with RSA-PSS, Ed25519, ECDSA (P-256) and HMAC-SHA256 and
+the verification of a list of audit entries signed with all versions, like an
+audit log after the signing key has been changed.
+
+Run it with
+
+    python -m tests.benchmarks.bench_signature_versions
+"""
+import os
+import timeit
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, ec
+
+from privacyidea.lib.crypto import Sign
+
+TESTDATA = os.path.join(os.path.dirname(os.path.dirname(__file__)), "testdata")
+HMAC_KEY = b"0123456789abcdef0123456789abcdef"
+DATA = ("id=1000,date=2024-01-01 10:00:00.000000,action=POST /validate/check,"
+        "success=1,serial=HOTP0001,token_type=hotp,user=cornelius,realm=realm1,"
+        "administrator=,action_detail=,info=,privacyidea_server=localhost,"
+        "client=10.0.0.1,loglevel=default,clearance_level=default,thread_id=1,"
+        "policies=,startdate=2024-01-01 10:00:00.000000,duration=0.01")
+
+
+def _pem_keys(private_key):
+    priv_pem = private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                         format=serialization.PrivateFormat.PKCS8,
+                                         encryption_algorithm=serialization.NoEncryption())
+    pub_pem = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo)
+    return priv_pem, pub_pem
+
+
+def create_sign_objects():
+    with open(os.path.join(TESTDATA, "private.pem"), "rb") as f:
+        rsa_priv = f.read()
+    with open(os.path.join(TESTDATA, "public.pem"), "rb") as f:
+        rsa_pub = f.read()
+    ed_priv, ed_pub = _pem_keys(ed25519.Ed25519PrivateKey.generate())
+    ec_priv, ec_pub = _pem_keys(ec.generate_private_key(ec.SECP256R1()))
+    sign_objects = [("rsa_sha256_pss", Sign(rsa_priv, rsa_pub)),
+                    ("ed25519", Sign(ed_priv, ed_pub)),
+                    ("ecdsa_p256_sha256", Sign(ec_priv, ec_pub)),
+                    ("hmac_sha256", Sign(hmac_key=HMAC_KEY))]
+    verify_object = Sign(public_key=rsa_pub + ed_pub + ec_pub, hmac_key=HMAC_KEY)
+    return sign_objects, verify_object
+
+
+def run(number):
+    sign_objects, verify_object = create_sign_objects()
+    for name, sign_object in sign_objects:
+        signature = sign_object.sign(DATA)
+        sign_duration = timeit.timeit(lambda: sign_object.sign(DATA), number=number)
+        verify_duration = timeit.timeit(lambda: sign_object.verify(DATA, signature), number=number)
+        print("{0:<20} {1:10.0f} signatures/s {2:10.0f} verifications/s".format(
+            name, number / sign_duration, number / verify_duration))
+
+    # an audit log with entries of all signature versions
+    signatures = [sign_object.sign(DATA) for _name, sign_object in sign_objects] * (number // 4)
+    duration = timeit.timeit(lambda: all(verify_object.verify(DATA, s) for s in signatures),
+                             number=1)
+    print("{0:<20} {1:10.0f} verifications/s".format("mixed versions", len(signatures) / duration))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    run(1000)
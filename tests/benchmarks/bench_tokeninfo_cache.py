@@ -0,0 +1,94 @@
+"""
+Profile of the successful check of a TOTP value. It compares the number of
+calls and the time of reading the token info with the cached token info of the
+token object and with building the token info dictionary for each access (as
+``TokenClass.get_tokeninfo`` did before).
+
+Run it with
+
+    python -m tests.benchmarks.bench_tokeninfo_cache
+"""
+import binascii
+import cProfile
+import os
+import pstats
+import time
+
+import mock
+
+os.environ.setdefault("TEST_DATABASE_URL", "sqlite://")
+
+from privacyidea.app import create_app  # noqa: E402
+from privacyidea.lib.crypto import decryptPassword  # noqa: E402
+from privacyidea.lib.token import init_token, remove_token  # noqa: E402
+from privacyidea.lib.tokenclass import TokenClass  # noqa: E402
+from privacyidea.models import db  # noqa: E402
+
+OTPKEY = binascii.hexlify(b"12345678901234567890").decode()
+SERIAL = "BENCH0002"
+PROFILED = ["get_tokeninfo", "former_get_tokeninfo", "get_info"]
+
+
+def former_get_tokeninfo(self, key=None, default=None, decrypted=False):
+    tokeninfo = self.token.get_info()
+    ret = tokeninfo
+    if key:
+        ret = tokeninfo.get(key, default)
+        if tokeninfo.get(key + ".type") == "password":
+            ret = decryptPassword(ret)
+    elif decrypted:
+        ret = {x: (decryptPassword(y) if tokeninfo.get(x + ".type") == "password" else y)
+               for x, y in tokeninfo.items()}
+    return ret
+
+
+def check(tok, number, success):
+    for _i in range(number):
+        # allow the same OTP value again
+        tok.token.count = 0
+        counter = tok._time2counter(time.time(), timeStepping=tok.timestep)
+        otp = tok._calc_otp(counter) if success else "000000"
+        if (tok.check_otp(otp) >= 0) != success:
+            raise Exception("Unexpected result of the check of the OTP value")
+
+
+def profile(tok, number, success):
+    profiler = cProfile.Profile()
+    profiler.runcall(check, tok, number, success)
+    stats = pstats.Stats(profiler)
+    total = stats.total_tt
+    calls = {}
+    for (_filename, _line, name), (_cc, ncalls, _tt, cumtime, _callers) in stats.stats.items():
+        if name in PROFILED:
+            count, cum = calls.get(name, (0, 0))
+            calls[name] = (count + ncalls, cum + cumtime)
+    return total, calls
+
+
+def run(number):
+    app = create_app("testing", "", silent=True)
+    with app.app_context():
+        db.create_all()
+        tok = init_token({"serial": SERIAL, "type": "totp", "otpkey": OTPKEY, "timeStep": 30})
+        tok.add_tokeninfo("timeShift", 0)
+        # The successful check commits the counter, so that the token info is
+        # read again from the database. The failed check does not commit.
+        for success in (True, False):
+            for name, get_tokeninfo in [("former", former_get_tokeninfo),
+                                        ("cached", TokenClass.get_tokeninfo)]:
+                with mock.patch.object(TokenClass, "get_tokeninfo", get_tokeninfo):
+                    total, calls = profile(tok, number, success)
+                print("{0:<7} {1:<8} {2:8.3f} ms/check".format(
+                    "success" if success else "fail", name, 1000 * total / number))
+                for func in PROFILED:
+                    count, cum = calls.get(func, (0, 0))
+                    if count:
+                        print("        {0:<22} {1:6.1f} calls/check {2:8.3f} ms/check".format(
+                            func, count / number, 1000 * cum / number))
+        remove_token(SERIAL)
+        db.session.remove()
+        db.drop_all()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    run(500)
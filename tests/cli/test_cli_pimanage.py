@@ -17,13 +17,21 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
+import datetime
+import os
+import shutil
+import tempfile
+
 import pytest
 from sqlalchemy.orm.session import close_all_sessions
 
 from privacyidea.app import create_app
-from privacyidea.models import db
+from privacyidea.models import db, Audit as LogEntry, OTPIndex
 from privacyidea.cli.pimanage import cli as pi_manage
+from privacyidea.cli.pimanage.audit import _regex_to_like, _glob_escape, _column_criterion
 from privacyidea.lib.lifecycle import call_finalizers
+from privacyidea.lib.otpindex import OTP_INDEX_SIZE
+from privacyidea.lib.token import init_token, remove_token
 from privacyidea.lib.resolver import (save_resolver, delete_resolver,
                                       get_resolver_list)
 from .base import CliTestCase
@@ -46,13 +54,145 @@ class PIManageAdminTestCase(CliTestCase):
 
 
 class PIManageAuditTestCase(CliTestCase):
-    # TODO: test audit rotate/dump with a given test config
+    # TODO: test audit dump
     def test_01_pimanage_audit_help(self):
         runner = self.app.test_cli_runner()
         result = runner.invoke(pi_manage, ["audit"])
         self.assertIn("Dump the audit log in csv format.", result.output, result)
         self.assertIn("Clean the SQL audit log.", result.output, result)
 
+    def test_02_regex_to_like(self):
+        self.assertEqual(_regex_to_like("POST /token/init"), ("contains", "POST /token/init"))
+        self.assertEqual(_regex_to_like(".*/validate/check.*"), ("contains", "/validate/check"))
+        self.assertEqual(_regex_to_like("^GET /token"), ("startswith", "GET /token"))
+        self.assertEqual(_regex_to_like("^nils$"), ("equals", "nils"))
+        self.assertEqual(_regex_to_like("example\\.com$"), ("endswith", "example.com"))
+        self.assertEqual(_regex_to_like("100%_done"), ("contains", "100%_done"))
+        self.assertEqual(_regex_to_like(".*"), ("contains", ""))
+        for pattern in ["^(nils|hans)$", "user\\d", "a.*b", "^GET .*?x", "ab*", "\\"]:
+            self.assertIsNone(_regex_to_like(pattern), pattern)
+        self.assertEqual(_glob_escape("a*b?[c]"), "a[*]b[?][[]c]")
+        # MySQL and MariaDB ignore the case and the trailing spaces
+        self.assertIsNotNone(_column_criterion(LogEntry.action, "POST", "postgresql"))
+        self.assertIsNone(_column_criterion(LogEntry.action, "POST", "mysql"))
+        self.assertIsNone(_column_criterion(LogEntry.action, "POST", "mariadb"))
+
+    def _create_entries(self):
+        now = datetime.datetime.now()
+        entries = []
+        for days, user, action, realm in [(20, "nils", "POST /validate/check", "realm1"),
+                                          (5, "nils", "POST /validate/check", "realm1"),
+                                          (20, "hans", "POST /validate/check", "realm1"),
+                                          (20, "hans", "GET /token/", "realm1"),
+                                          (40, "hans", "POST /auth", None),
+                                          (40, "hans", "POST /token/init", "realm1"),
+                                          (200, "hans", "POST /token/init", "realm2"),
+                                          (200, "nils", "POST /auth", "realm1"),
+                                          (1, "nils", "POST /auth", "realm1")]:
+            entry = LogEntry(action=action, user=user)
+            entry.realm = realm
+            entry.date = now - datetime.timedelta(days=days)
+            db.session.add(entry)
+            entries.append(entry)
+        db.session.commit()
+        return [entry.id for entry in entries]
+
+    def _rotate(self, config, dryrun=False):
+        filename = os.path.join(self.directory, "audit.yaml")
+        with open(filename, "w") as f:
+            f.write(config)
+        args = ["audit", "rotate", "--config", filename, "--chunksize", "2"]
+        if dryrun:
+            args.append("--dryrun")
+        result = self.app.test_cli_runner().invoke(pi_manage, args)
+        self.assertEqual(result.exit_code, 0, (result.output, result.exception))
+        return result.output
+
+    def test_03_rotate_config(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        config = """
+- rotate: 10
+  user: nils
+  action: .*/validate/check.*
+- rotate: 30
+  action: ^GET /token
+- rotate: 3650
+  action: POST /token/init
+- rotate: 30
+  realm: None
+- rotate: 180
+  action: .*
+"""
+        # The rules are evaluated by the database or in Python for the
+        # regular expression. Both delete the same entries.
+        for user_search in ["nils", "^(nils)$"]:
+            LogEntry.query.delete()
+            ids = self._create_entries()
+            rule_config = config.replace("user: nils", "user: {0!s}".format(user_search))
+            output = self._rotate(rule_config, dryrun=True)
+            self.assertIn("I would clean up 3 entries!", output)
+            self.assertEqual(LogEntry.query.count(), 9)
+            output = self._rotate(rule_config)
+            self.assertIn("3 entries deleted.", output)
+            remaining = [entry.id for entry in LogEntry.query.order_by(LogEntry.id)]
+            self.assertEqual(remaining, [ids[i] for i in [1, 2, 3, 5, 6, 8]], output)
+            if user_search == "nils":
+                self.assertNotIn("evaluated with regular expressions", output)
+            else:
+                self.assertIn("evaluated with regular expressions", output)
+                self.assertIn("entries scanned", output)
+
+        # Only the entries older than the shortest retention time are read
+        result = self.app.test_cli_runner().invoke(
+            pi_manage, ["audit", "rotate", "--config", os.path.join(self.directory, "audit.yaml")])
+        self.assertIn("4 entries scanned, 0 matching", result.output)
+
+        with open(os.path.join(self.directory, "unknown.yaml"), "w") as f:
+            f.write("- rotate: 10\n  unknown_column: x\n")
+        result = self.app.test_cli_runner().invoke(
+            pi_manage, ["audit", "rotate", "--config", os.path.join(self.directory, "unknown.yaml")])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("Unknown audit column", result.output)
+        LogEntry.query.delete()
+        db.session.commit()
+
+    def test_04_rotate_case_sensitive(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        LogEntry.query.delete()
+        ids = self._create_entries()
+        # The database compares like the regular expressions
+        for action in ["post /auth", "^post /auth$", "POST /auth ", "*/auth"]:
+            output = self._rotate("- rotate: 10\n  action: '{0!s}'\n".format(
+                action.replace("*", "\\*")))
+            self.assertIn("evaluated by the database", output)
+            self.assertIn("0 entries deleted.", output)
+        output = self._rotate("- rotate: 10\n  action: POST /au\n")
+        self.assertIn("2 entries deleted.", output)
+        remaining = [entry.id for entry in LogEntry.query.order_by(LogEntry.id)]
+        self.assertEqual(remaining, [ids[i] for i in [0, 1, 2, 3, 5, 6, 8]], output)
+        LogEntry.query.delete()
+        db.session.commit()
+
+    def test_05_rotate_rule_without_search(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        # A rule without a search value matches no entry and does not hide
+        # the following rules
+        for action in ["POST /auth", "^(POST /auth)$"]:
+            LogEntry.query.delete()
+            ids = self._create_entries()
+            config = "- rotate: 30\n- rotate: 10\n  action: '{0!s}'\n".format(action)
+            output = self._rotate(config, dryrun=True)
+            self.assertIn("I would clean up 2 entries!", output)
+            output = self._rotate(config)
+            self.assertIn("2 entries", output)
+            remaining = [entry.id for entry in LogEntry.query.order_by(LogEntry.id)]
+            self.assertEqual(remaining, [ids[i] for i in [0, 1, 2, 3, 5, 6, 8]], output)
+        LogEntry.query.delete()
+        db.session.commit()
+
 
 class PIManageBackupTestCase(CliTestCase):
     def test_01_pimanage_backup_help(self):
@@ -153,6 +293,32 @@ class PIManageTokenTestCase(CliTestCase):
         self.assertIn("Commands to manage token in privacyIDEA", result.output, result)
         self.assertIn("Import tokens from a file", result.output, result)
 
+    def test_02_pimanage_token_update_otp_index(self):
+        runner = self.app.test_cli_runner()
+        init_token({"serial": "IDX1", "type": "hotp", "otpkey": "3132333435363738393031323334353637383930"})
+        self.app.config[OTP_INDEX_SIZE] = 10
+        try:
+            result = runner.invoke(pi_manage, ["token", "update-otp-index", "--window", "20"])
+            self.assertEqual(result.exit_code, 1, result.output)
+            self.assertIn("smaller than the window", result.output)
+            result = runner.invoke(pi_manage, ["token", "update-otp-index", "--chunksize", "0"])
+            self.assertEqual(result.exit_code, 2, result.output)
+            result = runner.invoke(pi_manage, ["token", "update-otp-index"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("1 tokens checked, 1 updated", result.output)
+            self.assertIn("Updated the OTP index of 1 tokens", result.output)
+            self.assertEqual(OTPIndex.query.count(), 10)
+        finally:
+            self.app.config.pop(OTP_INDEX_SIZE)
+            remove_token("IDX1")
+
+    def test_03_pimanage_token_import_batch_size(self):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(pi_manage, ["token", "import", "tests/testdata/yubico-oath.csv",
+                                           "--batch-size", "0"])
+        self.assertEqual(result.exit_code, 2, result.output)
+        self.assertIn("0 is not in the range x>=1", result.output)
+
 
 @pytest.fixture(scope="function")
 def create_user_resolver(app):
@@ -31,3 +31,10 @@ class PITokenJanitorLoadTestCase(CliTestCase):
                       result.output, result)
         self.assertIn("Finds all tokens which match the conditions.",
                       result.output, result)
+
+    def test_02_pitokenjanitor_load_batch_size(self):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(pi_token_janitor, ["load", "tests/testdata/pskc-aes.xml",
+                                                  "--batch_size", "0"])
+        self.assertEqual(result.exit_code, 2, result.output)
+        self.assertIn("0 is not in the range x>=1", result.output)
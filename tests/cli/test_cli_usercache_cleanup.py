@@ -17,8 +17,13 @@
 # You should have received a copy of the GNU Affero General Public
 # License along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+from datetime import datetime, timedelta
+
 from .base import CliTestCase
 from privacyidea.cli.tools.usercache_cleanup import delete as privacyidea_usercache_cleanup
+from privacyidea.lib.config import set_privacyidea_config
+from privacyidea.lib.usercache import EXPIRATION_SECONDS
+from privacyidea.models import UserCache
 
 
 class PIUsercacheCleanupTestCase(CliTestCase):
@@ -27,3 +32,23 @@ class PIUsercacheCleanupTestCase(CliTestCase):
         result = runner.invoke(privacyidea_usercache_cleanup, ["-h"])
         self.assertIn("Delete all cache entries that are considered expired according to",
                       result.output, result)
+
+    def test_02_piusercachecleanup_delete(self):
+        timestamp = datetime.now() - timedelta(seconds=120)
+        for i in range(3):
+            UserCache("hans{0!s}".format(i), "hans{0!s}".format(i), "resolver1",
+                      "uid{0!s}".format(i), timestamp).save()
+        UserCache("current", "current", "resolver1", "uid9", datetime.now()).save()
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(privacyidea_usercache_cleanup, [])
+        self.assertIn("User cache is disabled", result.output, result)
+
+        set_privacyidea_config(EXPIRATION_SECONDS, 60)
+        result = runner.invoke(privacyidea_usercache_cleanup, ["-n"])
+        self.assertIn("3 entries", result.output, result)
+        self.assertEqual(UserCache.query.count(), 4)
+        result = runner.invoke(privacyidea_usercache_cleanup, ["--chunksize", "2"])
+        self.assertIn("Deleted 3 expired entries.", result.output, result)
+        self.assertEqual(UserCache.query.one().username, "current")
+        set_privacyidea_config(EXPIRATION_SECONDS, 0)
+        UserCache.query.delete()
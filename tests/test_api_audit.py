@@ -1,3 +1,4 @@
+import json
 import mock
 from contextlib import contextmanager
 from datetime import datetime, timedelta
@@ -8,6 +9,7 @@ from privacyidea.models import Audit
 from privacyidea.lib.resolver import save_resolver
 from privacyidea.lib.realm import set_realm
 from privacyidea.lib.auditmodules.base import Audit as BaseAudit
+from privacyidea.lib.requeststats import enable_request_stats, CATEGORIES
 
 PWFILE = "tests/testdata/passwords"
 
@@ -72,7 +74,7 @@ class APIAuditTestCase(MyApiTestCase):
             cols = json_response.get("result").get("value").get("auditcolumns")
             self.assertIn("number", cols)
             self.assertIn("serial", cols)
-            self.assertEqual(27, len(cols))
+            self.assertEqual(28, len(cols))
 
     def test_01_get_audit_csv(self):
         @contextmanager
@@ -390,3 +392,37 @@ class APIAuditTestCase(MyApiTestCase):
 
         # delete policy
         delete_policy("audit01")
+
+    def test_05_request_stats(self):
+        self.setUp_user_realms()
+        # The statistics are disabled by default
+        with self.app.test_request_context('/user/',
+                                           method='GET',
+                                           query_string={"realm": self.realm1a},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(200, res.status_code, res)
+        entry = Audit.query.filter_by(action="GET /user/").order_by(Audit.id.desc()).first()
+        self.assertFalse(entry.performance)
+
+        enable_request_stats()
+        try:
+            with self.app.test_request_context('/user/',
+                                               method='GET',
+                                               query_string={"realm": self.realm1a},
+                                               headers={'Authorization': self.at}):
+                res = self.app.full_dispatch_request()
+                self.assertEqual(200, res.status_code, res)
+        finally:
+            enable_request_stats(False)
+        entry = Audit.query.filter_by(action="GET /user/").order_by(Audit.id.desc()).first()
+        performance = json.loads(entry.performance)
+        self.assertEqual(set(performance), set(CATEGORIES))
+        # number of calls and time in milliseconds
+        self.assertGreater(performance["db"][0], 0)
+        self.assertEqual(performance["resolver"][0], 1)
+        self.assertGreater(performance["policy"][0], 0)
+        self.assertGreaterEqual(performance["policy"][1], 0)
+
+        aentry = self.find_most_recent_audit_entry(action="GET /user/")
+        self.assertEqual(aentry["performance"], entry.performance)
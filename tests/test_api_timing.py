@@ -0,0 +1,68 @@
+from .base import MyApiTestCase
+from privacyidea.lib.log import enable_timing, get_timing_stats, reset_timing_stats
+
+
+class APITimingTestCase(MyApiTestCase):
+
+    def tearDown(self):
+        enable_timing(False)
+        reset_timing_stats()
+
+    def test_01_get_timing(self):
+        reset_timing_stats()
+        with self.app.test_request_context('/timing/',
+                                           method='GET',
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(200, res.status_code, res)
+            value = res.json["result"]["value"]
+            self.assertFalse(value["enabled"])
+            self.assertEqual(value["functions"], [])
+
+        enable_timing()
+        with self.app.test_request_context('/token/',
+                                           method='GET',
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(200, res.status_code, res)
+
+        with self.app.test_request_context('/timing/',
+                                           method='GET',
+                                           query_string={"sortby": "count", "limit": 3},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(200, res.status_code, res)
+            value = res.json["result"]["value"]
+            self.assertTrue(value["enabled"])
+            functions = value["functions"]
+            self.assertEqual(len(functions), 3)
+            counts = [entry["count"] for entry in functions]
+            self.assertEqual(counts, sorted(counts, reverse=True))
+            for key in ["name", "total", "mean", "max", "p50", "p90", "p99"]:
+                self.assertIn(key, functions[0])
+        self.assertIn("privacyidea.api.token.list_api", get_timing_stats())
+
+        with self.app.test_request_context('/timing/',
+                                           method='GET',
+                                           query_string={"sortby": "unknown"},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(400, res.status_code, res)
+
+    def test_02_delete_timing(self):
+        enable_timing()
+        with self.app.test_request_context('/timing/',
+                                           method='GET',
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(200, res.status_code, res)
+        self.assertNotEqual(get_timing_stats(), {})
+
+        with self.app.test_request_context('/timing/',
+                                           method='DELETE',
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(200, res.status_code, res)
+            self.assertTrue(res.json["result"]["value"])
+        # Only the timing of the functions after the reset is left
+        self.assertNotIn("privacyidea.api.timing.get_timing", get_timing_stats())
@@ -37,6 +37,7 @@ from privacyidea.lib.tokenclass import ROLLOUTSTATE, CLIENTMODE
 from privacyidea.lib import _
 from privacyidea.lib.applications.offline import REFILLTOKEN_LENGTH
 from privacyidea.lib.machine import attach_token, detach_token
+from privacyidea.lib.sqlutils import in_unit_of_work
 from privacyidea.lib.machineresolver import save_resolver as save_machine_resolver
 from passlib.hash import argon2
 from privacyidea.lib.smsprovider.SMSProvider import set_smsgateway
@@ -48,6 +49,7 @@ import time
 import responses
 import mock
 import re
+import sqlalchemy
 from . import smtpmock, ldap3mock, radiusmock
 
 PWFILE = "tests/testdata/passwords"
@@ -3059,6 +3061,76 @@ class ValidateAPITestCase(MyApiTestCase):
         remove_token("softwareToken")
         remove_token("hardwareToken")
 
+    def test_37_unit_of_work(self):
+        serial = "unitofwork001"
+        init_token({"serial": serial, "type": "hotp", "otpkey": self.otpkey})
+        commits = []
+
+        def count_commits(conn):
+            commits.append(conn)
+
+        sqlalchemy.event.listen(db.engine, "commit", count_commits)
+        try:
+            # The OTP counter is committed immediately, the other changes at
+            # the end of the request
+            with self.app.test_request_context('/validate/check', method='POST',
+                                               data={"serial": serial,
+                                                     "pass": self.valid_otp_values[1]}):
+                res = self.app.full_dispatch_request()
+                self.assertEqual(res.status_code, 200, res)
+                self.assertTrue(res.json.get("result").get("value"))
+            self.assertEqual(len(commits), 2)
+            # The fail counter is also committed immediately
+            with self.app.test_request_context('/validate/check', method='POST',
+                                               data={"serial": serial,
+                                                     "pass": self.valid_otp_values[1]}):
+                res = self.app.full_dispatch_request()
+                self.assertEqual(res.status_code, 200, res)
+                self.assertFalse(res.json.get("result").get("value"))
+            self.assertEqual(len(commits), 4)
+        finally:
+            sqlalchemy.event.remove(db.engine, "commit", count_commits)
+        # The unit of work has ended with the request
+        self.assertFalse(in_unit_of_work(db.session))
+        tok = get_tokens(serial=serial)[0]
+        self.assertEqual(tok.token.count, 2)
+        self.assertEqual(tok.token.failcount, 1)
+        self.assertEqual(tok.get_tokeninfo("count_auth"), "2")
+        self.assertEqual(tok.get_tokeninfo("count_auth_success"), "1")
+        remove_token(serial)
+
+    def test_38_unit_of_work_failing_request(self):
+        serial = "unitofwork002"
+        tok = init_token({"serial": serial, "type": "hotp", "otpkey": self.otpkey})
+
+        def count_audit_entries():
+            with self.app.test_request_context('/audit/', method='GET',
+                                               query_string={"action": "*/validate/check*",
+                                                             "success": "0"},
+                                               headers={"Authorization": self.at}):
+                res = self.app.full_dispatch_request()
+                self.assertEqual(res.status_code, 200, res)
+                return res.json.get("result").get("value").get("count")
+
+        audit_entries = count_audit_entries()
+
+        def failing_check(*args, **kwargs):
+            tok.add_tokeninfo("unitofwork", "pending")
+            raise Exception("check failed")
+
+        with mock.patch("privacyidea.api.validate.check_serial_pass", side_effect=failing_check):
+            with self.assertRaises(Exception):
+                with self.app.test_request_context('/validate/check', method='POST',
+                                                   data={"serial": serial, "pass": "123456"}):
+                    self.app.full_dispatch_request()
+        # The pending changes of the request are rolled back
+        self.assertFalse(in_unit_of_work(db.session))
+        tok = get_tokens(serial=serial)[0]
+        self.assertEqual(tok.get_tokeninfo("unitofwork"), None)
+        # and the audit entry of the request is written
+        self.assertEqual(count_audit_entries(), audit_entries + 1)
+        remove_token(serial)
+
     def test_03b_check_previous_otp_with_totp(self):
         token = init_token({"type": "totp",
                             "serial": "totp_previous",
@@ -4158,6 +4230,58 @@ class PushChallengeTags(MyApiTestCase):
         delete_policy("push2")
         delete_policy("push1")
 
+    def test_02_push_challenge_visible_during_request(self):
+        from privacyidea.lib.tokens.pushtoken import POLL_ONLY, PushTokenClass
+        pin = "otppin"
+        set_policy("push2", scope=SCOPE.ENROLL,
+                   action="{0!s}={1!s},{2!s}={3!s}".format(
+                       PUSH_ACTION.FIREBASE_CONFIG, POLL_ONLY,
+                       PUSH_ACTION.REGISTRATION_URL, "http://test/ttype/push"))
+        with self.app.test_request_context('/token/init',
+                                           method='POST',
+                                           data={"type": "push",
+                                                 "pin": pin,
+                                                 "user": self.user,
+                                                 "realm": self.realm1,
+                                                 "serial": self.serial_push,
+                                                 "genkey": 1},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 200)
+            enrollment_credential = res.json.get("detail").get("enrollment_credential")
+        with self.app.test_request_context('/ttype/push',
+                                           method='POST',
+                                           data={"enrollment_credential": enrollment_credential,
+                                                 "serial": self.serial_push,
+                                                 "pubkey": self.smartphone_public_key_pem_urlsafe,
+                                                 "fbtoken": "firebaseT"}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 200, res)
+
+        # The smartphone reads the challenge in another request, while the
+        # authentication request is still running
+        visible_challenges = []
+        challenge_janitor = PushTokenClass.challenge_janitor
+
+        def read_challenges(token):
+            with sqlalchemy.orm.Session(db.engine) as session:
+                visible_challenges.extend(session.query(Challenge).filter(
+                    Challenge.serial == self.serial_push).all())
+            challenge_janitor(token)
+
+        with mock.patch.object(PushTokenClass, "challenge_janitor", new=read_challenges):
+            with self.app.test_request_context('/validate/check',
+                                               method='POST',
+                                               data={"user": self.user,
+                                                     "pass": pin}):
+                res = self.app.full_dispatch_request()
+                self.assertEqual(res.status_code, 200, res)
+                transaction_id = res.json.get("detail").get("transaction_id")
+        self.assertEqual([c.transaction_id for c in visible_challenges], [transaction_id])
+
+        remove_token(self.serial_push)
+        delete_policy("push2")
+
 
 class AChallengeResponse(MyApiTestCase):
     serial = "hotp1"
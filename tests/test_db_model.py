@@ -20,7 +20,9 @@
 """Test the models of the privacyIDEA database."""
 from mock import mock
 import os
-from sqlalchemy import func
+import passlib.hash
+from sqlalchemy import func, event
+from sqlalchemy.dialects import mysql, postgresql
 
 from privacyidea.models import (Token,
                                 Resolver,
@@ -39,7 +41,8 @@ from privacyidea.models import (Token,
                                 ClientApplication, Subscription, UserCache,
                                 EventCounter, PeriodicTask, PeriodicTaskLastRun,
                                 PeriodicTaskOption, MonitoringStats, PolicyCondition, db,
-                                Tokengroup, TokenTokengroup, Serviceid)
+                                Tokengroup, TokenTokengroup, Serviceid, TokenInfo,
+                                _get_tokeninfo_upsert)
 from .base import MyTestCase
 from dateutil.tz import tzutc
 from datetime import datetime
@@ -127,6 +130,14 @@ class TokenModelTestCase(MyTestCase):
         self.assertTrue(t.check_pin(''))
         self.assertFalse(t.check_pin('1234'))
 
+        # A PIN hash of another hash algorithm is updated on a successful PIN check
+        t.pin_hash = passlib.hash.pbkdf2_sha512.hash('1234')
+        self.assertFalse(t.check_pin('4321'))
+        self.assertTrue(t.pin_hash.startswith('$pbkdf2-sha512$'), t.pin_hash)
+        self.assertTrue(t.check_pin('1234'))
+        self.assertTrue(t.pin_hash.startswith('$argon2'), t.pin_hash)
+        self.assertTrue(t.check_pin('1234'))
+
         # Delete the token
         t1.delete()
         t = Token.query.filter_by(id=tid).first()
@@ -599,6 +610,51 @@ class TokenModelTestCase(MyTestCase):
         self.assertTrue(t2info.get("key1.type") == "password",
                         t2info)
 
+    def test_16b_upsert_tokeninfo(self):
+        t1 = Token("serialTI3")
+        t1.save()
+        t1.set_info({"key1": "value1", "key2": "value2"})
+        statements = []
+
+        def count_statements(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count_statements)
+        try:
+            # All entries are written with one statement
+            t1.set_info({"key{0!s}".format(i): "new{0!s}".format(i) for i in range(2, 12)})
+            self.assertEqual(len([s for s in statements if "tokeninfo" in s]), 1, statements)
+            # The other dialects read the existing keys and update and insert the entries
+            del statements[:]
+            with mock.patch.object(db.engine.dialect, "name", "oracle"):
+                t1.set_info({"key1": "other1", "key12": "new12", "key12.type": "password"})
+            self.assertEqual(len([s for s in statements if "tokeninfo" in s]), 3, statements)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_statements)
+        t2 = Token.query.filter_by(serial="serialTI3").first()
+        info = t2.get_info()
+        self.assertEqual(info.get("key1"), "other1")
+        self.assertEqual(info.get("key2"), "new2")
+        self.assertEqual(info.get("key11"), "new11")
+        self.assertEqual(info.get("key12"), "new12")
+        self.assertEqual(info.get("key12.type"), "password")
+        self.assertNotIn("key2.type", info)
+        self.assertEqual(TokenInfo.query.filter_by(token_id=t2.id).count(), 12)
+        # The type is reset by an update
+        t2.set_info({"key12": "value12"})
+        self.assertNotIn("key12.type", t2.get_info())
+        t2.delete()
+
+        # the statements of the other databases
+        rows = [{"token_id": 1, "Key": "key1", "Value": "value1", "Type": None, "Description": None}]
+        stmt = _get_tokeninfo_upsert("postgresql", rows)
+        self.assertIn('ON CONFLICT (token_id, "Key") DO UPDATE',
+                      str(stmt.compile(dialect=postgresql.dialect())))
+        stmt = _get_tokeninfo_upsert("mysql", rows)
+        self.assertIn("ON DUPLICATE KEY UPDATE",
+                      str(stmt.compile(dialect=mysql.dialect())))
+        self.assertIsNone(_get_tokeninfo_upsert("oracle", rows))
+
     def test_17_add_and_delete_smtpserver(self):
         s1 = SMTPServer(identifier="myserver", server="1.2.3.4")
         s1.save()
@@ -5,6 +5,9 @@ This tests the files
 """
 import datetime
 import os
+import shutil
+import tempfile
+import time
 import types
 
 import sqlalchemy.engine
@@ -12,9 +15,12 @@ from mock import mock
 
 from privacyidea.config import TestingConfig
 from privacyidea.lib.audit import getAudit, search
+from privacyidea.lib.framework import get_app_local_store
+from privacyidea.lib.auditmodules.asyncaudit import (Audit as AsyncAudit, AuditWriter,
+                                                      entry_to_dict, entry_from_dict)
 from privacyidea.lib.auditmodules.containeraudit import Audit as ContainerAudit
 from privacyidea.lib.auditmodules.loggeraudit import Audit as LoggerAudit
-from privacyidea.lib.auditmodules.sqlaudit import column_length
+from privacyidea.lib.auditmodules.sqlaudit import column_length, AuditBuffer
 from .base import MyTestCase, OverrideConfigTestCase
 from testfixtures import log_capture
 
@@ -262,6 +268,34 @@ class AuditTestCase(MyTestCase):
         self.assertEqual(audit_log.total, 1)
         self.assertEqual(audit_log.auditdata[0].get("sig_check"), "FAIL")
 
+    def test_07b_hmac_signatures(self):
+        directory = tempfile.mkdtemp()
+        try:
+            hmac_key_file = os.path.join(directory, "audit-hmac.key")
+            with open(hmac_key_file, "w") as f:
+                f.write("00112233445566778899aabbccddeeff00112233445566778899aabbccddeeff")
+            # an entry signed with the private key
+            self.Audit.log({"action": "test_07b", "info": "rsa"})
+            self.Audit.finalize_log()
+            config = dict(self.app.config)
+            config["PI_AUDIT_KEY_HMAC"] = hmac_key_file
+            hmac_audit = getAudit(config)
+            hmac_audit.log({"action": "test_07b", "info": "hmac"})
+            hmac_audit.finalize_log()
+            signatures = {e.info: e.signature for e in hmac_audit.search_query({"action": "test_07b"})}
+            self.assertTrue(signatures["rsa"].startswith("rsa_sha256_pss:"), signatures)
+            self.assertTrue(signatures["hmac"].startswith("hmac_sha256:"), signatures)
+            # Both entries are verified with the HMAC audit module
+            audit_log = hmac_audit.search({"action": "test_07b"})
+            self.assertEqual(audit_log.total, 2)
+            self.assertEqual([e.get("sig_check") for e in audit_log.auditdata], ["OK", "OK"])
+            # Without the HMAC key, the HMAC signature can not be verified
+            audit_log = self.Audit.search({"action": "test_07b", "info": "hmac"})
+            self.assertEqual(audit_log.auditdata[0].get("sig_check"), "FAIL")
+        finally:
+            shutil.rmtree(directory)
+            get_app_local_store().pop("signing_keys", None)
+
     def test_08_policies(self):
         self.Audit.log({"action": "validate/check"})
         self.Audit.add_policy(["rule1", "rule2"])
@@ -345,6 +379,292 @@ class AuditTestCase(MyTestCase):
                          set(self.Audit.available_audit_columns),
                          audit_log.auditdata[0].keys())
 
+    def test_12_single_commit(self):
+        # The entry and its signature are written in one transaction
+        self.Audit.log({"action": "test12"})
+        with mock.patch.object(self.Audit.session, "commit",
+                               wraps=self.Audit.session.commit) as mock_commit:
+            self.Audit.finalize_log()
+            mock_commit.assert_called_once()
+        audit_log = self.Audit.search({"action": "test12"})
+        self.assertEqual(audit_log.total, 1)
+        self.assertEqual(audit_log.auditdata[0].get("sig_check"), "OK")
+
+
+class AuditBufferTestCase(OverrideConfigTestCase):
+    class Config(TestingConfig):
+        PI_AUDIT_SQL_BUFFER_SIZE = 3
+        PI_AUDIT_SQL_BUFFER_INTERVAL = 3600
+
+    def test_01_buffer(self):
+        audit_buffer = AuditBuffer(2, 3600, 3)
+        self.assertFalse(audit_buffer.add("1"))
+        self.assertTrue(audit_buffer.add("2"))
+        self.assertTrue(audit_buffer.add("3"))
+        # the oldest entry is dropped
+        self.assertTrue(audit_buffer.add("4"))
+        self.assertEqual(audit_buffer.dropped, 1)
+        entries = audit_buffer.take()
+        self.assertEqual(entries, ["2", "3", "4"])
+        self.assertEqual(audit_buffer.take(), [])
+        # entries, that could not be written, are returned to the buffer
+        audit_buffer.add("5")
+        audit_buffer.put_back(entries)
+        self.assertEqual(audit_buffer.take(), ["3", "4", "5"])
+        self.assertEqual(audit_buffer.dropped, 2)
+        # the buffer is also flushed after the interval
+        audit_buffer = AuditBuffer(10, 0, 100)
+        self.assertTrue(audit_buffer.add("1"))
+
+    def test_02_buffered_audit(self):
+        audit = getAudit(self.app.config)
+        audit.clear()
+        self.assertIsNotNone(audit.buffer)
+        audit.log({"action": "buffered1"})
+        audit.finalize_log()
+        audit.log({"action": "buffered2"})
+        audit.finalize_log()
+        # The entries are not written, yet
+        self.assertEqual(audit.get_total({}), 0)
+        # all audit objects share the same buffer
+        audit2 = getAudit(self.app.config)
+        self.assertIs(audit.buffer, audit2.buffer)
+        audit2.log({"action": "buffered3", "user": "kölbel"})
+        audit2.finalize_log()
+        self.assertEqual(audit.get_total({}), 3)
+        audit_log = audit.search({}, sortorder="asc")
+        self.assertEqual([e.get("action") for e in audit_log.auditdata],
+                         ["buffered1", "buffered2", "buffered3"])
+        for entry in audit_log.auditdata:
+            self.assertEqual(entry.get("sig_check"), "OK", entry)
+        # Flush the remaining entries
+        audit.log({"action": "buffered4"})
+        audit.finalize_log()
+        self.assertEqual(audit.get_total({}), 3)
+        audit._flush_buffer()
+        self.assertEqual(audit.get_total({}), 4)
+
+
+class AsyncAuditTestCase(OverrideConfigTestCase):
+    class Config(TestingConfig):
+        PI_AUDIT_MODULE = "privacyidea.lib.auditmodules.asyncaudit"
+        PI_AUDIT_ASYNC_BATCH_SIZE = 2
+        PI_AUDIT_ASYNC_FLUSH_INTERVAL = 0.1
+        PI_AUDIT_ASYNC_STATS_INTERVAL = 0
+
+    def test_01_write_async(self):
+        audit = getAudit(self.app.config)
+        self.assertEqual(audit.name, "asyncaudit")
+        audit.clear()
+        for i in range(5):
+            audit.log({"action": "async{0!s}".format(i), "user": "kölbel"})
+            audit.finalize_log()
+            self.assertFalse(audit.has_data)
+        writer = audit.get_writer()
+        # All audit objects use the same writer
+        self.assertIs(writer, getAudit(self.app.config).get_writer())
+        writer.stop(10)
+        self.assertFalse(writer.thread.is_alive())
+        self.assertEqual(writer.get_stats().get("written"), 5)
+        self.assertEqual(writer.get_stats().get("queue_depth"), 0)
+        audit_log = audit.search({}, sortorder="asc")
+        self.assertEqual(audit_log.total, 5)
+        self.assertEqual([e.get("action") for e in audit_log.auditdata],
+                         ["async{0!s}".format(i) for i in range(5)])
+        for entry in audit_log.auditdata:
+            self.assertEqual(entry.get("sig_check"), "OK", entry)
+        # A new writer is started with the next entry
+        audit.log({"action": "async5"})
+        audit.finalize_log()
+        self.assertIsNot(audit.get_writer(), writer)
+        audit.get_writer().stop(10)
+        self.assertEqual(audit.get_total({}), 6)
+
+    def test_02_backpressure(self):
+        config = self.app.config.copy()
+        config.update({"PI_AUDIT_ASYNC_QUEUE_SIZE": 1,
+                       "PI_AUDIT_ASYNC_BACKPRESSURE": "drop"})
+        audit = AsyncAudit(config)
+        audit.clear()
+        writer = AuditWriter(audit)
+        # Stop the thread, so that the queue is not emptied
+        writer.stop(10)
+        audit.log({"action": "drop1"})
+        writer.put(audit._create_entry())
+        audit.log({"action": "drop2"})
+        writer.put(audit._create_entry())
+        self.assertEqual(writer.get_stats().get("dropped"), 1)
+        self.assertEqual(writer.get_stats().get("queue_depth"), 1)
+        writer.flush()
+        audit_log = audit.search({})
+        self.assertEqual([e.get("action") for e in audit_log.auditdata], ["drop1"])
+
+        spill_file = "tests/testdata/audit-spill.jsonl"
+        config.update({"PI_AUDIT_ASYNC_BACKPRESSURE": "spill",
+                       "PI_AUDIT_ASYNC_SPILL_FILE": spill_file})
+        writer = AuditWriter(audit)
+        self.assertEqual(writer.spill_file, "{0!s}.{1!s}".format(spill_file, os.getpid()))
+        writer.stop(10)
+        for action in ["spill1", "spill2", "spill3"]:
+            audit.log({"action": action, "user": "kölbel"})
+            writer.put(audit._create_entry())
+        self.assertEqual(writer.get_stats().get("spilled"), 2)
+        self.assertTrue(os.path.exists(writer.spill_file))
+        writer.flush()
+        self.assertFalse(os.path.exists(writer.spill_file))
+        audit_log = audit.search({"action": "spill*"}, sortorder="asc")
+        self.assertEqual([e.get("action") for e in audit_log.auditdata],
+                         ["spill1", "spill2", "spill3"])
+        for entry in audit_log.auditdata:
+            self.assertEqual(entry.get("sig_check"), "OK", entry)
+
+    def test_03_entry_serialization(self):
+        audit = AsyncAudit(self.app.config)
+        audit.log({"action": "serialize", "success": True, "serial": "s1"})
+        le = audit._create_entry()
+        values = entry_to_dict(le)
+        le2 = entry_from_dict(values)
+        self.assertEqual(entry_to_dict(le2), values)
+        self.assertEqual(le2.date, le.date)
+        self.assertEqual(le2.duration, le.duration)
+        self.assertEqual(le2.action, "serialize")
+        self.assertEqual(le2.success, 1)
+
+    def test_04_monitoring_stats(self):
+        from privacyidea.lib.monitoringstats import get_values, delete_stats
+        config = self.app.config.copy()
+        config.update({"PI_AUDIT_ASYNC_STATS_INTERVAL": 1})
+        writer = AuditWriter(AsyncAudit(config), self.app)
+        writer.stop(10)
+        writer.max_write_latency = 0.25
+        # The stats are only written after the interval
+        writer._write_stats()
+        self.assertEqual(get_values("audit_queue_depth"), [])
+        writer._last_stats -= 1
+        writer._write_stats()
+        self.assertEqual(len(get_values("audit_queue_depth")), 1)
+        self.assertEqual(get_values("audit_write_latency_ms")[0][1], 250)
+        delete_stats("audit_queue_depth")
+        delete_stats("audit_write_latency_ms")
+
+    def test_05_write_failures(self):
+        config = self.app.config.copy()
+        config.update({"PI_AUDIT_ASYNC_RETRY_DELAY": 0.01})
+        audit = AsyncAudit(config)
+        audit.clear()
+        write_entries = audit._write_entries
+        writer = AuditWriter(audit)
+        writer.stop(10)
+
+        def create_entries(*actions):
+            entries = []
+            for action in actions:
+                audit.log({"action": action})
+                entries.append(audit._create_entry())
+            return entries
+
+        # A short outage of the database is bridged by the retries
+        outage = [Exception("outage"), Exception("outage")]
+
+        def write_after_outage(entries, session=None):
+            if outage:
+                raise outage.pop()
+            write_entries(entries, session=session)
+
+        with mock.patch.object(audit, "_write_entries", side_effect=write_after_outage) as mock_write:
+            writer.write(create_entries("retry1", "retry2"))
+            self.assertEqual(mock_write.call_count, 3)
+        self.assertEqual(writer.get_stats().get("written"), 2)
+        self.assertEqual(audit.get_total({"action": "retry*"}), 2)
+
+        def write_good_entries(entries, session=None):
+            if any(le.action == "bad" for le in entries):
+                raise Exception("bad entry")
+            write_entries(entries, session=session)
+
+        # Without a spill file the failing entry is counted
+        with mock.patch.object(audit, "_write_entries", side_effect=write_good_entries):
+            writer.write(create_entries("good1", "bad", "good2"))
+        stats = writer.get_stats()
+        self.assertEqual(stats.get("written"), 4)
+        self.assertEqual(stats.get("failed"), 1)
+        self.assertEqual(sorted(e.get("action") for e in audit.search({"action": "good*"}).auditdata),
+                         ["good1", "good2"])
+
+        # With a spill file the failing entry is spilled
+        config.update({"PI_AUDIT_ASYNC_SPILL_FILE": "tests/testdata/audit-spill.jsonl"})
+        writer = AuditWriter(audit)
+        writer.stop(10)
+        with mock.patch.object(audit, "_write_entries", side_effect=write_good_entries):
+            writer.write(create_entries("good3", "bad"))
+            self.assertEqual(writer.get_stats().get("spilled"), 1)
+            self.assertFalse(writer.spill_pending)
+            # The spilled entry is tried again, when the writer is stopped
+            writer.flush()
+        self.assertEqual(writer.get_stats().get("spilled"), 2)
+        self.assertEqual(writer.get_stats().get("failed"), 0)
+        self.assertEqual(len(writer._read_spilled()), 1)
+        self.assertFalse(os.path.exists(writer.spill_file))
+
+    def test_06_writer_errors(self):
+        config = self.app.config.copy()
+        spill_file = "tests/testdata/audit-spill.jsonl"
+        config.update({"PI_AUDIT_ASYNC_QUEUE_SIZE": 1,
+                       "PI_AUDIT_ASYNC_SPILL_FILE": spill_file})
+        audit = AsyncAudit(config)
+        audit.clear()
+        writer = AuditWriter(audit)
+        writer.stop(10)
+        self.addCleanup(lambda: os.path.exists(writer.spill_file + ".corrupt")
+                        and os.remove(writer.spill_file + ".corrupt"))
+
+        # The unreadable lines of the spill file are moved aside
+        audit.log({"action": "spilled"})
+        writer._spill(audit._create_entry())
+        with open(writer.spill_file, "a") as f:
+            f.write('["no entry"]\n{"action": "trunc')
+        entries = writer._read_spilled()
+        self.assertEqual([le.action for le in entries], ["spilled"])
+        self.assertEqual(writer.get_stats().get("failed"), 2)
+        self.assertFalse(os.path.exists(writer.spill_file))
+        with open(writer.spill_file + ".corrupt") as f:
+            self.assertEqual(f.read(), '["no entry"]\n{"action": "trunc\n')
+
+        # The request does not wait for a stopped writer, but spills the entry
+        audit.log({"action": "queued"})
+        writer.put(audit._create_entry())
+        with mock.patch("privacyidea.lib.auditmodules.asyncaudit.PUT_TIMEOUT", 0.01):
+            audit.log({"action": "blocked"})
+            writer.put(audit._create_entry())
+        self.assertEqual(writer.get_stats().get("spilled"), 2)
+        self.assertEqual([le.action for le in writer._read_spilled()], ["blocked"])
+
+        # If the spill file can not be written, the entry is dropped
+        writer.spill_file = "tests/testdata/missing/audit-spill.jsonl"
+        audit.log({"action": "dropped"})
+        writer.put(audit._create_entry())
+        self.assertEqual(writer.get_stats().get("dropped"), 1)
+        with mock.patch.object(audit, "_write_entries", side_effect=Exception("bad entry")):
+            writer.write([audit._create_entry()])
+        self.assertEqual(writer.get_stats().get("failed"), 3)
+
+        # The writer thread survives an error
+        writer = AuditWriter(audit)
+        with mock.patch.object(writer, "_write_stats", side_effect=Exception("stats")):
+            audit.log({"action": "survive1"})
+            writer.put(audit._create_entry())
+            for _i in range(100):
+                if writer.get_stats().get("written"):
+                    break
+                time.sleep(0.05)
+            self.assertTrue(writer.thread.is_alive())
+            audit.log({"action": "survive2"})
+            writer.put(audit._create_entry())
+            writer.stop(10)
+        self.assertFalse(writer.thread.is_alive())
+        self.assertEqual(writer.get_stats().get("written"), 2)
+        self.assertEqual(audit.get_total({"action": "survive*"}), 2)
+
 
 class AuditColumnLengthTestCase(OverrideConfigTestCase):
     class Config(TestingConfig):
@@ -0,0 +1,94 @@
+"""
+This file tests the lib/challengenotify.py
+"""
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+from privacyidea.lib.challengenotify import (ChallengeNotifier, SocketChannel,
+                                             get_challenge_notifier, notify_challenge_answered,
+                                             DEFAULT_POLL_INTERVAL, DEFAULT_POLL_INTERVAL_CHANNEL)
+from privacyidea.lib.framework import get_app_local_store
+from .base import MyTestCase
+
+
+class ChallengeNotifierTestCase(MyTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        get_app_local_store().pop("challenge_notifier", None)
+        self.app.config.pop("PI_CHALLENGE_NOTIFY_CHANNEL", None)
+        self.app.config.pop("PI_CHALLENGE_NOTIFY_SOCKET_DIR", None)
+
+    def test_01_local(self):
+        notifier = ChallengeNotifier()
+        with notifier.waiting("tid1") as answered1, notifier.waiting("tid1") as answered2:
+            with notifier.waiting("tid2") as answered3:
+                self.assertEqual(notifier.notify("tid1"), 2)
+                self.assertTrue(answered1.is_set())
+                self.assertTrue(answered2.is_set())
+                self.assertFalse(answered3.is_set())
+        # The waiters are removed
+        self.assertEqual(notifier._waiters, {})
+        self.assertEqual(notifier.notify("tid1"), 0)
+
+        # A waiting thread is woken up
+        result = {}
+
+        def wait():
+            with notifier.waiting("tid3") as answered:
+                start = time.time()
+                result["answered"] = answered.wait(10)
+                result["duration"] = time.time() - start
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        while not notifier._waiters:
+            time.sleep(0.01)
+        notifier.notify("tid3")
+        thread.join()
+        self.assertTrue(result.get("answered"))
+        self.assertLess(result.get("duration"), 5)
+
+    def test_02_socket_channel(self):
+        notifier1 = ChallengeNotifier(SocketChannel(self.directory, "one"))
+        notifier2 = ChallengeNotifier(SocketChannel(self.directory, "two"))
+        # A stale socket of a process, which does not exist anymore
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        stale_path = os.path.join(self.directory, "pi-stale.sock")
+        stale.bind(stale_path)
+        stale.close()
+        try:
+            with notifier2.waiting("tid1") as answered:
+                self.assertEqual(notifier1.notify("tid1"), 0)
+                self.assertTrue(answered.wait(5))
+            self.assertFalse(os.path.exists(stale_path))
+        finally:
+            notifier1.close()
+            notifier2.close()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_03_get_notifier(self):
+        notifier = get_challenge_notifier()
+        self.assertIs(notifier, get_challenge_notifier())
+        self.assertEqual(notifier.poll_interval, DEFAULT_POLL_INTERVAL)
+        with notifier.waiting("tid1") as answered:
+            notify_challenge_answered("tid1")
+            self.assertTrue(answered.is_set())
+
+        get_app_local_store().pop("challenge_notifier")
+        self.app.config["PI_CHALLENGE_NOTIFY_CHANNEL"] = "socket"
+        self.app.config["PI_CHALLENGE_NOTIFY_SOCKET_DIR"] = self.directory
+        notifier = get_challenge_notifier()
+        try:
+            self.assertIsInstance(notifier.channel, SocketChannel)
+            self.assertEqual(notifier.poll_interval, DEFAULT_POLL_INTERVAL_CHANNEL)
+            self.assertEqual(os.listdir(self.directory), ["pi-{0!s}.sock".format(os.getpid())])
+        finally:
+            notifier.close()
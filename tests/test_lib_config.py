@@ -3,7 +3,7 @@ This test file tests the lib.config
 
 The lib.config only depends on the database model.
 """
-from privacyidea.models import Config, save_config_timestamp, db, NodeName
+from privacyidea.models import Config, save_config_timestamp, db, NodeName, CONFIG_CATEGORIES
 from .base import MyTestCase
 from privacyidea.lib.config import (get_resolver_list,
                                     get_resolver_classes,
@@ -22,6 +22,7 @@ from privacyidea.lib.config import (get_resolver_list,
                                     get_machine_resolver_class_dict,
                                     get_privacyidea_node, get_privacyidea_nodes,
                                     this, get_config_object, invalidate_config_object,
+                                    get_shared_config_object,
                                     get_multichallenge_enrollable_tokentypes,
                                     get_email_validators,
                                     check_node_uuid_exists)
@@ -270,6 +271,55 @@ class ConfigTestCase(MyTestCase):
         # ... and the new config object knows!
         self.assertEqual(get_from_config("some_key", "default"), "some_value")
 
+    def test_09b_reload_changed_categories(self):
+        from privacyidea.lib.policy import set_policy, delete_policy
+        from privacyidea.lib.resolver import save_resolver, delete_resolver
+        shared_config = get_shared_config_object()
+        save_resolver({"resolver": "reso_reload", "type": "passwdresolver",
+                       "fileName": "tests/testdata/passwords"})
+        get_config_object()
+        stats = shared_config.get_reload_stats()
+        resolver_definition = shared_config.resolver["reso_reload"]
+        # A policy change only reloads the policies
+        set_policy(name="pol_reload", scope="authentication", action="otppin=userstore")
+        self.assertIn("pol_reload", [p.get("name") for p in get_config_object().policies])
+        new_stats = shared_config.get_reload_stats()
+        self.assertEqual(new_stats["reload_count"], stats["reload_count"] + 1)
+        self.assertEqual(new_stats["category_reload_count"]["policy"],
+                         stats["category_reload_count"]["policy"] + 1)
+        for category in ["config", "resolver", "realm", "event", "caconnector"]:
+            self.assertEqual(new_stats["category_reload_count"][category],
+                             stats["category_reload_count"][category], category)
+        self.assertIs(shared_config.resolver["reso_reload"], resolver_definition)
+        self.assertGreaterEqual(new_stats["reload_duration"], new_stats["last_reload_duration"])
+        # The category timestamps are not part of the configuration
+        self.assertNotIn("__timestamp_policy__", get_from_config())
+
+        # A change of another resolver reuses the unchanged resolver definition
+        save_resolver({"resolver": "reso_reload2", "type": "passwdresolver",
+                       "fileName": "tests/testdata/passwords"})
+        self.assertIn("reso_reload2", get_config_object().resolver)
+        self.assertIs(shared_config.resolver["reso_reload"], resolver_definition)
+        save_resolver({"resolver": "reso_reload", "type": "passwdresolver",
+                       "fileName": "tests/testdata/passwd"})
+        self.assertEqual(get_config_object().resolver["reso_reload"]["data"]["fileName"],
+                         "tests/testdata/passwd")
+        self.assertIsNot(shared_config.resolver["reso_reload"], resolver_definition)
+
+        # A change without category reloads everything
+        stats = shared_config.get_reload_stats()
+        save_config_timestamp()
+        db.session.commit()
+        get_config_object()
+        new_stats = shared_config.get_reload_stats()
+        for category in CONFIG_CATEGORIES:
+            self.assertEqual(new_stats["category_reload_count"][category],
+                             stats["category_reload_count"][category] + 1, category)
+
+        delete_policy("pol_reload")
+        delete_resolver("reso_reload")
+        delete_resolver("reso_reload2")
+
     def test_10_enrollable_tokentypes(self):
         ttypes = get_multichallenge_enrollable_tokentypes()
         self.assertIn("hotp", ttypes)
@@ -3,6 +3,10 @@ This test file tests the lib.crypto and lib.security.default
 """
 from mock import call
 import binascii
+import mock
+import os
+import shutil
+import tempfile
 
 from privacyidea.config import TestingConfig
 from privacyidea.lib.error import HSMException
@@ -15,8 +19,12 @@ from privacyidea.lib.crypto import (encryptPin, encryptPassword, decryptPin,
                                     verify_with_pepper, aes_encrypt_b64, aes_decrypt_b64,
                                     get_hsm, init_hsm, set_hsm_password, hash,
                                     encrypt, decrypt, Sign, generate_keypair,
-                                    generate_password, pass_hash, verify_pass_hash)
+                                    generate_password, pass_hash, verify_pass_hash,
+                                    verify_and_update_pass_hash, get_pass_context,
+                                    get_sign_object, DEFAULT_HASH_ALGO_PARAMS,
+                                    SIG_VER_ED25519, SIG_VER_ECDSA, SIG_VER_HMAC)
 from privacyidea.lib.utils import to_bytes, to_unicode
+from privacyidea.lib.framework import get_app_local_store
 from privacyidea.lib.security.default import (SecurityModule,
                                               DefaultSecurityModule)
 from privacyidea.lib.security.aeshsm import AESHardwareSecurityModule
@@ -26,6 +34,18 @@ import PyKCS11
 from PyKCS11 import PyKCS11Error
 import string
 import passlib.hash
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, ec
+
+
+def _create_pem_keys(private_key):
+    priv_pem = private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                         format=serialization.PrivateFormat.PKCS8,
+                                         encryption_algorithm=serialization.NoEncryption())
+    pub_pem = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo)
+    return priv_pem, pub_pem
 
 
 class SecurityModuleTestCase(MyTestCase):
@@ -702,6 +722,105 @@ class SignObjectTestCase(MyTestCase):
         long_data = b'\x01\x02' * 5000
         self.assertTrue(so.verify(long_data, long_data_sig, verify_old_sigs=True))
 
+    def test_02_cached_sign_object(self):
+        priv_file = current_app.config.get("PI_AUDIT_KEY_PRIVATE")
+        pub_file = current_app.config.get("PI_AUDIT_KEY_PUBLIC")
+        get_app_local_store().pop("signing_keys", None)
+        with mock.patch.object(Sign, "load_private_key", wraps=Sign.load_private_key) as mock_load:
+            so1 = get_sign_object(priv_file, pub_file)
+            so2 = get_sign_object(priv_file, check_private_key=False)
+            # The checked private key is loaded only once
+            mock_load.assert_called_once()
+        self.assertIs(so1.private, so2.private)
+        self.assertIsNone(so2.public)
+        sig = so2.sign("testdata")
+        self.assertTrue(so1.verify("testdata", sig))
+
+        # The key is loaded again, if the file changed
+        directory = tempfile.mkdtemp()
+        try:
+            key_file = os.path.join(directory, "private.pem")
+            shutil.copy(priv_file, key_file)
+            so3 = get_sign_object(key_file)
+            self.assertIsNot(so3.private, so1.private)
+            self.assertIs(get_sign_object(key_file).private, so3.private)
+            stat = os.stat(key_file)
+            os.utime(key_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+            so4 = get_sign_object(key_file)
+            self.assertIsNot(so4.private, so3.private)
+            self.assertTrue(so1.verify("testdata", so4.sign("testdata")))
+            # A missing file raises an error
+            os.unlink(key_file)
+            self.assertRaises(IOError, get_sign_object, key_file)
+        finally:
+            shutil.rmtree(directory)
+            get_app_local_store().pop("signing_keys", None)
+
+    def test_03_signature_versions(self):
+        rsa_priv = open(current_app.config.get("PI_AUDIT_KEY_PRIVATE"), 'rb').read()
+        rsa_pub = open(current_app.config.get("PI_AUDIT_KEY_PUBLIC"), 'rb').read()
+        ed_priv, ed_pub = _create_pem_keys(ed25519.Ed25519PrivateKey.generate())
+        ec_priv, ec_pub = _create_pem_keys(ec.generate_private_key(ec.SECP256R1()))
+        data = 'short text'
+
+        ed_so = Sign(ed_priv, ed_pub)
+        self.assertEqual(ed_so.sig_ver, SIG_VER_ED25519)
+        ed_sig = ed_so.sign(data)
+        self.assertTrue(ed_sig.startswith(SIG_VER_ED25519 + ':'), ed_sig)
+        self.assertTrue(ed_so.verify(data, ed_sig))
+        self.assertFalse(ed_so.verify('other text', ed_sig))
+
+        ec_so = Sign(ec_priv, ec_pub)
+        self.assertEqual(ec_so.sig_ver, SIG_VER_ECDSA)
+        ec_sig = ec_so.sign(data)
+        self.assertTrue(ec_sig.startswith(SIG_VER_ECDSA + ':'), ec_sig)
+        self.assertTrue(ec_so.verify(data, ec_sig))
+        self.assertFalse(ec_so.verify('other text', ec_sig))
+        # an Ed25519 signature is not verified with the EC key
+        self.assertFalse(ec_so.verify(data, ed_sig))
+
+        # Unsupported key types
+        _, secp384_pub = _create_pem_keys(ec.generate_private_key(ec.SECP384R1()))
+        secp384_priv, _ = _create_pem_keys(ec.generate_private_key(ec.SECP384R1()))
+        self.assertRaises(Exception, Sign, secp384_priv)
+
+        hmac_so = Sign(hmac_key=b'0123456789abcdef0123456789abcdef')
+        self.assertEqual(hmac_so.sig_ver, SIG_VER_HMAC)
+        hmac_sig = hmac_so.sign(data)
+        self.assertTrue(hmac_sig.startswith(SIG_VER_HMAC + ':'), hmac_sig)
+        self.assertTrue(hmac_so.verify(data, hmac_sig))
+        self.assertFalse(hmac_so.verify('other text', hmac_sig))
+        self.assertFalse(Sign(hmac_key=b'another key').verify(data, hmac_sig))
+        # The HMAC signature can not be verified with a public key
+        self.assertFalse(ed_so.verify(data, hmac_sig))
+
+        # After a change of the key, the signatures of all keys can be verified
+        rsa_sig = Sign(rsa_priv).sign(data)
+        mixed_so = Sign(ed_priv, rsa_pub + ed_pub + ec_pub + secp384_pub,
+                        hmac_key=b'0123456789abcdef0123456789abcdef')
+        self.assertEqual(len(mixed_so.public_keys), 4)
+        self.assertEqual(mixed_so.sig_ver, SIG_VER_HMAC)
+        for sig in [rsa_sig, ed_sig, ec_sig, hmac_sig]:
+            self.assertTrue(mixed_so.verify(data, sig), sig)
+            self.assertFalse(mixed_so.verify('other text', sig), sig)
+
+    def test_04_cached_hmac_key(self):
+        directory = tempfile.mkdtemp()
+        try:
+            key_file = os.path.join(directory, "hmac.key")
+            with open(key_file, "w") as f:
+                f.write("00112233445566778899aabbccddeeff\n")
+            so = get_sign_object(public_key_file=current_app.config.get("PI_AUDIT_KEY_PUBLIC"),
+                                 hmac_key_file=key_file)
+            self.assertEqual(so.hmac_key, binascii.unhexlify("00112233445566778899aabbccddeeff"))
+            self.assertIs(get_sign_object(hmac_key_file=key_file).hmac_key, so.hmac_key)
+            sig = so.sign("testdata")
+            self.assertTrue(sig.startswith(SIG_VER_HMAC), sig)
+            self.assertTrue(get_sign_object(hmac_key_file=key_file).verify("testdata", sig))
+        finally:
+            shutil.rmtree(directory)
+            get_app_local_store().pop("signing_keys", None)
+
 
 class DefaultHashAlgoListTestCase(MyTestCase):
     """Check if the default hash algorithm list is used."""
@@ -726,6 +845,39 @@ class DefaultHashAlgoListTestCase(MyTestCase):
         # Checks if a faulty hash is failing.
         self.assertFalse(verify_pass_hash(password, argon2_fail_hash))
 
+    def test_02_cached_context(self):
+        pass_ctx = get_pass_context()
+        self.assertIs(pass_ctx, get_pass_context())
+        pass_hash("password")
+        self.assertEqual(DEFAULT_HASH_ALGO_PARAMS, {'argon2__rounds': 9})
+        self.assertIs(pass_ctx, get_pass_context())
+        # The context is created again, if the config changes
+        current_app.config["PI_HASH_ALGO_PARAMS"] = {'argon2__rounds': 5}
+        new_ctx = get_pass_context()
+        self.assertIsNot(pass_ctx, new_ctx)
+        self.assertIn('t=5', pass_hash("password").split('$')[3])
+        current_app.config.pop("PI_HASH_ALGO_PARAMS")
+        self.assertIsNot(new_ctx, get_pass_context())
+        self.assertEqual(DEFAULT_HASH_ALGO_PARAMS, {'argon2__rounds': 9})
+
+    def test_03_verify_and_update(self):
+        password = "password"
+        pbkdf2_sha512_hash = '$pbkdf2-sha512$25000$XEvJOcf437tXam1Nydm79w$6eDPlPjRgnJGGK0j8a3to' \
+                             'SZoSUvwZzcvEj96t7Hg.X/SC822EFaO2iWoHFTUc1NMsX6sgQyQqbjWxGXgRWNzkw'
+        # A hash with the current algorithm and parameters is not updated
+        self.assertEqual(verify_and_update_pass_hash(password, pass_hash(password)), (True, None))
+        # A hash with another algorithm is updated to the first algorithm in the list
+        valid, new_hash = verify_and_update_pass_hash(password, pbkdf2_sha512_hash)
+        self.assertTrue(valid)
+        self.assertTrue(new_hash.startswith('$argon2'), new_hash)
+        self.assertTrue(verify_pass_hash(password, new_hash))
+        # A wrong password is not updated
+        self.assertEqual(verify_and_update_pass_hash("wrong", pbkdf2_sha512_hash), (False, None))
+        # The rehashing can be switched off
+        current_app.config["PI_HASH_ALGO_REHASH"] = False
+        self.assertEqual(verify_and_update_pass_hash(password, pbkdf2_sha512_hash), (True, None))
+        current_app.config.pop("PI_HASH_ALGO_REHASH")
+
 
 class CustomParamsDefaultHashAlgoListTestCase(OverrideConfigTestCase):
     """Check if the default hash algorithm list is used with params from config."""
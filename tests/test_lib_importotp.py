@@ -3,12 +3,14 @@ This test file tests the lib.importotp
 
 """
 import gnupg
+import io
 import unittest
 
 from .base import MyTestCase
 from privacyidea.lib.importotp import (parseOATHcsv, parseYubicoCSV,
                                        parseSafeNetXML,
-                                       parsePSKCdata, GPGImport)
+                                       parsePSKCdata, GPGImport,
+                                       iter_oath_csv, iter_pskc_data)
 from privacyidea.lib.error import TokenImportException
 from privacyidea.lib.token import remove_token
 from privacyidea.lib.token import init_token
@@ -742,6 +744,66 @@ class ImportOTPTestCase(MyTestCase):
         self.assertEqual(tokens.get("t4").get("otpkey"), "lässig")
 
 
+    def test_07_iter_oath_csv(self):
+        # The lines of a file still contain the line endings
+        for csv in [OATHCSV, OATHCSV_USER]:
+            self.assertEqual(dict(iter_oath_csv(io.StringIO(csv))), parseOATHcsv(csv))
+        tokens = list(iter_oath_csv(io.StringIO(OATHCSV_USER)))
+        self.assertEqual([serial for serial, _token in tokens], ["tok1", "tok3"])
+        self.assertEqual(tokens[1][1]["user"]["realm"], "realm3")
+
+    def test_08_iter_pskc_data(self):
+        def iter_pskc(xml_data, **kwargs):
+            return iter_pskc_data(io.BytesIO(xml_data.strip().encode("utf8")), **kwargs)
+
+        # The incremental parser returns the same tokens
+        encryption_key_hex = "12345678901234567890123456789012"
+        for xml_data, kwargs in [(XML_PSKC, {}), (YUBIKEY_PSKC_TOTP, {}), (YUBIKEY_PSKC_HOTP, {}),
+                                 (XML_PSKC_AES, {"preshared_key_hex": encryption_key_hex})]:
+            tokens, _ = parsePSKCdata(xml_data, **kwargs)
+            self.assertEqual(dict(iter_pskc(xml_data, **kwargs)), tokens)
+        # a well-formed version of the password based file
+        xml_password = XML_PSKC_PASSWORD_PREFIX.replace(
+            'xmlns="urn:ietf:params:xml:ns:keyprov:pskc"',
+            'xmlns="urn:ietf:params:xml:ns:keyprov:pskc" xmlns:pskc="urn:ietf:params:xml:ns:keyprov:pskc"'
+        ).replace("</pskc:EncryptionKey>", "</EncryptionKey>").replace("</pskc:KeyContainer>",
+                                                                       "</KeyContainer>")
+        tokens, _ = parsePSKCdata(XML_PSKC_PASSWORD_PREFIX, password="qwerty")
+        self.assertEqual(dict(iter_pskc(xml_password, password="qwerty")), tokens)
+        self.assertRaises(TokenImportException, list, iter_pskc(xml_password))
+        with open("tests/testdata/pskc-aes.xml", "rb") as f:
+            tokens = list(iter_pskc_data(f, preshared_key_hex=encryption_key_hex))
+        self.assertEqual(len(tokens), 1)
+
+        # The tokens are returned one after the other
+        token_iter = iter_pskc(XML_PSKC)
+        serial, token = next(token_iter)
+        self.assertEqual(serial, "1000133508267")
+        self.assertEqual(token["hashlib"], "sha256")
+        self.assertEqual(len(list(token_iter)), 6)
+
+        # invalid MAC
+        xml_wrong_mac = XML_PSKC_AES.replace("Su+NvtQfmvfJzF6bmQiJqoLRExc=", "Su+NvtQfmvfJzF6XYZiJqoLRExc=")
+        with self.assertRaises(TokenImportException):
+            list(iter_pskc(xml_wrong_mac, preshared_key_hex=encryption_key_hex))
+        self.assertEqual(list(iter_pskc(xml_wrong_mac, preshared_key_hex=encryption_key_hex,
+                                        validate_mac='check_fail_soft')),
+                         [("987654321", None)])
+        tokens = dict(iter_pskc(xml_wrong_mac, preshared_key_hex=encryption_key_hex,
+                                validate_mac='no_check'))
+        self.assertEqual(tokens["987654321"]["otpkey"], "3132333435363738393031323334353637383930")
+        # wrong encryption key
+        with self.assertRaises(TokenImportException):
+            list(iter_pskc(XML_PSKC_AES, preshared_key_hex="00" * 16))
+
+        # The XML data needs to be well-formed
+        self.assertRaises(TokenImportException, list, iter_pskc("not xml"))
+        self.assertRaises(TokenImportException, list, iter_pskc(XML_PSKC_PASSWORD_PREFIX,
+                                                                password="qwerty"))
+        self.assertRaises(TokenImportException, list, iter_pskc("<Other><KeyPackage/></Other>"))
+        self.assertRaises(TokenImportException, list, iter_pskc("<KeyContainer><Key"))
+
+
 class GPGTestCase(MyTestCase):
 
     @unittest.skipIf(not gpg_available, "'gpg' binary not available")
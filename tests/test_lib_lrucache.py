@@ -0,0 +1,142 @@
+"""
+This file tests the lib/lrucache.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from privacyidea.lib.lrucache import LRUCache, SQLiteCache, LayeredCache, MISSING
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_01_get_set(self):
+        cache = LRUCache(max_entries=10)
+        self.assertIs(cache.get("bob"), MISSING)
+        cache.set("bob", "1000", 60)
+        self.assertEqual(cache.get("bob"), "1000")
+        # None and empty values are cached
+        cache.set("unknown", None, 60)
+        self.assertIsNone(cache.get("unknown"))
+        self.assertIn("unknown", cache)
+        self.assertEqual(len(cache), 2)
+        cache.delete("unknown")
+        self.assertNotIn("unknown", cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats.as_dict(), {"hits": 2, "misses": 1,
+                                                 "evictions": 0, "expirations": 0})
+
+    def test_02_eviction(self):
+        cache = LRUCache(max_entries=3)
+        for key in ["a", "b", "c"]:
+            cache.set(key, key, 60)
+        # "a" is used again, so "b" is the least recently used entry
+        cache.get("a")
+        cache.set("d", "d", 60)
+        self.assertEqual(len(cache), 3)
+        self.assertNotIn("b", cache)
+        for key in ["a", "c", "d"]:
+            self.assertIn(key, cache)
+        self.assertEqual(cache.stats.evictions, 1)
+
+    def test_03_expiration(self):
+        clock = FakeClock()
+        cache = LRUCache(clock=clock)
+        cache.set("bob", "1000", 60)
+        clock.now += 59
+        self.assertEqual(cache.get("bob"), "1000")
+        clock.now += 1
+        self.assertIs(cache.get("bob"), MISSING)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats.expirations, 1)
+        self.assertEqual(cache.stats.misses, 1)
+
+
+class SQLiteCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "cache.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_01_shared(self):
+        clock = FakeClock()
+        cache1 = SQLiteCache(self.filename, clock=clock)
+        cache2 = SQLiteCache(self.filename, clock=clock)
+        key = ("resolverid", "getUserInfo", "1000")
+        cache1.set(key, {"username": "bob", "phone": ["1234"]}, 60)
+        self.assertEqual(cache2.get(key), {"username": "bob", "phone": ["1234"]})
+        # values, which can not be stored as JSON, are not cached
+        cache1.set("object", object(), 60)
+        self.assertIs(cache2.get("object"), MISSING)
+        clock.now += 60
+        self.assertIs(cache2.get(key), MISSING)
+        self.assertEqual(cache2.stats.as_dict(), {"hits": 1, "misses": 2,
+                                                  "evictions": 0, "expirations": 1})
+        cache1.set(key, "bob", 60)
+        cache2.delete(key)
+        self.assertIs(cache1.get(key), MISSING)
+
+    def test_02_cleanup(self):
+        clock = FakeClock()
+        cache = SQLiteCache(self.filename, max_entries=3, clock=clock, cleanup_interval=5)
+        cache.set("expired", "value", 1)
+        clock.now += 2
+        for i in range(4):
+            cache.set(i, i, 60 + i)
+        # the fifth write removes the expired entry and evicts the oldest entry
+        self.assertIs(cache.get(0), MISSING)
+        self.assertIs(cache.get("expired"), MISSING)
+        for i in range(1, 4):
+            self.assertEqual(cache.get(i), i)
+        self.assertEqual(cache.stats.evictions, 1)
+        cache.clear()
+        self.assertIs(cache.get(1), MISSING)
+
+
+class LayeredCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "cache.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_01_layers(self):
+        clock = FakeClock()
+        cache1 = LayeredCache(LRUCache(clock=clock), SQLiteCache(self.filename, clock=clock),
+                              local_ttl=5)
+        cache2 = LayeredCache(LRUCache(clock=clock), SQLiteCache(self.filename, clock=clock),
+                              local_ttl=5)
+        cache1.set("bob", "1000", 60)
+        self.assertIn("bob", cache1.local)
+        # the entry is found in the shared cache and copied to the local cache
+        self.assertEqual(cache2.get("bob"), "1000")
+        self.assertEqual(cache2.local.get("bob", count=False), "1000")
+        # the local entries expire first
+        clock.now += 10
+        self.assertIs(cache1.local.get("bob", count=False), MISSING)
+        self.assertEqual(cache1.get("bob"), "1000")
+        clock.now += 60
+        self.assertIs(cache2.get("bob"), MISSING)
+        self.assertEqual(cache2.stats.as_dict()["hits"], 1)
+        self.assertEqual(cache2.stats.as_dict()["misses"], 1)
+        cache1.set("alice", "1001", 60)
+        cache2.delete("alice")
+        self.assertIs(cache2.get("alice"), MISSING)
+        cache1.clear()
+        self.assertEqual(len(cache1.local), 0)
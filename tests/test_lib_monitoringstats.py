@@ -1,12 +1,22 @@
 from privacyidea.models import MonitoringStats, db
 from privacyidea.lib.monitoringstats import (write_stats, delete_stats,
                                              get_stats_keys, get_values,
-                                             get_last_value)
+                                             get_last_value, write_timing_stats,
+                                             TIMING_STATS_INTERVAL, TIMING_STATS_TOP,
+                                             write_request_stats, REQUEST_STATS_INTERVAL,
+                                             write_config_reload_stats, CONFIG_RELOAD_STATS_INTERVAL,
+                                             _config_reload_flush)
+from privacyidea.lib.requeststats import (enable_request_stats, start_request_stats,
+                                          end_request_stats, request_timer, POLICY)
+from privacyidea.lib.log import (log_with, enable_timing, get_timing_stats,
+                                 reset_timing_stats)
 
 from .base import MyTestCase
 import datetime
 from dateutil.tz import tzlocal, tzutc
 from datetime import timedelta
+import logging
+import threading
 
 
 class TokenModelTestCase(MyTestCase):
@@ -123,4 +133,113 @@ class TokenModelTestCase(MyTestCase):
 
         # Get the last value of key1
         r = get_last_value("key1")
-        self.assertEqual(r, 10)
\ No newline at end of file
+        self.assertEqual(r, 10)
+
+    def test_05_write_timing_stats(self):
+        @log_with(logging.getLogger(__name__))
+        def timed_function(x):
+            return x
+
+        reset_timing_stats()
+        # The timing is disabled by default
+        timed_function(1)
+        self.assertEqual(get_timing_stats(), {})
+        self.assertEqual(write_timing_stats(force=True), 0)
+
+        enable_timing()
+        try:
+            timed_function(1)
+            # The timing of other threads is merged, also after they finished
+            thread = threading.Thread(target=timed_function, args=(2,))
+            thread.start()
+            thread.join()
+            name = timed_function.__module__ + "." + timed_function.__qualname__
+            stats = get_timing_stats()
+            self.assertEqual(stats[name]["count"], 2)
+            self.assertLessEqual(stats[name]["max"], stats[name]["total"])
+            self.assertLessEqual(stats[name]["p50"], stats[name]["p99"])
+            self.assertGreaterEqual(stats[name]["p99"], stats[name]["max"])
+
+            # The interval has not passed
+            self.app.config[TIMING_STATS_INTERVAL] = 3600
+            self.assertEqual(write_timing_stats(), 0)
+            self.app.config[TIMING_STATS_TOP] = 1
+            self.assertEqual(write_timing_stats(force=True), 1)
+            db.session.commit()
+            self.assertEqual([key for key in get_stats_keys() if key.startswith("timing_")],
+                             ["timing_" + name])
+            # Only the functions called since the last write are written
+            self.app.config[TIMING_STATS_TOP] = 20
+            write_timing_stats(force=True)
+            db.session.commit()
+            self.assertEqual(len(get_values("timing_" + name)), 1)
+            timed_function(3)
+            write_timing_stats(force=True)
+            db.session.commit()
+            self.assertEqual(len(get_values("timing_" + name)), 2)
+
+            reset_timing_stats()
+            self.assertEqual(get_timing_stats(), {})
+        finally:
+            enable_timing(False)
+            reset_timing_stats()
+            self.app.config.pop(TIMING_STATS_INTERVAL, None)
+            self.app.config.pop(TIMING_STATS_TOP, None)
+
+    def test_06_write_request_stats(self):
+        # The request statistics are disabled by default
+        self.assertEqual(write_request_stats(force=True), 0)
+        enable_request_stats()
+        try:
+            # write the statistics of the former requests
+            write_request_stats(force=True)
+            self.assertEqual(write_request_stats(force=True), 0)
+            for _i in range(2):
+                start_request_stats()
+                MonitoringStats.query.count()
+                with request_timer(POLICY):
+                    pass
+                end_request_stats()
+            # The interval has not passed
+            self.app.config[REQUEST_STATS_INTERVAL] = 3600
+            self.assertEqual(write_request_stats(), 0)
+            self.assertEqual(write_request_stats(force=True), 5)
+            db.session.commit()
+            keys = [key for key in get_stats_keys() if key.startswith("request_")]
+            self.assertEqual(sorted(keys), ["request_crypto", "request_db", "request_db_queries",
+                                            "request_policy", "request_resolver"])
+            self.assertEqual(get_last_value("request_db_queries"), 1)
+            self.assertEqual(get_last_value("request_crypto"), 0)
+            # No requests since the last write
+            self.assertEqual(write_request_stats(force=True), 0)
+        finally:
+            enable_request_stats(False)
+            self.app.config.pop(REQUEST_STATS_INTERVAL, None)
+
+    def test_07_write_config_reload_stats(self):
+        from privacyidea.lib.config import get_config_object
+        from privacyidea.lib.policy import set_policy, delete_policy
+        get_config_object()
+        # write the statistics of the former reloads
+        write_config_reload_stats(force=True)
+        self.assertEqual(write_config_reload_stats(force=True), 0)
+        try:
+            set_policy(name="pol_reload_stats", scope="authentication", action="otppin=userstore")
+            get_config_object()
+            # The statistics are only written, if the interval is configured
+            _config_reload_flush["time"] -= 600
+            self.assertEqual(write_config_reload_stats(), 0)
+            # The interval has not passed
+            self.app.config[CONFIG_RELOAD_STATS_INTERVAL] = 3600
+            self.assertEqual(write_config_reload_stats(), 0)
+            self.assertEqual(write_config_reload_stats(force=True), 8)
+            db.session.commit()
+            self.assertEqual(get_last_value("config_reload_count"), 1)
+            self.assertEqual(get_last_value("config_reload_policy"), 1)
+            self.assertEqual(get_last_value("config_reload_resolver"), 0)
+            self.assertGreaterEqual(get_last_value("config_reload_duration"), 0)
+            # No reloads since the last write
+            self.assertEqual(write_config_reload_stats(force=True), 0)
+        finally:
+            delete_policy("pol_reload_stats")
+            self.app.config.pop(CONFIG_RELOAD_STATS_INTERVAL, None)
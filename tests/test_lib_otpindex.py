@@ -0,0 +1,160 @@
+"""
+This file contains the tests for lib/otpindex.py
+"""
+import binascii
+
+from mock import patch
+
+from .base import MyTestCase
+from privacyidea.lib.error import TokenAdminError, ParameterError
+from privacyidea.lib.monitoringstats import get_values
+from privacyidea.lib.otpindex import (get_otp_index_size, lookup_otp_index,
+                                      update_otp_index, OTP_INDEX_SIZE, _hash_otp)
+from privacyidea.lib.task.otpindex import OTPIndexTask
+from privacyidea.lib.token import (init_token, get_tokens, get_token_by_otp,
+                                   get_serial_by_otp, remove_token, set_hashlib,
+                                   update_otp_index_of_tokens)
+from privacyidea.lib.tokens.HMAC import HmacOtp
+from privacyidea.models import OTPIndex
+
+OTPKEY = binascii.hexlify(b"12345678901234567890").decode()
+# test vectors of RFC 4226
+OTPS = ["755224", "287082", "359152", "969429", "338314",
+        "254676", "287922", "162583", "399871", "520489"]
+
+
+class OTPIndexTestCase(MyTestCase):
+
+    def setUp(self):
+        self.app.config[OTP_INDEX_SIZE] = 10
+
+    def tearDown(self):
+        self.app.config.pop(OTP_INDEX_SIZE, None)
+        for tok in get_tokens():
+            remove_token(tok.token.serial)
+
+    def test_01_update_and_lookup(self):
+        self.app.config.pop(OTP_INDEX_SIZE)
+        self.assertEqual(get_otp_index_size(), 0)
+        self.app.config[OTP_INDEX_SIZE] = 10
+        self.assertEqual(get_otp_index_size(), 10)
+
+        hotp = init_token({"serial": "IDX1", "type": "hotp", "otpkey": OTPKEY})
+        totp = init_token({"serial": "IDX2", "type": "totp", "otpkey": OTPKEY})
+        self.assertEqual(update_otp_index([hotp, totp], 10), 1)
+        entries = OTPIndex.query.filter_by(token_id=hotp.token.id).order_by(OTPIndex.counter).all()
+        self.assertEqual([entry.counter for entry in entries], list(range(10)))
+        # The OTP values are not stored in clear text
+        self.assertEqual([entry.otp_hash for entry in entries], [_hash_otp(otp) for otp in OTPS])
+        self.assertNotIn(OTPS[0], [entry.otp_hash for entry in entries])
+        self.assertEqual(OTPIndex.query.filter_by(token_id=totp.token.id).count(), 0)
+
+        # The TOTP token is not covered
+        candidates, remaining = lookup_otp_index([hotp, totp], OTPS[3], window=5)
+        self.assertEqual(candidates, [hotp])
+        self.assertEqual(remaining, [totp])
+        candidates, remaining = lookup_otp_index([hotp, totp], OTPS[6], window=5)
+        self.assertEqual(candidates, [])
+        self.assertEqual(remaining, [totp])
+        # The index does not cover a larger window
+        candidates, remaining = lookup_otp_index([hotp, totp], OTPS[3], window=20)
+        self.assertEqual(candidates, [])
+        self.assertEqual(remaining, [hotp, totp])
+
+        # The counter advanced, so that the index does not cover the window
+        hotp.set_otp_count(6)
+        candidates, remaining = lookup_otp_index([hotp], OTPS[7], window=5)
+        self.assertEqual(candidates, [])
+        self.assertEqual(remaining, [hotp])
+        candidates, remaining = lookup_otp_index([hotp], OTPS[7], window=4)
+        self.assertEqual(candidates, [hotp])
+        self.assertEqual(remaining, [])
+        # Values before the counter are not found
+        candidates, remaining = lookup_otp_index([hotp], OTPS[3], window=4)
+        self.assertEqual(candidates, [])
+        self.assertEqual(remaining, [])
+
+        # A changed hash algorithm invalidates the index
+        set_hashlib("IDX1", "sha256")
+        hotp = get_tokens(serial="IDX1")[0]
+        candidates, remaining = lookup_otp_index([hotp], OTPS[7], window=4)
+        self.assertEqual(remaining, [hotp])
+
+        # Removing the token removes the index
+        remove_token("IDX1")
+        self.assertEqual(OTPIndex.query.count(), 0)
+
+    def test_02_get_token_by_otp(self):
+        init_token({"serial": "IDX1", "type": "hotp", "otpkey": OTPKEY})
+        init_token({"serial": "IDX2", "type": "hotp", "genkey": 1})
+        init_token({"serial": "IDX3", "type": "totp", "otpkey": OTPKEY})
+        # The search does not write the index
+        self.assertEqual(get_serial_by_otp(get_tokens(), OTPS[1]), "IDX1")
+        self.assertEqual(OTPIndex.query.count(), 0)
+        self.assertEqual(get_tokens(serial="IDX1")[0].token.count, 2)
+
+        # The index is built for the HOTP tokens
+        progress = []
+        self.assertEqual(update_otp_index_of_tokens(chunksize=1,
+                                                    progress=lambda *args: progress.append(args)), 2)
+        self.assertEqual(OTPIndex.query.count(), 20)
+        self.assertEqual(progress, [(1, 1), (2, 2)])
+        # The tokens are covered
+        self.assertEqual(update_otp_index_of_tokens(), 0)
+
+        # The search only calculates the OTP values of the candidate
+        with patch("privacyidea.lib.tokens.hotptoken.HotpTokenClass.check_otp_exist",
+                   autospec=True, side_effect=lambda tok, **kwargs: -1) as mock_check:
+            self.assertIsNone(get_serial_by_otp(get_tokens(tokentype="hotp"), OTPS[3]))
+            self.assertEqual([call.args[0].token.serial for call in mock_check.call_args_list],
+                             ["IDX1"])
+        self.assertEqual(get_serial_by_otp(get_tokens(), OTPS[3]), "IDX1")
+        # The counter advanced, so the token is not covered by the index anymore.
+        self.assertEqual(get_serial_by_otp(get_tokens(), OTPS[9]), "IDX1")
+        self.assertEqual(update_otp_index_of_tokens(), 1)
+        entries = OTPIndex.query.filter_by(token_id=get_tokens(serial="IDX1")[0].token.id).all()
+        self.assertEqual(sorted(entry.counter for entry in entries), list(range(10, 20)))
+        self.assertIsNone(get_serial_by_otp(get_tokens(), OTPS[9]))
+
+        # Two tokens with the same OTP values
+        tok = init_token({"serial": "IDX4", "type": "hotp", "otpkey": OTPKEY})
+        tok.set_otp_count(10)
+        otp = HmacOtp(tok.token.get_otpkey(), 0, 6).generate(12, inc_counter=False)
+        self.assertRaises(TokenAdminError, get_token_by_otp, get_tokens(), otp)
+        update_otp_index_of_tokens()
+        # now both tokens are found in the index
+        otp = HmacOtp(tok.token.get_otpkey(), 0, 6).generate(15, inc_counter=False)
+        with patch("privacyidea.lib.token.lookup_otp_index",
+                   wraps=lookup_otp_index) as mock_lookup:
+            self.assertRaises(TokenAdminError, get_token_by_otp, get_tokens(), otp, window=5)
+            mock_lookup.assert_called_once()
+
+        # The index is not used for a window larger than the index
+        with patch("privacyidea.lib.token.lookup_otp_index") as mock_lookup:
+            self.assertIsNone(get_token_by_otp(get_tokens(), "000000", window=20))
+            mock_lookup.assert_not_called()
+        self.assertRaises(ParameterError, update_otp_index_of_tokens, window=20)
+        self.assertRaises(ParameterError, update_otp_index_of_tokens, chunksize=0)
+
+    def test_03_disabled_index(self):
+        self.app.config.pop(OTP_INDEX_SIZE)
+        init_token({"serial": "IDX1", "type": "hotp", "otpkey": OTPKEY})
+        with patch("privacyidea.lib.token.lookup_otp_index") as mock_lookup:
+            self.assertEqual(get_serial_by_otp(get_tokens(), OTPS[1]), "IDX1")
+            self.assertIsNone(get_token_by_otp(get_tokens(), otp=OTPS[2], window=0))
+            mock_lookup.assert_not_called()
+        self.assertEqual(update_otp_index_of_tokens(), 0)
+        self.assertEqual(OTPIndex.query.count(), 0)
+        # The index is not used for an empty window
+        self.app.config[OTP_INDEX_SIZE] = 10
+        self.assertIsNone(get_token_by_otp(get_tokens(), otp=OTPS[2], window=0))
+
+    def test_04_task(self):
+        init_token({"serial": "IDX1", "type": "hotp", "otpkey": OTPKEY})
+        task = OTPIndexTask(self.app.config)
+        self.assertIn("window", task.options)
+        self.assertRaises(ParameterError, task.do, {"window": "many"})
+        self.assertTrue(task.do({"window": "5", "stats_key": "otpindex_updated"}))
+        self.assertEqual(OTPIndex.query.count(), 10)
+        self.assertEqual(get_values("otpindex_updated")[0][1], 1)
+
@@ -0,0 +1,100 @@
+"""
+This file tests the lib/policyindex.py
+"""
+import re
+import unittest
+
+from privacyidea.lib.policyindex import PolicyIndex
+from privacyidea.lib.policy import PolicyClass
+
+
+def _policy(name, **kwargs):
+    policy = {"name": name, "active": True, "scope": "authentication",
+              "action": {"otppin": "userstore"}, "realm": [], "adminrealm": [],
+              "adminuser": [], "resolver": [], "pinode": [], "user": [],
+              "user_case_insensitive": False, "check_all_resolvers": False,
+              "client": [], "time": "", "conditions": [], "priority": 1}
+    policy.update(kwargs)
+    return policy
+
+
+class PolicyIndexTestCase(unittest.TestCase):
+
+    def _names(self, index, positions):
+        return [p.get("name") for p in index.get_policies(positions)]
+
+    def test_01_exact(self):
+        index = PolicyIndex([_policy("pol1"),
+                             _policy("pol2", scope="admin", active=False),
+                             _policy("pol3", scope="admin")])
+        self.assertEqual(self._names(index, index.exact("scope", "admin")), ["pol2", "pol3"])
+        self.assertEqual(self._names(index, index.exact("active", True)), ["pol1", "pol3"])
+        self.assertEqual(self._names(index, index.exact("name", "pol2")), ["pol2"])
+        self.assertEqual(index.exact("name", "unknown"), set())
+
+    def test_02_matching_values(self):
+        index = PolicyIndex([_policy("empty"),
+                             _policy("wildcard", realm=["*"]),
+                             _policy("exact", realm=["realm1", "realm2"]),
+                             _policy("excluded", realm=["*", "!realm1"]),
+                             _policy("regex", realm=["realm.*"]),
+                             _policy("other", realm=["realm3"])])
+        self.assertEqual(self._names(index, index.matching("realm", "realm1", index.all)),
+                         ["empty", "wildcard", "exact", "regex"])
+        self.assertEqual(self._names(index, index.matching("realm", "realm3", index.all)),
+                         ["empty", "wildcard", "excluded", "regex", "other"])
+        self.assertEqual(self._names(index, index.matching("realm", "xyz", index.all)),
+                         ["empty", "wildcard", "excluded"])
+        # A list of values is only matched exactly
+        self.assertEqual(self._names(index, index.matching("realm", ["realm1", "realm4"], index.all)),
+                         ["empty", "wildcard", "exact", "excluded"])
+        self.assertEqual(self._names(index, index.matching("realm", [{"name": "realm1"}], index.all)),
+                         ["empty", "wildcard", "excluded"])
+        # only the candidates are returned
+        self.assertEqual(self._names(index, index.matching("realm", "realm1", {1, 3, 5})),
+                         ["wildcard"])
+        # The resolver ignores excluded values
+        index = PolicyIndex([_policy("excluded", resolver=["*", "-reso1"])])
+        self.assertEqual(self._names(index, index.matching("resolver", "reso1", index.all,
+                                                           use_excluded=False)),
+                         ["excluded"])
+
+    def test_03_matching_user_case_insensitive(self):
+        index = PolicyIndex([_policy("sensitive", user=["Alice"]),
+                             _policy("insensitive", user=["ALICE"], user_case_insensitive=True),
+                             _policy("excluded", user=["*", "!alice"], user_case_insensitive=True)])
+        self.assertEqual(self._names(index, index.matching_user("user", "Alice", index.all)),
+                         ["sensitive", "insensitive"])
+        self.assertEqual(self._names(index, index.matching_user("user", "alice", index.all)),
+                         ["insensitive"])
+        self.assertEqual(self._names(index, index.matching_user("user", "bob", index.all)),
+                         ["excluded"])
+
+    def test_04_same_results_as_search_value(self):
+        # The index must behave exactly like PolicyClass._search_value
+        values = ["a", "b", "*", "!a", "-b", "a.*", "a|b", "!a|b", "", "[ab]", "x"]
+        searchvalues = ["a", "b", "x", "a|b", "ab", "a\n", "x\n", "", "!a", "*"]
+        policies = [_policy("pol{0!s}".format(i), realm=[value]) for i, value in enumerate(values)]
+        policies.append(_policy("combined", realm=["a", "!b", "c.*"]))
+        index = PolicyIndex(policies)
+        for searchvalue in searchvalues:
+            expected = set()
+            for position, policy in enumerate(policies):
+                found, excluded = PolicyClass._search_value(policy.get("realm"), searchvalue)
+                if found and not excluded:
+                    expected.add(position)
+            self.assertEqual(index.matching("realm", searchvalue, index.all), expected, searchvalue)
+
+    def test_05_invalid_regex(self):
+        index = PolicyIndex([_policy("invalid", user=["user("]),
+                             _policy("valid", scope="admin", user=["user1"])])
+        # The invalid regular expression only raises an error if the policy is a candidate
+        self.assertRaises(re.error, index.matching_user, "user", "user1", index.all)
+        self.assertEqual(self._names(index, index.matching_user("user", "user1", {1})), ["valid"])
+
+    def test_06_pinode(self):
+        index = PolicyIndex([_policy("all"),
+                             _policy("node1", pinode=["Node1"]),
+                             _policy("node2", pinode=["Node2", "Node3"])])
+        self.assertEqual(self._names(index, index.matching_pinode("Node1", index.all)), ["all", "node1"])
+        self.assertEqual(self._names(index, index.matching_pinode("Node3", index.all)), ["all", "node2"])
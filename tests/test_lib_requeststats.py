@@ -0,0 +1,70 @@
+"""
+This file contains the tests for lib/requeststats.py
+"""
+import json
+
+from .base import MyTestCase
+from privacyidea.lib.crypto import pass_hash, encryptPassword
+from privacyidea.lib.policy import PolicyClass
+from privacyidea.lib.requeststats import (enable_request_stats, is_request_stats_enabled,
+                                          start_request_stats, end_request_stats,
+                                          get_request_stats_totals, request_timer,
+                                          CATEGORIES, RESOLVER)
+from privacyidea.lib.user import User
+from privacyidea.models import Token
+
+
+class RequestStatsTestCase(MyTestCase):
+
+    def tearDown(self):
+        enable_request_stats(False)
+        super(RequestStatsTestCase, self).tearDown()
+
+    def test_01_disabled(self):
+        self.assertFalse(is_request_stats_enabled())
+        start_request_stats()
+        with request_timer(RESOLVER):
+            pass_hash("test")
+        self.assertIsNone(end_request_stats())
+
+    def test_02_request_stats(self):
+        self.setUp_user_realms()
+        enable_request_stats()
+        self.assertTrue(is_request_stats_enabled())
+        totals = get_request_stats_totals()
+        # Without a started request nothing is recorded
+        pass_hash("test")
+        self.assertIsNone(end_request_stats())
+
+        user = User("cornelius", self.realm1)
+        start_request_stats()
+        Token.query.count()
+        self.assertTrue(user.info)
+        # nested calls are only counted once
+        with request_timer(RESOLVER):
+            self.assertTrue(user.info)
+            self.assertTrue(user.info)
+        pass_hash("test")
+        encryptPassword("test")
+        PolicyClass().match_policies(scope="authentication")
+        stats = json.loads(end_request_stats())
+        self.assertEqual(set(stats), set(CATEGORIES))
+        self.assertGreaterEqual(stats["db"][0], 1)
+        self.assertEqual(stats["resolver"][0], 2)
+        self.assertEqual(stats["crypto"][0], 2)
+        self.assertEqual(stats["policy"][0], 1)
+        for count, duration in stats.values():
+            self.assertGreaterEqual(duration, 0)
+        # The statistics are added to the totals of the process
+        new_totals = get_request_stats_totals()
+        self.assertEqual(new_totals["requests"], totals["requests"] + 1)
+        self.assertEqual(new_totals["crypto"][0], totals["crypto"][0] + 2)
+        self.assertGreater(new_totals["crypto"][1], totals["crypto"][1])
+        # The request statistics have ended
+        self.assertIsNone(end_request_stats())
+
+        # The SQL statements are not timed anymore
+        enable_request_stats(False)
+        start_request_stats()
+        Token.query.count()
+        self.assertIsNone(end_request_stats())
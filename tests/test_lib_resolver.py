@@ -10,19 +10,22 @@ The lib.resolver.py only depends on the database model.
 
 from .base import MyTestCase
 from . import ldap3mock
-from ldap3.core.exceptions import LDAPOperationResult
+from ldap3.core.exceptions import LDAPOperationResult, LDAPCommunicationError
 from ldap3.core.results import RESULT_SIZE_LIMIT_EXCEEDED
 import mock
 import ldap3
 import responses
-import datetime
+import os
 import shutil
+import threading
 import tempfile
 import uuid
 import json
 import ssl
-from privacyidea.lib.resolvers.LDAPIdResolver import IdResolver as LDAPResolver, LockingServerPool
+from privacyidea.lib.resolvers.LDAPIdResolver import (IdResolver as LDAPResolver, LockingServerPool,
+                                                      LDAPConnectionPool)
 from privacyidea.lib.resolvers.SQLIdResolver import IdResolver as SQLResolver
+from privacyidea.lib.resolvers.PasswdIdResolver import IdResolver as PasswdResolver
 from privacyidea.lib.resolvers.SCIMIdResolver import IdResolver as SCIMResolver
 from privacyidea.lib.resolvers.UserIdResolver import UserIdResolver
 from privacyidea.lib.resolvers.LDAPIdResolver import (SERVERPOOL_ROUNDS, SERVERPOOL_SKIP)
@@ -37,6 +40,8 @@ from privacyidea.lib.resolver import (save_resolver,
 from privacyidea.lib.realm import (set_realm, delete_realm)
 from privacyidea.models import ResolverConfig
 from privacyidea.lib.utils import to_bytes, to_unicode
+from privacyidea.lib.framework import get_app_local_store, get_request_local_store
+from privacyidea.lib.lifecycle import call_finalizers
 from requests import HTTPError
 
 PWFILE = "tests/testdata/passwords"
@@ -575,6 +580,23 @@ class SQLResolverTestCase(MyTestCase):
         user_info = y.getUserInfo(user)
         self.assertEqual(user_info.get("userid"), "cornelius")
 
+    def test_09_get_user_info_many(self):
+        y = SQLResolver()
+        y.loadConfig(self.parameters)
+        user_ids = [y.getUserId(name) for name in ["cornelius", "fred"]]
+        user_infos = y.getUserInfoMany(user_ids + ["99999", "nodigit"])
+        self.assertEqual(len(user_infos), 4)
+        for user_id in user_ids:
+            self.assertEqual(user_infos[user_id], y.getUserInfo(user_id))
+        self.assertEqual(user_infos["99999"], {})
+        self.assertEqual(user_infos["nodigit"], {})
+        # The users are read with one query
+        with mock.patch.object(y.session, "execute", wraps=y.session.execute) as mock_execute:
+            usernames = y.getUsernameMany(user_ids + ["99999"])
+            mock_execute.assert_called_once()
+        self.assertEqual(usernames, {user_ids[0]: "cornelius", user_ids[1]: "fred",
+                                     "99999": ""})
+
     def test_99_testconnection_fail(self):
         y = SQLResolver()
         self.parameters['Database'] = "does_not_exist"
@@ -2076,39 +2098,92 @@ class LDAPResolverTestCase(MyTestCase):
                       'NOREFERRALS': True,
                       'CACHE_TIMEOUT': cache_timeout
                       })
-        from privacyidea.lib.resolvers.LDAPIdResolver import CACHE
+        from privacyidea.lib.resolvers.LDAPIdResolver import get_user_cache, get_user_cache_stats
+        user_cache = get_user_cache()
+        bob_key = (y.getResolverId(), 'getUserId', 'bob')
         # assert that the other tests haven't left anything in the cache
-        self.assertNotIn(y.getResolverId(), CACHE)
+        self.assertNotIn(bob_key, user_cache)
+        stats = get_user_cache_stats()
         bob_id = y.getUserId('bob')
         # assert the cache contains this entry
-        self.assertEqual(CACHE[y.getResolverId()]['getUserId']['bob']['value'], bob_id)
+        self.assertEqual(user_cache.get(bob_key), bob_id)
         # assert subsequent requests for the same data hit the cache
         with mock.patch.object(ldap3mock.Connection, 'search') as mock_search:
             bob_id2 = y.getUserId('bob')
             self.assertEqual(bob_id, bob_id2)
             mock_search.assert_not_called()
-        self.assertIn('bob', CACHE[y.getResolverId()]['getUserId'])
+        self.assertEqual(get_user_cache_stats()["hits"], stats["hits"] + 2)
+        self.assertEqual(get_user_cache_stats()["misses"], stats["misses"] + 1)
         # assert requests later than CACHE_TIMEOUT seconds query the directory again
-        now = datetime.datetime.now(tz=datetime.timezone.utc)
-        with mock.patch('privacyidea.lib.resolvers.LDAPIdResolver.datetime.datetime',
-                        wraps=datetime.datetime) as mock_datetime:
-            # we now live CACHE_TIMEOUT + 2 seconds in the future
-            mock_datetime.now.return_value = now + datetime.timedelta(seconds=cache_timeout + 2)
+        now = user_cache.clock()
+        with mock.patch.object(user_cache, 'clock', return_value=now + cache_timeout + 2):
             with mock.patch.object(ldap3mock.Connection, 'search', wraps=y.connection.search) as mock_search:
                 bob_id3 = y.getUserId('bob')
                 self.assertEqual(bob_id, bob_id3)
                 mock_search.assert_called_once()
-        # assert the cache contains this entry, with the updated timestamp
-        self.assertEqual(CACHE[y.getResolverId()]['getUserId']['bob'],
-                         {'value': bob_id,
-                          'timestamp': now + datetime.timedelta(seconds=cache_timeout + 2)})
-        # we now go 2 * (CACHE_TIMEOUT + 2) seconds to the future and query for someone else's user ID.
-        # This will cause bob's cache entry to be evicted.
-        with mock.patch('privacyidea.lib.resolvers.LDAPIdResolver.datetime.datetime',
-                        wraps=datetime.datetime) as mock_datetime:
-            mock_datetime.now.return_value = now + datetime.timedelta(seconds=2 * (cache_timeout + 2))
-            manager_id = y.getUserId('manager')
-        self.assertEqual(list(CACHE[y.getResolverId()]['getUserId'].keys()), ['manager'])
+            # assert the cache contains this entry again
+            self.assertEqual(user_cache.get(bob_key), bob_id)
+        self.assertEqual(get_user_cache_stats()["expirations"], stats["expirations"] + 1)
+        # unknown users are cached as well
+        unknown_key = (y.getResolverId(), 'getUserId', 'unknown')
+        self.assertEqual(y.getUserId('unknown'), "")
+        self.assertIn(unknown_key, user_cache)
+        # ... unless the negative caching is disabled
+        user_cache.delete(unknown_key)
+        self.app.config["PI_LDAP_CACHE_NEGATIVE_TIMEOUT"] = 0
+        self.assertEqual(y.getUserId('unknown'), "")
+        self.assertNotIn(unknown_key, user_cache)
+        self.app.config.pop("PI_LDAP_CACHE_NEGATIVE_TIMEOUT")
+        # the least recently used entries are evicted
+        manager_key = (y.getResolverId(), 'getUserId', 'manager')
+        user_cache.clear()
+        with mock.patch.object(user_cache, 'max_entries', 2):
+            y.getUserId('bob')
+            y.getUserId('manager')
+            # bob is used again
+            y.getUserId('bob')
+            y.getUserId('unknown')
+            self.assertEqual(get_user_cache_stats()["evictions"], stats["evictions"] + 1)
+            self.assertIn(bob_key, user_cache)
+            self.assertIn(unknown_key, user_cache)
+            self.assertNotIn(manager_key, user_cache)
+        user_cache.clear()
+
+    @ldap3mock.activate
+    def test_32b_shared_cache(self):
+        from privacyidea.lib.resolvers import LDAPIdResolver
+        from privacyidea.lib.lrucache import LayeredCache
+        ldap3mock.setLDAPDirectory(LDAPDirectory_small)
+        y = LDAPResolver()
+        y.loadConfig({'LDAPURI': 'ldap://localhost',
+                      'LDAPBASE': 'o=test',
+                      'BINDDN': 'cn=manager,ou=example,o=test',
+                      'BINDPW': 'ldaptest',
+                      'LOGINNAMEATTRIBUTE': 'cn',
+                      'LDAPSEARCHFILTER': '(&(cn=*)(cn=*))',
+                      'USERINFO': '{ "username": "cn", "email" : "mail", '
+                                  '"surname" : "sn", "givenname" : "givenName" }',
+                      'UIDTYPE': 'DN',
+                      'NOREFERRALS': True,
+                      'CACHE_TIMEOUT': 120
+                      })
+        directory = tempfile.mkdtemp()
+        self.app.config["PI_LDAP_CACHE_FILE"] = os.path.join(directory, "ldapcache.sqlite")
+        process_cache = LDAPIdResolver.CACHE
+        try:
+            LDAPIdResolver.CACHE = None
+            user_cache = LDAPIdResolver.get_user_cache()
+            self.assertIsInstance(user_cache, LayeredCache)
+            bob_info = y.getUserInfo(y.getUserId('bob'))
+            # Another process only finds the entries in the shared cache
+            LDAPIdResolver.CACHE = None
+            with mock.patch.object(ldap3mock.Connection, 'search') as mock_search:
+                self.assertEqual(y.getUserInfo(y.getUserId('bob')), bob_info)
+                mock_search.assert_not_called()
+        finally:
+            LDAPIdResolver.CACHE = process_cache
+            self.app.config.pop("PI_LDAP_CACHE_FILE")
+            shutil.rmtree(directory)
 
     @ldap3mock.activate
     def test_33_cache_disabled(self):
@@ -2132,12 +2207,13 @@ class LDAPResolverTestCase(MyTestCase):
                       'NOREFERRALS': True,
                       'CACHE_TIMEOUT': 0
                       })
-        from privacyidea.lib.resolvers.LDAPIdResolver import CACHE
+        from privacyidea.lib.resolvers.LDAPIdResolver import get_user_cache
+        bob_key = (y.getResolverId(), 'getUserId', 'bob')
         # assert that the other tests haven't left anything in the cache
-        self.assertNotIn(y.getResolverId(), CACHE)
+        self.assertNotIn(bob_key, get_user_cache())
         bob_id = y.getUserId('bob')
         # assert the cache does not contain this entry
-        self.assertNotIn(y.getResolverId(), CACHE)
+        self.assertNotIn(bob_key, get_user_cache())
         # assert subsequent requests query the directory
         with mock.patch.object(ldap3mock.Connection, 'search', wraps=y.connection.search) as mock_search:
             bob_id2 = y.getUserId('bob')
@@ -2231,6 +2307,152 @@ class LDAPResolverTestCase(MyTestCase):
             pool.get_current_server(None)
             mock_method.assert_called_once()
 
+    @ldap3mock.activate
+    def test_37_connection_pool(self):
+        ldap3mock.setLDAPDirectory(LDAPDirectory)
+        params = {'LDAPURI': 'ldap://localhost',
+                  'LDAPBASE': 'o=test',
+                  'BINDDN': 'cn=manager,ou=example,o=test',
+                  'BINDPW': 'ldaptest',
+                  'LOGINNAMEATTRIBUTE': 'cn',
+                  'LDAPSEARCHFILTER': '(cn=*)',
+                  'USERINFO': '{ "username": "cn", "email": "mail", '
+                              '"surname" : "sn", "givenname": "givenName" }',
+                  'UIDTYPE': 'DN',
+                  'CACHE_TIMEOUT': '0'}
+        y1 = LDAPResolver()
+        y1.loadConfig(params)
+        # Without PI_LDAP_CONNECTION_POOL_SIZE there is no connection pool
+        self.assertIsNone(y1.get_connection_pool())
+        self.app.config["PI_LDAP_CONNECTION_POOL_SIZE"] = 1
+        get_app_local_store().pop("ldap_connection_pools", None)
+        try:
+            y1 = LDAPResolver()
+            y1.loadConfig(params)
+            y2 = LDAPResolver()
+            y2.loadConfig(params)
+            pool = y1.get_connection_pool()
+            self.assertIs(pool, y2.get_connection_pool())
+            bob_id = y1.getUserId('bob')
+            self.assertEqual(pool.stats["created"], 1)
+            connection = y1.connection
+            self.assertEqual(len(pool), 0)
+            # At the end of the request the connection is returned to the pool
+            call_finalizers()
+            self.assertEqual(len(pool), 1)
+            # The next request uses the bound connection
+            with mock.patch.object(connection, "bind") as mock_bind:
+                self.assertEqual(y2.getUserId('bob'), bob_id)
+                mock_bind.assert_not_called()
+            self.assertIs(y2.connection, connection)
+            self.assertEqual(pool.stats["reused"], 1)
+            # A concurrent request creates a new connection
+            self.assertEqual(y1.getUserId('bob'), bob_id)
+            self.assertIsNot(y1.connection, connection)
+            self.assertEqual(pool.stats["created"], 2)
+            # The password of a user is checked with a dedicated connection
+            self.assertTrue(y1.checkPass(bob_id, "bobpwééé"))
+            self.assertEqual(pool.stats["created"], 2)
+            # The pool only keeps one idle connection
+            call_finalizers()
+            self.assertEqual(len(pool), 1)
+            self.assertEqual(pool.stats["closed"], 1)
+            # A failing pooled connection is replaced by a new connection
+            y3 = LDAPResolver()
+            y3.loadConfig(params)
+            original_search = ldap3mock.Connection.search
+            searches = []
+
+            def search_once_failing(connection, *args, **kwargs):
+                searches.append(connection)
+                if len(searches) == 1:
+                    raise LDAPCommunicationError("connection lost")
+                return original_search(connection, *args, **kwargs)
+
+            with mock.patch.object(ldap3mock.Connection, "search", search_once_failing):
+                self.assertEqual(y3.getUserId('bob'), bob_id)
+            self.assertIsNot(searches[0], searches[1])
+            self.assertEqual(pool.stats["created"], 3)
+            call_finalizers()
+            # Connections, which have been idle for too long, are closed
+            self.assertEqual(len(pool), 1)
+            with mock.patch.object(pool, "clock", return_value=pool.clock() + 61):
+                self.assertIsNone(pool.acquire())
+            self.assertEqual(len(pool), 0)
+            # A different bind password uses a different pool
+            params["BINDPW"] = "other"
+            y3.loadConfig(params)
+            self.assertIsNot(y3.get_connection_pool(), pool)
+        finally:
+            self.app.config.pop("PI_LDAP_CONNECTION_POOL_SIZE")
+            get_app_local_store().pop("ldap_connection_pools", None)
+
+    def test_38_connection_pool_unusable_connections(self):
+        pool = LDAPConnectionPool(max_size=2)
+        connection = mock.Mock(bound=True, closed=False)
+        pool.release(connection)
+        connection.bound = False
+        self.assertIsNone(pool.acquire())
+        connection.unbind.assert_called_once()
+        # A connection, which is not bound anymore, is not returned to the pool
+        pool.release(connection)
+        self.assertEqual(len(pool), 0)
+        connection = mock.Mock(bound=True, closed=False)
+        pool.release(connection)
+        pool.clear()
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(pool.stats["closed"], 3)
+
+    @ldap3mock.activate
+    def test_39_get_user_info_many(self):
+        ldap3mock.setLDAPDirectory(LDAPDirectory_small)
+        y = LDAPResolver()
+        y.loadConfig({'LDAPURI': 'ldap://localhost',
+                      'LDAPBASE': 'o=test',
+                      'BINDDN': 'cn=manager,ou=example,o=test',
+                      'BINDPW': 'ldaptest',
+                      'LOGINNAMEATTRIBUTE': 'cn',
+                      'LDAPSEARCHFILTER': '(oid=*)',
+                      'USERINFO': '{ "username": "cn",'
+                                  '"phone" : "telephoneNumber", '
+                                  '"mobile" : "mobile"'
+                                  ', "email" : "mail", '
+                                  '"surname" : "sn", '
+                                  '"givenname" : "givenName" }',
+                      'UIDTYPE': 'oid',
+                      'NOREFERRALS': True,
+                      'CACHE_TIMEOUT': 120
+                      })
+        from privacyidea.lib.resolvers.LDAPIdResolver import get_user_cache
+        user_cache = get_user_cache()
+        user_cache.clear()
+        # All users are searched with one request
+        with mock.patch.object(y, '_search', wraps=y._search) as mock_search:
+            user_infos = y.getUserInfoMany(["1", "3", "5"])
+            mock_search.assert_called_once()
+            self.assertIn("(|(oid=1)(oid=3)(oid=5))", mock_search.call_args[1]["search_filter"])
+        self.assertEqual(user_infos["1"].get("username"), "manager")
+        self.assertEqual(user_infos["3"].get("username"), "bob")
+        self.assertEqual(user_infos["3"].get("surname"), "Marley")
+        self.assertEqual(user_infos["5"], {})
+        # The users are added to the cache, so getUserInfo does not search again
+        with mock.patch.object(ldap3mock.Connection, 'search') as mock_search:
+            self.assertEqual(y.getUserInfo("3"), user_infos["3"])
+            self.assertEqual(y.getUsernameMany(["1", "3", "5"]),
+                             {"1": "manager", "3": "bob", "5": ""})
+            mock_search.assert_not_called()
+        user_cache.clear()
+        # The special characters of a userId do not change the search of the
+        # other users
+        with mock.patch.object(y, '_search', wraps=y._search) as mock_search:
+            user_infos = y.getUserInfoMany(["*", "1)(5", "3"])
+            self.assertIn("(|(oid=\\2a)(oid=1\\29\\285)(oid=3))",
+                          mock_search.call_args[1]["search_filter"])
+        self.assertEqual(user_infos, {"*": {}, "1)(5": {}, "3": user_infos["3"]})
+        self.assertEqual(user_infos["3"].get("username"), "bob")
+        user_cache.clear()
+
+
 class BaseResolverTestCase(MyTestCase):
 
     def test_00_basefunctions(self):
@@ -2578,6 +2800,84 @@ class ResolverTestCase(MyTestCase):
         delete_realm("myrealm")
         delete_resolver(self.resolvername1)
 
+    def test_16_shared_resolver_objects(self):
+        def new_request():
+            call_finalizers()
+            get_request_local_store().pop("resolver_objects", None)
+
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, "passwords")
+        shutil.copy(PWFILE, filename)
+        params = {"resolver": self.resolvername1,
+                  "type": "passwdresolver",
+                  "fileName": filename}
+        try:
+            save_resolver(params)
+            new_request()
+            # The resolver object is closed at the end of the request
+            with mock.patch.object(PasswdResolver, "close") as mock_close:
+                y1 = get_resolver_object(self.resolvername1)
+                new_request()
+                mock_close.assert_called_once()
+            # The next request uses the same resolver object
+            self.assertIs(get_resolver_object(self.resolvername1), y1)
+            # The resolver object is shared by all threads
+            thread_objects = []
+
+            def get_object_in_thread(resolvername):
+                with self.app.app_context():
+                    thread_objects.append(get_resolver_object(resolvername))
+                    call_finalizers()
+
+            thread = threading.Thread(target=get_object_in_thread, args=(self.resolvername1,))
+            thread.start()
+            thread.join()
+            self.assertIs(thread_objects[0], y1)
+            # If the file changed, it is read again
+            new_request()
+            stat = os.stat(filename)
+            os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+            y2 = get_resolver_object(self.resolvername1)
+            self.assertIsNot(y2, y1)
+            # If the configuration changed, a new resolver object is created
+            new_request()
+            params["fileName"] = PWFILE
+            save_resolver(params)
+            y3 = get_resolver_object(self.resolvername1)
+            self.assertIsNot(y3, y2)
+            self.assertEqual(y3.fileName, PWFILE)
+            new_request()
+            self.assertIs(get_resolver_object(self.resolvername1), y3)
+            delete_resolver(self.resolvername1)
+
+            # The base resolver is not thread-safe, each thread gets its own object
+            save_resolver({"resolver": "baseresolver",
+                           "type": "UserIdResolver"})
+            new_request()
+            y4 = get_resolver_object("baseresolver")
+            new_request()
+            self.assertIs(get_resolver_object("baseresolver"), y4)
+            thread = threading.Thread(target=get_object_in_thread, args=("baseresolver",))
+            thread.start()
+            thread.join()
+            self.assertIsNot(thread_objects[1], y4)
+            delete_resolver("baseresolver")
+        finally:
+            new_request()
+            shutil.rmtree(directory)
+
+    def test_17_passwdresolver_many_users(self):
+        save_resolver({"resolver": self.resolvername1,
+                       "type": "passwdresolver",
+                       "fileName": PWFILE})
+        y = get_resolver_object(self.resolvername1)
+        self.assertEqual(y.getUsernameMany(["1000", "1002", "9999"]),
+                         {"1000": "cornelius", "1002": "nopw", "9999": ""})
+        user_infos = y.getUserInfoMany(["1000", "9999"])
+        self.assertEqual(user_infos["1000"], y.getUserInfo("1000"))
+        self.assertEqual(user_infos["9999"], {})
+        delete_resolver(self.resolvername1)
+
 
 class HTTPResolverTestCase(MyTestCase):
 
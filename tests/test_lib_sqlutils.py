@@ -4,10 +4,13 @@ This file contains the tests for lib/sqlutils.py
 from datetime import datetime
 
 from mock import MagicMock
+import sqlalchemy
 import warnings
 from sqlalchemy.testing import AssertsCompiledSQL
-from privacyidea.lib.sqlutils import DeleteLimit, delete_matching_rows
-from privacyidea.models import Audit as LogEntry
+from privacyidea.lib.sqlutils import (DeleteLimit, delete_matching_rows, unit_of_work,
+                                      begin_unit_of_work, in_unit_of_work, commit_or_flush,
+                                      end_unit_of_work)
+from privacyidea.models import Audit as LogEntry, MonitoringStats, db
 from .base import MyTestCase
 
 
@@ -85,4 +88,108 @@ class SQLUtilsCompilationTestCase(MyTestCase, AssertsCompiledSQL):
         # delete in one statement
         result = delete_matching_rows(session, LogEntry.__table__, LogEntry.id < 1234)
         self.assertEqual(len(session.execute.mock_calls), 1)
-        self.assertEqual(result, 2500)
\ No newline at end of file
+        self.assertEqual(result, 2500)
+
+    @staticmethod
+    def _get_stats():
+        return sorted((ms.stats_key, ms.stats_value) for ms in
+                      MonitoringStats.query.filter(MonitoringStats.stats_key.like("uow_%")))
+
+    def test_04_unit_of_work(self):
+        commits = []
+
+        def count_commits(conn):
+            commits.append(conn)
+
+        sqlalchemy.event.listen(db.engine, "commit", count_commits)
+        try:
+            with unit_of_work(db.session):
+                self.assertTrue(in_unit_of_work(db.session))
+                MonitoringStats(datetime.now(), "uow_1", 1).save()
+                # The changes are flushed, so they can be queried
+                self.assertEqual(self._get_stats(), [("uow_1", 1)])
+                with unit_of_work(db.session):
+                    MonitoringStats(datetime.now(), "uow_2", 2).save()
+                self.assertEqual(len(commits), 0)
+            self.assertFalse(in_unit_of_work(db.session))
+            self.assertEqual(len(commits), 1)
+            self.assertEqual(self._get_stats(), [("uow_1", 1), ("uow_2", 2)])
+
+            # all changes are rolled back in case of an error
+            with self.assertRaises(ZeroDivisionError):
+                with unit_of_work(db.session):
+                    MonitoringStats(datetime.now(), "uow_3", 3).save()
+                    MonitoringStats.query.filter(MonitoringStats.stats_key == "uow_1").delete()
+                    commit_or_flush(db.session)
+                    1 / 0
+            self.assertEqual(len(commits), 1)
+            self.assertEqual(self._get_stats(), [("uow_1", 1), ("uow_2", 2)])
+            # Outside of a unit of work the changes are committed
+            MonitoringStats(datetime.now(), "uow_3", 3).save()
+            self.assertEqual(len(commits), 2)
+        finally:
+            sqlalchemy.event.remove(db.engine, "commit", count_commits)
+            MonitoringStats.query.filter(MonitoringStats.stats_key.like("uow_%")).delete(
+                synchronize_session=False)
+            db.session.commit()
+
+    def test_05_begin_unit_of_work(self):
+        commits = []
+
+        def count_commits(conn):
+            commits.append(conn)
+
+        sqlalchemy.event.listen(db.engine, "commit", count_commits)
+        try:
+            self.assertTrue(begin_unit_of_work(db.session))
+            self.assertFalse(begin_unit_of_work(db.session))
+            stats = MonitoringStats(datetime.now(), "uow_1", 1)
+            stats.save()
+            stats.stats_value = 2
+            commit_or_flush(db.session)
+            self.assertEqual(len(commits), 0)
+            # The loaded objects are expired like after a commit
+            self.assertNotIn("stats_value", vars(stats))
+            # A direct commit commits the changes immediately
+            db.session.commit()
+            self.assertEqual(len(commits), 1)
+            self.assertTrue(in_unit_of_work(db.session))
+            MonitoringStats(datetime.now(), "uow_2", 2).save()
+            self.assertEqual(len(commits), 1)
+            end_unit_of_work(db.session)
+            self.assertEqual(len(commits), 2)
+            # nothing happens, if the session is not in a unit of work
+            end_unit_of_work(db.session)
+            self.assertEqual(len(commits), 2)
+
+            # The changes are rolled back
+            begin_unit_of_work(db.session)
+            MonitoringStats(datetime.now(), "uow_3", 3).save()
+            end_unit_of_work(db.session, commit=False)
+            self.assertEqual(self._get_stats(), [("uow_1", 2), ("uow_2", 2)])
+
+            # A failing savepoint keeps the other changes of the unit of work
+            begin_unit_of_work(db.session)
+            MonitoringStats(datetime.now(), "uow_4", 4).save()
+            with self.assertRaises(sqlalchemy.exc.IntegrityError):
+                with db.session.begin_nested():
+                    db.session.add(MonitoringStats(datetime.now(), None, 5))
+            end_unit_of_work(db.session)
+            self.assertEqual(len(commits), 3)
+            self.assertEqual(self._get_stats(), [("uow_1", 2), ("uow_2", 2), ("uow_4", 4)])
+
+            # A failing commit is rolled back
+            begin_unit_of_work(db.session)
+            MonitoringStats(datetime.now(), "uow_5", 5).save()
+            self.assertRaises(sqlalchemy.exc.IntegrityError,
+                              MonitoringStats(datetime.now(), None, 6).save)
+            self.assertRaises(sqlalchemy.exc.SQLAlchemyError, end_unit_of_work, db.session)
+            self.assertFalse(in_unit_of_work(db.session))
+            self.assertEqual(self._get_stats(), [("uow_1", 2), ("uow_2", 2), ("uow_4", 4)])
+            self.assertEqual(len(commits), 3)
+        finally:
+            end_unit_of_work(db.session, commit=False)
+            sqlalchemy.event.remove(db.engine, "commit", count_commits)
+            MonitoringStats.query.filter(MonitoringStats.stats_key.like("uow_%")).delete(
+                synchronize_session=False)
+            db.session.commit()
@@ -0,0 +1,41 @@
+"""
+This tests the files
+  lib/task/usercachecleanup.py
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from .base import MyTestCase
+from privacyidea.lib.config import set_privacyidea_config
+from privacyidea.lib.error import ParameterError
+from privacyidea.lib.monitoringstats import get_values
+from privacyidea.lib.task.usercachecleanup import UserCacheCleanupTask
+from privacyidea.lib.usercache import EXPIRATION_SECONDS
+from privacyidea.models import UserCache, db
+
+
+class TaskUserCacheCleanupTestCase(MyTestCase):
+
+    def test_01_delete_expired_entries(self):
+        task = UserCacheCleanupTask(current_app.config)
+        self.assertIn("chunksize", task.options)
+        timestamp = datetime.now() - timedelta(seconds=120)
+        for i in range(3):
+            UserCache("hans{0!s}".format(i), "hans{0!s}".format(i), "resolver1",
+                      "uid{0!s}".format(i), timestamp).save()
+        UserCache("current", "current", "resolver1", "uid9", datetime.now()).save()
+
+        # The user cache is disabled, nothing is deleted
+        self.assertTrue(task.do({}))
+        self.assertEqual(UserCache.query.count(), 4)
+
+        set_privacyidea_config(EXPIRATION_SECONDS, 60)
+        self.assertRaises(ParameterError, task.do, {"chunksize": "many"})
+        self.assertRaises(ParameterError, task.do, {"chunksize": "0"})
+        self.assertTrue(task.do({"chunksize": "2", "stats_key": "usercache_deleted"}))
+        self.assertEqual(UserCache.query.one().username, "current")
+        self.assertEqual(get_values("usercache_deleted")[0][1], 3)
+        set_privacyidea_config(EXPIRATION_SECONDS, 0)
+        UserCache.query.delete()
+        db.session.commit()
@@ -13,6 +13,7 @@ gettokensoftype
 getToken....
 """
 import logging
+import sqlalchemy
 from testfixtures import LogCapture
 from privacyidea.lib.container import init_container, add_token_to_container
 from .base import MyTestCase, FakeAudit, FakeFlaskG
@@ -62,10 +63,11 @@ from privacyidea.lib.token import (create_tokenclass_object,
                                    get_tokens_paginate,
                                    set_validity_period_end,
                                    set_validity_period_start, delete_tokeninfo,
-                                   import_token, get_one_token,
+                                   import_token, import_tokens, get_one_token,
                                    get_tokens_from_serial_or_user,
                                    get_tokens_paginated_generator,
-                                   assign_tokengroup, unassign_tokengroup)
+                                   assign_tokengroup, unassign_tokengroup,
+                                   convert_token_objects_to_dicts)
 from privacyidea.lib.tokengroup import set_tokengroup, delete_tokengroup
 from privacyidea.lib.error import (TokenAdminError, ParameterError,
                                    privacyIDEAError, ResourceNotFoundError)
@@ -1540,6 +1542,40 @@ class TokenTestCase(MyTestCase):
         self.assertEqual(tok.get_user_displayname(), ('cornelius_realm1', 'Cornelius '))
         remove_token("IMP002")
 
+    def test_53b_import_tokens(self):
+        self.setUp_user_realms()
+        tokens = [("IMP{0!s}".format(i), {"type": "hotp", "otpkey": self.otpkey, "counter": "10"})
+                  for i in range(5)]
+        tokens[3] = ("IMP3", {"type": "unknown", "otpkey": self.otpkey})
+        commits = []
+        progress = []
+
+        def count_commits(session):
+            commits.append(session)
+
+        sqlalchemy.event.listen(db.session(), "after_commit", count_commits)
+        try:
+            imported, failed = import_tokens(iter(tokens), tokenrealms=[self.realm1], batch_size=2,
+                                             progress=lambda n, f: progress.append((n, list(f))))
+        finally:
+            sqlalchemy.event.remove(db.session(), "after_commit", count_commits)
+        self.assertEqual(imported, 4)
+        self.assertEqual(failed, ["IMP3"])
+        self.assertEqual(progress, [(2, []), (3, ["IMP3"]), (4, ["IMP3"])])
+        # The first and the last batch are committed at once, the tokens of the
+        # second batch are imported again one by one
+        self.assertLess(len(commits), 15)
+        self.assertEqual(get_tokens(serial="IMP3"), [])
+        for serial in ["IMP0", "IMP1", "IMP2", "IMP4"]:
+            tok = get_tokens(serial=serial)[0]
+            self.assertEqual(tok.get_otp_count(), 10)
+            self.assertEqual(tok.get_tokeninfo("tokenkind"), TOKENKIND.HARDWARE)
+            self.assertEqual(tok.get_realms(), [self.realm1])
+            remove_token(serial)
+        # The tokens can not be imported in empty batches
+        self.assertRaises(ParameterError, import_tokens, iter(tokens), batch_size=0)
+        self.assertEqual(get_tokens(serial="IMP0"), [])
+
     def test_54_helper_functions(self):
         user = User("cornelius", self.realm1)
         # unassign all tokens of cornelius, assign S1 and S2
@@ -1674,6 +1710,126 @@ class TokenTestCase(MyTestCase):
         self.assertTrue(weigh_token_type(dummy_token("push")) > weigh_token_type(dummy_token("HOTP")))
         self.assertTrue(weigh_token_type(dummy_token("PUSH")) > weigh_token_type(dummy_token("hotp")))
 
+    def test_60_check_token_list_verifies_pin_hash_once(self):
+        from privacyidea.lib.framework import get_request_local_store
+        from privacyidea.models import PIN_VERIFICATION_CACHE
+        import privacyidea.models
+        get_request_local_store().pop(PIN_VERIFICATION_CACHE, None)
+        tokenobject1 = init_token({"serial": "pinhash1", "otpkey": self.otpkey, "pin": "test"})
+        tokenobject2 = init_token({"serial": "pinhash2", "otpkey": self.otpkey})
+        copy_token_pin("pinhash1", "pinhash2")
+        tokenobject3 = init_token({"serial": "pinhash3", "otpkey": self.otpkey, "pin": "test"})
+        verify = privacyidea.models.verify_and_update_pass_hash
+        with mock.patch("privacyidea.models.verify_and_update_pass_hash",
+                        side_effect=verify) as mock_verify:
+            r = check_token_list([tokenobject1, tokenobject2, tokenobject3], "test123456")
+            self.assertFalse(r[0])
+            # The PINs are checked for the challenge request and the authentication.
+            # Without the cache these would be six verifications.
+            self.assertEqual(mock_verify.call_count, 4)
+            # the results are not mixed up
+            r = check_token_list([tokenobject1, tokenobject2, tokenobject3], "wrong123456")
+            self.assertFalse(r[0])
+            self.assertEqual(mock_verify.call_count, 8)
+            # only the complete password needs to be verified
+            r = check_token_list([tokenobject2], "test755224")
+            self.assertTrue(r[0])
+            self.assertEqual(mock_verify.call_count, 9)
+        self.assertEqual(tokenobject1.token.failcount, 2)
+        self.assertEqual(tokenobject2.token.failcount, 0)
+        self.assertEqual(tokenobject3.token.failcount, 2)
+        get_request_local_store().pop(PIN_VERIFICATION_CACHE, None)
+        remove_token("pinhash1")
+        remove_token("pinhash2")
+        remove_token("pinhash3")
+
+    def test_61_token_list_queries(self):
+        user = User("cornelius", self.realm1)
+        serials = ["LIST{0:02d}".format(i) for i in range(12)]
+        for i, serial in enumerate(serials):
+            init_token({"serial": serial, "otpkey": self.otpkey, "description": "token list"},
+                       user=user if i % 2 else None)
+            add_tokeninfo(serial, "key{0!s}".format(i), "value")
+        container_serial = init_container({"type": "generic"})
+        add_token_to_container(container_serial, serials[1], user_role="admin")
+        db.session.expunge_all()
+
+        statements = []
+
+        def count_statements(*args):
+            statements.append(args[2])
+
+        def list_tokens(psize):
+            del statements[:]
+            db.session.expunge_all()
+            sqlalchemy.event.listen(db.engine, "before_cursor_execute", count_statements)
+            try:
+                return get_tokens_paginate(description="token list", psize=psize)["tokens"]
+            finally:
+                sqlalchemy.event.remove(db.engine, "before_cursor_execute", count_statements)
+
+        tokens = list_tokens(4)
+        num_statements = len(statements)
+        self.assertEqual(len(tokens), 4)
+        # The number of statements does not depend on the number of tokens
+        tokens = list_tokens(12)
+        self.assertEqual(len(tokens), 12)
+        self.assertEqual(len(statements), num_statements, statements)
+
+        # The output is the same as with the data of the single token
+        for token_dict in tokens:
+            token = get_one_token(serial=token_dict["serial"])
+            expected = token.get_as_dict()
+            self.assertEqual(token_dict["info"], expected["info"])
+            self.assertEqual(token_dict["realms"], expected["realms"])
+            self.assertEqual(token_dict["user_id"], expected["user_id"])
+            if token.user:
+                self.assertEqual(token_dict["username"], "cornelius")
+                self.assertEqual(token_dict["user_realm"], self.realm1)
+                self.assertTrue(token_dict["user_editable"] in [True, False])
+            else:
+                self.assertEqual(token_dict["username"], "")
+                self.assertNotIn("user_editable", token_dict)
+            self.assertEqual(token_dict["container_serial"],
+                             container_serial if token_dict["serial"] == serials[1] else "")
+        # The prefetched owner is not used outside the token list
+        self.assertFalse(hasattr(Token.query.filter_by(serial=serials[1]).first(), "_prefetched_owner"))
+
+        # A resolver error is reported for the token
+        with mock.patch("privacyidea.lib.token.get_usernames", side_effect=Exception("no LDAP")):
+            tokens = get_tokens_paginate(description="token list", psize=12)["tokens"]
+        self.assertEqual(tokens[1]["username"], "**resolver error**")
+        self.assertEqual(tokens[0]["username"], "")
+
+        # The tokens without an owner are reduced to the serial
+        token_dicts = convert_token_objects_to_dicts(get_tokens(serial=",".join(serials[:2])),
+                                                     user, "user")
+        self.assertEqual(token_dicts[0], {"serial": serials[0]})
+        self.assertEqual(token_dicts[1]["username"], "cornelius")
+        for serial in serials:
+            remove_token(serial)
+
+    def test_62_convert_token_objects_to_dicts_other_owner(self):
+        owner = User("cornelius", self.realm1)
+        init_token({"serial": "OWNED1", "otpkey": self.otpkey}, user=owner)
+        init_token({"serial": "OWNED2", "otpkey": self.otpkey}, user=User("selfservice", self.realm1))
+        tokens = get_tokens(serial="OWNED1,OWNED2")
+        # A user only sees the details of the own tokens
+        token_dicts = convert_token_objects_to_dicts(tokens, owner, "user")
+        self.assertEqual(token_dicts[0]["username"], "cornelius")
+        self.assertEqual(token_dicts[1], {"serial": "OWNED2"})
+        token_dicts = convert_token_objects_to_dicts(tokens, User("selfservice", self.realm1), "user")
+        self.assertEqual(token_dicts[0], {"serial": "OWNED1"})
+        self.assertEqual(token_dicts[1]["username"], "selfservice")
+        # Without a user only the serials are returned
+        token_dicts = convert_token_objects_to_dicts(tokens, None, "user")
+        self.assertEqual(token_dicts, [{"serial": "OWNED1"}, {"serial": "OWNED2"}])
+        # An admin sees all tokens
+        token_dicts = convert_token_objects_to_dicts(tokens, None, "admin")
+        self.assertEqual([token_dict["username"] for token_dict in token_dicts], ["cornelius", "selfservice"])
+        remove_token("OWNED1")
+        remove_token("OWNED2")
+
 
 class TokenOutOfBandTestCase(MyTestCase):
 
@@ -11,13 +11,14 @@ from privacyidea.lib.policy import ACTION
 from privacyidea.lib.tokenclass import (TokenClass, DATE_FORMAT)
 from privacyidea.lib.config import (set_privacyidea_config,
                                     delete_privacyidea_config)
-from privacyidea.lib.crypto import geturandom
+from privacyidea.lib.crypto import geturandom, decryptPassword
 from privacyidea.lib.utils import hexlify_and_unicode, to_unicode
 from privacyidea.lib.error import TokenAdminError
 from privacyidea.models import (Token,
                                 Config,
                                 Challenge)
 import datetime
+import mock
 from dateutil.tz import tzlocal
 
 PWFILE = "tests/testdata/passwords"
@@ -438,6 +439,45 @@ class TokenBaseTestCase(MyTestCase):
         info = token.get_tokeninfo("radius.secret")
         self.assertEqual(info, "otherSecret", info)
 
+    def test_11_tokeninfo_cache(self):
+        db_token = Token.query.filter_by(serial=self.serial1).first()
+        token = TokenClass(db_token)
+        token.add_tokeninfo("radius.secret", "cachedSecret", value_type="password")
+        token.add_tokeninfo("cachekey", "value1")
+        with mock.patch.object(Token, "get_info", autospec=True,
+                               side_effect=Token.get_info) as mock_info, \
+                mock.patch("privacyidea.lib.tokenclass.decryptPassword",
+                           side_effect=decryptPassword) as mock_decrypt:
+            for _i in range(3):
+                self.assertEqual(token.get_tokeninfo("cachekey"), "value1")
+                self.assertEqual(token.get_tokeninfo("radius.secret"), "cachedSecret")
+                self.assertEqual(token.get_tokeninfo(decrypted=True).get("radius.secret"), "cachedSecret")
+            # The token info and the password are only read once
+            self.assertEqual(mock_info.call_count, 1)
+            self.assertEqual(mock_decrypt.call_count, 1)
+
+            # The returned dictionary does not change the cache
+            token.get_tokeninfo()["cachekey"] = "changed"
+            self.assertEqual(token.get_tokeninfo("cachekey"), "value1")
+
+            # Changing the token info invalidates the cache
+            token.add_tokeninfo("cachekey", "value2")
+            self.assertEqual(token.get_tokeninfo("cachekey"), "value2")
+            token.add_tokeninfo_dict({"cachekey": "value3"})
+            self.assertEqual(token.get_tokeninfo("cachekey"), "value3")
+            token.del_tokeninfo("cachekey")
+            self.assertIsNone(token.get_tokeninfo("cachekey"))
+            token.set_tokeninfo({"radius.secret": "newSecret",
+                                 "radius.secret.type": "password"})
+            self.assertEqual(token.get_tokeninfo("radius.secret"), "newSecret")
+            self.assertEqual(mock_info.call_count, 5)
+            self.assertEqual(mock_decrypt.call_count, 2)
+
+            # Changes by another token object are seen after the commit
+            TokenClass(db_token).add_tokeninfo("cachekey", "value4")
+            self.assertEqual(token.get_tokeninfo("cachekey"), "value4")
+        token.del_tokeninfo("cachekey")
+
     def test_12_inc_otp_counter(self):
         db_token = Token.query.filter_by(serial=self.serial1).first()
         token = TokenClass(db_token)
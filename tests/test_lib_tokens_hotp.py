@@ -13,6 +13,7 @@ from privacyidea.lib.user import (User)
 from privacyidea.lib.tokenclass import DATE_FORMAT
 from privacyidea.lib.utils import b32encode_and_unicode
 from privacyidea.lib.tokens.hotptoken import HotpTokenClass
+from privacyidea.lib.tokens.HMAC import HmacOtp
 from privacyidea.models import (Token,
                                 Config,
                                 Challenge)
@@ -854,3 +855,39 @@ class HOTPTokenTestCase(MyTestCase):
             _detail = token.get_init_detail(user=User("cornelius",
                                                       self.realm1), params=params)
             mock_log.assert_any_call("Unknown Tag 'real' in one of your policy definition")
+
+    def test_32_hmacotp_window(self):
+        # test vectors of RFC 4226
+        otps = ["755224", "287082", "359152", "969429", "338314",
+                "254676", "287922", "162583", "399871", "520489"]
+        db_token = Token("HMACWINDOW", tokentype="hotp")
+        db_token.set_otpkey(binascii.hexlify(b"12345678901234567890"))
+        hmac_otp = HmacOtp(db_token.get_otpkey(), counter=0, digits=6)
+        self.assertEqual(hmac_otp.window_values(0, 10), [int(otp) for otp in otps])
+        self.assertEqual([hmac_otp.generate(counter) for counter in range(10)], otps)
+        for counter, otp in enumerate(otps):
+            hmac_otp = HmacOtp(db_token.get_otpkey(), counter=0, digits=6)
+            self.assertEqual(hmac_otp.checkOtp(otp, 10), counter)
+            # the counter is set behind the matching counter
+            self.assertEqual(hmac_otp.counter, counter + 1)
+            # the OTP value may also be passed as bytes
+            hmac_otp = HmacOtp(db_token.get_otpkey(), counter=0, digits=6)
+            self.assertEqual(hmac_otp.checkOtp(otp.encode("utf8"), 10), counter)
+        hmac_otp = HmacOtp(db_token.get_otpkey(), counter=3, digits=6)
+        # the OTP values before the counter do not match
+        self.assertEqual(hmac_otp.checkOtp(otps[2], 10), -1)
+        self.assertEqual(hmac_otp.counter, 13)
+        hmac_otp = HmacOtp(db_token.get_otpkey(), counter=3, digits=6)
+        self.assertEqual(hmac_otp.checkOtp(otps[2], 2, symetric=True), 2)
+        # values with leading zeros, other characters or the wrong length do not match
+        self.assertEqual(hmac_otp.checkOtp("0" + otps[5], 10), -1)
+        self.assertEqual(hmac_otp.checkOtp(otps[5][:-1], 10), -1)
+        self.assertEqual(hmac_otp.checkOtp(" 55224", 10), -1)
+        self.assertEqual(hmac_otp.checkOtp("７５５２２４", 10), -1)
+        # 8 digits with SHA256
+        hmac_otp = HmacOtp(db_token.get_otpkey(), counter=0, digits=8, hashfunc=hashlib.sha256)
+        otp = hmac_otp.generate(7)
+        self.assertEqual(len(otp), 8)
+        self.assertEqual(hmac_otp.window_values(7, 8), [int(otp)])
+        hmac_otp = HmacOtp(db_token.get_otpkey(), counter=0, digits=8, hashfunc=hashlib.sha256)
+        self.assertEqual(hmac_otp.checkOtp(otp, 10), 7)
@@ -13,14 +13,20 @@ from tests.test_mock_ldap3 import LDAPDirectory
 from .base import MyTestCase
 from privacyidea.lib.resolver import (save_resolver, delete_resolver, get_resolver_object)
 from privacyidea.lib.realm import (set_realm, delete_realm)
-from privacyidea.lib.user import (User, get_username, create_user)
+from privacyidea.lib.user import (User, get_username, get_usernames, create_user)
+from privacyidea.lib.lrucache import MISSING
 from privacyidea.lib.usercache import (get_cache_time,
                                        cache_username, delete_user_cache,
-                                       EXPIRATION_SECONDS, retrieve_latest_entry, is_cache_enabled)
+                                       EXPIRATION_SECONDS, retrieve_latest_entry, is_cache_enabled,
+                                       add_to_cache, get_local_user_cache, get_user_cache_stats,
+                                       STATS_HIT_RATIO, STATS_LOCAL_HIT_RATIO)
+from privacyidea.lib.monitoringstats import get_last_value, delete_stats
 from privacyidea.lib.config import set_privacyidea_config
+from privacyidea.lib.sqlutils import unit_of_work
 from datetime import timedelta
 from datetime import datetime
-from privacyidea.models import UserCache
+from privacyidea.models import UserCache, db
+from sqlalchemy.exc import IntegrityError
 
 
 class UserCacheTestCase(MyTestCase):
@@ -222,13 +228,16 @@ class UserCacheTestCase(MyTestCase):
         self.assertFalse(r)
 
     def test_05_multiple_entries(self):
-        # two consistent entries
+        # a login name is only cached once per resolver
         now = datetime.now()
         UserCache("hans1", "hans1", "resolver1", "uid1", now - timedelta(seconds=60)).save()
-        UserCache("hans1", "hans1", "resolver1", "uid1", now).save()
-
+        self.assertRaises(IntegrityError, UserCache("hans1", "hans1", "resolver1", "uid1", now).save)
+        db.session.rollback()
+        # adding the entry again only updates the existing entry
+        add_to_cache("hans1", "hans1", "resolver1", "uid1")
         r = UserCache.query.filter(UserCache.username == "hans1", UserCache.resolver == "resolver1")
-        self.assertEqual(r.count(), 2)
+        self.assertEqual(r.count(), 1)
+        self.assertGreaterEqual(r.one().timestamp, now)
 
         u_name = get_username("uid1", "resolver1")
         self.assertEqual(u_name, "hans1")
@@ -270,11 +279,10 @@ class UserCacheTestCase(MyTestCase):
         # that the cache entry is indeed not queried as it contains 'fake_uid' instead of the correct uid)
         user = User(self.username, self.realm1, self.resolvername1)
         self.assertEqual(user.uid, self.uid)
-        # a new entry should have been added to the cache now
+        # the expired entry has been replaced with the new entry
         r = retrieve_latest_entry((UserCache.username == self.username) & (UserCache.resolver == self.resolvername1))
         self.assertEqual(self.uid, r.user_id)
-        # But the expired entry is also still in the cache
-        self.assertEqual(UserCache.query.count(), 2)
+        self.assertEqual(UserCache.query.count(), 1)
         r = delete_user_cache()
 
         self._delete_realm()
@@ -493,6 +501,111 @@ class UserCacheTestCase(MyTestCase):
         self.assertEqual(r, "user1")
         self.assertEqual(self.counter, 1)
 
+    def test_14_get_usernames(self):
+        self._create_realm()
+        delete_user_cache()
+        self.assertTrue(is_cache_enabled())
+        # The usernames are added to the cache, unknown users are not
+        usernames = get_usernames(["0", "1", "99999", ""], self.resolvername1)
+        self.assertEqual(usernames, {"0": "root", "1": "daemon", "99999": ""})
+        self.assertEqual(UserCache.query.filter(UserCache.resolver == self.resolvername1).count(), 2)
+        # The second call only reads the cache
+        with patch.object(get_resolver_object(self.resolvername1), "getUsernameMany") as mock_many:
+            usernames = get_usernames(["0", "1"], self.resolvername1)
+            mock_many.assert_not_called()
+        self.assertEqual(usernames, {"0": "root", "1": "daemon"})
+        # Only the missing users are requested from the resolver
+        with patch.object(get_resolver_object(self.resolvername1), "getUsernameMany",
+                          return_value={"2": "bin"}) as mock_many:
+            usernames = get_usernames(["0", "2"], self.resolvername1)
+            mock_many.assert_called_once_with(["2"])
+        self.assertEqual(usernames, {"0": "root", "2": "bin"})
+        delete_user_cache()
+        self._delete_realm()
+
+    def test_15_local_cache(self):
+        self._create_realm()
+        delete_user_cache()
+        stats = get_user_cache_stats()
+        # The user is added to the database table and kept in memory
+        user = User(self.username, self.realm1)
+        self.assertEqual(user.uid, self.uid)
+        self.assertEqual(UserCache.query.count(), 1)
+        with patch('privacyidea.lib.usercache.retrieve_latest_entry') as mock_retrieve:
+            self.assertEqual(User(self.username, self.realm1).uid, self.uid)
+            self.assertEqual(get_username(self.uid, self.resolvername1), self.username)
+            mock_retrieve.assert_not_called()
+        # Adding an existing record only updates the timestamp
+        add_to_cache(self.username, self.username, self.resolvername1, self.uid)
+        self.assertEqual(UserCache.query.count(), 1)
+        new_stats = get_user_cache_stats()
+        self.assertEqual(new_stats["local_hits"], stats["local_hits"] + 2)
+        self.assertEqual(new_stats["misses"], stats["misses"] + 1)
+        self.assertTrue(0 < new_stats["hit_ratio"] <= 100)
+
+        # The entries in memory expire with the database entries
+        with patch('privacyidea.lib.usercache.get_cache_time') as mock_get_cache_time:
+            mock_get_cache_time.return_value = timedelta(seconds=-1)
+            self.assertIs(get_local_user_cache().lookup(("uid", self.resolvername1, self.uid),
+                                                        mock_get_cache_time.return_value),
+                          MISSING)
+        # Deleting the user cache also clears the entries in memory
+        get_username(self.uid, self.resolvername1)
+        delete_user_cache()
+        self.assertEqual(len(get_local_user_cache()), 0)
+
+        # The hit ratios are written to the monitoring statistics
+        delete_stats(STATS_HIT_RATIO)
+        delete_stats(STATS_LOCAL_HIT_RATIO)
+        # The hit ratios are only written, if the interval is configured
+        with patch.object(get_local_user_cache(), "_last_stats", (-3600, 0, 0, 0)):
+            with patch('privacyidea.lib.usercache.register_finalizer') as mock_register:
+                get_username(self.uid, self.resolvername1)
+                mock_register.assert_not_called()
+        delete_user_cache()
+        self.app.config["PI_USERCACHE_STATS_INTERVAL"] = 3600
+        with patch.object(get_local_user_cache(), "_last_stats", (-3600, 0, 0, 0)):
+            with patch('privacyidea.lib.usercache.register_finalizer') as mock_register:
+                get_username(self.uid, self.resolvername1)
+                get_username(self.uid, self.resolvername1)
+                mock_register.assert_called_once()
+            get_local_user_cache().write_stats()
+        self.assertTrue(0 <= get_last_value(STATS_HIT_RATIO) <= 100)
+        self.assertTrue(0 <= get_last_value(STATS_LOCAL_HIT_RATIO) <= 100)
+        self.app.config.pop("PI_USERCACHE_STATS_INTERVAL")
+        delete_user_cache()
+        self._delete_realm()
+
+    def test_16_delete_chunked(self):
+        delete_user_cache()
+        timestamp = datetime.now() - timedelta(weeks=50)
+        for i in range(5):
+            UserCache("hans{0!s}".format(i), "hans{0!s}".format(i), "resolver1", "uid{0!s}".format(i),
+                      timestamp).save()
+        UserCache("current", "current", "resolver1", "uid9", datetime.now()).save()
+        with patch.object(db.session, "commit", wraps=db.session.commit) as mock_commit:
+            self.assertEqual(delete_user_cache(expired=True, chunksize=2), 5)
+            # three chunks of at most two entries are committed
+            self.assertEqual(mock_commit.call_count, 3)
+        self.assertEqual(UserCache.query.one().username, "current")
+        delete_user_cache()
+
+    def test_17_unit_of_work(self):
+        delete_user_cache()
+        now = datetime.now()
+        UserCache("hans1", "hans1", "resolver1", "uid1", now - timedelta(seconds=60)).save()
+        with unit_of_work(db.session):
+            add_to_cache("hans2", "hans2", "resolver1", "uid2")
+            # The entry of hans1 was added by another request in the meantime
+            with patch('privacyidea.lib.usercache._update_entry',
+                       side_effect=[False, True]) as mock_update:
+                add_to_cache("hans1", "hans1", "resolver1", "uid1")
+                self.assertEqual(mock_update.call_count, 2)
+            # The failed insert does not roll back the other changes
+            self.assertEqual(UserCache.query.filter(UserCache.username == "hans2").count(), 1)
+        self.assertEqual(sorted(entry.username for entry in UserCache.query.all()), ["hans1", "hans2"])
+        delete_user_cache()
+
     def test_99_unset_config(self):
         # Test early exit!
         # Assert that the function `retrieve_latest_entry` is called if the cache is enabled